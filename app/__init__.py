@@ -1,9 +1,14 @@
 """
 แพ็คเกจหลักของแชทบอท 'ใจดี'
 รวมโมดูลทั้งหมดสำหรับแอปพลิเคชันแชทบอท
+
+ส่วนประกอบหลักถูกนำเข้าเมื่อเรียกใช้ครั้งแรกเท่านั้น (การนำเข้า app_deepseek จะสร้างแอป Flask,
+การเชื่อมต่อ Redis/MySQL และเธรดเบื้องหลัง) สคริปต์ที่ใช้เฉพาะโมดูลย่อย เช่น app.user_state
+หรือ app.token_counter จึงไม่ต้องมีสภาพแวดล้อมของ LINE/DeepSeek/MySQL
 """
 import os
 import logging
+from importlib import import_module
 
 __version__ = '1.0.0'
 
@@ -17,28 +22,27 @@ logging.basicConfig(
     ]
 )
 
-# นำเข้าส่วนประกอบหลักเพื่อให้ใช้งานได้ง่าย
-try:
-    from .app_deepseek import app, init_scheduler
-    from .async_api import AsyncDeepseekClient
-    from .chat_history_db import ChatHistoryDB
-    from .token_counter import TokenCounter
-    from .utils import safe_api_call, safe_db_operation
-    from .config import load_config
-    
-    # ส่งออกส่วนประกอบที่จำเป็นสำหรับการใช้งานจากภายนอก
-    __all__ = [
-        'app', 
-        'init_scheduler', 
-        'AsyncDeepseekClient', 
-        'ChatHistoryDB', 
-        'TokenCounter',
-        'safe_api_call',
-        'safe_db_operation',
-        'load_config'
-    ]
-    
-except ImportError as e:
-    logging.error(f"เกิดข้อผิดพลาดในการนำเข้าโมดูล: {str(e)}")
-    # ส่งออกเฉพาะเวอร์ชันในกรณีที่มีข้อผิดพลาดในการนำเข้า
-    __all__ = ['__version__']
\ No newline at end of file
+# ส่วนประกอบที่ส่งออกให้ใช้งานจากภายนอก -> โมดูลที่นำเข้าเมื่อเรียกใช้ครั้งแรก
+_LAZY_EXPORTS = {
+    'app': '.app_deepseek',
+    'init_scheduler': '.app_deepseek',
+    'init_workers': '.app_deepseek',
+    'AsyncDeepseekClient': '.async_api',
+    'AsyncLoopThread': '.async_bridge',
+    'ChatHistoryDB': '.chat_history_db',
+    'TokenCounter': '.token_counter',
+    'safe_api_call': '.utils',
+    'safe_db_operation': '.utils',
+    'load_config': '.config'
+}
+
+__all__ = list(_LAZY_EXPORTS)
+
+def __getattr__(name):
+    """นำเข้าส่วนประกอบที่ส่งออกเมื่อถูกเรียกใช้ครั้งแรก"""
+    module = _LAZY_EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value
+    return value
@@ -5,15 +5,14 @@
 import os
 import json
 import logging
-import requests
 import time
 import threading
-import asyncio
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from flask import Flask, request, abort, jsonify
-from linebot import LineBotApi, WebhookHandler
+from linebot import WebhookHandler
 from linebot.exceptions import InvalidSignatureError
-from linebot.models import MessageEvent, TextMessage, TextSendMessage
+from linebot.models import MessageEvent, TextMessage
 from openai import OpenAI
 import redis
 from random import choice
@@ -24,12 +23,35 @@ from apscheduler.schedulers.background import BackgroundScheduler
 
 # นำเข้าโมดูลภายในโปรเจค
 from .middleware.rate_limiter import init_limiter
-from .config import load_config, SYSTEM_MESSAGES, GENERATION_CONFIG, SUMMARY_GENERATION_CONFIG
-from .utils import safe_db_operation, safe_api_call
-from .chat_history_db import ChatHistoryDB
-from .token_counter import TokenCounter
+from .config import (
+    load_config, GENERATION_CONFIG, EVENT_QUEUE_CONFIG, DISPATCHER_CONFIG, ASYNC_CLIENT_CONFIG,
+    STREAMING_CONFIG, LINE_CLIENT_CONFIG, DELIVERY_CONFIG, RESPONSE_DELAY_CONFIG
+)
+from .utils import safe_db_operation
+from .context_builder import get_cache_stats
 from .async_api import AsyncDeepseekClient
-from .database_init import initialize_database
+from .async_bridge import AsyncLoopThread
+from .call_policy import CircuitOpenError
+from .line_client import LineClient
+from .delivery import MessageDelivery, ReplyTokenStore
+from .event_queue import EventQueue, start_worker_pool
+from .dispatcher import UserOrderedDispatcher, classify_priority
+from .delay_queue import DelayQueue
+from .stage_graph import StageGraph
+from .user_state import RoundTrips
+from .services import (
+    FOLLOW_UP_CHECK_MINUTES, TIMEOUT_WARNING_TTL, MESSAGE_LOCK_TIMEOUT,
+    PENDING_MESSAGE_TTL, MAX_PENDING_MESSAGES, TIMEOUT_WARNING_MESSAGE, SESSION_TIMEOUT_MESSAGE,
+    EMERGENCY_MESSAGE, WAIT_NOTICE_MESSAGE, ERROR_MESSAGE, HOLDING_MESSAGE, FOLLOW_UP_MESSAGE,
+    RESET_MESSAGE, NO_PROGRESS_MESSAGE, UNKNOWN_COMMAND_MESSAGE, STATIC_COMMAND_RESPONSES,
+    assess_risk, progress_entry, merge_pending_messages, next_follow_up_time, needs_timeout_warning,
+    format_progress_report, collect_status, format_status, create_deepseek_limiter, create_deepseek_policy,
+    create_token_counter, create_chat_history_db, create_summarizer, create_context_builder, create_user_state
+)
+from . import services
+from .keywords import keyword_matcher
+from .metrics import metrics
+from .streaming import ThaiChunker, batch_messages, LINE_MAX_MESSAGES_PER_REQUEST
 
 # สร้างอินสแตนซ์แอป Flask
 app = Flask(__name__)
@@ -60,8 +82,30 @@ try:
     )
     redis_client.ping()  # ตรวจสอบการเชื่อมต่อ
     
+    # เริ่มต้นคิวเหตุการณ์ webhook (ถ้าเปิดใช้งาน)
+    event_queue = None
+    if EVENT_QUEUE_CONFIG['enabled']:
+        event_queue = EventQueue(
+            redis_client,
+            stream=EVENT_QUEUE_CONFIG['stream'],
+            group=EVENT_QUEUE_CONFIG['group'],
+            maxlen=EVENT_QUEUE_CONFIG['maxlen'],
+            claim_idle_ms=EVENT_QUEUE_CONFIG['claim_idle_ms'],
+            max_deliveries=EVENT_QUEUE_CONFIG['max_deliveries']
+        )
+        event_queue.ensure_group()
+    
     # เริ่มต้น Line API
-    line_bot_api = LineBotApi(config.LINE_CHANNEL_ACCESS_TOKEN)
+    line_client = LineClient(
+        config.LINE_CHANNEL_ACCESS_TOKEN,
+        timeout=LINE_CLIENT_CONFIG['timeout'],
+        connect_timeout=LINE_CLIENT_CONFIG['connect_timeout'],
+        pool_size=LINE_CLIENT_CONFIG['pool_size']
+    )
+    reply_tokens = None
+    if DELIVERY_CONFIG['reply_enabled']:
+        reply_tokens = ReplyTokenStore(redis_client, ttl=DELIVERY_CONFIG['reply_token_ttl'])
+    delivery = MessageDelivery(line_client, reply_tokens)
     handler = WebhookHandler(config.LINE_CHANNEL_SECRET)
     
     # เริ่มต้น DeepSeek client
@@ -70,32 +114,31 @@ try:
         base_url="https://api.deepseek.com"
     )
     
-    # เริ่มต้น Async client สำหรับการประมวลผลเบื้องหลัง
-    async_deepseek = AsyncDeepseekClient(config.DEEPSEEK_API_KEY)
-    threading.Thread(target=lambda: asyncio.run(async_deepseek.setup())).start()
-    
-    # เริ่มต้นตัวนับโทเค็น
-    token_counter = TokenCounter()
-    
-    # เริ่มต้น MySQL pool และฐานข้อมูล
-    from mysql.connector import pooling
-    mysql_pool = pooling.MySQLConnectionPool(
-        pool_name="chat_pool",
-        pool_size=10,
-        host=config.MYSQL_HOST,
-        user=config.MYSQL_USER,
-        password=config.MYSQL_PASSWORD,
-        database=config.MYSQL_DB,
-        port=config.MYSQL_PORT,
-        connect_timeout=10
+    # เริ่มต้น event loop ถาวรที่เป็นเจ้าของ Async client และ connection pool แบบ keep-alive
+    async_loop = AsyncLoopThread().start()
+    async_deepseek = AsyncDeepseekClient(
+        config.DEEPSEEK_API_KEY,
+        max_connections=ASYNC_CLIENT_CONFIG['max_connections'],
+        max_keepalive_connections=ASYNC_CLIENT_CONFIG['max_keepalive_connections'],
+        limiter=create_deepseek_limiter(redis_client),
+        http2=ASYNC_CLIENT_CONFIG['http2']
     )
+    async_loop.run(async_deepseek.setup(), timeout=10)
+    # เปิดการเชื่อมต่อล่วงหน้าเบื้องหลังโดยไม่หน่วงการเริ่มต้นแอป
+    async_loop.submit(async_deepseek.warmup(ASYNC_CLIENT_CONFIG['warmup_connections']))
+    
+    # เริ่มต้นตัวนับโทเค็น (ใช้ร่วมกับ ChatHistoryDB เพื่อใช้แคชเดียวกัน)
+    token_counter = create_token_counter()
     
-    # เริ่มต้นฐานข้อมูล (สร้างตารางถ้ายังไม่มี)
-    initialize_database(mysql_pool)
-    logging.info("เสร็จสิ้นการตรวจสอบและเริ่มต้นฐานข้อมูล")
+    # เริ่มต้น MySQL pool และฐานข้อมูล (สร้างตารางถ้ายังไม่มี)
+    db = create_chat_history_db(config, token_counter)
+    mysql_pool = db.pool
     
-    # เริ่มต้นฐานข้อมูล
-    db = ChatHistoryDB(mysql_pool)
+    # เริ่มต้นตัวจัดการสรุปการสนทนาแบบสะสม
+    summarizer = create_summarizer(db, redis_client, async_deepseek)
+    
+    # เริ่มต้นตัวประกอบพรอมต์แบบคงส่วนต้น
+    context_builder = create_context_builder(token_counter)
     
 except Exception as e:
     logging.critical(f"เกิดข้อผิดพลาดในการเริ่มต้นแอปพลิเคชัน: {str(e)}")
@@ -104,10 +147,28 @@ except Exception as e:
 # เริ่มต้น rate limiter
 limiter = init_limiter(app)
 
-# ค่าคงที่ส่วนของการแอพลิเคชัน
-FOLLOW_UP_INTERVALS = [1, 3, 7, 14, 30]  # จำนวนวันในการติดตาม
-SESSION_TIMEOUT = 604800  # 7 วัน (7 * 24 * 60 * 60 วินาที)
-MESSAGE_LOCK_TIMEOUT = 30  # ระยะเวลาล็อค (วินาที)
+# ตัวกระจายงาน: ขนานกันระหว่างผู้ใช้ เรียงลำดับภายในผู้ใช้คนเดียวกัน
+dispatcher = UserOrderedDispatcher(
+    max_workers=DISPATCHER_CONFIG['max_workers'],
+    aging_seconds=DISPATCHER_CONFIG['aging_seconds']
+)
+
+# กลุ่มเธรดสำหรับขั้นตอนเตรียมข้อมูลที่รันพร้อมกัน (แยกจากเธรดของตัวกระจายงาน)
+prepare_executor = ThreadPoolExecutor(
+    max_workers=DISPATCHER_CONFIG['prepare_workers'],
+    thread_name_prefix='prepare'
+)
+
+# คิวหน่วงเวลาการส่งคำตอบ (ให้ภาพเคลื่อนไหวแสดงครบเวลาโดยไม่ครอบครองเธรดของ worker)
+response_delays = DelayQueue(
+    name='response_delay',
+    executor=UserOrderedDispatcher(max_workers=RESPONSE_DELAY_CONFIG['send_workers'], name='response_send')
+)
+
+# นโยบายการเรียก DeepSeek ของโปรเซสนี้
+deepseek_policy = create_deepseek_policy()
+
+# ค่าคงที่ส่วนของการแอพลิเคชัน (ค่าที่ใช้ร่วมกับโหมด ASGI อยู่ใน services.py)
 PROCESSING_MESSAGES = [
     "⌛ กำลังคิดอยู่ค่ะ...",
     "🤔 กำลังประมวลผลข้อความของคุณ...",
@@ -115,204 +176,44 @@ PROCESSING_MESSAGES = [
     "🔄 รอสักครู่นะคะ..."
 ]
 
-# คำที่บ่งชี้ความเสี่ยง
-RISK_KEYWORDS = {
-    'high_risk': [
-        'ฆ่าตัวตาย', 'ทำร้ายตัวเอง', 'อยากตาย',
-        'เกินขนาด', 'overdose', 'od',
-        'เลือดออก', 'ชัก', 'หมดสติ'
-    ],
-    'medium_risk': [
-        'นอนไม่หลับ', 'เครียด', 'กังวล',
-        'ซึมเศร้า', 'เหงา', 'ท้อแท้'
-    ]
-}
+# สถานะผู้ใช้บน Redis: รวมคำสั่งของเส้นทางประมวลผลข้อความเป็นไม่กี่ round trip
+user_state = create_user_state(redis_client)
 
 # ฟังก์ชันเกี่ยวกับการดำเนินการเซสชัน
-def get_chat_session(user_id):
-    """ดึงหรือสร้างเซสชันการแชทจาก Redis"""
-    try:
-        history = redis_client.get(f"chat_session:{user_id}")
-        if history:
-            loaded_history = json.loads(history)
-            return [
-                {"role": msg_data["role"], "content": msg_data["content"]}
-                for msg_data in loaded_history
-            ]
-        return []
-    except redis.RedisError as e:
-        logging.error(f"Redis error in get_chat_session: {str(e)}")
-        return []
-
-def save_chat_session(user_id, messages):
-    """บันทึกเซสชันการแชทไปยัง Redis"""
-    try:
-        serialized_history = [
-            {"role": msg["role"], "content": msg["content"]}
-            for msg in messages[-10:]  # เก็บเฉพาะ 10 ข้อความล่าสุด
-        ]
-        
-        redis_client.setex(
-            f"chat_session:{user_id}", 
-            3600 * 24,  # หมดอายุหลังจาก 24 ชั่วโมง
-            json.dumps(serialized_history)
-        )
-    except redis.RedisError as e:
-        logging.error(f"Redis error in save_chat_session: {str(e)}")
-
-def check_session_timeout(user_id):
-    """ตรวจสอบ timeout ของเซสชัน"""
-    try:
-        last_activity = redis_client.get(f"last_activity:{user_id}")
-        if last_activity:
-            # แปลงจาก bytes เป็น string ถ้าจำเป็น
-            if isinstance(last_activity, bytes):
-                last_activity = last_activity.decode('utf-8')
-                
-            last_activity_time = float(last_activity)
-            if (datetime.now().timestamp() - last_activity_time) > SESSION_TIMEOUT:
-                # ล้างเซสชัน
-                redis_client.delete(f"chat_session:{user_id}")
-                return True
-        return False
-    except Exception as e:
-        logging.error(f"เกิดข้อผิดพลาดในการตรวจสอบ session timeout สำหรับผู้ใช้ {user_id}: {str(e)}")
-        return False
-
-def update_last_activity(user_id):
-    """อัพเดทเวลาการใช้งานล่าสุด และตรวจสอบการแจ้งเตือน"""
-    try:
-        current_time = datetime.now().timestamp()
-        last_activity = redis_client.get(f"last_activity:{user_id}")
-        warning_sent = redis_client.get(f"timeout_warning:{user_id}")
-        
-        # แปลงจาก bytes เป็น string ถ้าจำเป็น
-        if isinstance(last_activity, bytes):
-            last_activity = last_activity.decode('utf-8')
-        if isinstance(warning_sent, bytes):
-            warning_sent = warning_sent.decode('utf-8')
-        
-        if last_activity:
-            time_passed = current_time - float(last_activity)
-            # ถ้าเวลาผ่านไป 6 วัน (1 วันก่อนหมด session) และยังไม่เคยส่งการแจ้งเตือน
-            if time_passed > (SESSION_TIMEOUT - 86400) and not warning_sent:  # 86400 = 1 วัน
-                warning_message = (
-                    "⚠️ เซสชันของคุณจะหมดอายุในอีก 1 วัน\n"
-                    "หากต้องการคุยต่อ กรุณาพิมพ์ข้อความใดๆ เพื่อต่ออายุเซสชัน"
-                )
-                line_bot_api.push_message(
-                    user_id,
-                    TextSendMessage(text=warning_message)
-                )
-                # ตั้งค่าว่าได้ส่งการแจ้งเตือนแล้ว
-                redis_client.setex(
-                    f"timeout_warning:{user_id}",
-                    86400,  # หมดอายุใน 1 วัน
-                    "1"
-                )
+def load_user_state(user_id, reply_token=None, received_at=None, trips=None):
+    """
+    เตรียมสถานะผู้ใช้ก่อนประมวลผลข้อความในหนึ่ง round trip
+    (ล้างการแจ้งเตือนรอ, เก็บ reply token, ตรวจสอบ timeout, อัพเดทเวลาใช้งานล่าสุด และดึงเซสชัน)
+    แล้วส่งการแจ้งเตือนเมื่อเซสชันใกล้หมดอายุ
+    
+    Returns:
+        dict: timed_out, last_activity, warning_sent และ session
+    """
+    current_time = datetime.now().timestamp()
+    token_entry = reply_tokens.entry(reply_token, received_at) if reply_tokens is not None else None
+    state = user_state.prepare(user_id, current_time, reply_token=token_entry, trips=trips)
+    
+    # ถ้าเวลาผ่านไป 6 วัน (1 วันก่อนหมด session) และยังไม่เคยส่งการแจ้งเตือน
+    if needs_timeout_warning(state, current_time):
+        try:
+            if line_client.push_message(user_id, TIMEOUT_WARNING_MESSAGE):
+                # ตั้งค่าว่าได้ส่งการแจ้งเตือนแล้ว (หมดอายุใน 1 วัน)
+                user_state.mark_warning_sent(user_id, TIMEOUT_WARNING_TTL, trips=trips)
                 logging.info(f"ส่งการแจ้งเตือนหมดเวลาเซสชันไปยังผู้ใช้: {user_id}")
-        
-        # อัพเดทเวลาใช้งานล่าสุด
-        redis_client.setex(
-            f"last_activity:{user_id}",
-            SESSION_TIMEOUT,
-            str(current_time)
-        )
-        
-    except Exception as e:
-        logging.error(f"เกิดข้อผิดพลาดในการอัพเดทเวลาใช้งานล่าสุดสำหรับผู้ใช้ {user_id}: {str(e)}")
-
-# ฟังก์ชันที่เกี่ยวข้องกับความเสี่ยงและความก้าวหน้า
-def assess_risk(message):
-    """ประเมินความเสี่ยงจากข้อความ"""
-    message = message.lower()
-    risk_level = 'low'
-    matched_keywords = []
-    
-    for keyword in RISK_KEYWORDS['high_risk']:
-        if keyword in message:
-            risk_level = 'high'
-            matched_keywords.append(keyword)
-    
-    if risk_level == 'low':
-        for keyword in RISK_KEYWORDS['medium_risk']:
-            if keyword in message:
-                risk_level = 'medium'
-                matched_keywords.append(keyword)
-    
-    return risk_level, matched_keywords
-
-def save_progress_data(user_id, risk_level, keywords):
-    """บันทึกข้อมูลความก้าวหน้า"""
-    try:
-        progress_data = {
-            'timestamp': datetime.now().isoformat(),
-            'risk_level': risk_level,
-            'keywords': keywords
-        }
-        redis_client.lpush(f"progress:{user_id}", json.dumps(progress_data))
-        redis_client.ltrim(f"progress:{user_id}", 0, 99)  # เก็บแค่ 100 รายการล่าสุด
-    except Exception as e:
-        logging.error(f"เกิดข้อผิดพลาดในการบันทึกความก้าวหน้า: {str(e)}")
+        except Exception as e:
+            logging.error(f"เกิดข้อผิดพลาดในการแจ้งเตือนหมดเวลาเซสชันสำหรับผู้ใช้ {user_id}: {str(e)}")
+    return state
 
+# ฟังก์ชันที่เกี่ยวข้องกับความก้าวหน้า
 def generate_progress_report(user_id):
     """สร้างรายงานความก้าวหน้า"""
     try:
-        progress_data = redis_client.lrange(f"progress:{user_id}", 0, -1)
-        if not progress_data:
-            return "ยังไม่มีข้อมูลความก้าวหน้า"
-
-        data = [json.loads(item) for item in progress_data]
-        
-        # วิเคราะห์แนวโน้มความเสี่ยง
-        risk_trends = {
-            'high': sum(1 for d in data if d['risk_level'] == 'high'),
-            'medium': sum(1 for d in data if d['risk_level'] == 'medium'),
-            'low': sum(1 for d in data if d['risk_level'] == 'low')
-        }
-        
-        report = (
-            "📊 รายงานความก้าวหน้า\n\n"
-            f"📅 ช่วงเวลา: {data[-1]['timestamp'][:10]} ถึง {data[0]['timestamp'][:10]}\n"
-            f"📈 การประเมินความเสี่ยง:\n"
-            f"▫️ ความเสี่ยงสูง: {risk_trends['high']} ครั้ง\n"
-            f"▫️ ความเสี่ยงปานกลาง: {risk_trends['medium']} ครั้ง\n"
-            f"▫️ ความเสี่ยงต่ำ: {risk_trends['low']} ครั้ง\n"
-        )
-        return report
+        return format_progress_report(user_state.get_progress(user_id))
     except Exception as e:
         logging.error(f"เกิดข้อผิดพลาดในการสร้างรายงานความก้าวหน้า: {str(e)}")
         return "ไม่สามารถสร้างรายงานได้"
 
-# ฟังก์ชันที่เกี่ยวข้องกับการล็อคข้อความ
-def is_user_locked(user_id):
-    """ตรวจสอบว่าผู้ใช้ถูกล็อคอยู่หรือไม่"""
-    return redis_client.exists(f"message_lock:{user_id}")
-
-def lock_user(user_id):
-    """ล็อคผู้ใช้"""
-    redis_client.setex(f"message_lock:{user_id}", MESSAGE_LOCK_TIMEOUT, "1")
-
-def unlock_user(user_id):
-    """ปลดล็อคผู้ใช้"""
-    redis_client.delete(f"message_lock:{user_id}")
-
 # ฟังก์ชันเกี่ยวกับการติดตามผู้ใช้
-def schedule_follow_up(user_id, interaction_date):
-    """จัดการการติดตามผู้ใช้"""
-    try:
-        current_date = datetime.now()
-        for days in FOLLOW_UP_INTERVALS:
-            follow_up_date = interaction_date + timedelta(days=days)
-            if follow_up_date > current_date:
-                redis_client.zadd(
-                    'follow_up_queue',
-                    {user_id: follow_up_date.timestamp()}
-                )
-                break
-    except Exception as e:
-        logging.error(f"เกิดข้อผิดพลาดในการกำหนดการติดตามผล: {str(e)}")
-
 def check_and_send_follow_ups():
     """ตรวจสอบและส่งการติดตามที่ถึงกำหนด"""
     logging.info("กำลังรันการตรวจสอบการติดตามผลตามกำหนดเวลา")
@@ -330,15 +231,10 @@ def check_and_send_follow_ups():
             if isinstance(user_id, bytes):
                 user_id = user_id.decode('utf-8')
                 
-            follow_up_message = (
-                "สวัสดีค่ะ ใจดีมาติดตามผลการเลิกใช้สารเสพติดของคุณ\n"
-                "คุณสามารถเล่าให้ฟังได้ว่าช่วงที่ผ่านมาเป็นอย่างไรบ้าง?"
-            )
             try:
-                line_bot_api.push_message(
-                    user_id,
-                    TextSendMessage(text=follow_up_message)
-                )
+                if not line_client.push_message(user_id, FOLLOW_UP_MESSAGE):
+                    # ส่งไม่สำเร็จ เก็บไว้ในคิวเพื่อลองใหม่รอบถัดไป
+                    continue
                 # ลบรายการติดตามที่ส่งแล้ว
                 redis_client.zrem('follow_up_queue', user_id)
                 # บันทึกการติดตามลงในฐานข้อมูล
@@ -356,95 +252,76 @@ def send_processing_status(user_id, reply_token):
     try:
         # ส่งข้อความว่ากำลังประมวลผลทันที
         processing_message = choice(PROCESSING_MESSAGES)
-        line_bot_api.reply_message(
-            reply_token,
-            TextSendMessage(text=processing_message)
-        )
-        return True
+        return line_client.reply_message(reply_token, processing_message).ok
     except Exception as e:
         logging.error(f"เกิดข้อผิดพลาดในการส่งสถานะประมวลผล: {str(e)}")
         return False
 
-def send_final_response(user_id, bot_response):
-    """ส่งคำตอบสุดท้ายหลังประมวลผลเสร็จ"""
-    try:
-        line_bot_api.push_message(
-            user_id,
-            TextSendMessage(text=bot_response)
-        )
+def send_final_response(user_id, bot_response, delay=0):
+    """ส่งคำตอบสุดท้ายหลังประมวลผลเสร็จ (ใช้ reply token ของข้อความถ้ายังไม่หมดอายุ มิฉะนั้นส่งแบบ push)
+    
+    Args:
+        user_id (str): LINE user ID
+        bot_response (str): ข้อความที่จะส่ง
+        delay (float): หน่วงการส่งผ่านคิวหน่วงเวลา (วินาที) โดยไม่ครอบครองเธรด
+    
+    Returns:
+        bool: True หากส่งสำเร็จหรือเข้าคิวหน่วงเวลาแล้ว
+    """
+    # ข้อความที่ตามหลังคำตอบที่หน่วงไว้ต้องเข้าคิวเดียวกันเพื่อรักษาลำดับ
+    if delay > 0 or response_delays.has_pending(user_id):
+        response_delays.schedule(user_id, delay, deliver_message, user_id, bot_response)
         return True
+    return deliver_message(user_id, bot_response)
+
+def deliver_message(user_id, texts):
+    """ส่งข้อความหนึ่งคำขอ (สูงสุด 5 ข้อความ) ทันที"""
+    try:
+        return delivery.send(user_id, texts).ok
     except Exception as e:
         logging.error(f"เกิดข้อผิดพลาดในการส่งคำตอบสุดท้าย: {str(e)}")
         return False
 
+def send_message_batch(user_id, texts):
+    """ส่งหลายข้อความในคำขอ push เดียว (สูงสุด 5 ข้อความต่อคำขอตามข้อจำกัดของ LINE)"""
+    try:
+        for batch in batch_messages(texts):
+            if response_delays.has_pending(user_id):
+                response_delays.schedule(user_id, 0, deliver_message, user_id, batch)
+            elif not delivery.send(user_id, batch):
+                return False
+        return True
+    except Exception as e:
+        logging.error(f"เกิดข้อผิดพลาดในการส่งข้อความแบบกลุ่ม: {str(e)}")
+        return False
+
 def start_loading_animation(user_id, duration=60):
-    """แสดงภาพเคลื่อนไหวการโหลดของ LINE ให้กับผู้ใช้
+    """แสดงภาพเคลื่อนไหวการโหลดของ LINE ให้กับผู้ใช้ (ไม่รอผล จึงไม่อยู่บนเส้นทางหลักของการตอบกลับ)
     
     Args:
         user_id (str): LINE user ID
         duration (int): ระยะเวลาเป็นวินาที (ต้องอยู่ในช่วง 5-60 และเป็นจำนวนเท่าของ 5)
     
     Returns:
-        bool: True หากสำเร็จ, False หากไม่สำเร็จ
+        tuple: (True, ระยะเวลา) เมื่อส่งคำขอเข้าคิวได้, (False, 0) หากไม่สำเร็จ
     """
     try:
         # ใช้ 60 วินาทีเสมอ (ระยะเวลาสูงสุดที่อนุญาตโดย LINE API)
         duration = 60
-        
-        # ดึงโทเค็นการเข้าถึงจากตัวแปรสภาพแวดล้อม
-        access_token = config.LINE_CHANNEL_ACCESS_TOKEN
-        
-        # สร้างคำขอ
-        url = 'https://api.line.me/v2/bot/chat/loading/start'
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {access_token}'
-        }
-        payload = {
-            'chatId': user_id,
-            'loadingSeconds': duration
-        }
-        
-        # ส่งคำขอ
-        response = requests.post(url, headers=headers, json=payload)
-        
-        # ตรวจสอบการตอบกลับ - ทั้ง 200 และ 202 ถือว่าสำเร็จ
-        # 202 หมายถึง "Accepted" ใน HTTP ซึ่งเหมาะสำหรับการดำเนินการแบบอะซิงโครนัส
-        if response.status_code in [200, 202]:
-            logging.info(f"เริ่มภาพเคลื่อนไหวการโหลดสำหรับผู้ใช้ {user_id} เป็นเวลา {duration} วินาที (สถานะ: {response.status_code})")
-            return True, duration
-        else:
-            logging.error(f"ไม่สามารถเริ่มภาพเคลื่อนไหวการโหลด: {response.status_code} {response.text}")
-            return False, 0
+        future = line_client.start_loading_background(user_id, duration)
+        future.add_done_callback(lambda f: _log_loading_result(user_id, f))
+        return True, duration
     except Exception as e:
         logging.error(f"เกิดข้อผิดพลาดในการเริ่มภาพเคลื่อนไหวการโหลด: {str(e)}")
         return False, 0
 
-# ฟังก์ชันหลักสำหรับสรุปประวัติการสนทนา
-@safe_api_call
-def summarize_conversation_history(history):
-    """สรุปประวัติการสนทนาให้กระชับ"""
-    if not history:
-        return ""
-        
-    try:
-        summary_prompt = "นี่คือประวัติการสนทนา โปรดสรุปประเด็นสำคัญในประวัติการสนทนานี้:\n"
-        for _, msg, resp in history:
-            summary_prompt += f"\nผู้ใช้: {msg}\nบอท: {resp}\n"
-        
-        response = deepseek_client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                SYSTEM_MESSAGES,
-                {"role": "user", "content": summary_prompt}
-            ],
-            **SUMMARY_GENERATION_CONFIG
-        )
-        
-        return response.choices[0].message.content
-    except Exception as e:
-        logging.error(f"เกิดข้อผิดพลาดใน summarize_conversation_history: {str(e)}")
-        return ""
+def _log_loading_result(user_id, future):
+    """บันทึกผลของคำขอภาพเคลื่อนไหวการโหลดที่ทำงานเบื้องหลัง"""
+    if future.cancelled() or future.exception():
+        return
+    result = future.result()
+    if result:
+        logging.info(f"เริ่มภาพเคลื่อนไหวการโหลดสำหรับผู้ใช้ {user_id} ({result.elapsed * 1000:.0f} มิลลิวินาที)")
 
 # ฟังก์ชันสำหรับการจัดการคำสั่งกับการแสดงสถานะประมวลผล
 def handle_command_with_processing(user_id, command):
@@ -452,139 +329,62 @@ def handle_command_with_processing(user_id, command):
     # สำหรับคำสั่ง ใช้ภาพเคลื่อนไหวสั้นกว่า (10 วินาที) เนื่องจากคำสั่งประมวลผลเร็วกว่า
     animation_success, _ = start_loading_animation(user_id, duration=10)
     
-    response_text = None
-    
     if command == '/reset':
         db.clear_user_history(user_id)
-        redis_client.delete(f"chat_session:{user_id}")
-        response_text = (
-            "🔄 ล้างประวัติการสนทนาเรียบร้อยแล้วค่ะ\n\n"
-            "เราสามารถเริ่มต้นการสนทนาใหม่ได้ทันที\n"
-            "คุณต้องการพูดคุยเกี่ยวกับเรื่องอะไรดีคะ?"
-        )
-        
-    elif command == '/help':
-        response_text = (
-            "สวัสดีค่ะ 👋 ฉันคือน้องใจดี ผู้ช่วยดูแลและให้คำปรึกษาสำหรับผู้ที่ต้องการเลิกใช้สารเสพติด\n\n"
-            "💬 ฉันสามารถช่วยคุณได้ดังนี้:\n"
-            "- พูดคุยและให้กำลังใจในการเลิกใช้สารเสพติด\n"
-            "- ให้ข้อมูลเกี่ยวกับผลกระทบของสารเสพติดต่อร่างกายและจิตใจ\n"
-            "- แนะนำเทคนิคจัดการความอยากและความเครียด\n"
-            "- เชื่อมต่อกับบริการช่วยเหลือในกรณีฉุกเฉิน\n\n"
-            "📋 คำสั่งที่ใช้ได้:\n"
-            "📊 /status - ดูสถิติการใช้งานและข้อมูลเซสชัน\n"
-            "📈 /progress - ดูรายงานความก้าวหน้าของคุณ\n"
-            "🚨 /emergency - ดูข้อมูลติดต่อฉุกเฉินและสายด่วน\n"
-            "📩 /feedback - ส่งความคิดเห็นเพื่อพัฒนาระบบ\n"
-            "❓ /help - แสดงเมนูช่วยเหลือนี้\n\n"
-            "💡 ตัวอย่างคำถามที่สามารถถามฉันได้:\n"
-            "- \"ช่วยประเมินการใช้สารเสพติดของฉันหน่อย\"\n"
-            "- \"ผลกระทบของยาบ้าต่อร่างกายมีอะไรบ้าง\"\n"
-            "- \"มีเทคนิคจัดการความอยากยาอย่างไร\"\n"
-            "- \"ฉันควรทำอย่างไรเมื่อรู้สึกอยากกลับไปใช้สารอีก\"\n\n"
-            "เริ่มพูดคุยกับฉันได้เลยนะคะ ฉันพร้อมรับฟังและช่วยเหลือคุณ 💚"
-        )
+        user_state.clear_session(user_id)
+        response_text = RESET_MESSAGE
     
-    elif command == '/status':
-        status_data = {
-        'history_count': db.get_user_history_count(user_id),
-        'important_count': db.get_important_message_count(user_id),
-        'last_interaction': db.get_last_interaction(user_id),
-        'current_session': redis_client.exists(f"chat_session:{user_id}") == 1,
-        'total_tokens': db.get_total_tokens(user_id) or 0,
-        'session_tokens': 0,
-        }
-
-        # คำนวณโทเค็นในเซสชัน
-        session_data = redis_client.get(f"chat_session:{user_id}")
-        if session_data:
-            history = json.loads(session_data)
-            total_session_text = ""
-            for msg in history:
-                if msg['role'] in ['user', 'assistant']:
-                    total_session_text += msg.get('content', '')
-            status_data['session_tokens'] = token_counter.count_tokens(total_session_text)
-
-        # อัพเดทข้อความสถานะพร้อมตัวเลขสำคัญ
-        response_text = (
-            "📊 สถิติการสนทนาของคุณ\n"
-            f"▫️ จำนวนการสนทนาที่บันทึก: {status_data['history_count']} ครั้ง\n"
-            f"▫️ ประเด็นสำคัญที่พูดคุย: {status_data['important_count']} รายการ\n"
-            f"▫️ สนทนาล่าสุดเมื่อ: {status_data['last_interaction']}\n"
-            f"▫️ สถานะเซสชันปัจจุบัน: {'🟢 กำลังสนทนาอยู่' if status_data['current_session'] else '🔴 ยังไม่เริ่มสนทนา'}\n\n"
-            "💚 น้องใจดีพร้อมให้คำปรึกษาและสนับสนุนคุณตลอดเส้นทางการเลิกสารเสพติด\n"
-            "💬 มีคำถามหรือต้องการความช่วยเหลือ เพียงพิมพ์บอกฉันได้เลยค่ะ"
-        )
-
-    elif command == '/emergency':
-        response_text = (
-            "🚨 บริการช่วยเหลือฉุกเฉิน 🚨\n\n"
-            "หากคุณหรือคนใกล้ตัวกำลังประสบปัญหาต่อไปนี้:\n"
-            "- ใช้สารเสพติดเกินขนาด (Overdose)\n"
-            "- มีอาการชัก เลือดออก หมดสติ\n"
-            "- มีความคิดทำร้ายตัวเอง\n"
-            "- มีอาการถอนยารุนแรง\n\n"
-            "📞 ติดต่อขอความช่วยเหลือด่วนได้ที่:\n"
-            "🔸 สายด่วนกรมควบคุมโรค: 1422\n"
-            "🔸 ศูนย์ปรึกษาปัญหายาเสพติด: 1165\n"
-            "🔸 หน่วยกู้ชีพฉุกเฉิน: 1669\n"
-            "🔸 สายด่วนสุขภาพจิต: 1323\n\n"
-            "🌐 เว็บไซต์ช่วยเหลือ:\n"
-            "https://www.pmnidat.go.th\n\n"
-            "💚 การขอความช่วยเหลือคือก้าวแรกของการดูแลตัวเอง"
-        )
+    elif command in STATIC_COMMAND_RESPONSES:
+        response_text = STATIC_COMMAND_RESPONSES[command]
     
-    elif command == '/feedback':
-        response_text = (
-            "🌟 ความคิดเห็นของคุณมีคุณค่าต่อการพัฒนา\n\n"
-            "น้องใจดีต้องการพัฒนาให้ดียิ่งขึ้นสำหรับทุกคน\n"
-            "โปรดแสดงความคิดเห็นผ่านแบบฟอร์มนี้:\n"
-            "https://forms.gle/7K2y21gomWHGcWpq9\n\n"
-            "🙏 ขอบคุณที่ช่วยพัฒนาน้องใจดีให้ดีขึ้น"
-        )
+    elif command == '/status':
+        history = user_state.get_session(user_id)
+        response_text = format_status(collect_status(db, token_counter, user_id, history))
     
     elif command == '/progress':
         report = generate_progress_report(user_id)
-        response_text = report if report else (
-            "📊 รายงานความก้าวหน้า\n\n"
-            "ยังไม่มีข้อมูลความก้าวหน้าเพียงพอสำหรับการวิเคราะห์\n\n"
-            "เมื่อเราพูดคุยกันมากขึ้น น้องใจดีจะสามารถติดตามและวิเคราะห์ความก้าวหน้าของคุณได้"
-        )
+        response_text = report if report else NO_PROGRESS_MESSAGE
     
     else:
-        response_text = "คำสั่งไม่ถูกต้อง ลองพิมพ์ /help เพื่อดูคำสั่งทั้งหมด"
+        response_text = UNKNOWN_COMMAND_MESSAGE
 
     if response_text:
         send_final_response(user_id, response_text)
 
 # ฟังก์ชันสำหรับการจัดการข้อความที่ถูกล็อค
-def handle_locked_user(user_id):
-    """จัดการกรณีผู้ใช้ถูกล็อค"""
-    wait_notice_sent = redis_client.exists(f"wait_notice:{user_id}")
+def handle_locked_user(user_id, user_message, reply_token=None, received_at=None, trips=None):
+    """จัดการกรณีผู้ใช้ถูกล็อค: พักข้อความไว้ตอบรวมกันหลังประมวลผลข้อความก่อนหน้าเสร็จ"""
+    notice_needed = user_state.buffer_pending(
+        user_id, user_message,
+        max_messages=MAX_PENDING_MESSAGES,
+        ttl=PENDING_MESSAGE_TTL,
+        notice_ttl=MESSAGE_LOCK_TIMEOUT,
+        trips=trips
+    )
     
-    if not wait_notice_sent:
-        line_bot_api.push_message(
-            user_id,
-            TextSendMessage(text="กรุณารอระบบประมวลผลข้อความก่อนหน้าให้เสร็จสิ้นก่อนค่ะ")
-        )
-        redis_client.setex(f"wait_notice:{user_id}", 10, "1")
+    # แจ้งเตือนเพียงครั้งเดียวต่อรอบการประมวลผล (ใช้ reply token ของข้อความนี้เอง)
+    if notice_needed:
+        delivery.send(user_id, WAIT_NOTICE_MESSAGE, reply_token=reply_token, received_at=received_at)
 
 # ฟังก์ชันสำหรับประมวลผลข้อความของผู้ใช้
-def process_user_message(user_id, user_message, reply_token):
+def process_user_message(user_id, user_message, reply_token, received_at=None, trips=None):
     """ประมวลผลข้อความผู้ใช้พร้อมภาพเคลื่อนไหวและการจัดการเซสชัน"""
     start_time = time.time()
-    redis_client.delete(f"wait_notice:{user_id}")
     
-    # เริ่มภาพเคลื่อนไหวการโหลด
+    # เริ่มภาพเคลื่อนไหวการโหลด (ไม่รอผล)
     animation_success, _ = start_loading_animation(user_id)
     
+    try:
+        context = prepare_message(user_id, user_message, reply_token, received_at, trips)
+    except Exception as e:
+        logging.error(f"เกิดข้อผิดพลาดในการเตรียมข้อมูลสำหรับผู้ใช้ {user_id}: {str(e)}", exc_info=True)
+        send_final_response(user_id, ERROR_MESSAGE)
+        return
+    
     # ตรวจสอบการหมดเวลาเซสชัน
-    if check_session_timeout(user_id):
+    if context['state']['timed_out']:
         send_session_timeout_message(user_id)
         return
-        
-    # อัพเดทกิจกรรมล่าสุดของผู้ใช้
-    update_last_activity(user_id)
     
     # ตรวจสอบและจัดการคำสั่ง
     if user_message.startswith('/'):
@@ -592,117 +392,224 @@ def process_user_message(user_id, user_message, reply_token):
         return
         
     # ประมวลผลกับ AI และส่งการตอบกลับ
-    process_ai_response(user_id, user_message, start_time, animation_success)
+    process_ai_response(user_id, user_message, start_time, animation_success,
+                        context['state']['session'], context['prompt'], trips)
+
+def prepare_message(user_id, user_message, reply_token, received_at, trips=None):
+    """
+    เตรียมข้อมูลของข้อความเป็นกราฟขั้นตอน: สถานะบน Redis (หนึ่ง round trip) และข้อมูลบน MySQL รันพร้อมกัน
+    และการประกอบพรอมต์เริ่มทันทีที่เซสชัน สรุป และประวัติสำคัญพร้อม
+    
+    Returns:
+        dict: ผลลัพธ์ของแต่ละขั้นตอน (state และสำหรับข้อความที่ไม่ใช่คำสั่ง prompt)
+    """
+    graph = StageGraph('prepare', prepare_executor)
+    # เก็บ reply token ไว้ให้ข้อความแรกที่ส่งกลับ (ข้อความที่รวมจากการพักไว้ไม่มี token จึงส่งแบบ push)
+    graph.add('state', load_user_state, user_id, reply_token, received_at, trips)
+    
+    if not user_message.startswith('/'):
+        graph.add('summary', lambda: summarizer.get(user_id)[0])
+        # ประวัติสำคัญต้องรู้จำนวนรอบของเซสชันเพื่อตัดรอบที่อยู่ในเซสชันออกในฐานข้อมูล
+        graph.add('important',
+                  lambda state: [] if state['timed_out'] else get_important_turns(user_id, state['session']),
+                  deps=['state'])
+        # ประกอบพรอมต์ภายในงบประมาณโทเค็น (สรุปและประวัติสำคัญไม่ถูกบันทึกลงเซสชัน)
+        graph.add('prompt',
+                  lambda state, summary, important: None if state['timed_out'] else context_builder.build(
+                      state['session'], user_message, summary=summary, important=important, user_id=user_id
+                  ),
+                  deps=['state', 'summary', 'important'])
+    
+    return graph.run(timeout=DISPATCHER_CONFIG['prepare_timeout'])
 
 def send_session_timeout_message(user_id):
     """ส่งข้อความเซสชันหมดอายุ"""
-    welcome_back = (
-        "สวัสดีค่ะ ยินดีต้อนรับกลับมา 👋\n\n"
-        "เซสชันก่อนหน้าของเราหมดอายุแล้ว เราสามารถเริ่มการสนทนาใหม่ได้ทันที\n\n"
-        "💡 ต้องการดูประวัติการสนทนาก่อนหน้า พิมพ์: /status\n"
-        "💡 ต้องการดูรายงานความก้าวหน้า พิมพ์: /progress\n"
-        "💡 ต้องการคำแนะนำเพิ่มเติม พิมพ์: /help\n\n"
-        "คุณต้องการพูดคุยเกี่ยวกับเรื่องอะไรดีคะวันนี้?"
-    )
-    send_final_response(user_id, welcome_back)
-
-def prepare_conversation_context(messages, optimized_history):
-    """เตรียมบริบทการสนทนาโดยใช้ประวัติ"""
-    # ตรวจสอบว่า optimized_history เป็น None หรือไม่
-    if optimized_history is None:
-        # ถ้าเป็น None ให้ใช้ list ว่าง
-        optimized_history = []
-        
-    if len(optimized_history) > 5:
-        summary = summarize_conversation_history(optimized_history[5:])
-        if summary:
-            messages.append({"role": "assistant", "content": f"สรุปการสนทนาก่อนหน้า: {summary}"})
-
-@safe_api_call
-def generate_ai_response(messages):
-    """สร้างการตอบกลับด้วย AI โดยมีการจัดการข้อผิดพลาด"""
-    return deepseek_client.chat.completions.create(
-        model="deepseek-chat",
-        messages=[SYSTEM_MESSAGES] + messages,
-        **GENERATION_CONFIG
+    send_final_response(user_id, SESSION_TIMEOUT_MESSAGE)
+
+def get_important_turns(user_id, session):
+    """ดึงการสนทนาสำคัญที่เก่ากว่าเซสชันสำหรับเติมพรอมต์เมื่อเหลืองบประมาณ"""
+    return services.get_important_turns(db, context_builder, user_id, session)
+
+def schedule_summary_refresh(user_id):
+    """สั่งปรับปรุงสรุปการสนทนาเบื้องหลังบน event loop ถาวร"""
+    if summarizer.try_acquire(user_id):
+        async_loop.submit(summarizer.refresh(user_id))
+
+def generate_ai_response(prompt):
+    """
+    สร้างการตอบกลับด้วย AI ผ่าน Async client บน event loop ถาวร (รับพรอมต์ที่ประกอบแล้ว)
+    การลองใหม่ hedging และ circuit breaker เป็นไปตาม deepseek_policy
+
+    Raises:
+        CircuitOpenError: ถ้า DeepSeek ถูกตัดการเรียกชั่วคราว
+        DeadlineExceededError: ถ้าใช้งบประมาณเวลาของข้อความหมด
+    """
+    return async_loop.run(
+        deepseek_policy.execute(lambda: async_deepseek.generate_completion(prompt, GENERATION_CONFIG)),
+        timeout=ASYNC_CLIENT_CONFIG['request_timeout']
     )
 
-def process_conversation_data(user_id, user_message, bot_response, messages):
-    """ประมวลผลและบันทึกข้อมูลการสนทนา"""
-    # นับโทเค็นสำหรับการสนทนา
-    token_count = token_counter.count_tokens(user_message + bot_response)
+def process_conversation_data(user_id, user_message, bot_response, messages, usage=None, trips=None):
+    """ประมวลผลและบันทึกข้อมูลการสนทนา (ข้อมูลบน Redis ทั้งหมดบันทึกในหนึ่ง round trip)"""
+    # นับโทเค็นของข้อความใหม่ทั้งสองครั้งเดียว แล้วเก็บไว้กับเซสชันเพื่อไม่ต้องนับใหม่ในรอบถัดไป
+    user_tokens, bot_tokens = token_counter.count_tokens([user_message, bot_response])
+    messages[-2]["tokens"], messages[-1]["tokens"] = user_tokens, bot_tokens
+    token_count = user_tokens + bot_tokens
 
     # ประเมินความเสี่ยง
     risk_level, keywords = assess_risk(user_message)
-    save_progress_data(user_id, risk_level, keywords)
 
-    # บันทึกการสนทนาและกำหนดการติดตาม
-    save_chat_session(user_id, messages)
+    # บันทึกเซสชัน (ตัดความยาวเป็นช่วงเพื่อคงส่วนต้นของพรอมต์) ความก้าวหน้า การติดตาม และสถิติ cache
+    session = context_builder.trim_session(messages)
+    trimmed = len(session) < len(messages)
+    try:
+        user_state.save(
+            user_id,
+            session=session,
+            new_messages=2,
+            progress=progress_entry(risk_level, keywords),
+            follow_up_at=next_follow_up_time(datetime.now()),
+            cache_usage=usage,
+            trips=trips
+        )
+    except redis.RedisError as e:
+        logging.error(f"Redis error in process_conversation_data: {str(e)}")
     db.save_conversation(
         user_id=user_id,
         user_message=user_message,
         bot_response=bot_response,
         token_count=token_count
     )
-    schedule_follow_up(user_id, datetime.now())
+    
+    # ปรับปรุงสรุปเฉพาะเมื่อเซสชันถูกตัด เพื่อให้ส่วนต้นของพรอมต์เปลี่ยนพร้อมกันในรอบเดียว
+    if trimmed:
+        schedule_summary_refresh(user_id)
     
     # ส่งการแจ้งเตือนถ้าพบความเสี่ยงสูง
     if risk_level == 'high':
-        emergency_message = (
-            "⚠️ น้องใจดีกังวลว่าคุณอาจกำลังเผชิญกับภาวะเสี่ยง\n\n"
-            "ขอแนะนำให้ติดต่อผู้เชี่ยวชาญเพื่อรับความช่วยเหลือโดยเร็วที่สุด:\n"
-            "📞 สายด่วนสุขภาพจิต: 1323\n"
-            "📞 สายด่วนยาเสพติด: 1165\n"
-            "📞 หน่วยกู้ชีพฉุกเฉิน: 1669\n\n"
-            "คุณไม่จำเป็นต้องเผชิญกับสิ่งนี้เพียงลำพัง การขอความช่วยเหลือคือความกล้าหาญ"
-        )
-        send_final_response(user_id, emergency_message)
-
-def handle_response_timing(start_time, animation_success):
-    """จัดการเวลาในการตอบสนองเพื่อประสบการณ์ผู้ใช้ที่ดีขึ้น"""
-    # คำนวณเวลาที่ผ่านไป
-    elapsed_time = time.time() - start_time
-    
-    # ถ้าเรามีการเคลื่อนไหวที่สำเร็จและการตอบสนอง API กลับมาอย่างรวดเร็ว
-    # เพิ่มการหน่วงเวลาเล็กน้อยเพื่อให้แน่ใจว่าผู้ใช้เห็นภาพเคลื่อนไหวเป็นระยะเวลาที่เหมาะสม
-    # แต่ไม่นานเกินไปที่จะทำให้เกิดความหงุดหงิด (ขั้นต่ำ 5 วินาที สูงสุด 15 วินาที)
-    if animation_success and elapsed_time < 5:
-        # เพิ่มการหน่วงเวลาเล็กน้อยเพื่อให้แน่ใจว่าการเคลื่อนไหวจะถูกมองเห็นเป็นเวลาอย่างน้อย 5 วินาที
-        time.sleep(5 - elapsed_time)
-
-def process_ai_response(user_id, user_message, start_time, animation_success):
-    """สร้างการตอบกลับ AI และจัดการผลลัพธ์"""
+        send_final_response(user_id, EMERGENCY_MESSAGE)
+
+def stream_ai_response(user_id, prompt, start_time):
+    """
+    สร้างการตอบกลับแบบสตรีม ส่งชิ้นแรกทันทีที่พร้อม และส่งชิ้นถัดไปเป็นกลุ่ม
+
+    Returns:
+        tuple: (ข้อความตอบกลับทั้งหมด, ฟิลด์ usage จากชิ้นสุดท้ายหรือ None)
+    """
+    chunker = ThaiChunker(
+        first_min_chars=STREAMING_CONFIG['first_chunk_min_chars'],
+        min_chars=STREAMING_CONFIG['chunk_min_chars']
+    )
+    parts = []
+    pending = []
+    first_sent = False
+    usage = None
+    # ข้อผิดพลาดขณะส่งข้อความ LINE ไม่ใช่ผลของ DeepSeek จึงไม่นับใน breaker
+    sending = False
+    
+    # สตรีมลองใหม่ไม่ได้หลังส่งชิ้นแรกแล้ว จึงใช้เฉพาะ circuit breaker ของนโยบาย
+    breaker = deepseek_policy.breaker
+    if not breaker.allow_request():
+        raise CircuitOpenError("deepseek circuit is open")
+    
+    stream = async_deepseek.stream_completion(prompt, GENERATION_CONFIG)
+    try:
+        for chunk in async_loop.iterate(stream, timeout=ASYNC_CLIENT_CONFIG['request_timeout']):
+            if chunk.get("usage"):
+                usage = chunk["usage"]
+            choices = chunk.get("choices") or []
+            delta = choices[0].get("delta", {}).get("content") if choices else None
+            if not delta:
+                continue
+            parts.append(delta)
+            
+            sending = True
+            for piece in chunker.feed(delta):
+                if not first_sent:
+                    send_final_response(user_id, piece)
+                    first_sent = True
+                    metrics.observe('time_to_first_message_seconds', time.time() - start_time,
+                                    labels={'mode': 'stream'})
+                else:
+                    pending.append(piece)
+                    # ส่งเมื่อครบจำนวนข้อความสูงสุดต่อคำขอ
+                    if len(pending) >= LINE_MAX_MESSAGES_PER_REQUEST:
+                        send_message_batch(user_id, pending)
+                        pending = []
+            sending = False
+    except Exception as e:
+        if sending:
+            breaker.record_neutral()
+        else:
+            deepseek_policy.record_outcome(e)
+        raise
+    deepseek_policy.record_outcome()
+    
+    pending.extend(chunker.flush())
+    if not first_sent and pending:
+        send_final_response(user_id, pending.pop(0))
+        metrics.observe('time_to_first_message_seconds', time.time() - start_time,
+                        labels={'mode': 'stream'})
+    if pending:
+        send_message_batch(user_id, pending)
+    
+    metrics.observe('stream_chunks_per_response', chunker.chunks_emitted)
+    return "".join(parts), usage
+
+def response_delay(start_time, animation_success):
+    """
+    คำนวณเวลาหน่วงคำตอบเพื่อให้ภาพเคลื่อนไหวการโหลดแสดงอย่างน้อยตามเวลาที่กำหนด
+    การหน่วงเป็นเพียงเรื่องความรู้สึก จึงปิดเองเมื่อมีงานรอเธรดว่างหรือคิวหน่วงเวลายาวเกินไป
+    
+    Returns:
+        float: เวลาหน่วง (วินาที) หรือ 0 ถ้าไม่ต้องหน่วง
+    """
+    remaining = RESPONSE_DELAY_CONFIG['min_animation_seconds'] - (time.time() - start_time)
+    if not animation_success or remaining <= 0:
+        return 0
+    if dispatcher.is_saturated() or response_delays.pending() >= RESPONSE_DELAY_CONFIG['max_pending']:
+        metrics.inc('response_delay_skipped_total')
+        return 0
+    return remaining
+
+def process_ai_response(user_id, user_message, start_time, animation_success, messages, prompt, trips=None):
+    """สร้างการตอบกลับ AI และจัดการผลลัพธ์ (รับเซสชันและพรอมต์ที่เตรียมไว้แล้วจาก prepare_message)"""
     try:
-        # ดึงเซสชันการแชทและประวัติ
-        messages = get_chat_session(user_id)
-        
-        # ประมวลผลประวัติและสร้างการตอบกลับ
-        optimized_history = db.get_user_history(user_id, max_tokens=10000)
-        prepare_conversation_context(messages, optimized_history)
-        
-        # เพิ่มข้อความของผู้ใช้
         messages.append({"role": "user", "content": user_message})
         
+        if STREAMING_CONFIG['enabled']:
+            # โหมดสตรีม: ส่งคำตอบทีละส่วนระหว่างสร้าง แล้วจึงบันทึกข้อมูล
+            bot_response, usage = stream_ai_response(user_id, prompt, start_time)
+            messages.append({"role": "assistant", "content": bot_response})
+            process_conversation_data(user_id, user_message, bot_response, messages, usage, trips)
+            logging.info(f"เวลาในการประมวลผลทั้งหมดสำหรับผู้ใช้ {user_id}: {time.time() - start_time:.2f} วินาที")
+            return
+        
         # รับการตอบกลับจาก DeepSeek
-        response = generate_ai_response(messages)
-        bot_response = response.choices[0].message.content
+        response = generate_ai_response(prompt)
+        bot_response = response["choices"][0]["message"]["content"]
         messages.append({"role": "assistant", "content": bot_response})
 
         # ประมวลผลข้อมูลการตอบกลับ
-        process_conversation_data(user_id, user_message, bot_response, messages)
+        process_conversation_data(user_id, user_message, bot_response, messages, response.get("usage"), trips)
         
-        # จัดการจังหวะเวลาสำหรับ UX ที่ดีขึ้น
-        handle_response_timing(start_time, animation_success)
-        
-        # ส่งการตอบกลับสุดท้าย
-        send_final_response(user_id, bot_response)
+        # ส่งการตอบกลับสุดท้าย (คำตอบที่เร็วมากถูกหน่วงผ่านคิว worker จึงว่างทันที)
+        send_final_response(user_id, bot_response, delay=response_delay(start_time, animation_success))
+        metrics.observe('time_to_first_message_seconds', time.time() - start_time,
+                        labels={'mode': 'full'})
         
         # บันทึกเวลาประมวลผลทั้งหมด
         logging.info(f"เวลาในการประมวลผลทั้งหมดสำหรับผู้ใช้ {user_id}: {time.time() - start_time:.2f} วินาที")
         
+    except CircuitOpenError:
+        # DeepSeek ไม่พร้อม: ตอบกลับทันทีด้วยข้อความรอ แต่ยังแจ้งช่องทางช่วยเหลือเมื่อพบความเสี่ยงสูง
+        logging.warning(f"ตัดการเรียก DeepSeek ชั่วคราว ส่งข้อความรอให้ผู้ใช้ {user_id}")
+        send_final_response(user_id, HOLDING_MESSAGE)
+        if assess_risk(user_message)[0] == 'high':
+            send_final_response(user_id, EMERGENCY_MESSAGE)
     except Exception as e:
         logging.error(f"เกิดข้อผิดพลาดในการประมวลผล AI: {str(e)}", exc_info=True)
-        send_final_response(user_id, "ขออภัยค่ะ เกิดข้อผิดพลาดในการประมวลผล")
+        send_final_response(user_id, ERROR_MESSAGE)
 
 # เส้นทาง Flask
 @app.route("/callback", methods=['POST'])
@@ -716,12 +623,53 @@ def callback():
     app.logger.info("Request body: " + body)
 
     try:
-        handler.handle(body, signature)
+        if event_queue is not None:
+            # ตรวจสอบลายเซ็นแล้วส่งเหตุการณ์เข้าคิว ให้ worker ประมวลผลภายหลัง
+            handler.parser.parse(body, signature)
+            event_queue.enqueue(json.loads(body).get('events', []))
+        else:
+            # ประมวลผลเหตุการณ์ของผู้ใช้ต่างคนพร้อมกัน และรอให้ครบก่อนตอบกลับ
+            events = handler.parser.parse(body, signature)
+            futures = [
+                dispatcher.submit_with_priority(
+                    getattr(event.source, 'user_id', None), event_priority(event), dispatch_event, event
+                )
+                for event in events
+            ]
+            for future in futures:
+                future.exception()
     except InvalidSignatureError:
         abort(400)
 
     return 'OK'
 
+@app.route("/metrics", methods=['GET'])
+@limiter.exempt
+def metrics_endpoint():
+    """แสดงตัวชี้วัดภายในของโปรเซสนี้"""
+    snapshot = metrics.snapshot()
+    snapshot['dispatcher'] = dispatcher.stats()
+    snapshot['deepseek_pool'] = async_deepseek.pool_stats()
+    snapshot['deepseek_policy'] = deepseek_policy.stats()
+    snapshot['token_cache'] = token_counter.cache.stats()
+    if async_deepseek.limiter is not None:
+        snapshot['deepseek_limiter'] = async_deepseek.limiter.stats()
+    if event_queue is not None:
+        try:
+            snapshot['event_queue'] = event_queue.stats()
+        except redis.RedisError as e:
+            snapshot['event_queue'] = {"error": str(e)}
+    return jsonify(snapshot)
+
+@app.route("/metrics/prompt-cache/<user_id>", methods=['GET'])
+@limiter.exempt
+def prompt_cache_endpoint(user_id):
+    """แสดงอัตราการตรง context cache ของ DeepSeek สำหรับผู้ใช้"""
+    try:
+        return jsonify(get_cache_stats(redis_client, user_id))
+    except redis.RedisError as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/health", methods=['GET'])
 @limiter.exempt  # ไม่ต้องจำกัดการตรวจสอบสุขภาพ
 def health_check():
@@ -765,8 +713,8 @@ def check_line_api_health():
     """ตรวจสอบการเชื่อมต่อ LINE API"""
     try:
         # ตรวจสอบแบบพื้นฐานว่า API พร้อมใช้งาน
-        bot_info = line_bot_api.get_bot_info()
-        return bool(bot_info.display_name)
+        result = line_client.get_bot_info()
+        return bool(result and result.data.get('displayName'))
     except Exception:
         return False
 
@@ -817,27 +765,109 @@ def get_memory_usage():
 def handle_message(event):
     user_id = event.source.user_id
     user_message = event.message.text
-
-    # ตรวจสอบการล็อค
-    if is_user_locked(user_id):
-        handle_locked_user(user_id)
+    # เวลาของเหตุการณ์จาก LINE (มิลลิวินาที) ใช้คำนวณอายุของ reply token
+    received_at = event.timestamp / 1000 if event.timestamp else None
+
+    # ล็อคผู้ใช้ ถ้ามีการประมวลผลอื่นอยู่ให้พักข้อความไว้
+    trips = RoundTrips()
+    lock_token = user_state.lock(user_id, trips)
+    if not lock_token:
+        handle_locked_user(user_id, user_message, event.reply_token, received_at, trips)
+        trips.observe()
         return
 
-    # ล็อคผู้ใช้และประมวลผลข้อความ
-    lock_user(user_id)
     try:
-        process_user_message(user_id, user_message, event.reply_token)
+        process_user_message(user_id, user_message, event.reply_token, received_at, trips)
     finally:
-        unlock_user(user_id)
+        # ปลดล็อค (เฉพาะล็อคของรอบนี้) และตรวจสอบข้อความที่พักไว้ในขั้นตอนเดียว
+        has_pending = user_state.release(user_id, lock_token, trips)
+        trips.observe()
+    
+    # ตอบข้อความที่เข้ามาระหว่างประมวลผลรวมในรอบเดียว เป็นงานแยกของผู้ใช้เดียวกัน
+    # (ไม่รวมเวลาไว้ในเหตุการณ์นี้ ซึ่งจะถูกยืนยันในคิวเหตุการณ์ทันทีที่คืนค่า)
+    if has_pending:
+        dispatcher.submit(user_id, process_pending_messages, user_id)
+
+def process_pending_messages(user_id):
+    """ประมวลผลข้อความที่พักไว้ระหว่างล็อค โดยรวมข้อความต่อเนื่องเป็นการเรียก LLM ครั้งเดียว"""
+    # ตรวจสอบซ้ำหลังปลดล็อค เพื่อไม่ให้ข้อความที่เข้ามาระหว่างปลดล็อคตกหล่น
+    has_pending = True
+    while has_pending:
+        trips = RoundTrips()
+        lock_token = user_state.lock(user_id, trips)
+        if not lock_token:
+            return
+        try:
+            pending = user_state.drain_pending(user_id, trips)
+            if pending:
+                logging.info(f"รวมข้อความที่พักไว้ {len(pending)} ข้อความสำหรับผู้ใช้ {user_id}")
+                metrics.observe('coalesced_messages_per_turn', len(pending))
+                for i, turn in enumerate(merge_pending_messages(pending)):
+                    # ล็อครองรับหนึ่งรอบการประมวลผล จึงต่ออายุก่อนรอบถัดไป
+                    if i and not user_state.extend(user_id, lock_token, trips):
+                        logging.warning(f"ล็อคของผู้ใช้ {user_id} หมดอายุระหว่างตอบข้อความที่พักไว้")
+                    process_user_message(user_id, turn, None, trips=trips)
+        finally:
+            has_pending = user_state.release(user_id, lock_token, trips)
+            trips.observe()
+
+def message_priority(text):
+    """จัดระดับความสำคัญของข้อความจากคะแนนความสำคัญและการประเมินความเสี่ยง (ค้นหาคำสำคัญรอบเดียว)"""
+    result = keyword_matcher.scan(text)
+    return classify_priority(result.priority, result.risk_level)
+
+def event_priority(event):
+    """จัดระดับความสำคัญของเหตุการณ์ที่แยกวิเคราะห์แล้ว"""
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+        return message_priority(event.message.text)
+    return 'normal'
+
+def queued_event_priority(raw_event):
+    """จัดระดับความสำคัญของเหตุการณ์ดิบจากคิว"""
+    message = raw_event.get('message') or {}
+    if raw_event.get('type') == 'message' and message.get('type') == 'text':
+        return message_priority(message.get('text', ''))
+    return 'normal'
+
+def dispatch_event(event):
+    """ส่งเหตุการณ์ที่แยกวิเคราะห์แล้วให้ตัวจัดการที่ลงทะเบียนไว้"""
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+        handle_message(event)
+    else:
+        logging.debug(f"ข้ามเหตุการณ์ประเภท {getattr(event, 'type', None)}")
+
+def dispatch_queued_event(raw_event):
+    """ประมวลผลเหตุการณ์ดิบที่ worker ดึงมาจากคิว"""
+    if raw_event.get('type') != 'message' or raw_event.get('message', {}).get('type') != 'text':
+        logging.debug(f"ข้ามเหตุการณ์ประเภท {raw_event.get('type')}")
+        return
+    handle_message(MessageEvent.new_from_json_dict(raw_event))
+
+# สัญญาณหยุดสำหรับ worker ของคิวเหตุการณ์
+worker_stop_event = threading.Event()
+
+def init_workers(num_workers=None):
+    """เริ่ม worker สำหรับคิวเหตุการณ์ในโปรเซสปัจจุบัน"""
+    if event_queue is None:
+        return []
+    if num_workers is None:
+        num_workers = EVENT_QUEUE_CONFIG['inprocess_workers']
+    if num_workers <= 0:
+        return []
+    threads = start_worker_pool(event_queue, dispatch_queued_event, num_workers, worker_stop_event,
+                                dispatcher=dispatcher, priority_func=queued_event_priority,
+                                max_in_flight=EVENT_QUEUE_CONFIG['max_in_flight'])
+    logging.info(f"เริ่ม worker ของคิวเหตุการณ์ {num_workers} ตัว")
+    return threads
 
 # เริ่มต้นตัวกำหนดการ
 scheduler = BackgroundScheduler()
 
 # เพิ่มงานตัวกำหนดการ
 def init_scheduler():
-    scheduler.add_job(check_and_send_follow_ups, 'interval', minutes=30)
+    scheduler.add_job(check_and_send_follow_ups, 'interval', minutes=FOLLOW_UP_CHECK_MINUTES)
     scheduler.start()
-    logging.info("ตัวกำหนดการเริ่มต้นแล้ว ตรวจสอบการติดตามทุก 30 นาที")
+    logging.info(f"ตัวกำหนดการเริ่มต้นแล้ว ตรวจสอบการติดตามทุก {FOLLOW_UP_CHECK_MINUTES} นาที")
     
     # การจัดการการปิดอย่างถูกต้อง
     atexit.register(lambda: scheduler.shutdown())
@@ -845,7 +875,19 @@ def init_scheduler():
 # ตัวจัดการการปิดอย่างสง่างาม
 def handle_shutdown(sig, frame):
     logging.info("กำลังปิดแอปพลิเคชัน...")
-    scheduler.shutdown()
+    worker_stop_event.set()
+    if scheduler.running:
+        scheduler.shutdown()
+    # ปิด connection pool ของ Async client และหยุด event loop
+    try:
+        async_loop.run(async_deepseek.close(), timeout=5)
+    except Exception as e:
+        logging.warning(f"ปิด Async client ไม่สำเร็จ: {str(e)}")
+    async_loop.stop()
+    # ส่งคำตอบที่หน่วงไว้ทันทีและรอให้ส่งเสร็จก่อนปิดไคลเอนต์ LINE
+    response_delays.stop()
+    prepare_executor.shutdown(wait=False)
+    line_client.close()
     # ปิดการเชื่อมต่อ redis
     redis_client.close()
     exit(0)
@@ -856,5 +898,6 @@ signal.signal(signal.SIGINT, handle_shutdown)
 if __name__ == "__main__":
     # เริ่มต้นตัวกำหนดการก่อนเริ่มเซิร์ฟเวอร์
     init_scheduler()
+    init_workers()
     # เริ่มเซิร์ฟเวอร์
     serve(app, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,473 @@
+"""
+แอปพลิเคชัน ASGI แบบอะซิงโครนัสสำหรับแชทบอท 'ใจดี'
+ไปป์ไลน์ข้อความบน Redis (ล็อค, สถานะผู้ใช้, เซสชัน และข้อความที่พักไว้ผ่าน AsyncUserStateStore),
+การสร้างคำตอบ และการส่ง LINE ทำงานบน event loop เดียว ทำให้หนึ่งโปรเซสรองรับการเรียก LLM ที่ช้าได้พร้อมกันจำนวนมาก
+
+โหมดนี้เป็นแบบผสม: ไดรเวอร์ MySQL (mysql-connector) เป็นแบบซิงโครนัส การอ่านและบันทึกประวัติ สรุป
+และสถิติจึงรันในเธรดผ่าน asyncio.to_thread และตัวจำกัดคำขอพร้อมกันกับล็อคการปรับปรุงสรุปใช้การเชื่อมต่อ
+Redis แบบซิงโครนัสแยกนอก event loop ส่วนประกอบที่ใช้ร่วมกับโหมด WSGI มาจาก services.py
+จึงไม่สร้างแอป Flask หรือเธรดของโหมด WSGI
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+import redis
+import redis.asyncio as aioredis
+from linebot import WebhookParser
+from linebot.exceptions import InvalidSignatureError
+from linebot.models import MessageEvent, TextMessage
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+from .async_api import AsyncDeepseekClient
+from .call_policy import CircuitOpenError
+from .config import (
+    load_config, GENERATION_CONFIG, ASGI_CONFIG, ASYNC_CLIENT_CONFIG, LINE_CLIENT_CONFIG, DELIVERY_CONFIG,
+    RESPONSE_DELAY_CONFIG
+)
+from .delivery import AsyncMessageDelivery, AsyncReplyTokenStore
+from .line_client import AsyncLineClient
+from .metrics import metrics
+from .services import (
+    FOLLOW_UP_CHECK_MINUTES, TIMEOUT_WARNING_TTL, MESSAGE_LOCK_TIMEOUT, PENDING_MESSAGE_TTL, MAX_PENDING_MESSAGES,
+    TIMEOUT_WARNING_MESSAGE, SESSION_TIMEOUT_MESSAGE, EMERGENCY_MESSAGE, WAIT_NOTICE_MESSAGE, ERROR_MESSAGE,
+    HOLDING_MESSAGE, FOLLOW_UP_MESSAGE, RESET_MESSAGE, NO_PROGRESS_MESSAGE, UNKNOWN_COMMAND_MESSAGE,
+    STATIC_COMMAND_RESPONSES, assess_risk, progress_entry, merge_pending_messages, next_follow_up_time,
+    needs_timeout_warning, format_progress_report, collect_status, format_status, get_important_turns,
+    create_deepseek_limiter, create_deepseek_policy, create_token_counter, create_chat_history_db,
+    create_summarizer, create_context_builder, create_user_state
+)
+from .user_state import AsyncUserStateStore, RoundTrips
+
+config = load_config()
+parser = WebhookParser(config.LINE_CHANNEL_SECRET)
+
+# นโยบายการเรียก DeepSeek ของโปรเซสนี้
+deepseek_policy = create_deepseek_policy()
+
+# ไคลเอนต์ที่ผูกกับ event loop ของเซิร์ฟเวอร์ (สร้างใน lifespan)
+redis_client: aioredis.Redis = None
+user_state: AsyncUserStateStore = None
+line_client: AsyncLineClient = None
+delivery: AsyncMessageDelivery = None
+deepseek: AsyncDeepseekClient = None
+
+# ส่วนประกอบที่ใช้ร่วมกับโหมด WSGI (สร้างใน lifespan)
+sync_redis: redis.Redis = None
+token_counter = None
+db = None
+summarizer = None
+context_builder = None
+
+# จำกัดจำนวนการสนทนาที่ประมวลผลพร้อมกัน และรักษาลำดับต่อผู้ใช้
+_concurrency: asyncio.Semaphore = None
+_user_tails: Dict[str, asyncio.Future] = {}
+_background_tasks = set()
+_follow_up_task: asyncio.Task = None
+
+async def startup():
+    """สร้างไคลเอนต์อะซิงโครนัสและส่วนประกอบทั้งหมดบน event loop ของเซิร์ฟเวอร์"""
+    global redis_client, user_state, line_client, delivery, deepseek, sync_redis
+    global token_counter, db, summarizer, context_builder, _concurrency, _follow_up_task
+    redis_client = aioredis.Redis(
+        host=config.REDIS_HOST,
+        port=config.REDIS_PORT,
+        db=config.REDIS_DB,
+        decode_responses=True,
+        socket_timeout=5,
+        socket_connect_timeout=5,
+        max_connections=ASGI_CONFIG['redis_max_connections']
+    )
+    await redis_client.ping()
+    user_state = create_user_state(redis_client, asynchronous=True)
+
+    # Redis แบบซิงโครนัสสำหรับการประสานตัวจำกัดระหว่างโปรเซสและล็อคการปรับปรุงสรุป (เรียกในเธรดเสมอ)
+    sync_redis = redis.Redis(
+        host=config.REDIS_HOST,
+        port=config.REDIS_PORT,
+        db=config.REDIS_DB,
+        decode_responses=True,
+        socket_timeout=5,
+        socket_connect_timeout=5
+    )
+
+    line_client = AsyncLineClient(
+        config.LINE_CHANNEL_ACCESS_TOKEN,
+        timeout=LINE_CLIENT_CONFIG['timeout'],
+        connect_timeout=LINE_CLIENT_CONFIG['connect_timeout'],
+        pool_size=LINE_CLIENT_CONFIG['pool_size']
+    )
+    reply_tokens = None
+    if DELIVERY_CONFIG['reply_enabled']:
+        reply_tokens = AsyncReplyTokenStore(redis_client, ttl=DELIVERY_CONFIG['reply_token_ttl'])
+    delivery = AsyncMessageDelivery(line_client, reply_tokens)
+    deepseek = await AsyncDeepseekClient(
+        config.DEEPSEEK_API_KEY,
+        limiter=create_deepseek_limiter(sync_redis),
+        http2=ASYNC_CLIENT_CONFIG['http2']
+    ).setup()
+
+    # การโหลดตัวตัดคำและการเริ่มต้น MySQL เป็นงานบล็อก จึงรันในเธรด
+    token_counter = await asyncio.to_thread(create_token_counter)
+    db = await asyncio.to_thread(create_chat_history_db, config, token_counter)
+    summarizer = create_summarizer(db, sync_redis, deepseek)
+    context_builder = create_context_builder(token_counter)
+
+    _concurrency = asyncio.Semaphore(ASGI_CONFIG['max_concurrency'])
+    _follow_up_task = asyncio.create_task(follow_up_loop())
+    logging.info("แอปพลิเคชันแชทบอท 'ใจดี' กำลังทำงาน (โหมด ASGI)")
+
+async def shutdown():
+    """ปิดการเชื่อมต่อทั้งหมด"""
+    if _follow_up_task is not None:
+        _follow_up_task.cancel()
+    if _background_tasks:
+        await asyncio.wait(_background_tasks, timeout=30)
+    await deepseek.close()
+    await line_client.close()
+    await redis_client.close()
+    sync_redis.close()
+
+def spawn(coro):
+    """รันงานเบื้องหลังบน event loop ของเซิร์ฟเวอร์ (รอให้เสร็จตอนปิดแอป)"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+# ฟังก์ชันส่งข้อความ LINE
+async def push_message(user_id, text):
+    """ส่งข้อความแบบ push ไปยังผู้ใช้"""
+    return (await line_client.push_message(user_id, text)).ok
+
+async def send_message(user_id, text, reply_token=None, received_at=None):
+    """ส่งข้อความตอบกลับ (ใช้ reply token ของข้อความถ้ายังไม่หมดอายุ มิฉะนั้นส่งแบบ push)"""
+    return (await delivery.send(user_id, text, reply_token=reply_token, received_at=received_at)).ok
+
+def start_loading_animation(user_id, duration=60):
+    """แสดงภาพเคลื่อนไหวการโหลดของ LINE ให้กับผู้ใช้โดยไม่รอผล (คืน Task ที่ให้ผลเป็น LineResult)"""
+    return line_client.start_loading_background(user_id, duration)
+
+# ฟังก์ชันสถานะผู้ใช้บน Redis
+async def load_user_state(user_id, reply_token=None, received_at=None, trips=None):
+    """
+    เตรียมสถานะผู้ใช้ก่อนประมวลผลข้อความในหนึ่ง round trip (ดู app_deepseek.load_user_state)
+    แล้วส่งการแจ้งเตือนเมื่อเซสชันใกล้หมดอายุ
+
+    Returns:
+        dict: timed_out, last_activity, warning_sent และ session
+    """
+    current_time = datetime.now().timestamp()
+    token_store = delivery.token_store
+    token_entry = token_store.entry(reply_token, received_at) if token_store is not None else None
+    state = await user_state.prepare(user_id, current_time, reply_token=token_entry, trips=trips)
+
+    if needs_timeout_warning(state, current_time):
+        try:
+            if await push_message(user_id, TIMEOUT_WARNING_MESSAGE):
+                await user_state.mark_warning_sent(user_id, TIMEOUT_WARNING_TTL, trips=trips)
+                logging.info(f"ส่งการแจ้งเตือนหมดเวลาเซสชันไปยังผู้ใช้: {user_id}")
+        except Exception as e:
+            logging.error(f"เกิดข้อผิดพลาดในการแจ้งเตือนหมดเวลาเซสชันสำหรับผู้ใช้ {user_id}: {str(e)}")
+    return state
+
+async def handle_locked_user(user_id, user_message, reply_token=None, received_at=None, trips=None):
+    """พักข้อความที่เข้ามาระหว่างล็อค และแจ้งผู้ใช้เพียงครั้งเดียวต่อรอบการประมวลผล"""
+    notice_needed = await user_state.buffer_pending(
+        user_id, user_message,
+        max_messages=MAX_PENDING_MESSAGES,
+        ttl=PENDING_MESSAGE_TTL,
+        notice_ttl=MESSAGE_LOCK_TIMEOUT,
+        trips=trips
+    )
+    if notice_needed:
+        await send_message(user_id, WAIT_NOTICE_MESSAGE, reply_token, received_at)
+
+# ฟังก์ชันเกี่ยวกับการติดตามผู้ใช้
+async def check_and_send_follow_ups():
+    """ตรวจสอบและส่งการติดตามที่ถึงกำหนด"""
+    logging.info("กำลังรันการตรวจสอบการติดตามผลตามกำหนดเวลา")
+    try:
+        due_follow_ups = await redis_client.zrangebyscore('follow_up_queue', 0, datetime.now().timestamp())
+        for user_id in due_follow_ups:
+            try:
+                if not await push_message(user_id, FOLLOW_UP_MESSAGE):
+                    # ส่งไม่สำเร็จ เก็บไว้ในคิวเพื่อลองใหม่รอบถัดไป
+                    continue
+                await redis_client.zrem('follow_up_queue', user_id)
+                await asyncio.to_thread(db.update_follow_up_status, user_id, 'sent', datetime.now())
+                logging.info(f"ส่งการติดตามไปยังผู้ใช้: {user_id}")
+            except Exception as e:
+                logging.error(f"เกิดข้อผิดพลาดในการส่งการติดตามไปยัง {user_id}: {str(e)}")
+    except Exception as e:
+        logging.error(f"เกิดข้อผิดพลาดใน check_and_send_follow_ups: {str(e)}")
+
+async def follow_up_loop():
+    """ตรวจสอบการติดตามที่ถึงกำหนดเป็นรอบ (แทน BackgroundScheduler ของโหมด WSGI)"""
+    while True:
+        await asyncio.sleep(FOLLOW_UP_CHECK_MINUTES * 60)
+        await check_and_send_follow_ups()
+
+# ฟังก์ชันสำหรับการจัดการคำสั่ง
+async def handle_command(user_id, command):
+    """จัดการคำสั่ง (ข้อมูลบน Redis อ่านแบบอะซิงโครนัส ข้อมูลบน MySQL อ่านในเธรด)"""
+    if command == '/reset':
+        await asyncio.gather(
+            asyncio.to_thread(db.clear_user_history, user_id),
+            user_state.clear_session(user_id)
+        )
+        response_text = RESET_MESSAGE
+
+    elif command in STATIC_COMMAND_RESPONSES:
+        response_text = STATIC_COMMAND_RESPONSES[command]
+
+    elif command == '/status':
+        history = await user_state.get_session(user_id)
+        response_text = format_status(await asyncio.to_thread(collect_status, db, token_counter, user_id, history))
+
+    elif command == '/progress':
+        try:
+            report = format_progress_report(await user_state.get_progress(user_id))
+        except Exception as e:
+            logging.error(f"เกิดข้อผิดพลาดในการสร้างรายงานความก้าวหน้า: {str(e)}")
+            report = "ไม่สามารถสร้างรายงานได้"
+        response_text = report if report else NO_PROGRESS_MESSAGE
+
+    else:
+        response_text = UNKNOWN_COMMAND_MESSAGE
+
+    await send_message(user_id, response_text)
+
+# ไปป์ไลน์ข้อความ
+async def schedule_summary_refresh(user_id):
+    """สั่งปรับปรุงสรุปการสนทนาเบื้องหลังบน event loop ของเซิร์ฟเวอร์"""
+    if await asyncio.to_thread(summarizer.try_acquire, user_id):
+        spawn(summarizer.refresh(user_id))
+
+async def generate_ai_response(prompt: List[Dict[str, str]]) -> Dict[str, Any]:
+    """สร้างการตอบกลับด้วย DeepSeek แบบอะซิงโครนัส (รับพรอมต์ที่ประกอบแล้ว) ตามนโยบายการเรียกของโปรเซส"""
+    return await deepseek_policy.execute(
+        lambda: deepseek.generate_completion(messages=prompt, config=GENERATION_CONFIG)
+    )
+
+async def process_conversation_data(user_id, user_message, bot_response, messages, usage=None, trips=None):
+    """บันทึกข้อมูลการสนทนา: สถานะบน Redis (หนึ่ง pipeline) และประวัติบน MySQL พร้อมกัน"""
+    user_tokens, bot_tokens = token_counter.count_tokens([user_message, bot_response])
+    messages[-2]["tokens"], messages[-1]["tokens"] = user_tokens, bot_tokens
+    risk_level, keywords = assess_risk(user_message)
+
+    session = context_builder.trim_session(messages)
+    trimmed = len(session) < len(messages)
+    state_saved, history_saved = await asyncio.gather(
+        user_state.save(
+            user_id,
+            session=session,
+            new_messages=2,
+            progress=progress_entry(risk_level, keywords),
+            follow_up_at=next_follow_up_time(datetime.now()),
+            cache_usage=usage,
+            trips=trips
+        ),
+        asyncio.to_thread(
+            db.save_conversation,
+            user_id=user_id,
+            user_message=user_message,
+            bot_response=bot_response,
+            token_count=user_tokens + bot_tokens
+        ),
+        return_exceptions=True
+    )
+    if isinstance(state_saved, aioredis.RedisError):
+        logging.error(f"Redis error in process_conversation_data: {str(state_saved)}")
+    elif isinstance(state_saved, BaseException):
+        raise state_saved
+    if isinstance(history_saved, BaseException):
+        raise history_saved
+
+    # ปรับปรุงสรุปเฉพาะเมื่อเซสชันถูกตัด เพื่อให้ส่วนต้นของพรอมต์เปลี่ยนพร้อมกันในรอบเดียว
+    if trimmed:
+        await schedule_summary_refresh(user_id)
+    if risk_level == 'high':
+        await send_message(user_id, EMERGENCY_MESSAGE)
+
+async def process_ai_response(user_id, user_message, start_time, animation_success, messages, trips=None):
+    """สร้างการตอบกลับ AI บันทึกข้อมูล และส่งผลลัพธ์ให้ผู้ใช้ (รับเซสชันจาก load_user_state)"""
+    try:
+        (summary, _), important = await asyncio.gather(
+            asyncio.to_thread(summarizer.get, user_id),
+            asyncio.to_thread(get_important_turns, db, context_builder, user_id, messages)
+        )
+        prompt = context_builder.build(messages, user_message, summary=summary,
+                                       important=important, user_id=user_id)
+        messages.append({"role": "user", "content": user_message})
+
+        response = await generate_ai_response(prompt)
+        bot_response = response["choices"][0]["message"]["content"]
+        messages.append({"role": "assistant", "content": bot_response})
+        await process_conversation_data(user_id, user_message, bot_response, messages, response.get("usage"), trips)
+
+        # ให้ภาพเคลื่อนไหวแสดงอย่างน้อยตามเวลาที่กำหนด โดยไม่ครอบครองเธรด
+        # ข้ามการหน่วงเมื่อช่องประมวลผลพร้อมกันเต็ม เพราะการหน่วงยังครอบครองช่องอยู่
+        remaining = RESPONSE_DELAY_CONFIG['min_animation_seconds'] - (time.time() - start_time)
+        if animation_success and remaining > 0:
+            if _concurrency.locked():
+                metrics.inc('response_delay_skipped_total')
+            else:
+                await asyncio.sleep(remaining)
+
+        await send_message(user_id, bot_response)
+        metrics.observe('asgi_message_seconds', time.time() - start_time)
+        logging.info(f"เวลาในการประมวลผลทั้งหมดสำหรับผู้ใช้ {user_id}: {time.time() - start_time:.2f} วินาที")
+    except CircuitOpenError:
+        logging.warning(f"ตัดการเรียก DeepSeek ชั่วคราว ส่งข้อความรอให้ผู้ใช้ {user_id}")
+        await send_message(user_id, HOLDING_MESSAGE)
+        if assess_risk(user_message)[0] == 'high':
+            await send_message(user_id, EMERGENCY_MESSAGE)
+    except Exception as e:
+        logging.error(f"เกิดข้อผิดพลาดในการประมวลผล AI: {str(e)}", exc_info=True)
+        await send_message(user_id, ERROR_MESSAGE)
+
+async def process_user_message(user_id, user_message, reply_token=None, received_at=None, trips=None):
+    """ประมวลผลข้อความผู้ใช้หนึ่งรอบ"""
+    start_time = time.time()
+    animation_task = start_loading_animation(user_id)
+
+    try:
+        state = await load_user_state(user_id, reply_token, received_at, trips)
+    except Exception as e:
+        logging.error(f"เกิดข้อผิดพลาดในการเตรียมข้อมูลสำหรับผู้ใช้ {user_id}: {str(e)}", exc_info=True)
+        await send_message(user_id, ERROR_MESSAGE)
+        return
+
+    if state['timed_out']:
+        await send_message(user_id, SESSION_TIMEOUT_MESSAGE)
+        return
+
+    if user_message.startswith('/'):
+        await handle_command(user_id, user_message)
+        return
+
+    # ไม่รอคำขอภาพเคลื่อนไหว: ถือว่าสำเร็จจนกว่าจะรู้ผลว่าล้มเหลว
+    animation_success = not animation_task.done() or animation_task.result().ok
+    await process_ai_response(user_id, user_message, start_time, animation_success, state['session'], trips)
+
+async def handle_message(user_id, user_message, reply_token=None, received_at=None):
+    """จัดการข้อความพร้อมล็อคผู้ใช้ และตอบข้อความที่พักไว้รวมกัน"""
+    trips = RoundTrips()
+    lock_token = await user_state.lock(user_id, trips)
+    if not lock_token:
+        await handle_locked_user(user_id, user_message, reply_token, received_at, trips)
+        trips.observe()
+        return
+
+    try:
+        await process_user_message(user_id, user_message, reply_token, received_at, trips)
+    finally:
+        # ปลดล็อค (เฉพาะล็อคของรอบนี้) และตรวจสอบข้อความที่พักไว้ในขั้นตอนเดียว
+        has_pending = await user_state.release(user_id, lock_token, trips)
+        trips.observe()
+
+    if has_pending:
+        await process_pending_messages(user_id)
+
+async def process_pending_messages(user_id):
+    """ประมวลผลข้อความที่พักไว้ระหว่างล็อค โดยรวมข้อความต่อเนื่องเป็นการเรียก LLM ครั้งเดียว"""
+    # ตรวจสอบซ้ำหลังปลดล็อค เพื่อไม่ให้ข้อความที่เข้ามาระหว่างปลดล็อคตกหล่น
+    has_pending = True
+    while has_pending:
+        trips = RoundTrips()
+        lock_token = await user_state.lock(user_id, trips)
+        if not lock_token:
+            return
+        try:
+            pending = await user_state.drain_pending(user_id, trips)
+            if pending:
+                logging.info(f"รวมข้อความที่พักไว้ {len(pending)} ข้อความสำหรับผู้ใช้ {user_id}")
+                metrics.observe('coalesced_messages_per_turn', len(pending))
+                for i, turn in enumerate(merge_pending_messages(pending)):
+                    # ล็อครองรับหนึ่งรอบการประมวลผล จึงต่ออายุก่อนรอบถัดไป
+                    if i and not await user_state.extend(user_id, lock_token, trips):
+                        logging.warning(f"ล็อคของผู้ใช้ {user_id} หมดอายุระหว่างตอบข้อความที่พักไว้")
+                    await process_user_message(user_id, turn, trips=trips)
+        finally:
+            has_pending = await user_state.release(user_id, lock_token, trips)
+            trips.observe()
+
+async def run_in_user_order(user_id, coro_factory):
+    """รันงานหลังงานก่อนหน้าของผู้ใช้คนเดียวกัน ภายใต้ขีดจำกัดการทำงานพร้อมกัน"""
+    previous = _user_tails.get(user_id)
+    done = asyncio.get_running_loop().create_future()
+    _user_tails[user_id] = done
+    try:
+        if previous is not None:
+            await previous
+        async with _concurrency:
+            await coro_factory()
+    except Exception as e:
+        logging.error(f"เกิดข้อผิดพลาดในการประมวลผลเหตุการณ์ของ {user_id}: {str(e)}", exc_info=True)
+    finally:
+        done.set_result(None)
+        if _user_tails.get(user_id) is done:
+            del _user_tails[user_id]
+
+# เส้นทาง ASGI
+async def callback(request: Request):
+    """รับ webhook ตรวจสอบลายเซ็น แล้วประมวลผลเหตุการณ์เบื้องหลัง"""
+    signature = request.headers.get('X-Line-Signature', '')
+    body = (await request.body()).decode('utf-8')
+
+    try:
+        events = parser.parse(body, signature)
+    except InvalidSignatureError:
+        return PlainTextResponse('Invalid signature', status_code=400)
+
+    for event in events:
+        if not (isinstance(event, MessageEvent) and isinstance(event.message, TextMessage)):
+            continue
+        user_id = event.source.user_id
+        text = event.message.text
+        received_at = event.timestamp / 1000 if event.timestamp else None
+        spawn(run_in_user_order(
+            user_id,
+            lambda u=user_id, t=text, r=event.reply_token, ts=received_at: handle_message(u, t, r, ts)
+        ))
+
+    metrics.set_gauge('asgi_inflight_tasks', len(_background_tasks))
+    return PlainTextResponse('OK')
+
+async def health_check(request: Request):
+    """จุดสิ้นสุดการตรวจสอบสุขภาพ"""
+    try:
+        redis_ok = await redis_client.ping()
+    except aioredis.RedisError:
+        redis_ok = False
+    status = {
+        "status": "ok" if redis_ok else "degraded",
+        "mode": "asgi",
+        "services": {"redis": bool(redis_ok)},
+        "inflight": len(_background_tasks)
+    }
+    return JSONResponse(status, status_code=200 if redis_ok else 503)
+
+async def metrics_endpoint(request: Request):
+    """แสดงตัวชี้วัดภายในของโปรเซสนี้"""
+    snapshot = metrics.snapshot()
+    snapshot['deepseek_policy'] = deepseek_policy.stats()
+    if deepseek is not None and deepseek.limiter is not None:
+        snapshot['deepseek_limiter'] = deepseek.limiter.stats()
+    return JSONResponse(snapshot)
+
+app = Starlette(
+    routes=[
+        Route("/callback", callback, methods=["POST"]),
+        Route("/health", health_check, methods=["GET"]),
+        Route("/metrics", metrics_endpoint, methods=["GET"]),
+    ],
+    on_startup=[startup],
+    on_shutdown=[shutdown]
+)
@@ -3,26 +3,74 @@
 ช่วยเพิ่มประสิทธิภาพการตอบสนองต่อผู้ใช้
 """
 import asyncio
+import contextlib
 import httpx
 import os
 import logging
 import json
-from typing import Dict, List, Any, Optional, Union
+import time
+from typing import AsyncIterator, Dict, Iterable, List, Any, Optional, Union
+
+# HTTP/2 ต้องใช้แพ็กเกจ h2 (httpx[http2]) ถ้าไม่มีจะใช้ HTTP/1.1
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+class DeepseekAPIError(Exception):
+    """
+    ข้อผิดพลาดจากการเรียก DeepSeek API พร้อมรหัสสถานะ HTTP (None หากเป็นข้อผิดพลาดของการเชื่อมต่อ)
+    """
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def retryable(self) -> bool:
+        """ข้อผิดพลาดชั่วคราวที่ควรลองใหม่: การเชื่อมต่อล้มเหลว, 429 หรือ 5xx"""
+        return self.status_code is None or self.status_code == 429 or self.status_code >= 500
 
 class AsyncDeepseekClient:
     """
     ไคลเอนต์แบบอะซิงโครนัสสำหรับการเรียกใช้ DeepSeek AI API
     """
-    def __init__(self, api_key: str):
+    def __init__(self, 
+                 api_key: str,
+                 max_connections: int = 100,
+                 max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 300.0,
+                 limiter=None,
+                 http2: bool = False):
         """
         สร้างไคลเอนต์อะซิงโครนัสสำหรับ DeepSeek AI
         
         Args:
             api_key (str): คีย์ API ของ DeepSeek
+            max_connections (int): จำนวนการเชื่อมต่อสูงสุดใน pool
+            max_keepalive_connections (int): จำนวนการเชื่อมต่อ keep-alive ที่เก็บไว้ใช้ซ้ำ
+            keepalive_expiry (float): ระยะเวลาเก็บการเชื่อมต่อที่ว่าง (วินาที)
+            limiter (AdaptiveLimiter, optional): ตัวจำกัดคำขอพร้อมกันแบบปรับตัว
+            http2 (bool): ใช้ HTTP/2 เพื่อส่งหลายคำขอบนการเชื่อมต่อเดียว (ต้องติดตั้ง h2)
         """
         self.api_key = api_key
         self.base_url = "https://api.deepseek.com"
         self.client = None
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.limiter = limiter
+        self.http2 = http2 and HTTP2_AVAILABLE
+        if http2 and not HTTP2_AVAILABLE:
+            logging.warning("ไม่พบแพ็กเกจ h2 จึงใช้ HTTP/1.1 กับ DeepSeek (ติดตั้งด้วย pip install httpx[http2])")
+        self.stats = {
+            "requests": 0,
+            "errors": 0,
+            "in_flight": 0,
+            "total_latency": 0.0
+        }
         
     async def setup(self):
         """
@@ -35,6 +83,8 @@ class AsyncDeepseekClient:
             self.client = httpx.AsyncClient(
                 base_url=self.base_url,
                 timeout=60.0,
+                limits=self.limits,
+                http2=self.http2,
                 headers={
                     "Authorization": f"Bearer {self.api_key}",
                     "Content-Type": "application/json"
@@ -48,6 +98,55 @@ class AsyncDeepseekClient:
             await self.client.aclose()
             self.client = None
             
+    async def warmup(self, connections: int = 2) -> int:
+        """
+        เปิดการเชื่อมต่อล่วงหน้า (TLS handshake) เพื่อให้คำขอแรกไม่ต้องรอ
+        
+        Args:
+            connections (int): จำนวนการเชื่อมต่อที่ต้องการเปิด
+            
+        Returns:
+            int: จำนวนการเชื่อมต่อที่เปิดสำเร็จ
+        """
+        if not self.client:
+            await self.setup()
+            
+        results = await asyncio.gather(
+            *[self.client.get("/models") for _ in range(connections)],
+            return_exceptions=True
+        )
+        opened = sum(1 for r in results if not isinstance(r, Exception))
+        logging.info(f"เปิดการเชื่อมต่อล่วงหน้าไปยัง DeepSeek {opened}/{connections} การเชื่อมต่อ")
+        return opened
+        
+    def _limit_slot(self):
+        """สร้าง context ของตัวจำกัดคำขอพร้อมกัน หรือ context เปล่าถ้าไม่ได้กำหนด"""
+        if self.limiter is None:
+            return contextlib.nullcontext()
+        return self.limiter.slot()
+        
+    def pool_stats(self) -> Dict[str, Any]:
+        """
+        ดึงสถิติของ connection pool และคำขอ
+        
+        Returns:
+            Dict[str, Any]: จำนวนการเชื่อมต่อ (ทั้งหมด/ว่าง) และสถิติคำขอ
+        """
+        stats = dict(self.stats)
+        stats["avg_latency"] = (
+            round(stats["total_latency"] / stats["requests"], 4) if stats["requests"] else 0.0
+        )
+        stats["connections"] = None
+        stats["idle_connections"] = None
+        
+        # httpx ไม่มี API สาธารณะสำหรับสถานะ pool จึงอ่านจาก transport ถ้ามี
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is not None:
+            stats["connections"] = len(connections)
+            stats["idle_connections"] = sum(1 for c in connections if c.is_idle())
+        return stats
+            
     async def generate_completion(self, 
                                  messages: List[Dict[str, str]], 
                                  config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
@@ -76,26 +175,103 @@ class AsyncDeepseekClient:
         # รวมการตั้งค่า
         merged_config = {**default_config, **(config or {})}
             
-        try:
-            response = await self.client.post(
-                "/v1/chat/completions",
-                json={
-                    "model": "deepseek-chat",
-                    "messages": messages,
-                    **merged_config
-                }
-            )
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            logging.error(f"HTTP error in async API call: {e.response.status_code} - {e.response.text}")
-            raise Exception(f"HTTP error: {e.response.status_code}")
-        except httpx.RequestError as e:
-            logging.error(f"Request error in async API call: {str(e)}")
-            raise Exception(f"Request error: {str(e)}")
-        except Exception as e:
-            logging.error(f"Error in async completion: {str(e)}")
-            raise
+        # จองสิทธิ์จากตัวจำกัดคำขอพร้อมกัน (ถ้ามี) ตลอดอายุของคำขอ
+        async with self._limit_slot():
+            start_time = time.monotonic()
+            self.stats["requests"] += 1
+            self.stats["in_flight"] += 1
+            try:
+                response = await self.client.post(
+                    "/v1/chat/completions",
+                    json={
+                        "model": "deepseek-chat",
+                        "messages": messages,
+                        **merged_config
+                    }
+                )
+                response.raise_for_status()
+                return response.json()
+            except httpx.HTTPStatusError as e:
+                self.stats["errors"] += 1
+                logging.error(f"HTTP error in async API call: {e.response.status_code} - {e.response.text}")
+                raise DeepseekAPIError(f"HTTP error: {e.response.status_code}", e.response.status_code)
+            except httpx.RequestError as e:
+                self.stats["errors"] += 1
+                logging.error(f"Request error in async API call: {str(e)}")
+                raise DeepseekAPIError(f"Request error: {str(e)}")
+            except Exception as e:
+                self.stats["errors"] += 1
+                logging.error(f"Error in async completion: {str(e)}")
+                raise
+            finally:
+                self.stats["in_flight"] -= 1
+                self.stats["total_latency"] += time.monotonic() - start_time
+    
+    async def stream_completion(self,
+                                messages: List[Dict[str, str]],
+                                config: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        สร้างการเติมเต็มการแชทแบบสตรีม (stream=True)
+        
+        Args:
+            messages (List[Dict[str, str]]): ลิสต์ของข้อความแชท
+            config (Dict[str, Any], optional): การตั้งค่าการสร้าง
+            
+        Yields:
+            Dict[str, Any]: ชิ้นส่วนการตอบกลับ (chat.completion.chunk) ตามลำดับที่ได้รับ
+            
+        Raises:
+            Exception: กรณีที่มีข้อผิดพลาดในระหว่างการสร้าง
+        """
+        if not self.client:
+            await self.setup()
+            
+        default_config = {
+            "temperature": 1.0,
+            "max_tokens": 500,
+            "top_p": 0.9
+        }
+        merged_config = {**default_config, **(config or {})}
+        
+        # จองสิทธิ์จากตัวจำกัดคำขอพร้อมกัน (ถ้ามี) ตลอดอายุของคำขอ
+        async with self._limit_slot():
+            start_time = time.monotonic()
+            self.stats["requests"] += 1
+            self.stats["in_flight"] += 1
+            try:
+                async with self.client.stream(
+                    "POST",
+                    "/v1/chat/completions",
+                    json={
+                        "model": "deepseek-chat",
+                        "messages": messages,
+                        "stream": True,
+                        "stream_options": {"include_usage": True},
+                        **merged_config
+                    }
+                ) as response:
+                    if response.status_code >= 400:
+                        await response.aread()
+                        response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        # รูปแบบ Server-Sent Events: "data: {...}" และปิดท้ายด้วย "data: [DONE]"
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        yield json.loads(data)
+            except httpx.HTTPStatusError as e:
+                self.stats["errors"] += 1
+                logging.error(f"HTTP error in async stream: {e.response.status_code} - {e.response.text}")
+                raise DeepseekAPIError(f"HTTP error: {e.response.status_code}", e.response.status_code)
+            except httpx.RequestError as e:
+                self.stats["errors"] += 1
+                logging.error(f"Request error in async stream: {str(e)}")
+                raise DeepseekAPIError(f"Request error: {str(e)}")
+            finally:
+                self.stats["in_flight"] -= 1
+                self.stats["total_latency"] += time.monotonic() - start_time
     
     async def summarize_conversation(self, 
                                     history: List[tuple], 
@@ -142,47 +318,87 @@ class AsyncDeepseekClient:
             logging.error(f"Error in async summarize_conversation: {str(e)}")
             return ""
     
+    async def stream_message_batch(self,
+                                   batch: Iterable[Dict[str, Any]],
+                                   system_message: Dict[str, str],
+                                   max_concurrency: int = 8,
+                                   item_timeout: Optional[float] = 60.0) -> AsyncIterator[Dict[str, Any]]:
+        """
+        ประมวลผลชุดข้อความโดยจำกัดจำนวนที่ทำงานพร้อมกัน และส่งผลลัพธ์ทันทีที่แต่ละรายการเสร็จ
+        รายการถูกดึงจาก batch เมื่อมีช่องว่างเท่านั้น จึงใช้กับ iterator ขนาดใหญ่ (เช่น งาน backfill) ได้
+        
+        Args:
+            batch (Iterable[Dict[str, Any]]): รายการที่มี id, messages และ config (ถ้ามี)
+            system_message (Dict[str, str]): ข้อความคำแนะนำระบบ
+            max_concurrency (int): จำนวนรายการสูงสุดที่ประมวลผลพร้อมกัน
+            item_timeout (float, optional): เวลาสูงสุดต่อรายการ (วินาที) หรือ None ถ้าไม่จำกัด
+            
+        Yields:
+            Dict[str, Any]: ผลลัพธ์ตามลำดับที่เสร็จ (id, success, response หรือ error, latency)
+        """
+        async def run_item(item: Dict[str, Any]) -> Dict[str, Any]:
+            start_time = time.monotonic()
+            try:
+                response = await asyncio.wait_for(
+                    self.generate_completion(
+                        messages=[system_message] + item.get("messages", []),
+                        config=item.get("config", {})
+                    ),
+                    item_timeout
+                )
+                result = {"id": item.get("id"), "success": True, "response": response}
+            except asyncio.TimeoutError:
+                result = {"id": item.get("id"), "success": False, "error": f"timeout after {item_timeout}s"}
+            except Exception as e:
+                result = {"id": item.get("id"), "success": False, "error": str(e)}
+            result["latency"] = round(time.monotonic() - start_time, 4)
+            return result
+        
+        items = iter(batch)
+        pending = set()
+        try:
+            while True:
+                # เติมงานจนเต็มขีดจำกัด
+                while len(pending) < max_concurrency:
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    pending.add(asyncio.ensure_future(run_item(item)))
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            # ผู้เรียกหยุดอ่านก่อนครบ: ยกเลิกรายการที่ค้าง
+            for task in pending:
+                task.cancel()
+    
     async def process_message_batch(self, 
                                    batch: List[Dict[str, Any]], 
-                                   system_message: Dict[str, str]) -> List[Dict[str, Any]]:
+                                   system_message: Dict[str, str],
+                                   max_concurrency: int = 8,
+                                   item_timeout: Optional[float] = 60.0) -> List[Dict[str, Any]]:
         """
-        ประมวลผลชุดข้อความพร้อมกัน
+        ประมวลผลชุดข้อความพร้อมกัน (จำกัดจำนวนพร้อมกัน) และคืนผลลัพธ์ตามลำดับของ batch
         
         Args:
             batch (List[Dict[str, Any]]): ลิสต์ของข้อความและข้อมูลบริบท
             system_message (Dict[str, str]): ข้อความคำแนะนำระบบ
+            max_concurrency (int): จำนวนรายการสูงสุดที่ประมวลผลพร้อมกัน
+            item_timeout (float, optional): เวลาสูงสุดต่อรายการ (วินาที)
             
         Returns:
             List[Dict[str, Any]]: ผลลัพธ์การประมวลผลสำหรับแต่ละข้อความ
         """
         if not batch:
             return []
-            
-        tasks = []
-        for item in batch:
-            messages = [system_message] + item.get("messages", [])
-            task = asyncio.create_task(
-                self.generate_completion(
-                    messages=messages,
-                    config=item.get("config", {})
-                )
-            )
-            tasks.append((item.get("id"), task))
-            
-        results = []
-        for item_id, task in tasks:
-            try:
-                response = await task
-                results.append({
-                    "id": item_id,
-                    "success": True,
-                    "response": response
-                })
-            except Exception as e:
-                results.append({
-                    "id": item_id,
-                    "success": False,
-                    "error": str(e)
-                })
-                
-        return results
\ No newline at end of file
+        
+        # ใช้ตำแหน่งใน batch เป็นคีย์ชั่วคราว เพื่อเรียงผลลัพธ์กลับตามลำดับเดิม
+        indexed = [{**item, "id": index} for index, item in enumerate(batch)]
+        results = [None] * len(batch)
+        async for result in self.stream_message_batch(indexed, system_message, max_concurrency, item_timeout):
+            index = result["id"]
+            result["id"] = batch[index].get("id")
+            results[index] = result
+        return results
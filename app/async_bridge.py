@@ -0,0 +1,124 @@
+"""
+โมดูล event loop ถาวรสำหรับแชทบอท 'ใจดี'
+รัน asyncio event loop ในเธรดเบื้องหลังตลอดอายุโปรเซส เพื่อให้ไคลเอนต์อะซิงโครนัส
+(และ connection pool แบบ keep-alive) ใช้งานได้จากโค้ด WSGI แบบซิงโครนัส
+"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from typing import Any, AsyncIterator, Awaitable, Iterator, Optional
+
+class AsyncLoopThread:
+    """
+    เธรดที่เป็นเจ้าของ event loop ถาวร พร้อมสะพานเชื่อมแบบปลอดภัยต่อเธรด
+    """
+    def __init__(self, name: str = 'async-loop'):
+        """
+        สร้างเธรดของ event loop (ยังไม่เริ่มทำงาน)
+
+        Args:
+            name (str): ชื่อเธรด
+        """
+        self.name = name
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._ready = threading.Event()
+
+    def _run(self):
+        """วนรอบ event loop จนกว่าจะถูกสั่งหยุด"""
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._ready.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def start(self) -> 'AsyncLoopThread':
+        """
+        เริ่มเธรดและรอจน event loop พร้อมรับงาน
+
+        Returns:
+            AsyncLoopThread: ตัวเองเพื่อให้สามารถรวมคำสั่งได้
+        """
+        if not self._thread.is_alive():
+            self._thread.start()
+            self._ready.wait()
+            logging.info(f"เริ่ม event loop ถาวร ({self.name})")
+        return self
+
+    @property
+    def running(self) -> bool:
+        """ตรวจสอบว่า event loop กำลังทำงานอยู่หรือไม่"""
+        return self._thread.is_alive() and self.loop.is_running()
+
+    def submit(self, coro: Awaitable[Any]) -> concurrent.futures.Future:
+        """
+        ส่ง coroutine ไปรันบน event loop โดยไม่รอผลลัพธ์
+
+        Args:
+            coro (Awaitable): coroutine ที่ต้องการรัน
+
+        Returns:
+            concurrent.futures.Future: ผลลัพธ์ที่รอได้จากเธรดใดก็ได้
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """
+        รัน coroutine บน event loop และรอผลลัพธ์จากเธรดปัจจุบัน
+
+        Args:
+            coro (Awaitable): coroutine ที่ต้องการรัน
+            timeout (float, optional): เวลารอสูงสุด (วินาที)
+
+        Returns:
+            Any: ผลลัพธ์ของ coroutine
+
+        Raises:
+            concurrent.futures.TimeoutError: ถ้าเกินเวลาที่กำหนด (งานจะถูกยกเลิก)
+        """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def iterate(self, agen: AsyncIterator[Any], timeout: Optional[float] = None) -> Iterator[Any]:
+        """
+        วนอ่าน async generator ที่รันบน event loop จากโค้ดซิงโครนัส
+
+        Args:
+            agen (AsyncIterator): async generator ที่ต้องการอ่าน
+            timeout (float, optional): เวลารอสูงสุดต่อหนึ่งรายการ (วินาที)
+
+        Yields:
+            Any: รายการจาก async generator ตามลำดับ
+        """
+        done = object()
+
+        async def next_item():
+            try:
+                return await agen.__anext__()
+            except StopAsyncIteration:
+                return done
+
+        try:
+            while True:
+                item = self.run(next_item(), timeout)
+                if item is done:
+                    return
+                yield item
+        finally:
+            # ปิด generator บน event loop เพื่อคืนการเชื่อมต่อให้ pool
+            try:
+                self.run(agen.aclose(), timeout=5)
+            except Exception as e:
+                logging.debug(f"ปิด async generator ไม่สำเร็จ: {str(e)}")
+
+    def stop(self, timeout: float = 5.0):
+        """หยุด event loop และรอให้เธรดจบการทำงาน"""
+        if self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout)
@@ -0,0 +1,344 @@
+"""
+โมดูลนโยบายการเรียกบริการภายนอกสำหรับแชทบอท 'ใจดี'
+รวมงบประมาณเวลาต่อข้อความ การลองใหม่แบบ backoff พร้อม jitter การส่งคำขอสำรอง (hedging)
+และ circuit breaker ที่ตัดการเรียกทันทีเมื่อบริการปลายทางไม่พร้อม
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .metrics import metrics
+
+class CircuitOpenError(Exception):
+    """บริการปลายทางถูกตัดการเรียกชั่วคราวโดย circuit breaker"""
+
+class DeadlineExceededError(Exception):
+    """ใช้งบประมาณเวลาของการเรียกหมดแล้ว"""
+
+class CircuitBreaker:
+    """
+    Circuit breaker แบบสามสถานะ (closed → open → half_open) ที่ปลอดภัยต่อเธรด
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self,
+                 name: str,
+                 failure_threshold: int = 5,
+                 recovery_timeout: float = 30.0,
+                 half_open_max_calls: int = 1):
+        """
+        สร้าง circuit breaker
+
+        Args:
+            name (str): ชื่อบริการ (ใช้ในตัวชี้วัด)
+            failure_threshold (int): จำนวนความล้มเหลวต่อเนื่องที่ทำให้ตัดการเรียก
+            recovery_timeout (float): เวลาที่ตัดการเรียกก่อนทดลองใหม่ (วินาที)
+            half_open_max_calls (int): จำนวนคำขอทดลองพร้อมกันในสถานะ half_open
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._times_opened = 0
+
+    @property
+    def state(self) -> str:
+        """สถานะปัจจุบันของ breaker"""
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        """เปลี่ยนเป็น half_open เมื่อครบเวลาตัดการเรียก (ต้องถือ lock)"""
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._set_state(self.HALF_OPEN)
+            self._half_open_calls = 0
+
+    def _set_state(self, state: str):
+        """เปลี่ยนสถานะและบันทึกตัวชี้วัด (ต้องถือ lock)"""
+        if state != self._state:
+            logging.warning(f"Circuit breaker {self.name}: {self._state} → {state}")
+            self._state = state
+        metrics.set_gauge('circuit_breaker_open', 0 if state == self.CLOSED else 1,
+                          labels={'name': self.name})
+
+    def allow_request(self) -> bool:
+        """
+        ตรวจสอบว่าอนุญาตให้เรียกบริการได้หรือไม่
+
+        Returns:
+            bool: True ถ้าเรียกได้ (ในสถานะ half_open จะจองสิทธิ์ทดลองหนึ่งครั้ง)
+        """
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return True
+            return False
+
+    def record_success(self):
+        """บันทึกการเรียกที่สำเร็จ"""
+        with self._lock:
+            self._failures = 0
+            if self._state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_neutral(self):
+        """ไม่นับผลของการเรียก (ไม่ได้ไปถึงบริการปลายทาง) และคืนสิทธิ์ทดลองที่จองไว้ในสถานะ half_open"""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def record_failure(self):
+        """บันทึกการเรียกที่ล้มเหลว"""
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._times_opened += 1
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        ดึงสถานะของ breaker
+
+        Returns:
+            Dict[str, Any]: สถานะ จำนวนความล้มเหลวต่อเนื่อง จำนวนครั้งที่ตัดการเรียก และเวลาที่เหลือก่อนทดลองใหม่
+        """
+        with self._lock:
+            self._maybe_half_open()
+            retry_in = 0.0
+            if self._state == self.OPEN:
+                retry_in = max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "times_opened": self._times_opened,
+                "retry_in_seconds": round(retry_in, 2)
+            }
+
+class CallPolicy:
+    """
+    นโยบายการเรียกแบบอะซิงโครนัส: งบประมาณเวลา + ลองใหม่พร้อม jitter + hedging + circuit breaker
+    """
+    def __init__(self,
+                 name: str,
+                 breaker: Optional[CircuitBreaker] = None,
+                 deadline: float = 30.0,
+                 max_attempts: int = 3,
+                 base_delay: float = 0.5,
+                 max_delay: float = 4.0,
+                 hedge: bool = False,
+                 hedge_percentile: float = 0.95,
+                 hedge_min_delay: float = 3.0,
+                 hedge_min_samples: int = 20,
+                 hedge_max_ratio: float = 0.1,
+                 is_retryable: Optional[Callable[[Exception], bool]] = None):
+        """
+        สร้างนโยบายการเรียก
+
+        Args:
+            name (str): ชื่อบริการ (ใช้ในตัวชี้วัด)
+            breaker (CircuitBreaker, optional): circuit breaker ของบริการ
+            deadline (float): งบประมาณเวลาเริ่มต้นต่อการเรียกหนึ่งครั้งรวมการลองใหม่ (วินาที)
+            max_attempts (int): จำนวนครั้งสูงสุดที่พยายามเรียก
+            base_delay (float): เวลารอพื้นฐานของ backoff (วินาที)
+            max_delay (float): เวลารอสูงสุดระหว่างการลองใหม่ (วินาที)
+            hedge (bool): ส่งคำขอสำรองเมื่อคำขอแรกช้ากว่าเปอร์เซ็นไทล์ที่กำหนด
+            hedge_percentile (float): เปอร์เซ็นไทล์ของเวลาแฝงที่ใช้เป็นเกณฑ์ส่งคำขอสำรอง
+            hedge_min_delay (float): เวลารอขั้นต่ำก่อนส่งคำขอสำรอง (วินาที)
+            hedge_min_samples (int): จำนวนตัวอย่างเวลาแฝงขั้นต่ำก่อนใช้เปอร์เซ็นไทล์
+            hedge_max_ratio (float): สัดส่วนสูงสุดของคำขอสำรองต่อการเรียกทั้งหมด
+            is_retryable (Callable, optional): ฟังก์ชันตัดสินว่าข้อผิดพลาดควรลองใหม่หรือไม่
+        """
+        self.name = name
+        self.breaker = breaker
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_ratio = hedge_max_ratio
+        self.is_retryable = is_retryable or (lambda e: getattr(e, "retryable", True))
+        self._lock = threading.Lock()
+        self._latency_samples = 0
+        self.counters = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "failures": 0,
+            "deadline_exceeded": 0,
+            "short_circuited": 0
+        }
+
+    def _count(self, key: str, value: int = 1):
+        """เพิ่มตัวนับของนโยบายและตัวชี้วัดรวม"""
+        with self._lock:
+            self.counters[key] += value
+        metrics.inc(f'call_policy_{key}_total', value, labels={'name': self.name})
+
+    def record_outcome(self, error: Optional[BaseException] = None):
+        """
+        บันทึกผลของการเรียกหนึ่งครั้งลง circuit breaker (ใช้ร่วมกันระหว่าง execute และเส้นทางที่เรียก breaker เอง เช่น สตรีม)
+        คำขอที่ไม่ได้ไปถึงบริการ (เช่น รอคิวของตัวจำกัดเกินเวลา) ไม่นับผลและคืนสิทธิ์ทดลอง
+        ข้อผิดพลาดของคำขอเอง (เช่น 400) ไม่ได้บ่งบอกว่าบริการไม่พร้อม จึงนับเป็นความสำเร็จ
+
+        Args:
+            error (BaseException, optional): ข้อผิดพลาดของการเรียก หรือ None ถ้าสำเร็จ
+        """
+        if self.breaker is None:
+            return
+        if error is None:
+            self.breaker.record_success()
+        elif getattr(error, "breaker_neutral", False):
+            self.breaker.record_neutral()
+        elif self.is_retryable(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        คำนวณเวลารอก่อนส่งคำขอสำรอง
+
+        Returns:
+            Optional[float]: เวลารอ (วินาที) หรือ None ถ้าไม่ควรส่งคำขอสำรอง
+        """
+        if not self.hedge:
+            return None
+        with self._lock:
+            calls = self.counters["calls"]
+            if calls and self.counters["hedges"] >= calls * self.hedge_max_ratio:
+                return None
+            samples = self._latency_samples
+        if samples < self.hedge_min_samples:
+            return self.hedge_min_delay
+        observed = metrics.get_percentile('call_policy_attempt_seconds', self.hedge_percentile,
+                                          labels={'name': self.name})
+        return max(self.hedge_min_delay, observed or 0.0)
+
+    async def execute(self,
+                      factory: Callable[[], Awaitable[Any]],
+                      deadline: Optional[float] = None) -> Any:
+        """
+        เรียกบริการตามนโยบาย
+
+        Args:
+            factory (Callable): ฟังก์ชันที่สร้าง coroutine ของการเรียกหนึ่งครั้ง (เรียกซ้ำได้)
+            deadline (float, optional): งบประมาณเวลาของการเรียกนี้ (วินาที)
+
+        Returns:
+            Any: ผลลัพธ์ของการเรียกที่สำเร็จ
+
+        Raises:
+            CircuitOpenError: ถ้า breaker ตัดการเรียกอยู่
+            DeadlineExceededError: ถ้าใช้งบประมาณเวลาหมด
+            Exception: ข้อผิดพลาดสุดท้ายของการเรียก
+        """
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        self._count("calls")
+        attempt = 0
+        while True:
+            if self.breaker is not None and not self.breaker.allow_request():
+                self._count("short_circuited")
+                raise CircuitOpenError(f"{self.name} circuit is open")
+
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                self._count("deadline_exceeded")
+                raise DeadlineExceededError(f"{self.name} deadline exceeded after {attempt} attempts")
+
+            attempt += 1
+            self._count("attempts")
+            try:
+                result = await asyncio.wait_for(self._attempt(factory), remaining)
+                self.record_outcome()
+                return result
+            except asyncio.TimeoutError:
+                if self.breaker is not None:
+                    self.breaker.record_failure()
+                self._count("deadline_exceeded")
+                raise DeadlineExceededError(f"{self.name} deadline exceeded after {attempt} attempts")
+            except Exception as e:
+                retryable = self.is_retryable(e)
+                self.record_outcome(e)
+                self._count("failures")
+                if not retryable or attempt >= self.max_attempts:
+                    raise
+
+                # backoff แบบ full jitter และไม่รอเกินงบประมาณเวลา
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+                if time.monotonic() + delay >= deadline_at:
+                    self._count("deadline_exceeded")
+                    raise
+                logging.warning(f"เรียก {self.name} ล้มเหลว (ครั้งที่ {attempt}/{self.max_attempts}) "
+                                f"ลองใหม่ใน {delay:.2f} วินาที: {str(e)}")
+                self._count("retries")
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """เรียกหนึ่งครั้ง และส่งคำขอสำรองถ้าคำขอแรกช้ากว่าเกณฑ์ คืนผลของคำขอที่สำเร็จก่อน"""
+        start_time = time.monotonic()
+        primary = asyncio.ensure_future(factory())
+        tasks = {primary}
+        try:
+            delay = self.hedge_delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    self._count("hedges")
+                    tasks.add(asyncio.ensure_future(factory()))
+
+            last_error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._count("hedge_wins")
+                        self._record_latency(time.monotonic() - start_time)
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            # ยกเลิกคำขอที่ยังค้าง (คำขอที่แพ้หรือเมื่อหมดเวลา)
+            for task in tasks:
+                task.cancel()
+
+    def _record_latency(self, seconds: float):
+        """บันทึกเวลาแฝงของการเรียกที่สำเร็จ (ใช้คำนวณเกณฑ์ hedging)"""
+        with self._lock:
+            self._latency_samples += 1
+        metrics.observe('call_policy_attempt_seconds', seconds, labels={'name': self.name})
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        ดึงสถิติของนโยบายและสถานะ breaker
+
+        Returns:
+            Dict[str, Any]: ตัวนับการเรียก/ลองใหม่/hedging และสถานะ breaker
+        """
+        with self._lock:
+            stats = dict(self.counters)
+        stats["hedge_delay"] = self.hedge_delay()
+        if self.breaker is not None:
+            stats["breaker"] = self.breaker.stats()
+        return stats
@@ -4,6 +4,7 @@
 from datetime import datetime
 import logging
 from .utils import safe_db_operation
+from .keywords import keyword_matcher
 from .token_counter import TokenCounter
 
 class ChatHistoryDB:
@@ -11,15 +12,16 @@ class ChatHistoryDB:
     คลาสสำหรับจัดการการดำเนินการกับฐานข้อมูลประวัติการแชท
     """
     
-    def __init__(self, mysql_pool):
+    def __init__(self, mysql_pool, token_counter=None):
         """
         สร้างอินสแตนซ์ของ ChatHistoryDB
         
         Args:
             mysql_pool: MySQL connection pool
+            token_counter (TokenCounter, optional): ตัวนับโทเค็นที่ใช้ร่วมกัน (สร้างใหม่ถ้าไม่ระบุ)
         """
         self.pool = mysql_pool
-        self.counter = TokenCounter()
+        self.counter = token_counter or TokenCounter()
         logging.info("ChatHistoryDB initialized")
         
     def get_connection(self):
@@ -60,12 +62,18 @@ class ChatHistoryDB:
             
             all_messages = cursor.fetchall()
             
+            # นับโทเค็นของแถวที่ยังไม่มีจำนวน (token_count = 0) ในครั้งเดียวแบบ batch
+            uncounted = [i for i, msg in enumerate(all_messages) if not msg[4]]
+            counted = dict(zip(uncounted, self.counter.count_tokens_batch(
+                [all_messages[i][2] + all_messages[i][3] for i in uncounted]
+            )))
+            
             # Apply token limit
             selected_history = []
             total_tokens = 0
             
-            for msg in all_messages:
-                msg_tokens = msg[4] or self.counter.count_tokens(msg[2] + msg[3])
+            for i, msg in enumerate(all_messages):
+                msg_tokens = msg[4] or counted[i]
                 if total_tokens + msg_tokens <= max_tokens:
                     selected_history.append((msg[0], msg[2], msg[3]))
                     total_tokens += msg_tokens
@@ -184,19 +192,9 @@ class ChatHistoryDB:
         Returns:
             bool: True หากข้อความสำคัญ
         """
-        # ตรวจสอบคำสำคัญในข้อความของผู้ใช้
-        important_keywords = [
-            'ฆ่าตัวตาย', 'ทำร้ายตัวเอง', 'อยากตาย', 
-            'overdose', 'เกินขนาด', 'ก้าวร้าว',
-            'ซึมเศร้า', 'วิตกกังวล', 'ความทรงจำ', 
-            'ไม่มีความสุข', 'ทรมาน', 'เครียด',
-            'เลิก', 'หยุด', 'อดทน'
-        ]
-        
-        combined_text = (user_message + " " + bot_response).lower()
-        for keyword in important_keywords:
-            if keyword.lower() in combined_text:
-                return True
+        # ตรวจสอบคำสำคัญในข้อความของผู้ใช้และคำตอบ (ทะเบียนใน keywords.py)
+        if keyword_matcher.scan(user_message + " " + bot_response).important:
+            return True
                 
         # ตรวจสอบความยาวของข้อความ (ข้อความที่ยาวมักมีเนื้อหาสำคัญ)
         if len(user_message) > 300 or len(bot_response) > 500:
@@ -306,6 +304,7 @@ class ChatHistoryDB:
         try:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM conversations WHERE user_id = %s', (user_id,))
+            cursor.execute('DELETE FROM conversation_summaries WHERE user_id = %s', (user_id,))
             conn.commit()
             return True
         except Exception as e:
@@ -316,6 +315,205 @@ class ChatHistoryDB:
             cursor.close()
             conn.close()
     
+    @safe_db_operation
+    def get_conversation_summary(self, user_id):
+        """
+        ดึงสรุปการสนทนาแบบสะสมของผู้ใช้
+        
+        Args:
+            user_id (str): LINE User ID
+            
+        Returns:
+            tuple: (ข้อความสรุป, ID การสนทนาล่าสุดที่รวมในสรุป) หรือ None ถ้ายังไม่มีสรุป
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT summary, last_conversation_id FROM conversation_summaries WHERE user_id = %s',
+                (user_id,)
+            )
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+            conn.close()
+    
+    @safe_db_operation
+    def save_conversation_summary(self, user_id, summary, last_conversation_id):
+        """
+        บันทึกสรุปการสนทนาแบบสะสม (ไม่เขียนทับสรุปที่ใหม่กว่า)
+        
+        Args:
+            user_id (str): LINE User ID
+            summary (str): ข้อความสรุป
+            last_conversation_id (int): ID การสนทนาล่าสุดที่รวมในสรุป
+            
+        Returns:
+            bool: True หากสำเร็จ
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            # MySQL ประเมินการกำหนดค่าจากซ้ายไปขวา จึงต้องอัพเดท summary ก่อน last_conversation_id
+            cursor.execute('''
+                INSERT INTO conversation_summaries (user_id, summary, last_conversation_id, updated_at)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    summary = IF(VALUES(last_conversation_id) > last_conversation_id, VALUES(summary), summary),
+                    updated_at = IF(VALUES(last_conversation_id) > last_conversation_id, VALUES(updated_at), updated_at),
+                    last_conversation_id = GREATEST(last_conversation_id, VALUES(last_conversation_id))
+            ''', (user_id, summary, last_conversation_id, datetime.now()))
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error saving conversation summary: {str(e)}")
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+    
+    @safe_db_operation
+    def get_turns_outside_window(self, user_id, after_id, recent_window=5, limit=20):
+        """
+        ดึงการสนทนาที่หลุดออกจากหน้าต่างล่าสุดและยังไม่ถูกรวมในสรุป
+        
+        Args:
+            user_id (str): LINE User ID
+            after_id (int): ID การสนทนาล่าสุดที่รวมในสรุปแล้ว
+            recent_window (int): จำนวนการสนทนาล่าสุดที่ยังอยู่ในบริบทโดยตรง
+            limit (int): จำนวนการสนทนาสูงสุดที่ดึง
+            
+        Returns:
+            list: รายการ (id, user_message, bot_response) เรียงจากเก่าไปใหม่
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT c.id, c.user_message, c.bot_response
+                FROM conversations c
+                WHERE c.user_id = %s
+                AND c.id > %s
+                AND c.id < (
+                    SELECT COALESCE(MIN(recent.id), 0) FROM (
+                        SELECT id FROM conversations
+                        WHERE user_id = %s
+                        ORDER BY id DESC
+                        LIMIT %s
+                    ) recent
+                )
+                ORDER BY c.id ASC
+                LIMIT %s
+            ''', (user_id, after_id, user_id, recent_window, limit))
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+    
+    @safe_db_operation
+    def get_users_needing_summary(self, recent_window=5, min_new_turns=3, limit=1000):
+        """
+        ดึงผู้ใช้ที่มีการสนทนานอกหน้าต่างล่าสุดซึ่งยังไม่ถูกรวมในสรุป (สำหรับงาน backfill)
+        
+        Args:
+            recent_window (int): จำนวนการสนทนาล่าสุดที่ยังอยู่ในบริบทโดยตรง
+            min_new_turns (int): จำนวนการสนทนาใหม่ขั้นต่ำที่ต้องปรับปรุงสรุป
+            limit (int): จำนวนผู้ใช้สูงสุด
+            
+        Returns:
+            list: รายการ user_id เรียงตามจำนวนการสนทนาที่ยังไม่สรุปจากมากไปน้อย
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT c.user_id, COUNT(*) AS unsummarized
+                FROM conversations c
+                LEFT JOIN conversation_summaries s ON s.user_id = c.user_id
+                WHERE c.id > COALESCE(s.last_conversation_id, 0)
+                GROUP BY c.user_id
+                HAVING unsummarized >= %s
+                ORDER BY unsummarized DESC
+                LIMIT %s
+            ''', (recent_window + min_new_turns, limit))
+            return [row[0] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+            conn.close()
+    
+    @safe_db_operation
+    def get_important_turns(self, user_id, session_turns=0, limit=3):
+        """
+        ดึงการสนทนาสำคัญล่าสุดที่เก่ากว่ารอบแรกของเซสชัน (ไม่ซ้ำกับเซสชัน)
+        การสนทนาแต่ละรอบของเซสชันถูกบันทึกเป็นหนึ่งแถว รอบแรกของเซสชันจึงเป็นแถวล่าสุดลำดับที่ session_turns
+        ซึ่งคงเดิมจนกว่าเซสชันจะถูกตัด ผลลัพธ์จึงคงที่ระหว่างการตัดแต่ละครั้ง (ส่วนต้นของพรอมต์ไม่เปลี่ยน)
+        
+        Args:
+            user_id (str): LINE User ID
+            session_turns (int): จำนวนรอบการสนทนาในเซสชัน (0 = ไม่ต้องตัดรอบใดออก)
+            limit (int): จำนวนการสนทนาสูงสุดที่ดึง
+            
+        Returns:
+            list: รายการ (id, user_message, bot_response, token_count) เรียงจากเก่าไปใหม่
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            if session_turns > 0:
+                cursor.execute('''
+                    SELECT c.id, c.user_message, c.bot_response, c.token_count
+                    FROM conversations c
+                    WHERE c.user_id = %s
+                    AND c.important_flag = TRUE
+                    AND c.id < (
+                        SELECT COALESCE(MIN(session_rows.id), 0) FROM (
+                            SELECT id FROM conversations
+                            WHERE user_id = %s
+                            ORDER BY id DESC
+                            LIMIT %s
+                        ) session_rows
+                    )
+                    ORDER BY c.id DESC
+                    LIMIT %s
+                ''', (user_id, user_id, session_turns, limit))
+            else:
+                cursor.execute('''
+                    SELECT id, user_message, bot_response, token_count
+                    FROM conversations
+                    WHERE user_id = %s
+                    AND important_flag = TRUE
+                    ORDER BY id DESC
+                    LIMIT %s
+                ''', (user_id, limit))
+            return list(reversed(cursor.fetchall()))
+        finally:
+            cursor.close()
+            conn.close()
+    
+    @safe_db_operation
+    def get_message_sample(self, limit=1000):
+        """
+        ดึงข้อความล่าสุดของผู้ใช้และบอทเป็นคลังตัวอย่าง (ใช้ปรับเทียบตัวประมาณจำนวนโทเค็น)
+        
+        Args:
+            limit (int): จำนวนการสนทนาสูงสุดที่ดึง (ได้ข้อความไม่เกินสองเท่า)
+            
+        Returns:
+            list: ข้อความที่ไม่ว่าง เรียงจากใหม่ไปเก่า
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT user_message, bot_response FROM conversations ORDER BY id DESC LIMIT %s',
+                (limit,)
+            )
+            return [text for row in cursor.fetchall() for text in row if text]
+        finally:
+            cursor.close()
+            conn.close()
+    
     @safe_db_operation
     def update_follow_up_status(self, user_id, status, timestamp=None):
         """
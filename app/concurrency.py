@@ -0,0 +1,298 @@
+"""
+โมดูลจำกัดจำนวนคำขอพร้อมกันแบบปรับตัวสำหรับแชทบอท 'ใจดี'
+ปรับขีดจำกัดแบบ AIMD (เพิ่มทีละน้อยเมื่อบริการตอบเร็ว ลดครึ่งเมื่อเกิด 429/5xx หรือช้าเกินเป้าหมาย)
+และประสานขีดจำกัดรวมระหว่างโปรเซสผ่าน Redis
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+from .metrics import metrics
+
+class ConcurrencyLimitExceeded(Exception):
+    """รอคิวเกินเวลาที่กำหนดเนื่องจากคำขอพร้อมกันเต็มขีดจำกัด"""
+    # ไม่ใช่ความล้มเหลวของบริการปลายทาง จึงไม่ควรลองใหม่ และไม่นับเป็นทั้งความสำเร็จและความล้มเหลวใน circuit breaker
+    retryable = False
+    breaker_neutral = True
+
+class AdaptiveLimiter:
+    """
+    ตัวจำกัดคำขอพร้อมกันแบบ AIMD สำหรับ event loop เดียว ประสานกับโปรเซสอื่นผ่าน Redis
+    """
+    def __init__(self,
+                 name: str,
+                 initial_limit: int = 20,
+                 min_limit: int = 2,
+                 max_limit: int = 100,
+                 latency_target: float = 20.0,
+                 decrease_factor: float = 0.5,
+                 decrease_cooldown: float = 2.0,
+                 queue_timeout: float = 20.0,
+                 redis_client=None,
+                 sync_interval: float = 5.0,
+                 is_overload: Optional[Callable[[BaseException], bool]] = None):
+        """
+        สร้างตัวจำกัดคำขอพร้อมกัน
+
+        Args:
+            name (str): ชื่อบริการ (ใช้ในตัวชี้วัดและคีย์ Redis)
+            initial_limit (int): ขีดจำกัดเริ่มต้นของโปรเซสนี้
+            min_limit (int): ขีดจำกัดต่ำสุด
+            max_limit (int): ขีดจำกัดรวมสูงสุดของทุกโปรเซส (แบ่งเท่าๆ กันตามจำนวนโปรเซสที่ทำงานอยู่)
+            latency_target (float): เวลาแฝงที่ถือว่าบริการเริ่มอิ่มตัว (วินาที)
+            decrease_factor (float): ตัวคูณเมื่อลดขีดจำกัด
+            decrease_cooldown (float): ระยะห่างขั้นต่ำระหว่างการลดแต่ละครั้ง (วินาที)
+            queue_timeout (float): เวลารอคิวสูงสุดก่อนยกเลิกคำขอ (วินาที)
+            redis_client: การเชื่อมต่อ Redis แบบซิงโครนัสสำหรับประสานงาน (None = ทำงานเฉพาะโปรเซส)
+            sync_interval (float): ระยะห่างของการประสานงานผ่าน Redis (วินาที)
+            is_overload (Callable, optional): ฟังก์ชันตัดสินว่าข้อผิดพลาดแสดงว่าบริการรับโหลดไม่ไหว
+        """
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.queue_timeout = queue_timeout
+        self.redis = redis_client
+        self.sync_interval = sync_interval
+        self.is_overload = is_overload or (lambda e: bool(getattr(e, "retryable", False)))
+
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+        self._limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self._ceiling = max_limit
+        self._in_flight = 0
+        self._waiters = deque()
+        self._last_decrease = 0.0
+        self._last_sync = 0.0
+        self._seen_overload = 0.0
+        self._syncing = False
+        self._global = {"instances": 1, "limit": int(self._limit), "in_flight": 0, "queued": 0}
+        self._publish_gauges()
+
+    @property
+    def limit(self) -> int:
+        """ขีดจำกัดปัจจุบันของโปรเซสนี้"""
+        return max(self.min_limit, int(self._limit))
+
+    def slot(self) -> '_Slot':
+        """
+        สร้าง context manager สำหรับครอบการเรียกหนึ่งครั้ง
+
+        Returns:
+            _Slot: async context manager ที่จองและคืนสิทธิ์พร้อมบันทึกผลการเรียก
+        """
+        return _Slot(self)
+
+    async def acquire(self, timeout: Optional[float] = None):
+        """
+        จองสิทธิ์เรียกหนึ่งครั้ง รอคิวถ้าเต็มขีดจำกัด
+
+        Args:
+            timeout (float, optional): เวลารอคิวสูงสุด (ค่าเริ่มต้นคือ queue_timeout)
+
+        Raises:
+            ConcurrencyLimitExceeded: ถ้ารอคิวเกินเวลาที่กำหนด
+        """
+        self._maybe_sync()
+        if self._in_flight < self.limit and not self._waiters:
+            self._in_flight += 1
+            self._publish_gauges()
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._publish_gauges()
+        start_time = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, timeout if timeout is not None else self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # ได้รับสิทธิ์พร้อมกับหมดเวลา ถือว่าได้รับสิทธิ์
+                return
+            metrics.inc('concurrency_rejected_total', labels={'name': self.name})
+            raise ConcurrencyLimitExceeded(f"{self.name}: queue wait exceeded ({len(self._waiters)} waiting)")
+        except asyncio.CancelledError:
+            # ถ้าได้รับสิทธิ์พร้อมกับถูกยกเลิก ต้องคืนสิทธิ์ให้คิวถัดไป
+            if waiter.done() and not waiter.cancelled():
+                self._in_flight -= 1
+                self._wake()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            metrics.observe('concurrency_queue_wait_seconds', time.monotonic() - start_time,
+                            labels={'name': self.name})
+            self._publish_gauges()
+
+    def release(self, latency: Optional[float] = None, error: Optional[BaseException] = None):
+        """
+        คืนสิทธิ์และปรับขีดจำกัดตามผลการเรียก
+
+        Args:
+            latency (float, optional): เวลาแฝงของการเรียก (วินาที) หรือ None ถ้าไม่นับผล
+            error (BaseException, optional): ข้อผิดพลาดของการเรียก ถ้ามี
+        """
+        self._in_flight -= 1
+        if error is not None and self.is_overload(error):
+            self._decrease(share=True)
+        elif latency is not None and error is None:
+            if latency > self.latency_target:
+                self._decrease(share=False)
+            elif self._in_flight + 1 >= self.limit * 0.8:
+                # เพิ่มแบบ additive: ประมาณ +1 ต่อการเรียกครบหนึ่งรอบของขีดจำกัด (เฉพาะเมื่อใช้ขีดจำกัดเกือบเต็ม)
+                self._limit = min(self._ceiling, self._limit + 1.0 / self.limit)
+        self._wake()
+        self._publish_gauges()
+
+    def _decrease(self, share: bool):
+        """ลดขีดจำกัดแบบ multiplicative (ไม่เกินหนึ่งครั้งต่อช่วง cooldown)"""
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+        metrics.inc('concurrency_decreases_total', labels={'name': self.name})
+        logging.warning(f"ลดขีดจำกัดคำขอพร้อมกันของ {self.name}: {previous} → {self.limit}")
+        if share and self.redis is not None:
+            self._spawn(self._signal_overload())
+
+    def _wake(self):
+        """ให้สิทธิ์แก่คำขอที่รอคิวจนเต็มขีดจำกัด"""
+        while self._waiters and self._in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._in_flight += 1
+                waiter.set_result(None)
+
+    def _publish_gauges(self):
+        """ส่งออกขีดจำกัด จำนวนที่กำลังทำงาน และความยาวคิวเป็นเกจ"""
+        labels = {'name': self.name}
+        metrics.set_gauge('concurrency_limit', self.limit, labels=labels)
+        metrics.set_gauge('concurrency_in_flight', self._in_flight, labels=labels)
+        metrics.set_gauge('concurrency_queue_length', len(self._waiters), labels=labels)
+
+    # การประสานงานผ่าน Redis
+    def _spawn(self, coro):
+        """รัน coroutine เบื้องหลังบน event loop ปัจจุบัน"""
+        try:
+            asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            coro.close()
+
+    def _maybe_sync(self):
+        """เริ่มการประสานงานเบื้องหลังเมื่อครบรอบเวลา"""
+        if self.redis is None or self._syncing:
+            return
+        if time.monotonic() - self._last_sync < self.sync_interval:
+            return
+        self._syncing = True
+        self._last_sync = time.monotonic()
+        self._spawn(self._sync())
+
+    async def _sync(self):
+        """ประกาศสถานะของโปรเซสนี้ อ่านสถานะของโปรเซสอื่น และรับสัญญาณโหลดเกิน"""
+        try:
+            state = {
+                "limit": self.limit,
+                "in_flight": self._in_flight,
+                "queued": len(self._waiters),
+                "ts": time.time()
+            }
+            instances, overload_at = await asyncio.to_thread(self._sync_redis, state)
+            self._apply_sync(instances, overload_at)
+        except Exception as e:
+            logging.debug(f"ประสานขีดจำกัดของ {self.name} ผ่าน Redis ไม่สำเร็จ: {str(e)}")
+        finally:
+            self._syncing = False
+
+    def _sync_redis(self, state: Dict[str, Any]):
+        """คำสั่ง Redis ของการประสานงาน (รันในเธรดแยก)"""
+        key = f"concurrency:{self.name}:instances"
+        pipe = self.redis.pipeline()
+        pipe.hset(key, self.instance_id, json.dumps(state))
+        pipe.expire(key, int(self.sync_interval * 6))
+        pipe.hgetall(key)
+        pipe.get(f"concurrency:{self.name}:overload")
+        _, _, instances, overload_at = pipe.execute()
+
+        # ลบโปรเซสที่ไม่ได้ประกาศสถานะนานเกินไป
+        stale_before = time.time() - self.sync_interval * 3
+        live = {}
+        for instance_id, raw in (instances or {}).items():
+            data = json.loads(raw)
+            if data.get("ts", 0) < stale_before:
+                self.redis.hdel(key, instance_id)
+            else:
+                live[instance_id] = data
+        return live, float(overload_at) if overload_at else 0.0
+
+    def _apply_sync(self, instances: Dict[str, Dict[str, Any]], overload_at: float):
+        """ปรับเพดานของโปรเซสนี้ตามจำนวนโปรเซสที่ทำงานอยู่ และลดขีดจำกัดเมื่อโปรเซสอื่นพบโหลดเกิน"""
+        count = max(1, len(instances))
+        self._ceiling = max(self.min_limit, self.max_limit // count)
+        self._limit = min(self._limit, float(self._ceiling))
+        self._global = {
+            "instances": count,
+            "limit": sum(i.get("limit", 0) for i in instances.values()),
+            "in_flight": sum(i.get("in_flight", 0) for i in instances.values()),
+            "queued": sum(i.get("queued", 0) for i in instances.values())
+        }
+        if overload_at > self._seen_overload:
+            first_signal = self._seen_overload == 0.0
+            self._seen_overload = overload_at
+            # ข้ามสัญญาณเก่าที่มีอยู่ก่อนโปรเซสนี้เริ่มทำงาน
+            if not first_signal or time.time() - overload_at < self.sync_interval:
+                self._decrease(share=False)
+        self._wake()
+        self._publish_gauges()
+        metrics.set_gauge('concurrency_global_limit', self._global["limit"], labels={'name': self.name})
+
+    async def _signal_overload(self):
+        """แจ้งโปรเซสอื่นว่าบริการรับโหลดไม่ไหว"""
+        now = time.time()
+        self._seen_overload = now
+        try:
+            await asyncio.to_thread(self.redis.set, f"concurrency:{self.name}:overload", now, ex=300)
+        except Exception as e:
+            logging.debug(f"ส่งสัญญาณโหลดเกินของ {self.name} ไม่สำเร็จ: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        ดึงสถานะของตัวจำกัด
+
+        Returns:
+            Dict[str, Any]: ขีดจำกัด จำนวนที่กำลังทำงาน ความยาวคิว และสถานะรวมจาก Redis
+        """
+        return {
+            "limit": self.limit,
+            "ceiling": self._ceiling,
+            "in_flight": self._in_flight,
+            "queue_length": len(self._waiters),
+            "global": dict(self._global)
+        }
+
+class _Slot:
+    """Async context manager ของการเรียกหนึ่งครั้งภายใต้ AdaptiveLimiter"""
+    def __init__(self, limiter: AdaptiveLimiter):
+        self.limiter = limiter
+        self.start_time = 0.0
+
+    async def __aenter__(self):
+        await self.limiter.acquire()
+        self.start_time = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None and issubclass(exc_type, (asyncio.CancelledError, GeneratorExit)):
+            # ถูกยกเลิก (เช่น คำขอ hedging ที่แพ้) ไม่นับเป็นผลของบริการ
+            self.limiter.release(None, None)
+        else:
+            self.limiter.release(time.monotonic() - self.start_time, exc)
+        return False
@@ -138,4 +138,153 @@ GENERATION_CONFIG = {
 SUMMARY_GENERATION_CONFIG = {
     "temperature": 0.3,
     "max_tokens": 500
-}
\ No newline at end of file
+}
+# คอนฟิกคิวเหตุการณ์ webhook (Redis Streams)
+EVENT_QUEUE_CONFIG = {
+    "enabled": os.getenv('EVENT_QUEUE_ENABLED', 'true').lower() == 'true',
+    "stream": os.getenv('EVENT_QUEUE_STREAM', 'line_events'),
+    "group": os.getenv('EVENT_QUEUE_GROUP', 'line_workers'),
+    "maxlen": int(os.getenv('EVENT_QUEUE_MAXLEN', '10000')),
+    # worker ที่ยังทำงานต่ออายุรายการของตัวเองทุกหนึ่งในสามของช่วงนี้ จึงถูกเคลมเฉพาะเมื่อ worker หยุดทำงาน
+    "claim_idle_ms": int(os.getenv('EVENT_QUEUE_CLAIM_IDLE_MS', '60000')),
+    "max_deliveries": int(os.getenv('EVENT_QUEUE_MAX_DELIVERIES', '5')),
+    # จำนวนเหตุการณ์ที่ส่งให้ตัวกระจายงานแล้วแต่ยังไม่เสร็จสูงสุดต่อ worker (อ่านเพิ่มทันทีที่มีช่องว่าง)
+    "max_in_flight": int(os.getenv('EVENT_QUEUE_MAX_IN_FLIGHT', '20')),
+    # จำนวน worker ที่รันในโปรเซสเว็บ (0 = ใช้ worker.py แยกต่างหากเท่านั้น)
+    "inprocess_workers": int(os.getenv('EVENT_QUEUE_INPROCESS_WORKERS', '2'))
+}
+
+# คอนฟิกตัวกระจายงานตามผู้ใช้
+DISPATCHER_CONFIG = {
+    # จำนวนเธรดสูงสุดที่ประมวลผลข้อความของผู้ใช้ต่างคนพร้อมกัน
+    "max_workers": int(os.getenv('DISPATCH_MAX_WORKERS', '8')),
+    # งานที่รอนานเท่านี้ (วินาที) จะถูกเลื่อนขึ้นหนึ่งระดับความสำคัญ
+    "aging_seconds": float(os.getenv('DISPATCH_AGING_SECONDS', '5')),
+    # จำนวนเธรดที่ดึงข้อมูลเตรียมพรอมต์ (Redis, MySQL) พร้อมกัน
+    "prepare_workers": int(os.getenv('PREPARE_MAX_WORKERS', '16')),
+    "prepare_timeout": float(os.getenv('PREPARE_TIMEOUT_SECONDS', '10'))
+}
+
+# คอนฟิกโหมด ASGI (asgi.py)
+ASGI_CONFIG = {
+    # จำนวนการสนทนาสูงสุดที่ประมวลผลพร้อมกันในหนึ่งโปรเซส
+    "max_concurrency": int(os.getenv('ASGI_MAX_CONCURRENCY', '2000')),
+    "redis_max_connections": int(os.getenv('ASGI_REDIS_MAX_CONNECTIONS', '200'))
+}
+
+# คอนฟิก Async client ของ DeepSeek บน event loop ถาวร
+ASYNC_CLIENT_CONFIG = {
+    "max_connections": int(os.getenv('DEEPSEEK_MAX_CONNECTIONS', '100')),
+    "max_keepalive_connections": int(os.getenv('DEEPSEEK_MAX_KEEPALIVE', '20')),
+    # จำนวนการเชื่อมต่อที่เปิดล่วงหน้าตอนเริ่มแอป
+    "warmup_connections": int(os.getenv('DEEPSEEK_WARMUP_CONNECTIONS', '2')),
+    # เวลารอสูงสุดของการเรียกจากโค้ดซิงโครนัส (วินาที)
+    "request_timeout": float(os.getenv('DEEPSEEK_REQUEST_TIMEOUT', '90')),
+    # ส่งหลายคำขอบนการเชื่อมต่อเดียวด้วย HTTP/2 (ต้องติดตั้ง h2)
+    "http2": os.getenv('DEEPSEEK_HTTP2', 'false').lower() == 'true'
+}
+
+# คอนฟิกการตอบกลับแบบสตรีม
+STREAMING_CONFIG = {
+    "enabled": os.getenv('STREAMING_ENABLED', 'false').lower() == 'true',
+    # ความยาวขั้นต่ำของชิ้นแรก (ยิ่งน้อยยิ่งส่งถึงผู้ใช้เร็ว)
+    "first_chunk_min_chars": int(os.getenv('STREAMING_FIRST_CHUNK_MIN_CHARS', '40')),
+    "chunk_min_chars": int(os.getenv('STREAMING_CHUNK_MIN_CHARS', '200'))
+}
+
+# คอนฟิกสรุปการสนทนาแบบสะสม
+SUMMARY_CONFIG = {
+    # จำนวนการสนทนาล่าสุดที่อยู่ในบริบทโดยตรง (ไม่ต้องสรุป)
+    "recent_window": int(os.getenv('SUMMARY_RECENT_WINDOW', '5')),
+    # ปรับปรุงสรุปเมื่อมีการสนทนาหลุดออกจากหน้าต่างอย่างน้อยเท่านี้
+    "min_new_turns": int(os.getenv('SUMMARY_MIN_NEW_TURNS', '3'))
+}
+
+# การตั้งค่าการประกอบพรอมต์ (คงส่วนต้นของพรอมต์เพื่อใช้ context cache ของ DeepSeek)
+PROMPT_CONTEXT_CONFIG = {
+    # เซสชันเพิ่มต่อท้ายจนถึงจำนวนนี้ แล้วจึงตัดเป็นช่วงในครั้งเดียว
+    "session_max_messages": int(os.getenv('PROMPT_SESSION_MAX_MESSAGES', '20')),
+    # จำนวนข้อความที่เหลือหลังการตัด (ควรเท่ากับ SUMMARY_RECENT_WINDOW x 2)
+    "session_keep_messages": int(os.getenv('PROMPT_SESSION_KEEP_MESSAGES', '10')),
+    # งบประมาณโทเค็นของพรอมต์ทั้งหมด (0 = ไม่จำกัด)
+    "max_prompt_tokens": int(os.getenv('PROMPT_TOKEN_BUDGET', '6000')),
+    # จำนวนการสนทนาสำคัญจากฐานข้อมูลที่เพิ่มเมื่อเหลืองบประมาณ (0 = ปิด)
+    "important_turns": int(os.getenv('PROMPT_IMPORTANT_TURNS', '3'))
+}
+
+# นโยบายการเรียก DeepSeek (งบประมาณเวลา, ลองใหม่, hedging, circuit breaker)
+DEEPSEEK_POLICY_CONFIG = {
+    # งบประมาณเวลาต่อข้อความรวมการลองใหม่ทั้งหมด (วินาที)
+    "deadline": float(os.getenv('DEEPSEEK_DEADLINE_SECONDS', '25')),
+    "max_attempts": int(os.getenv('DEEPSEEK_MAX_ATTEMPTS', '3')),
+    "base_delay": float(os.getenv('DEEPSEEK_RETRY_BASE_DELAY', '0.5')),
+    "max_delay": float(os.getenv('DEEPSEEK_RETRY_MAX_DELAY', '4')),
+    # ส่งคำขอสำรองเมื่อคำขอแรกช้ากว่า p95 (ไม่ต่ำกว่า hedge_min_delay วินาที)
+    "hedge": os.getenv('DEEPSEEK_HEDGE_ENABLED', 'false').lower() == 'true',
+    "hedge_min_delay": float(os.getenv('DEEPSEEK_HEDGE_MIN_DELAY', '8')),
+    "hedge_max_ratio": float(os.getenv('DEEPSEEK_HEDGE_MAX_RATIO', '0.1')),
+    # ตัดการเรียกหลังล้มเหลวต่อเนื่องตามจำนวนนี้ และทดลองใหม่หลังเวลาที่กำหนด (วินาที)
+    "breaker_failure_threshold": int(os.getenv('DEEPSEEK_BREAKER_FAILURES', '5')),
+    "breaker_recovery_timeout": float(os.getenv('DEEPSEEK_BREAKER_RECOVERY_SECONDS', '30'))
+}
+
+# ตัวจำกัดคำขอพร้อมกันแบบปรับตัว (AIMD) สำหรับ DeepSeek ประสานระหว่างโปรเซสผ่าน Redis
+CONCURRENCY_CONFIG = {
+    "enabled": os.getenv('DEEPSEEK_ADAPTIVE_LIMIT', 'true').lower() == 'true',
+    "initial_limit": int(os.getenv('DEEPSEEK_LIMIT_INITIAL', '20')),
+    "min_limit": int(os.getenv('DEEPSEEK_LIMIT_MIN', '2')),
+    # ขีดจำกัดรวมของทุกโปรเซส
+    "max_limit": int(os.getenv('DEEPSEEK_LIMIT_MAX', '100')),
+    # เวลาแฝงที่ถือว่า DeepSeek เริ่มอิ่มตัว (วินาที)
+    "latency_target": float(os.getenv('DEEPSEEK_LIMIT_LATENCY_TARGET', '20')),
+    "queue_timeout": float(os.getenv('DEEPSEEK_LIMIT_QUEUE_TIMEOUT', '20')),
+    "sync_interval": float(os.getenv('DEEPSEEK_LIMIT_SYNC_INTERVAL', '5'))
+}
+
+# ไคลเอนต์ LINE Messaging API (connection pool แบบ keep-alive และเวลารอที่เข้มงวด)
+LINE_CLIENT_CONFIG = {
+    "timeout": float(os.getenv('LINE_API_TIMEOUT', '10')),
+    "connect_timeout": float(os.getenv('LINE_API_CONNECT_TIMEOUT', '3')),
+    "pool_size": int(os.getenv('LINE_API_POOL_SIZE', '20'))
+}
+
+# การส่งคำตอบ: ใช้ reply token ก่อนเมื่อยังไม่หมดอายุ แล้วจึงส่งแบบ push
+DELIVERY_CONFIG = {
+    "reply_enabled": os.getenv('REPLY_TOKEN_ENABLED', 'true').lower() == 'true',
+    # อายุของ reply token ที่ถือว่าปลอดภัย นับจากเวลาของเหตุการณ์ (LINE กำหนดประมาณ 1 นาที)
+    "reply_token_ttl": float(os.getenv('REPLY_TOKEN_TTL', '50'))
+}
+
+# ระยะเวลาแสดงภาพเคลื่อนไหวการโหลดขั้นต่ำ (หน่วงคำตอบที่เร็วผ่านคิวหน่วงเวลา ไม่ครอบครองเธรด)
+RESPONSE_DELAY_CONFIG = {
+    "min_animation_seconds": float(os.getenv('MIN_ANIMATION_SECONDS', '5')),
+    # ปิดการหน่วงเมื่อมีคำตอบรออยู่ในคิวเกินจำนวนนี้ หรือเมื่อมีงานรอเธรดว่าง
+    "max_pending": int(os.getenv('RESPONSE_DELAY_MAX_PENDING', '500')),
+    # จำนวนเธรดที่ส่งคำตอบที่ถึงเวลาไปยัง LINE (เธรดตัวจับเวลาไม่ทำ I/O เอง)
+    "send_workers": int(os.getenv('RESPONSE_DELAY_SEND_WORKERS', '8'))
+}
+
+# รูปแบบการจัดเก็บสถานะผู้ใช้บน Redis
+USER_STATE_CONFIG = {
+    # keys = หนึ่งคีย์ต่อข้อมูล, hash = แฮชเดียวต่อผู้ใช้ (ย้ายข้อมูลด้วย scripts/migrate_user_state.py)
+    "layout": os.getenv('USER_STATE_LAYOUT', 'keys').lower(),
+    # บีบอัดเซสชันการแชทด้วย zlib ก่อนเก็บ
+    "compact": os.getenv('USER_STATE_COMPACT', 'false').lower() == 'true'
+}
+
+# ตัวนับโทเค็น
+TOKEN_COUNTER_CONFIG = {
+    # งบประมาณหน่วยความจำของแคชจำนวนโทเค็นแบบ LRU (ไบต์)
+    "cache_bytes": int(os.getenv('TOKEN_CACHE_BYTES', str(8 * 1024 * 1024))),
+    # จำนวนเธรดของการนับโทเค็นแบบ batch (tiktoken ปล่อย GIL ระหว่างเข้ารหัส)
+    "batch_threads": int(os.getenv('TOKEN_BATCH_THREADS', '4')),
+    # ไดเรกทอรีไฟล์ตัวตัดคำ cl100k_base ที่เตรียมไว้ล่วงหน้า (scripts/preseed_tokenizer.py)
+    "cache_dir": os.getenv('TIKTOKEN_CACHE_DIR', os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.tiktoken_cache')),
+    # true = อ่านตัวตัดคำจาก cache_dir เท่านั้น ไม่ดาวน์โหลด (ถ้าไม่มีไฟล์จะใช้ตัวประมาณ)
+    "offline": os.getenv('TOKENIZER_OFFLINE', 'false').lower() == 'true',
+    # tiktoken = นับด้วย cl100k_base (ใช้ตัวประมาณถ้าโหลดไม่ได้), estimate = ใช้ตัวประมาณที่ปรับเทียบแล้วเท่านั้น
+    "mode": os.getenv('TOKEN_COUNTER_MODE', 'tiktoken'),
+    # ไฟล์สัมประสิทธิ์ของตัวประมาณจาก scripts/calibrate_token_estimator.py (ว่าง = ค่าเริ่มต้น)
+    "estimator_file": os.getenv('TOKEN_ESTIMATOR_FILE', '') or None
+}
@@ -0,0 +1,262 @@
+"""
+โมดูลประกอบพรอมต์สำหรับแชทบอท 'ใจดี'
+เรียงส่วนของพรอมต์จากส่วนที่เปลี่ยนน้อยที่สุดไปมากที่สุด เพื่อให้ส่วนต้นของพรอมต์
+คงที่ระหว่างรอบการสนทนาและได้ประโยชน์จาก context cache ของ DeepSeek
+และจำกัดขนาดพรอมต์ตามงบประมาณโทเค็น
+"""
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+
+from .metrics import metrics
+
+SUMMARY_PREFIX = "สรุปการสนทนาก่อนหน้า: "
+TRUNCATION_MARK = "…"
+
+# โทเค็นส่วนเกินต่อข้อความและต่อพรอมต์ (ตรงกับ TokenCounter.count_message_tokens)
+MESSAGE_OVERHEAD_TOKENS = 4
+PROMPT_OVERHEAD_TOKENS = 2
+
+class PromptContextBuilder:
+    """
+    ตัวประกอบพรอมต์แบบคงส่วนต้น (prefix-stable)
+
+    ลำดับของส่วนในพรอมต์: คำแนะนำระบบ → สรุปการสนทนา → ประวัติสำคัญ → เซสชันล่าสุด → ข้อความใหม่
+    ลำดับการใช้งบประมาณโทเค็น: คำแนะนำระบบ → สรุปการสนทนา → เซสชันล่าสุด → ประวัติสำคัญ
+    """
+    def __init__(self,
+                 system_message: Dict[str, str],
+                 session_max_messages: int = 20,
+                 session_keep_messages: int = 10,
+                 token_counter=None,
+                 max_prompt_tokens: int = 0):
+        """
+        สร้างตัวประกอบพรอมต์
+
+        Args:
+            system_message (Dict[str, str]): ข้อความคำแนะนำระบบ
+            session_max_messages (int): จำนวนข้อความสูงสุดของเซสชันก่อนตัดทิ้ง
+            session_keep_messages (int): จำนวนข้อความที่เหลือหลังการตัดแต่ละครั้ง
+            token_counter (TokenCounter, optional): ตัวนับโทเค็น (จำเป็นเมื่อกำหนดงบประมาณ)
+            max_prompt_tokens (int): งบประมาณโทเค็นของพรอมต์ทั้งหมด (0 = ไม่จำกัด)
+        """
+        self.system_message = system_message
+        self.session_max_messages = session_max_messages
+        self.session_keep_messages = session_keep_messages
+        self.counter = token_counter
+        self.max_prompt_tokens = max_prompt_tokens if token_counter is not None else 0
+
+    def build(self,
+              session: List[Dict[str, str]],
+              user_message: str,
+              summary: Optional[str] = None,
+              important: Optional[Sequence[tuple]] = None,
+              user_id: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        ประกอบพรอมต์สำหรับการเรียก API ภายในงบประมาณโทเค็น
+
+        Args:
+            session (List[Dict[str, str]]): ข้อความในเซสชัน (เฉพาะ user/assistant)
+                ข้อความที่มี tokens (จำนวนโทเค็นที่เก็บไว้พร้อมเซสชัน) จะไม่ถูกนับใหม่
+            user_message (str): ข้อความใหม่ของผู้ใช้
+            summary (str, optional): สรุปการสนทนาแบบสะสม
+            important (Sequence[tuple], optional): การสนทนาสำคัญ (id, user_message, bot_response, ...)
+                ที่เก่ากว่ารอบแรกของเซสชัน เรียงจากเก่าไปใหม่
+            user_id (str, optional): LINE User ID สำหรับบันทึก log
+
+        Returns:
+            List[Dict[str, str]]: ข้อความทั้งหมดที่ส่งให้โมเดล
+        """
+        user_msg = {"role": "user", "content": user_message}
+        turns = self.split_turns(session)
+        history = self._important_turns(important)
+
+        if not self.max_prompt_tokens:
+            summary_msg = self.summary_message(summary) if summary else None
+            return self._assemble(summary_msg, history, turns, user_msg)
+
+        # ส่วนที่ต้องมีเสมอ: คำแนะนำระบบและข้อความใหม่ของผู้ใช้
+        used = PROMPT_OVERHEAD_TOKENS + self._tokens(self.system_message) + self._tokens(user_msg)
+        remaining = self.max_prompt_tokens - used
+        if remaining < 0:
+            logging.warning(f"คำแนะนำระบบและข้อความของผู้ใช้ {user_id} เกินงบประมาณ ({used} > {self.max_prompt_tokens})")
+
+        # 1) สรุปการสนทนา: ตัดให้สั้นลงถ้าไม่พอ
+        summary_msg = None
+        summary_truncated = False
+        if summary and remaining > MESSAGE_OVERHEAD_TOKENS:
+            summary_msg = self.summary_message(summary)
+            tokens = self._tokens(summary_msg)
+            if tokens > remaining:
+                summary_truncated = True
+                summary_msg = self._truncate(summary_msg, remaining)
+                tokens = self._tokens(summary_msg) if summary_msg else 0
+            remaining -= tokens
+
+        # 2) เซสชันล่าสุด: เลือกจากใหม่ไปเก่า ทิ้งทั้งรอบการสนทนาเมื่อไม่พอ
+        kept_turns, remaining = self._fit_turns(turns, remaining)
+
+        # 3) ประวัติสำคัญ: ใช้งบประมาณที่เหลือ (เฉพาะเมื่อเซสชันใส่ได้ครบ)
+        kept_history = []
+        if len(kept_turns) == len(turns):
+            kept_history, remaining = self._fit_turns(history, remaining)
+
+        prompt = self._assemble(summary_msg, kept_history, kept_turns, user_msg)
+        prompt_tokens = self.max_prompt_tokens - remaining
+        metrics.observe('prompt_tokens', prompt_tokens)
+        if len(kept_turns) < len(turns) or (summary and (summary_truncated or summary_msg is None)):
+            metrics.inc('prompt_budget_truncations_total')
+        logging.info(
+            f"พรอมต์ของผู้ใช้ {user_id}: สรุป={'มี' if summary_msg else 'ไม่มี'}"
+            f"{' (ถูกตัด)' if summary_msg and summary_truncated else ''}, "
+            f"เซสชัน={len(kept_turns)}/{len(turns)} รอบ, ประวัติสำคัญ={len(kept_history)}/{len(history)} รอบ, "
+            f"โทเค็น={prompt_tokens}/{self.max_prompt_tokens}"
+        )
+        return prompt
+
+    def _assemble(self, summary_msg, history, turns, user_msg) -> List[Dict[str, str]]:
+        """เรียงส่วนของพรอมต์จากส่วนที่คงที่ที่สุดไปหาส่วนที่เปลี่ยนบ่อยที่สุด"""
+        messages = [self.system_message]
+        if summary_msg:
+            messages.append(summary_msg)
+        for turn in history:
+            messages.extend(turn)
+        for turn in turns:
+            # ส่งเฉพาะ role และ content (ไม่ส่งจำนวนโทเค็นที่เก็บไว้ให้ API)
+            messages.extend({"role": msg["role"], "content": msg["content"]} for msg in turn)
+        messages.append(user_msg)
+        return messages
+
+    def _tokens(self, message: Dict[str, str]) -> int:
+        """นับโทเค็นของข้อความหนึ่งข้อความรวมส่วนเกินของบทบาท (ใช้จำนวนที่เก็บไว้ถ้ามี)"""
+        if message.get("tokens") is not None:
+            metrics.inc('prompt_stored_token_counts_total')
+            return message["tokens"] + MESSAGE_OVERHEAD_TOKENS
+        return self.counter.count_message_tokens([message]) - PROMPT_OVERHEAD_TOKENS
+
+    def _fit_turns(self, turns: List[List[Dict[str, str]]], budget: int):
+        """
+        เลือกรอบการสนทนาจากใหม่ไปเก่าจนเต็มงบประมาณ (ทิ้งทั้งรอบ ไม่ตัดกลางรอบ)
+
+        Returns:
+            tuple: (รอบที่เลือกเรียงจากเก่าไปใหม่, งบประมาณที่เหลือ)
+        """
+        kept = []
+        for turn in reversed(turns):
+            tokens = sum(self._tokens(msg) for msg in turn)
+            if tokens > budget:
+                break
+            kept.append(turn)
+            budget -= tokens
+        kept.reverse()
+        return kept, budget
+
+    def _truncate(self, message: Dict[str, str], budget: int) -> Optional[Dict[str, str]]:
+        """ตัดเนื้อหาข้อความจากท้ายให้อยู่ในงบประมาณ หรือ None ถ้าใส่ไม่ได้เลย"""
+        content = message["content"]
+        while content and self._tokens({"content": content}) > budget:
+            # ย่อตามสัดส่วนที่เกิน แล้วตรวจนับใหม่
+            ratio = budget / self._tokens({"content": content})
+            content = content[:max(0, int(len(content) * ratio) - 1)].rstrip() + TRUNCATION_MARK
+            if len(content) <= len(SUMMARY_PREFIX) + len(TRUNCATION_MARK):
+                return None
+        return {"role": message["role"], "content": content} if content else None
+
+    @staticmethod
+    def split_turns(session: List[Dict[str, str]]) -> List[List[Dict[str, str]]]:
+        """แบ่งเซสชันเป็นรอบการสนทนา โดยแต่ละรอบเริ่มที่ข้อความของผู้ใช้"""
+        turns = []
+        for msg in session:
+            if msg.get("role") == "user" or not turns:
+                turns.append([msg])
+            else:
+                turns[-1].append(msg)
+        return turns
+
+    @staticmethod
+    def _important_turns(important: Optional[Sequence[tuple]]) -> List[List[Dict[str, str]]]:
+        """แปลงการสนทนาสำคัญจากฐานข้อมูลเป็นรอบการสนทนา (ฐานข้อมูลตัดรอบที่อยู่ในเซสชันออกแล้ว)"""
+        if not important:
+            return []
+        return [
+            [{"role": "user", "content": row[1]}, {"role": "assistant", "content": row[2]}]
+            for row in important
+        ]
+
+    @staticmethod
+    def summary_message(summary: str) -> Dict[str, str]:
+        """สร้างข้อความสรุปในรูปแบบคงที่ (เปลี่ยนเฉพาะเมื่อสรุปถูกปรับปรุง)"""
+        return {"role": "system", "content": SUMMARY_PREFIX + summary}
+
+    def trim_session(self, session: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        ตัดเซสชันเป็นช่วง แทนการเลื่อนหน้าต่างทุกรอบ
+        เซสชันจะเพิ่มต่อท้ายเรื่อยๆ จนถึงจำนวนสูงสุด แล้วจึงตัดเหลือจำนวนที่กำหนดในครั้งเดียว
+        ทำให้ส่วนต้นของพรอมต์คงที่ระหว่างการตัดแต่ละครั้ง
+
+        Args:
+            session (List[Dict[str, str]]): ข้อความในเซสชัน
+
+        Returns:
+            List[Dict[str, str]]: เซสชันหลังการตัด
+        """
+        if len(session) <= self.session_max_messages:
+            return session
+        trimmed = session[-self.session_keep_messages:]
+        # เริ่มเซสชันที่ข้อความของผู้ใช้เสมอ
+        while trimmed and trimmed[0].get("role") != "user":
+            trimmed = trimmed[1:]
+        return trimmed
+
+def record_cache_usage(redis_client, user_id: str, usage: Optional[Dict[str, Any]], ttl: int = 2592000,
+                       pipeline=None):
+    """
+    บันทึกจำนวนโทเค็นที่ตรงและไม่ตรง context cache จากฟิลด์ usage ของ API
+
+    Args:
+        redis_client: การเชื่อมต่อ Redis
+        user_id (str): LINE User ID
+        usage (Dict[str, Any], optional): ฟิลด์ usage จากการตอบกลับของ DeepSeek
+        ttl (int): อายุของสถิติต่อผู้ใช้ (วินาที)
+        pipeline: ถ้าระบุ จะเพิ่มคำสั่งลงใน pipeline นี้โดยไม่ execute (รวมกับการบันทึกอื่นในรอบเดียว)
+    """
+    if not usage:
+        return
+    hit = usage.get("prompt_cache_hit_tokens") or 0
+    miss = usage.get("prompt_cache_miss_tokens") or 0
+    metrics.inc('prompt_cache_hit_tokens_total', hit)
+    metrics.inc('prompt_cache_miss_tokens_total', miss)
+    if hit + miss:
+        metrics.observe('prompt_cache_hit_ratio', hit / (hit + miss))
+
+    try:
+        key = f"prompt_cache:{user_id}"
+        pipe = pipeline if pipeline is not None else redis_client.pipeline()
+        pipe.hincrby(key, "hit_tokens", hit)
+        pipe.hincrby(key, "miss_tokens", miss)
+        pipe.hincrby(key, "requests", 1)
+        pipe.expire(key, ttl)
+        if pipeline is None:
+            pipe.execute()
+    except Exception as e:
+        logging.error(f"ไม่สามารถบันทึกสถิติ context cache ของ {user_id}: {str(e)}")
+
+def get_cache_stats(redis_client, user_id: str) -> Dict[str, Any]:
+    """
+    ดึงสถิติ context cache ของผู้ใช้
+
+    Args:
+        redis_client: การเชื่อมต่อ Redis
+        user_id (str): LINE User ID
+
+    Returns:
+        Dict[str, Any]: จำนวนโทเค็นที่ตรง/ไม่ตรง cache จำนวนคำขอ และอัตราการตรง cache
+    """
+    data = redis_client.hgetall(f"prompt_cache:{user_id}") or {}
+    hit = int(data.get("hit_tokens", 0))
+    miss = int(data.get("miss_tokens", 0))
+    return {
+        "hit_tokens": hit,
+        "miss_tokens": miss,
+        "requests": int(data.get("requests", 0)),
+        "hit_rate": round(hit / (hit + miss), 4) if hit + miss else 0.0
+    }
@@ -0,0 +1,151 @@
+"""
+โมดูลสรุปการสนทนาแบบสะสมสำหรับแชทบอท 'ใจดี'
+เก็บสรุปต่อผู้ใช้พร้อมเวอร์ชัน (ID การสนทนาล่าสุดที่รวมในสรุป) และปรับปรุงเฉพาะเมื่อ
+มีการสนทนาหลุดออกจากหน้าต่างล่าสุด โดยทำงานเบื้องหลังนอกเส้นทางการตอบกลับ
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import SUMMARY_GENERATION_CONFIG
+from .metrics import metrics
+
+SUMMARY_PROMPT_HEADER = "นี่คือประวัติการสนทนา โปรดสรุปประเด็นสำคัญในประวัติการสนทนานี้:\n"
+INCREMENTAL_PROMPT_HEADER = (
+    "นี่คือสรุปการสนทนาก่อนหน้า และบทสนทนาที่เกิดขึ้นหลังจากนั้น "
+    "โปรดปรับปรุงสรุปให้ครอบคลุมประเด็นสำคัญทั้งหมด โดยคงข้อมูลสำคัญจากสรุปเดิมไว้:\n"
+)
+
+class RollingSummarizer:
+    """
+    ตัวจัดการสรุปการสนทนาแบบสะสมต่อผู้ใช้
+    """
+    def __init__(self,
+                 db,
+                 redis_client,
+                 deepseek_client,
+                 system_message: Dict[str, str],
+                 recent_window: int = 5,
+                 min_new_turns: int = 3,
+                 max_turns_per_refresh: int = 20,
+                 max_tokens: int = 500,
+                 lock_ttl: int = 120):
+        """
+        สร้างตัวจัดการสรุป
+
+        Args:
+            db (ChatHistoryDB): ฐานข้อมูลประวัติการแชท
+            redis_client: การเชื่อมต่อ Redis สำหรับล็อคการปรับปรุง
+            deepseek_client (AsyncDeepseekClient): ไคลเอนต์ DeepSeek แบบอะซิงโครนัส
+            system_message (Dict[str, str]): ข้อความคำแนะนำระบบ
+            recent_window (int): จำนวนการสนทนาล่าสุดที่ไม่ต้องสรุป (อยู่ในเซสชันแล้ว)
+            min_new_turns (int): จำนวนการสนทนาใหม่ขั้นต่ำที่ทำให้ปรับปรุงสรุป
+            max_turns_per_refresh (int): จำนวนการสนทนาสูงสุดที่รวมต่อการปรับปรุงหนึ่งครั้ง
+            max_tokens (int): จำนวนโทเค็นสูงสุดของสรุป
+            lock_ttl (int): อายุของล็อคการปรับปรุงต่อผู้ใช้ (วินาที)
+        """
+        self.db = db
+        self.redis = redis_client
+        self.deepseek = deepseek_client
+        self.system_message = system_message
+        self.recent_window = recent_window
+        self.min_new_turns = min_new_turns
+        self.max_turns_per_refresh = max_turns_per_refresh
+        self.max_tokens = max_tokens
+        self.lock_ttl = lock_ttl
+
+    def get(self, user_id: str) -> Tuple[str, int]:
+        """
+        ดึงสรุปปัจจุบันของผู้ใช้ (ไม่มีการเรียก LLM)
+
+        Args:
+            user_id (str): LINE User ID
+
+        Returns:
+            Tuple[str, int]: (ข้อความสรุป, เวอร์ชัน) หรือ ("", 0) ถ้ายังไม่มีสรุป
+        """
+        row = self.db.get_conversation_summary(user_id)
+        if not row:
+            return "", 0
+        return row[0], row[1]
+
+    def try_acquire(self, user_id: str) -> bool:
+        """จองสิทธิ์ปรับปรุงสรุปของผู้ใช้ เพื่อไม่ให้มีการปรับปรุงซ้อนกัน"""
+        try:
+            return bool(self.redis.set(f"summary_refresh:{user_id}", "1", nx=True, ex=self.lock_ttl))
+        except Exception as e:
+            logging.error(f"ไม่สามารถจองการปรับปรุงสรุปของ {user_id}: {str(e)}")
+            return False
+
+    async def refresh(self, user_id: str) -> bool:
+        """
+        รวมการสนทนาที่หลุดออกจากหน้าต่างล่าสุดเข้ากับสรุปเดิม
+        ต้องเรียก try_acquire ก่อน ล็อคจะถูกปลดเมื่อจบการทำงาน
+
+        Args:
+            user_id (str): LINE User ID
+
+        Returns:
+            bool: True หากสรุปถูกปรับปรุง
+        """
+        start_time = time.monotonic()
+        try:
+            summary, version = await asyncio.to_thread(self.get, user_id)
+            turns = await asyncio.to_thread(
+                self.db.get_turns_outside_window,
+                user_id, version, self.recent_window, self.max_turns_per_refresh
+            )
+            if not turns or len(turns) < self.min_new_turns:
+                return False
+
+            new_summary = await self._summarize(summary, turns)
+            if not new_summary:
+                return False
+
+            await asyncio.to_thread(self.db.save_conversation_summary, user_id, new_summary, turns[-1][0])
+            metrics.inc('summary_refresh_total')
+            metrics.observe('summary_refresh_seconds', time.monotonic() - start_time)
+            logging.info(f"ปรับปรุงสรุปของผู้ใช้ {user_id} ด้วย {len(turns)} การสนทนา (เวอร์ชัน {turns[-1][0]})")
+            return True
+        except Exception as e:
+            metrics.inc('summary_refresh_errors_total')
+            logging.error(f"เกิดข้อผิดพลาดในการปรับปรุงสรุปของ {user_id}: {str(e)}")
+            return False
+        finally:
+            try:
+                await asyncio.to_thread(self.redis.delete, f"summary_refresh:{user_id}")
+            except Exception as e:
+                logging.warning(f"ปลดล็อคการปรับปรุงสรุปของ {user_id} ไม่สำเร็จ: {str(e)}")
+
+    def build_prompt(self, previous_summary: str, turns: List[tuple]) -> List[Dict[str, str]]:
+        """
+        สร้างข้อความสำหรับขอสรุปใหม่ (ไม่รวมคำแนะนำระบบ)
+
+        Args:
+            previous_summary (str): สรุปเดิม หรือ "" ถ้ายังไม่มี
+            turns (List[tuple]): การสนทนาใหม่ (id, user_message, bot_response)
+
+        Returns:
+            List[Dict[str, str]]: ข้อความของผู้ใช้ที่ใช้ขอสรุป
+        """
+        if previous_summary:
+            prompt = INCREMENTAL_PROMPT_HEADER + f"\nสรุปเดิม: {previous_summary}\n\nบทสนทนาใหม่:\n"
+        else:
+            prompt = SUMMARY_PROMPT_HEADER
+        for _, msg, resp in turns:
+            prompt += f"\nผู้ใช้: {msg}\nบอท: {resp}\n"
+        return [{"role": "user", "content": prompt}]
+
+    @property
+    def generation_config(self) -> Dict[str, Any]:
+        """การตั้งค่าการสร้างสรุป (SUMMARY_GENERATION_CONFIG โดยใช้ max_tokens ของตัวจัดการนี้)"""
+        return {**SUMMARY_GENERATION_CONFIG, "max_tokens": self.max_tokens}
+
+    async def _summarize(self, previous_summary: str, turns: List[tuple]) -> Optional[str]:
+        """สร้างสรุปใหม่จากสรุปเดิมและการสนทนาที่เพิ่มเข้ามา"""
+        response = await self.deepseek.generate_completion(
+            messages=[self.system_message] + self.build_prompt(previous_summary, turns),
+            config=self.generation_config
+        )
+        return response["choices"][0]["message"]["content"]
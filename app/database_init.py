@@ -118,6 +118,27 @@ class DatabaseInitializer:
                 """)
                 logging.info("สร้างตาราง user_metrics สำเร็จ")
             
+            # ตรวจสอบว่ามีตาราง conversation_summaries หรือไม่
+            cursor.execute("""
+                SELECT COUNT(*) 
+                FROM information_schema.tables 
+                WHERE table_schema = DATABASE()
+                AND table_name = 'conversation_summaries'
+            """)
+            
+            if cursor.fetchone()[0] == 0:
+                logging.info("ไม่พบตาราง conversation_summaries กำลังสร้าง...")
+                # สร้างตาราง conversation_summaries (สรุปแบบสะสมต่อผู้ใช้)
+                cursor.execute("""
+                    CREATE TABLE conversation_summaries (
+                        user_id VARCHAR(50) PRIMARY KEY,
+                        summary TEXT NOT NULL,
+                        last_conversation_id INT NOT NULL,
+                        updated_at DATETIME NOT NULL
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+                """)
+                logging.info("สร้างตาราง conversation_summaries สำเร็จ")
+            
             conn.commit()
             logging.info("การเริ่มต้นฐานข้อมูลสำเร็จ")
             return True
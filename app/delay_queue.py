@@ -0,0 +1,115 @@
+"""
+โมดูลคิวหน่วงเวลาสำหรับแชทบอท 'ใจดี'
+เธรดตัวจับเวลาเดียวส่งงานที่ถึงเวลาต่อให้ executor (ไม่ทำ I/O เอง) แทนการ sleep ในเธรดของ worker
+งานของคีย์เดียวกัน (LINE user ID) รันตามลำดับที่ส่งเข้าเสมอ แม้งานหลังจะไม่มีการหน่วง
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from .dispatcher import UserOrderedDispatcher
+from .metrics import metrics
+
+class DelayQueue:
+    """
+    คิวงานที่รันเมื่อถึงเวลา (heap เรียงตามเวลาครบกำหนด) พร้อมรักษาลำดับต่อคีย์
+    """
+    def __init__(self, name: str = 'delay_queue', executor: Optional[UserOrderedDispatcher] = None):
+        """
+        สร้างคิวและเริ่มเธรดตัวจับเวลา
+
+        Args:
+            name (str): ชื่อเธรดและคำนำหน้าตัวชี้วัด
+            executor (UserOrderedDispatcher, optional): ตัวรันงานที่ถึงเวลา (รักษาลำดับต่อคีย์)
+                ถ้าไม่ระบุจะสร้างขึ้นเอง งานช้าของคีย์หนึ่งจึงไม่ทำให้คีย์อื่นล่าช้า
+        """
+        self.name = name
+        self._executor = executor or UserOrderedDispatcher(max_workers=4, name=f'{name}_run')
+        self._heap = []
+        self._sequence = itertools.count()
+        self._pending: Dict[Hashable, int] = {}
+        self._last_due: Dict[Hashable, float] = {}
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def schedule(self, key: Hashable, delay: float, fn: Callable[..., Any], *args: Any) -> float:
+        """
+        ตั้งเวลารันงาน
+
+        Args:
+            key (Hashable): คีย์สำหรับรักษาลำดับ (เช่น LINE user ID)
+            delay (float): เวลาหน่วงจากตอนนี้ (วินาที)
+            fn (Callable): ฟังก์ชันที่จะรัน
+            *args: อาร์กิวเมนต์ของฟังก์ชัน
+
+        Returns:
+            float: เวลาครบกำหนดจริง (monotonic) ซึ่งไม่ก่อนงานก่อนหน้าของคีย์เดียวกัน
+        """
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError(f"{self.name} is stopped")
+            due = max(time.monotonic() + max(delay, 0), self._last_due.get(key, 0))
+            heapq.heappush(self._heap, (due, next(self._sequence), key, fn, args))
+            self._pending[key] = self._pending.get(key, 0) + 1
+            self._last_due[key] = due
+            metrics.set_gauge(f'{self.name}_pending', len(self._heap))
+            self._condition.notify()
+        return due
+
+    def has_pending(self, key: Hashable) -> bool:
+        """ตรวจสอบว่าคีย์มีงานรออยู่หรือไม่ (งานใหม่ของคีย์นี้ต้องเข้าคิวตามหลัง)"""
+        with self._condition:
+            return key in self._pending
+
+    def pending(self) -> int:
+        """จำนวนงานที่รออยู่ทั้งหมด"""
+        with self._condition:
+            return len(self._heap)
+
+    def _run(self):
+        """วนรอจนถึงเวลาของงานแรกในคิว แล้วส่งงานนั้นให้ executor (หลัง stop ส่งงานที่เหลือทันที)"""
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    if self._heap:
+                        wait = self._heap[0][0] - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._condition.wait(wait)
+                    else:
+                        self._condition.wait()
+                if not self._heap:
+                    return
+                due, _, key, fn, args = heapq.heappop(self._heap)
+                metrics.set_gauge(f'{self.name}_pending', len(self._heap))
+
+            metrics.observe(f'{self.name}_lateness_ms', max(time.monotonic() - due, 0) * 1000)
+            try:
+                future = self._executor.submit(key, fn, *args)
+            except Exception as e:
+                logging.error(f"ส่งงานของ {key} ใน {self.name} ไม่สำเร็จ: {str(e)}")
+                self._done(key)
+            else:
+                # คีย์ยังถือว่ามีงานรอจนงานรันเสร็จ งานถัดไปของคีย์จึงยังต่อท้ายคิวนี้
+                future.add_done_callback(lambda _, key=key: self._done(key))
+
+    def _done(self, key: Hashable):
+        """ลดจำนวนงานค้างของคีย์เมื่องานรันเสร็จ"""
+        with self._condition:
+            self._pending[key] -= 1
+            if not self._pending[key]:
+                del self._pending[key]
+                del self._last_due[key]
+
+    def stop(self, timeout: float = 10):
+        """หยุดรับงานใหม่ ส่งงานที่ค้างอยู่ให้ executor ทันที แล้วรอให้งานทั้งหมดรันเสร็จ"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,206 @@
+"""
+โมดูลการส่งคำตอบสำหรับแชทบอท 'ใจดี'
+ส่งคำตอบด้วย reply token ก่อนเมื่อยังไม่หมดอายุ (ไม่นับโควตา push และส่งถึงเร็วกว่า)
+และส่งแบบ push เมื่อไม่มี token ที่ใช้ได้หรือ LINE ปฏิเสธ token พร้อมบันทึกเส้นทางที่ใช้ของทุกข้อความ
+reply token เก็บใน Redis จึงใช้ได้แม้ข้อความถูกประมวลผลในโปรเซสอื่น และใช้ได้เพียงครั้งเดียว
+"""
+import json
+import logging
+import time
+from typing import List, Optional, Tuple, Union
+
+from .line_client import LineResult
+from .metrics import metrics
+
+REPLY_TOKEN_KEY = "reply_token:{}"
+
+# LINE กำหนดให้ใช้ reply token ภายในประมาณ 1 นาทีหลังได้รับเหตุการณ์
+DEFAULT_REPLY_TOKEN_TTL = 50
+
+def remaining_ttl(received_at: Optional[float], ttl: float, now: Optional[float] = None) -> float:
+    """
+    คำนวณเวลาที่เหลือก่อน reply token หมดอายุ
+
+    Args:
+        received_at (float | None): เวลาที่ LINE สร้างเหตุการณ์ (epoch วินาที) ถ้าไม่ทราบถือว่าเพิ่งได้รับ
+        ttl (float): อายุของ token ที่ถือว่าปลอดภัย (วินาที)
+        now (float | None): เวลาปัจจุบัน (ใช้ในการทดสอบ)
+
+    Returns:
+        float: จำนวนวินาทีที่เหลือ (ติดลบเมื่อหมดอายุแล้ว)
+    """
+    now = time.time() if now is None else now
+    if received_at is None:
+        return ttl
+    return received_at + ttl - now
+
+def _encode(reply_token: str, received_at: float) -> str:
+    return json.dumps({"token": reply_token, "received_at": received_at})
+
+def _decode(value) -> Optional[Tuple[str, float]]:
+    if not value:
+        return None
+    data = json.loads(value)
+    return data["token"], data["received_at"]
+
+def _record(user_id: str, path: str, result: LineResult, token_age: Optional[float] = None):
+    """บันทึกเส้นทางการส่งของข้อความหนึ่งครั้ง"""
+    metrics.inc('line_delivery_total', labels={'path': path})
+    if token_age is not None:
+        metrics.observe('reply_token_age_seconds', token_age)
+    logging.info(f"ส่งข้อความถึง {user_id} ผ่าน {path} "
+                 f"({'สำเร็จ' if result.ok else 'ล้มเหลว'}, {result.elapsed * 1000:.0f} มิลลิวินาที)")
+
+class ReplyTokenStore:
+    """
+    ที่เก็บ reply token ล่าสุดของผู้ใช้บน Redis (หมดอายุเองตามเวลาที่เหลือของ token)
+    """
+    def __init__(self, redis_client, ttl: float = DEFAULT_REPLY_TOKEN_TTL):
+        """
+        Args:
+            redis_client (redis.Redis): การเชื่อมต่อ Redis
+            ttl (float): อายุของ token ที่ถือว่าปลอดภัย นับจากเวลาของเหตุการณ์ (วินาที)
+        """
+        self.redis = redis_client
+        self.ttl = ttl
+
+    def entry(self, reply_token: Optional[str], received_at: Optional[float] = None) -> Optional[Tuple[str, int]]:
+        """
+        เตรียมค่าที่จะเก็บสำหรับ reply token (ใช้เมื่อรวมการเก็บไว้ในคำสั่ง Redis อื่น)
+
+        Returns:
+            tuple | None: (ค่าที่เข้ารหัสแล้ว, อายุที่เหลือเป็นวินาที) หรือ None ถ้าไม่มี token หรือหมดอายุแล้ว
+        """
+        if not reply_token:
+            return None
+        received_at = time.time() if received_at is None else received_at
+        remaining = int(remaining_ttl(received_at, self.ttl))
+        if remaining < 1:
+            metrics.inc('reply_token_expired_total')
+            return None
+        return _encode(reply_token, received_at), remaining
+
+    def register(self, user_id: str, reply_token: Optional[str], received_at: Optional[float] = None) -> bool:
+        """
+        เก็บ reply token ของข้อความที่กำลังประมวลผล
+
+        Returns:
+            bool: True ถ้าเก็บได้, False ถ้าไม่มี token หรือหมดอายุแล้ว
+        """
+        entry = self.entry(reply_token, received_at)
+        if entry is None:
+            return False
+        self.redis.set(REPLY_TOKEN_KEY.format(user_id), entry[0], ex=entry[1])
+        return True
+
+    def claim(self, user_id: str) -> Optional[Tuple[str, float]]:
+        """
+        ดึงและลบ reply token ของผู้ใช้ (token ใช้ได้ครั้งเดียว)
+
+        Returns:
+            tuple | None: (reply token, เวลาของเหตุการณ์) หรือ None ถ้าไม่มี token ที่ยังใช้ได้
+        """
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.get(REPLY_TOKEN_KEY.format(user_id))
+        pipe.delete(REPLY_TOKEN_KEY.format(user_id))
+        value, _ = pipe.execute()
+        return _decode(value)
+
+class AsyncReplyTokenStore(ReplyTokenStore):
+    """
+    ที่เก็บ reply token แบบอะซิงโครนัส (ใช้ redis.asyncio)
+    """
+    async def register(self, user_id: str, reply_token: Optional[str], received_at: Optional[float] = None) -> bool:
+        """เก็บ reply token ของข้อความที่กำลังประมวลผล (ดู ReplyTokenStore.register)"""
+        entry = self.entry(reply_token, received_at)
+        if entry is None:
+            return False
+        await self.redis.set(REPLY_TOKEN_KEY.format(user_id), entry[0], ex=entry[1])
+        return True
+
+    async def claim(self, user_id: str) -> Optional[Tuple[str, float]]:
+        """ดึงและลบ reply token ของผู้ใช้ (ดู ReplyTokenStore.claim)"""
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.get(REPLY_TOKEN_KEY.format(user_id))
+        pipe.delete(REPLY_TOKEN_KEY.format(user_id))
+        value, _ = await pipe.execute()
+        return _decode(value)
+
+class MessageDelivery:
+    """
+    ส่งข้อความด้วย reply token ก่อน และส่งแบบ push เมื่อใช้ reply ไม่ได้
+    """
+    def __init__(self, line_client, token_store: Optional[ReplyTokenStore] = None):
+        """
+        Args:
+            line_client (LineClient): ไคลเอนต์ LINE
+            token_store (ReplyTokenStore | None): ที่เก็บ reply token (None = ใช้ push เสมอ)
+        """
+        self.line_client = line_client
+        self.token_store = token_store
+
+    def send(self, user_id: str, texts: Union[str, List[str]],
+             reply_token: Optional[str] = None, received_at: Optional[float] = None) -> LineResult:
+        """
+        ส่งข้อความถึงผู้ใช้ (สูงสุด 5 ข้อความ)
+
+        Args:
+            user_id (str): LINE user ID
+            texts (str | List[str]): ข้อความที่จะส่ง
+            reply_token (str | None): token ที่จะใช้โดยตรง ถ้าไม่ระบุจะดึงจากที่เก็บ
+            received_at (float | None): เวลาของเหตุการณ์ของ reply_token ที่ระบุ
+
+        Returns:
+            LineResult: ผลลัพธ์ของคำขอสุดท้ายที่ส่ง
+        """
+        claimed = None
+        if self.token_store is not None and reply_token:
+            claimed = (reply_token, time.time() if received_at is None else received_at)
+        elif self.token_store is not None:
+            try:
+                claimed = self.token_store.claim(user_id)
+            except Exception as e:
+                logging.warning(f"ดึง reply token ของ {user_id} ไม่สำเร็จ: {str(e)}")
+
+        path = 'push'
+        if claimed and remaining_ttl(claimed[1], self.token_store.ttl) > 0:
+            token_age = time.time() - claimed[1]
+            result = self.line_client.reply_message(claimed[0], texts)
+            if result.ok:
+                _record(user_id, 'reply', result, token_age)
+                return result
+            # token หมดอายุหรือถูกใช้แล้ว (เช่น เหตุการณ์ถูกส่งซ้ำ) ส่งแบบ push แทน
+            path = 'push_fallback'
+
+        result = self.line_client.push_message(user_id, texts)
+        _record(user_id, path, result)
+        return result
+
+class AsyncMessageDelivery(MessageDelivery):
+    """
+    ส่งข้อความด้วย reply token ก่อนแบบอะซิงโครนัส (ใช้ AsyncLineClient และ AsyncReplyTokenStore)
+    """
+    async def send(self, user_id: str, texts: Union[str, List[str]],
+                   reply_token: Optional[str] = None, received_at: Optional[float] = None) -> LineResult:
+        """ส่งข้อความถึงผู้ใช้ (ดู MessageDelivery.send)"""
+        claimed = None
+        if self.token_store is not None and reply_token:
+            claimed = (reply_token, time.time() if received_at is None else received_at)
+        elif self.token_store is not None:
+            try:
+                claimed = await self.token_store.claim(user_id)
+            except Exception as e:
+                logging.warning(f"ดึง reply token ของ {user_id} ไม่สำเร็จ: {str(e)}")
+
+        path = 'push'
+        if claimed and remaining_ttl(claimed[1], self.token_store.ttl) > 0:
+            token_age = time.time() - claimed[1]
+            result = await self.line_client.reply_message(claimed[0], texts)
+            if result.ok:
+                _record(user_id, 'reply', result, token_age)
+                return result
+            path = 'push_fallback'
+
+        result = await self.line_client.push_message(user_id, texts)
+        _record(user_id, path, result)
+        return result
@@ -0,0 +1,242 @@
+"""
+โมดูลกระจายงานตามผู้ใช้สำหรับแชทบอท 'ใจดี'
+ประมวลผลเหตุการณ์ของผู้ใช้ต่างคนพร้อมกันบนกลุ่มเธรดที่จำกัดขนาด
+โดยรักษาลำดับของเหตุการณ์จากผู้ใช้คนเดียวกันอย่างเคร่งครัด
+ผู้ใช้ที่มีข้อความเสี่ยงสูงจะได้รันก่อนเมื่อมีงานรอ และงานลำดับต่ำจะถูกเลื่อนขึ้นตามเวลาที่รอ
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Iterable, List
+
+from .metrics import metrics
+
+# ระดับความสำคัญของงาน เรียงจากสูงไปต่ำ
+PRIORITY_URGENT = 'urgent'
+PRIORITY_ELEVATED = 'elevated'
+PRIORITY_NORMAL = 'normal'
+PRIORITY_CLASSES = (PRIORITY_URGENT, PRIORITY_ELEVATED, PRIORITY_NORMAL)
+_PRIORITY_RANK = {name: rank for rank, name in enumerate(PRIORITY_CLASSES)}
+
+def classify_priority(score: int, risk_level: str = 'low') -> str:
+    """
+    แปลงคะแนนความสำคัญ (1-10) และระดับความเสี่ยงเป็นระดับความสำคัญของงาน
+
+    Args:
+        score (int): คะแนนจาก calculate_message_priority
+        risk_level (str): ผลจาก assess_risk ('low', 'medium', 'high')
+
+    Returns:
+        str: ระดับความสำคัญ (urgent, elevated หรือ normal)
+    """
+    if risk_level == 'high' or score >= 8:
+        return PRIORITY_URGENT
+    if risk_level == 'medium' or score >= 6:
+        return PRIORITY_ELEVATED
+    return PRIORITY_NORMAL
+
+class UserOrderedDispatcher:
+    """
+    ตัวกระจายงานที่เรียงลำดับตามคีย์ (LINE user ID) และขนานกันระหว่างคีย์
+    """
+    def __init__(self, max_workers: int = 8, name: str = 'dispatch', aging_seconds: float = 5.0):
+        """
+        สร้างตัวกระจายงาน
+
+        Args:
+            max_workers (int): จำนวนเธรดสูงสุดที่ประมวลผลพร้อมกัน
+            name (str): คำนำหน้าชื่อเธรดและตัวชี้วัด
+            aging_seconds (float): เวลารอที่ทำให้งานถูกเลื่อนขึ้นหนึ่งระดับความสำคัญ
+        """
+        self.max_workers = max_workers
+        self.name = name
+        self.aging_seconds = aging_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        # แจ้งเมื่อไม่มีคีย์ใดเหลืองานค้าง (shutdown รอจุดนี้ก่อนปิดกลุ่มเธรด)
+        self._idle = threading.Condition(self._lock)
+        self._queues: Dict[Hashable, deque] = {}
+        self._ready = []
+        # คีย์ที่รออยู่ในคิวพร้อมรัน -> (ลำดับ, เลขลำดับ) ของรายการที่ยังใช้ได้ในฮีป
+        # (รายการเก่าของคีย์ที่ถูกเลื่อนลำดับขึ้นยังค้างในฮีปและถูกข้ามตอนดึง)
+        self._ready_rank: Dict[Hashable, tuple] = {}
+        self._sequence = itertools.count()
+        self._running = 0
+
+    def submit(self, key: Hashable, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """
+        ส่งงานเข้าคิวของคีย์ งานของคีย์เดียวกันจะรันตามลำดับที่ส่งเข้ามา
+
+        Args:
+            key (Hashable): คีย์ที่ใช้เรียงลำดับ (เช่น user_id)
+            fn (Callable): ฟังก์ชันที่ต้องการรัน
+
+        Returns:
+            Future: ผลลัพธ์ของงาน
+        """
+        return self.submit_with_priority(key, PRIORITY_NORMAL, fn, *args, **kwargs)
+
+    def submit_with_priority(self, key: Hashable, priority: str, fn: Callable[..., Any],
+                             *args: Any, **kwargs: Any) -> Future:
+        """
+        ส่งงานเข้าคิวของคีย์พร้อมระดับความสำคัญ
+        เมื่อเธรดไม่พอ คีย์ที่มีงานสำคัญกว่าจะได้รันก่อน (ลำดับภายในคีย์เดียวกันยังคงเดิม)
+
+        Args:
+            key (Hashable): คีย์ที่ใช้เรียงลำดับ (เช่น user_id)
+            priority (str): ระดับความสำคัญ (urgent, elevated หรือ normal)
+            fn (Callable): ฟังก์ชันที่ต้องการรัน
+
+        Returns:
+            Future: ผลลัพธ์ของงาน
+        """
+        if priority not in _PRIORITY_RANK:
+            priority = PRIORITY_NORMAL
+        future = Future()
+        with self._lock:
+            queue = self._queues.get(key)
+            schedule = queue is None
+            if schedule:
+                queue = deque()
+                self._queues[key] = queue
+            enqueued_at = time.monotonic()
+            queue.append((enqueued_at, priority, fn, args, kwargs, future))
+            depth = len(queue)
+            if schedule:
+                self._push_ready(key, queue)
+            elif key in self._ready_rank:
+                # คีย์รออยู่แล้ว: งานที่สำคัญกว่าต้องเลื่อนลำดับของทั้งคีย์ขึ้นทันที
+                rank = _PRIORITY_RANK[priority] * self.aging_seconds + enqueued_at
+                if rank < self._ready_rank[key][0]:
+                    self._add_ready(key, rank)
+
+        metrics.observe(f'{self.name}_user_queue_depth', depth)
+        metrics.inc(f'{self.name}_submitted_total', labels={'priority': priority})
+        if schedule:
+            self._executor.submit(self._run_ready)
+        return future
+
+    def _push_ready(self, key: Hashable, queue: deque):
+        """
+        ใส่คีย์ลงคิวพร้อมรัน (ต้องถือ lock)
+        ลำดับคือ ระดับความสำคัญ x aging_seconds + เวลาที่เข้าคิว: งานที่รอนานกว่า aging_seconds
+        ต่อหนึ่งระดับจะแซงงานที่สำคัญกว่าที่เพิ่งเข้ามา จึงไม่มีงานใดรอไม่สิ้นสุด
+        คีย์ใช้ลำดับของงานที่สำคัญที่สุดในคิว เพราะงานนั้นต้องรอให้งานก่อนหน้าของคีย์เดียวกันเสร็จก่อน
+        """
+        rank = min(
+            _PRIORITY_RANK[priority] * self.aging_seconds + enqueued_at
+            for enqueued_at, priority, _, _, _, _ in queue
+        )
+        self._add_ready(key, rank)
+
+    def _add_ready(self, key: Hashable, rank: float):
+        """ใส่รายการของคีย์ลงฮีป และทำให้รายการก่อนหน้าของคีย์เดียวกันหมดอายุ (ต้องถือ lock)"""
+        entry = (rank, next(self._sequence))
+        self._ready_rank[key] = entry
+        heapq.heappush(self._ready, (*entry, key))
+
+    def _run_ready(self):
+        """รันงานถัดไปของคีย์ที่สำคัญที่สุดในคิวพร้อมรัน (ข้ามรายการที่หมดอายุแล้ว)"""
+        with self._lock:
+            while True:
+                rank, sequence, key = heapq.heappop(self._ready)
+                if self._ready_rank.get(key) == (rank, sequence):
+                    del self._ready_rank[key]
+                    break
+        self._run_next(key)
+
+    def map_ordered(self, items: Iterable[Any], key_func: Callable[[Any], Hashable],
+                    fn: Callable[[Any], Any]) -> List[Future]:
+        """
+        ส่งหลายรายการเข้าคิวตามคีย์ของแต่ละรายการ
+
+        Args:
+            items (Iterable): รายการที่ต้องการประมวลผล
+            key_func (Callable): ฟังก์ชันดึงคีย์จากรายการ
+            fn (Callable): ฟังก์ชันประมวลผลรายการ
+
+        Returns:
+            List[Future]: ผลลัพธ์ตามลำดับของรายการ
+        """
+        return [self.submit(key_func(item), fn, item) for item in items]
+
+    def _run_next(self, key: Hashable):
+        """รันงานถัดไปของคีย์ แล้วคืนเธรดให้คีย์อื่นก่อนรันงานถัดไป"""
+        with self._lock:
+            queue = self._queues[key]
+            enqueued_at, priority, fn, args, kwargs, future = queue[0]
+            self._running += 1
+            running = self._running
+
+        metrics.set_gauge(f'{self.name}_running', running)
+        metrics.observe(f'{self.name}_wait_ms', (time.monotonic() - enqueued_at) * 1000,
+                        labels={'priority': priority})
+
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                logging.error(f"งานของ {key} ใน {self.name} ล้มเหลว: {str(e)}", exc_info=True)
+                future.set_exception(e)
+
+        with self._lock:
+            self._running -= 1
+            queue.popleft()
+            has_more = bool(queue)
+            if has_more:
+                self._push_ready(key, queue)
+            else:
+                del self._queues[key]
+                if not self._queues:
+                    self._idle.notify_all()
+
+        # คืนคีย์นี้เข้าคิวพร้อมรันตามลำดับความสำคัญ เพื่อให้ผู้ใช้อื่นได้รันสลับกัน
+        if has_more:
+            self._executor.submit(self._run_ready)
+
+    def is_saturated(self) -> bool:
+        """ตรวจสอบว่ามีงานรอเธรดว่างอยู่หรือไม่ (ใช้ปิดการหน่วงเวลาที่ไม่จำเป็นเมื่อระบบมีภาระสูง)"""
+        with self._lock:
+            return bool(self._ready_rank)
+
+    def stats(self, top: int = 10) -> Dict[str, Any]:
+        """
+        ดึงสถานะของตัวกระจายงาน
+
+        Args:
+            top (int): จำนวนผู้ใช้ที่มีคิวยาวที่สุดที่ต้องการแสดง
+
+        Returns:
+            Dict[str, Any]: จำนวนเธรด งานที่รันอยู่ ความยาวคิวรวม และคิวของผู้ใช้ที่ยาวที่สุด
+        """
+        with self._lock:
+            depths = {key: len(queue) for key, queue in self._queues.items()}
+            by_priority = {name: 0 for name in PRIORITY_CLASSES}
+            for queue in self._queues.values():
+                for _, priority, _, _, _, _ in queue:
+                    by_priority[priority] += 1
+            running = self._running
+
+        deepest = sorted(depths.items(), key=lambda item: item[1], reverse=True)[:top]
+        return {
+            "max_workers": self.max_workers,
+            "running": running,
+            "active_users": len(depths),
+            "pending_total": sum(depths.values()) - running,
+            "queued_by_priority": by_priority,
+            "deepest_user_queues": {str(key): depth for key, depth in deepest}
+        }
+
+    def shutdown(self, wait: bool = True):
+        """
+        หยุดรับงานใหม่และรอให้งานที่ค้างอยู่เสร็จ
+        ต้องรอคิวของทุกคีย์ว่างก่อนปิดกลุ่มเธรด เพราะงานถัดไปของคีย์ถูกส่งเข้ากลุ่มเธรดหลังงานก่อนหน้าเสร็จ
+        """
+        if wait:
+            with self._idle:
+                self._idle.wait_for(lambda: not self._queues)
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,438 @@
+"""
+โมดูลคิวเหตุการณ์ webhook แบบคงทนสำหรับแชทบอท 'ใจดี'
+ใช้ Redis Streams พร้อม consumer group เพื่อให้ /callback ตอบกลับได้ทันที
+และให้ worker ประมวลผลเหตุการณ์แบบ at-least-once
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import redis
+
+from .metrics import metrics
+
+# สคริปต์ Lua สำหรับกรองเหตุการณ์ซ้ำและเพิ่มลงสตรีมในขั้นตอนเดียว
+# KEYS[1] = สตรีม, KEYS[2] = คีย์กันซ้ำ
+# ARGV[1] = เนื้อหาเหตุการณ์, ARGV[2] = ความยาวสูงสุดของสตรีม, ARGV[3] = TTL ของคีย์กันซ้ำ ('' = ไม่กรอง)
+ENQUEUE_SCRIPT = """
+if ARGV[3] ~= '' then
+    if not redis.call('SET', KEYS[2], '1', 'NX', 'EX', ARGV[3]) then
+        return false
+    end
+end
+return redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[2], '*', 'event', ARGV[1])
+"""
+
+# สคริปต์ Lua สำหรับต่ออายุเฉพาะรายการที่ consumer ยังเป็นเจ้าของอยู่
+# KEYS[1] = สตรีม
+# ARGV[1] = consumer group, ARGV[2] = consumer, ARGV[3..] = ID ของรายการ
+REFRESH_SCRIPT = """
+local refreshed = 0
+for i = 3, #ARGV do
+    local pending = redis.call('XPENDING', KEYS[1], ARGV[1], ARGV[i], ARGV[i], 1)
+    if pending[1] and pending[1][2] == ARGV[2] then
+        redis.call('XCLAIM', KEYS[1], ARGV[1], ARGV[2], 0, ARGV[i], 'JUSTID')
+        refreshed = refreshed + 1
+    end
+end
+return refreshed
+"""
+
+def _entry_age_ms(entry_id: str) -> int:
+    """คำนวณอายุของรายการในสตรีมจาก ID (มิลลิวินาที)"""
+    try:
+        return max(0, int(time.time() * 1000) - int(entry_id.split('-')[0]))
+    except (ValueError, AttributeError):
+        return 0
+
+class EventQueue:
+    """
+    คิวเหตุการณ์ LINE บน Redis Streams
+    """
+    def __init__(self,
+                 redis_client: redis.Redis,
+                 stream: str = 'line_events',
+                 group: str = 'line_workers',
+                 maxlen: int = 10000,
+                 claim_idle_ms: int = 60000,
+                 max_deliveries: int = 5,
+                 dedup_ttl: int = 3600):
+        """
+        สร้างคิวเหตุการณ์
+
+        Args:
+            redis_client (redis.Redis): การเชื่อมต่อ Redis (decode_responses=True)
+            stream (str): ชื่อสตรีม
+            group (str): ชื่อ consumer group
+            maxlen (int): ความยาวสูงสุดโดยประมาณของสตรีม
+            claim_idle_ms (int): เวลาที่รายการค้างอยู่ก่อนให้ worker อื่นเคลมคืน
+                (worker ที่ยังทำงานต่ออายุรายการของตัวเองทุกหนึ่งในสามของช่วงนี้)
+            max_deliveries (int): จำนวนครั้งสูงสุดที่ส่งมอบก่อนย้ายไปคิวข้อผิดพลาด
+            dedup_ttl (int): ระยะเวลาจำ webhookEventId เพื่อกรองการส่งซ้ำจาก LINE
+        """
+        self.redis = redis_client
+        self.stream = stream
+        self.group = group
+        self.dead_letter_stream = f"{stream}:dead"
+        self.maxlen = maxlen
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+        self.dedup_ttl = dedup_ttl
+        self._enqueue_script = self.redis.register_script(ENQUEUE_SCRIPT)
+        self._refresh_script = self.redis.register_script(REFRESH_SCRIPT)
+
+    def ensure_group(self):
+        """สร้างสตรีมและ consumer group ถ้ายังไม่มี"""
+        try:
+            self.redis.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+            logging.info(f"สร้าง consumer group {self.group} บนสตรีม {self.stream}")
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def enqueue(self, events: List[Dict[str, Any]]) -> int:
+        """
+        เพิ่มเหตุการณ์ลงคิว โดยกรองเหตุการณ์ที่ LINE ส่งซ้ำ
+
+        Args:
+            events (List[Dict[str, Any]]): เหตุการณ์ดิบจากเนื้อหา webhook
+
+        Returns:
+            int: จำนวนเหตุการณ์ที่เพิ่มลงคิวจริง
+        """
+        added = 0
+        for event in events:
+            event_id = event.get('webhookEventId')
+            dedup_key = f"webhook_event:{event_id}" if event_id else f"webhook_event:{self.stream}"
+            result = self._enqueue_script(
+                keys=[self.stream, dedup_key],
+                args=[
+                    json.dumps(event, ensure_ascii=False),
+                    self.maxlen,
+                    self.dedup_ttl if event_id else ''
+                ]
+            )
+            if result:
+                added += 1
+            else:
+                metrics.inc('event_queue_duplicates_total')
+        metrics.inc('event_queue_enqueued_total', added)
+        return added
+
+    def read(self, consumer: str, count: int = 10, block_ms: int = 5000) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        อ่านเหตุการณ์ใหม่ที่ยังไม่ถูกส่งให้ worker ใด
+
+        Args:
+            consumer (str): ชื่อ consumer
+            count (int): จำนวนรายการสูงสุดต่อการอ่าน
+            block_ms (int): เวลารอสูงสุดเมื่อไม่มีข้อมูล
+
+        Returns:
+            List[Tuple[str, Dict[str, Any]]]: รายการ (entry_id, เหตุการณ์)
+        """
+        response = self.redis.xreadgroup(
+            self.group, consumer, {self.stream: '>'}, count=count, block=block_ms
+        )
+        entries = []
+        for _, stream_entries in response or []:
+            entries.extend(self._decode(stream_entries))
+        return entries
+
+    def reclaim(self, consumer: str, count: int = 10) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        เคลมรายการที่ค้างอยู่นานเกินกำหนด (worker เดิมหยุดทำงาน)
+        รายการที่ส่งมอบเกินจำนวนครั้งสูงสุดจะถูกย้ายไปสตรีมข้อผิดพลาด
+
+        Args:
+            consumer (str): ชื่อ consumer ที่จะรับรายการ
+            count (int): จำนวนรายการสูงสุด
+
+        Returns:
+            List[Tuple[str, Dict[str, Any]]]: รายการที่เคลมมาได้
+        """
+        pending = self.redis.xpending_range(
+            self.stream, self.group, min='-', max='+', count=count, idle=self.claim_idle_ms
+        )
+        if not pending:
+            return []
+
+        for item in pending:
+            if item['times_delivered'] >= self.max_deliveries:
+                self._dead_letter(item['message_id'], item['times_delivered'])
+
+        result = self.redis.xautoclaim(
+            self.stream, self.group, consumer, self.claim_idle_ms, start_id='0-0', count=count
+        )
+        entries = self._decode(result[1] if result else [])
+        if entries:
+            metrics.inc('event_queue_reclaimed_total', len(entries))
+            logging.warning(f"{consumer} เคลมเหตุการณ์ที่ค้างอยู่ {len(entries)} รายการ")
+        return entries
+
+    def refresh(self, consumer: str, entry_ids: List[str]) -> int:
+        """
+        ต่ออายุรายการที่ consumer ยังประมวลผลอยู่ (XCLAIM JUSTID รีเซ็ตเวลาค้างโดยไม่นับการส่งมอบเพิ่ม)
+        เพื่อไม่ให้ worker อื่นเคลมรายการที่ใช้เวลานานไปตอบซ้ำ
+        รายการที่ worker อื่นเคลมไปแล้วจะถูกข้าม (ตรวจเจ้าของจาก XPENDING ในสคริปต์เดียวกัน)
+        เพื่อไม่ให้ดึงรายการกลับมาจาก worker ที่กำลังประมวลผลอยู่
+
+        Args:
+            consumer (str): ชื่อ consumer ที่ถือรายการ
+            entry_ids (List[str]): รายการที่ยังไม่เสร็จ
+
+        Returns:
+            int: จำนวนรายการที่ต่ออายุได้
+        """
+        refreshed = int(self._refresh_script(keys=[self.stream], args=[self.group, consumer, *entry_ids]))
+        metrics.inc('event_queue_heartbeats_total')
+        lost = len(entry_ids) - refreshed
+        if lost:
+            metrics.inc('event_queue_refresh_lost_total', lost)
+            logging.warning(f"{consumer} ไม่ได้เป็นเจ้าของเหตุการณ์ {lost} รายการแล้ว (ถูก worker อื่นเคลมไป)")
+        return refreshed
+
+    def ack(self, entry_id: str):
+        """ยืนยันว่าประมวลผลรายการเสร็จแล้ว"""
+        self.redis.xack(self.stream, self.group, entry_id)
+        metrics.inc('event_queue_acked_total')
+        metrics.observe('event_queue_end_to_end_ms', _entry_age_ms(entry_id))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        ดึงสถานะของคิว
+
+        Returns:
+            Dict[str, Any]: ความยาวสตรีม จำนวนรายการค้าง และจำนวน consumer
+        """
+        info = {"stream": self.stream, "length": self.redis.xlen(self.stream), "pending": 0, "consumers": 0}
+        for group in self.redis.xinfo_groups(self.stream):
+            if group['name'] == self.group:
+                info['pending'] = group['pending']
+                info['consumers'] = group['consumers']
+        info['dead_letters'] = self.redis.xlen(self.dead_letter_stream)
+        return info
+
+    def _dead_letter(self, entry_id: str, deliveries: int):
+        """ย้ายรายการที่ล้มเหลวซ้ำๆ ไปยังสตรีมข้อผิดพลาด"""
+        entries = self.redis.xrange(self.stream, min=entry_id, max=entry_id)
+        pipe = self.redis.pipeline()
+        for _, fields in entries:
+            pipe.xadd(self.dead_letter_stream, {**fields, 'source_id': entry_id, 'deliveries': deliveries},
+                      maxlen=self.maxlen, approximate=True)
+        pipe.xack(self.stream, self.group, entry_id)
+        pipe.execute()
+        metrics.inc('event_queue_dead_lettered_total')
+        logging.error(f"ย้ายเหตุการณ์ {entry_id} ไปคิวข้อผิดพลาดหลังส่งมอบ {deliveries} ครั้ง")
+
+    @staticmethod
+    def _decode(stream_entries) -> List[Tuple[str, Dict[str, Any]]]:
+        """แปลงรายการจากสตรีมเป็นเหตุการณ์"""
+        entries = []
+        for entry_id, fields in stream_entries:
+            if not fields:
+                continue
+            try:
+                entries.append((entry_id, json.loads(fields['event'])))
+            except (KeyError, ValueError) as e:
+                logging.error(f"ไม่สามารถอ่านเหตุการณ์ {entry_id}: {str(e)}")
+        return entries
+
+class EventWorker:
+    """
+    worker ที่ดึงเหตุการณ์จากคิวและส่งให้ฟังก์ชันประมวลผล
+    """
+    def __init__(self,
+                 queue: EventQueue,
+                 handle_event: Callable[[Dict[str, Any]], None],
+                 name: Optional[str] = None,
+                 batch_size: int = 10,
+                 block_ms: int = 5000,
+                 claim_interval: float = 30.0,
+                 dispatcher=None,
+                 key_func: Optional[Callable[[Dict[str, Any]], Hashable]] = None,
+                 priority_func: Optional[Callable[[Dict[str, Any]], str]] = None,
+                 max_in_flight: Optional[int] = None):
+        """
+        สร้าง worker
+
+        Args:
+            queue (EventQueue): คิวเหตุการณ์
+            handle_event (Callable): ฟังก์ชันประมวลผลเหตุการณ์หนึ่งรายการ
+            name (str, optional): ชื่อ consumer (ค่าเริ่มต้นคือ host-pid-thread)
+            batch_size (int): จำนวนรายการสูงสุดต่อการอ่าน
+            block_ms (int): เวลารอสูงสุดเมื่อไม่มีข้อมูล
+            claim_interval (float): ระยะห่าง (วินาที) ระหว่างการเคลมรายการค้าง
+            dispatcher (UserOrderedDispatcher, optional): ตัวกระจายงานสำหรับประมวลผลชุดพร้อมกันตามผู้ใช้
+            key_func (Callable, optional): ฟังก์ชันดึงคีย์ลำดับ (user_id) จากเหตุการณ์
+            priority_func (Callable, optional): ฟังก์ชันจัดระดับความสำคัญของเหตุการณ์สำหรับตัวกระจายงาน
+            max_in_flight (int, optional): จำนวนรายการสูงสุดที่ส่งให้ตัวกระจายงานแล้วแต่ยังไม่เสร็จ
+                (ค่าเริ่มต้นคือ batch_size) worker อ่านรายการใหม่ทันทีที่มีช่องว่าง
+        """
+        self.queue = queue
+        self.handle_event = handle_event
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}"
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_interval = claim_interval
+        self.dispatcher = dispatcher
+        self.key_func = key_func or event_user_id
+        self.priority_func = priority_func
+        self.max_in_flight = max_in_flight or batch_size
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        # รายการที่อ่านมาแล้วแต่ยังประมวลผลไม่เสร็จ (รวมที่รอในตัวกระจายงาน) ต่ออายุด้วย heartbeat
+        self._in_flight = set()
+        self._in_flight_lock = threading.Lock()
+        self.heartbeat_interval = queue.claim_idle_ms / 3000
+
+    def process(self, entry_id: str, event: Dict[str, Any]) -> bool:
+        """
+        ประมวลผลเหตุการณ์หนึ่งรายการ และยืนยันเมื่อสำเร็จ
+        ถ้าล้มเหลว รายการจะค้างอยู่เพื่อให้ถูกเคลมและลองใหม่ภายหลัง
+
+        Returns:
+            bool: True หากประมวลผลสำเร็จ
+        """
+        try:
+            self.handle_event(event)
+        except Exception as e:
+            metrics.inc('event_queue_failed_total')
+            logging.error(f"worker {self.name} ประมวลผลเหตุการณ์ {entry_id} ไม่สำเร็จ: {str(e)}", exc_info=True)
+            return False
+        finally:
+            # หยุดต่ออายุ: รายการที่ล้มเหลวต้องค้างจนถูกเคลมไปลองใหม่
+            with self._in_flight_lock:
+                self._in_flight.discard(entry_id)
+        self.queue.ack(entry_id)
+        return True
+
+    def run(self, stop_event: threading.Event):
+        """
+        วนรอบดึงและประมวลผลเหตุการณ์จนกว่าจะได้รับสัญญาณหยุด
+
+        Args:
+            stop_event (threading.Event): สัญญาณหยุดการทำงาน
+        """
+        logging.info(f"worker {self.name} เริ่มทำงานบนสตรีม {self.queue.stream}")
+        threading.Thread(target=self._heartbeat, args=(stop_event,), name=f"{self.name}-heartbeat",
+                         daemon=True).start()
+        next_claim = 0.0
+        while not stop_event.is_set():
+            count = self.batch_size
+            if self.dispatcher is not None:
+                count = self._acquire_slots()
+                if not count:
+                    continue
+            try:
+                entries = []
+                if time.monotonic() >= next_claim:
+                    entries = self.queue.reclaim(self.name, count)
+                    next_claim = time.monotonic() + self.claim_interval
+                if not entries:
+                    entries = self.queue.read(self.name, count, self.block_ms)
+                with self._in_flight_lock:
+                    self._in_flight.update(entry_id for entry_id, _ in entries)
+                for entry_id, _ in entries:
+                    metrics.observe('event_queue_wait_ms', _entry_age_ms(entry_id))
+                if self.dispatcher is None:
+                    for entry_id, event in entries:
+                        self.process(entry_id, event)
+                else:
+                    # ส่งรายการให้ตัวกระจายงานโดยไม่รอทั้งชุด ช่องจะคืนเมื่อแต่ละรายการเสร็จ
+                    for entry_id, event in entries:
+                        try:
+                            future = self._dispatch(entry_id, event)
+                        except Exception as e:
+                            # ส่งต่อไม่ได้ (เช่น key_func/priority_func ผิดพลาด): ปล่อยรายการค้างไว้
+                            # ให้ถูกเคลมไปลองใหม่หรือย้ายไปคิวข้อผิดพลาด ช่องของรายการนี้คืนใน finally
+                            metrics.inc('event_queue_failed_total')
+                            logging.error(f"worker {self.name} ส่งเหตุการณ์ {entry_id} ให้ตัวกระจายงานไม่สำเร็จ: {str(e)}",
+                                          exc_info=True)
+                            with self._in_flight_lock:
+                                self._in_flight.discard(entry_id)
+                            continue
+                        future.add_done_callback(lambda _: self._slots.release())
+                        count -= 1
+            except redis.RedisError as e:
+                logging.error(f"worker {self.name} เชื่อมต่อ Redis ไม่ได้: {str(e)}")
+                stop_event.wait(1.0)
+            finally:
+                if self.dispatcher is not None:
+                    for _ in range(count):
+                        self._slots.release()
+        logging.info(f"worker {self.name} หยุดทำงาน")
+
+    def _heartbeat(self, stop_event: threading.Event):
+        """ต่ออายุรายการที่ยังไม่เสร็จเป็นระยะ จนกว่าจะได้รับสัญญาณหยุด"""
+        while not stop_event.wait(self.heartbeat_interval):
+            with self._in_flight_lock:
+                entry_ids = list(self._in_flight)
+            if not entry_ids:
+                continue
+            try:
+                self.queue.refresh(self.name, entry_ids)
+            except redis.RedisError as e:
+                logging.error(f"worker {self.name} ต่ออายุเหตุการณ์ไม่สำเร็จ: {str(e)}")
+
+    def _acquire_slots(self) -> int:
+        """
+        จองช่องสำหรับรายการที่จะอ่าน (รออย่างน้อยหนึ่งช่อง แล้วจองช่องที่ว่างอยู่เพิ่มไม่เกิน batch_size)
+
+        Returns:
+            int: จำนวนช่องที่จองได้ (0 เมื่อรอครบเวลาแล้วยังไม่มีช่องว่าง)
+        """
+        if not self._slots.acquire(timeout=1.0):
+            return 0
+        count = 1
+        while count < self.batch_size and self._slots.acquire(blocking=False):
+            count += 1
+        return count
+
+    def _dispatch(self, entry_id: str, event: Dict[str, Any]):
+        """ส่งเหตุการณ์ให้ตัวกระจายงานตามผู้ใช้และระดับความสำคัญ"""
+        key = self.key_func(event)
+        if self.priority_func is None:
+            return self.dispatcher.submit(key, self.process, entry_id, event)
+        return self.dispatcher.submit_with_priority(key, self.priority_func(event), self.process, entry_id, event)
+
+def event_user_id(event: Dict[str, Any]) -> Hashable:
+    """ดึงคีย์ลำดับจากเหตุการณ์ดิบ (userId, groupId หรือ roomId)"""
+    source = event.get('source') or {}
+    return source.get('userId') or source.get('groupId') or source.get('roomId') or ''
+
+def start_worker_pool(queue: EventQueue,
+                      handle_event: Callable[[Dict[str, Any]], None],
+                      num_workers: int,
+                      stop_event: threading.Event,
+                      dispatcher=None,
+                      priority_func: Optional[Callable[[Dict[str, Any]], str]] = None,
+                      max_in_flight: Optional[int] = None) -> List[threading.Thread]:
+    """
+    เริ่มกลุ่ม worker แบบเธรดในโปรเซสปัจจุบัน
+
+    Args:
+        queue (EventQueue): คิวเหตุการณ์
+        handle_event (Callable): ฟังก์ชันประมวลผลเหตุการณ์
+        num_workers (int): จำนวน worker ที่อ่านจากคิว
+        stop_event (threading.Event): สัญญาณหยุดการทำงาน
+        dispatcher (UserOrderedDispatcher, optional): ตัวกระจายงานที่ worker ใช้ร่วมกัน
+        priority_func (Callable, optional): ฟังก์ชันจัดระดับความสำคัญของเหตุการณ์
+        max_in_flight (int, optional): จำนวนรายการที่ยังไม่เสร็จสูงสุดต่อ worker
+
+    Returns:
+        List[threading.Thread]: เธรดของ worker ที่เริ่มแล้ว
+    """
+    queue.ensure_group()
+    prefix = f"{socket.gethostname()}-{os.getpid()}"
+    threads = []
+    for i in range(num_workers):
+        worker = EventWorker(queue, handle_event, name=f"{prefix}-{i}", dispatcher=dispatcher,
+                             priority_func=priority_func, max_in_flight=max_in_flight)
+        thread = threading.Thread(target=worker.run, args=(stop_event,), name=f"event-worker-{i}", daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
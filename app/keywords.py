@@ -0,0 +1,196 @@
+"""
+ทะเบียนคำสำคัญและตัวค้นหาหลายคำแบบ Aho-Corasick สำหรับแชทบอท 'ใจดี'
+คำสำคัญทุกคำอยู่ในทะเบียนเดียวพร้อมหมวดหมู่และน้ำหนัก (ระดับความเสี่ยง, คะแนนความสำคัญ, ประวัติสำคัญ)
+และค้นหาเพียงครั้งเดียวเพื่อให้ได้ผลของ assess_risk, calculate_message_priority
+และการตรวจความสำคัญของ ChatHistoryDB พร้อมกัน
+
+ใช้ automaton ของ pyahocorasick (อ่านข้อความรอบเดียวใน C) ถ้าติดตั้งไว้
+ถ้าไม่มีจะค้นหาทีละคำในทะเบียนด้วย `in` ซึ่งเร็วกว่า automaton ที่เขียนด้วย Python ล้วน
+"""
+import string
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# คะแนนความสำคัญเริ่มต้นและสูงสุดของข้อความ (calculate_message_priority)
+BASE_PRIORITY = 5
+MAX_PRIORITY = 10
+
+# อักขระที่ถือว่าเป็นส่วนหนึ่งของคำภาษาอังกฤษ (ภาษาไทยไม่มีช่องว่างระหว่างคำ จึงไม่ใช้ขอบเขตคำ)
+_WORD_CHARS = frozenset(string.ascii_lowercase + string.digits)
+
+@dataclass(frozen=True)
+class Keyword:
+    """คำสำคัญหนึ่งคำในทะเบียน"""
+    text: str
+    # ระดับความเสี่ยงที่คำนี้บ่งชี้ ('high', 'medium' หรือ None)
+    risk: Optional[str] = None
+    # คะแนนที่เพิ่มให้ความสำคัญของข้อความเมื่อพบคำนี้
+    priority: int = 0
+    # การสนทนาที่มีคำนี้ถูกบันทึกเป็นประวัติสำคัญ
+    important: bool = False
+    # ต้องไม่ติดกับตัวอักษรหรือตัวเลขภาษาอังกฤษ (เช่น 'od' ต้องไม่ตรงกับ 'good')
+    word_boundary: bool = False
+
+def _high(text, **kwargs):
+    return Keyword(text, risk='high', priority=3, important=True, **kwargs)
+
+def _medium(text, **kwargs):
+    return Keyword(text, risk='medium', priority=1, important=True, **kwargs)
+
+# ทะเบียนคำสำคัญ: คำเสี่ยงสูงมีคะแนน +3 และคำเสี่ยงปานกลางมีคะแนน +1 เสมอ และทั้งสองกลุ่มเป็นประวัติสำคัญ
+KEYWORDS = [
+    # ความเสี่ยงสูง
+    _high('ฆ่าตัวตาย'),
+    _high('ทำร้ายตัวเอง'),
+    _high('อยากตาย'),
+    _high('ไม่อยากมีชีวิตอยู่'),
+    _high('เกินขนาด'),
+    _high('overdose'),
+    _high('od', word_boundary=True),
+    _high('เลือดออก'),
+    _high('ชัก'),
+    _high('หมดสติ'),
+    _high('หายใจไม่ออก'),
+    _high('โคม่า'),
+    # ความเสี่ยงปานกลาง
+    _medium('นอนไม่หลับ'),
+    _medium('เครียด'),
+    _medium('กังวล'),
+    _medium('ซึมเศร้า'),
+    _medium('เหงา'),
+    _medium('ท้อแท้'),
+    # ความเร่งด่วนที่ไม่ใช่ความเสี่ยงโดยตรง
+    Keyword('ฉุกเฉิน', priority=3),
+    Keyword('ช่วยด่วน', priority=3),
+    # ความอยากและการกลับไปใช้ซ้ำ
+    Keyword('เสพติด', priority=1, important=True),
+    Keyword('กลับไปเสพ', priority=1, important=True),
+    Keyword('อยากเสพ', priority=1, important=True),
+    Keyword('cravings', priority=1, important=True),
+    Keyword('ทรมาน', priority=1, important=True),
+    # เนื้อหาที่ควรเก็บเป็นประวัติสำคัญ
+    Keyword('ก้าวร้าว', important=True),
+    Keyword('ความทรงจำ', important=True),
+    Keyword('ไม่มีความสุข', important=True),
+    Keyword('เลิก', important=True),
+    Keyword('หยุด', important=True),
+    Keyword('อดทน', important=True),
+]
+
+@dataclass
+class KeywordScan:
+    """ผลการค้นหาคำสำคัญในข้อความหนึ่งข้อความ"""
+    # คำที่พบทั้งหมดตามลำดับในทะเบียน
+    matches: List[str] = field(default_factory=list)
+    risk_level: str = 'low'
+    # คำที่กำหนดระดับความเสี่ยง (เฉพาะกลุ่มที่สูงที่สุดที่พบ)
+    risk_keywords: List[str] = field(default_factory=list)
+    priority: int = BASE_PRIORITY
+    important: bool = False
+
+class KeywordMatcher:
+    """
+    ตัวค้นหาคำสำคัญหลายคำพร้อมกัน (Aho-Corasick เมื่อมี pyahocorasick)
+    """
+    def __init__(self, keywords: Iterable[Keyword], use_automaton: bool = True):
+        """
+        สร้าง automaton จากทะเบียนคำสำคัญ
+
+        Args:
+            keywords (Iterable[Keyword]): ทะเบียนคำสำคัญ (ไม่สนตัวพิมพ์เล็กใหญ่)
+            use_automaton (bool): False = ค้นหาทีละคำเสมอ (ใช้เปรียบเทียบในการวัดผล)
+
+        Raises:
+            ValueError: ถ้ามีคำว่างหรือคำซ้ำ
+        """
+        self.keywords = list(keywords)
+        self._patterns = [keyword.text.lower() for keyword in self.keywords]
+        if not all(self._patterns):
+            raise ValueError("keyword must not be empty")
+        if len(set(self._patterns)) != len(self._patterns):
+            raise ValueError("duplicate keyword in registry")
+
+        self._automaton = None
+        if use_automaton and ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for index, pattern in enumerate(self._patterns):
+                self._automaton.add_word(pattern, index)
+            self._automaton.make_automaton()
+        self.backend = 'aho-corasick' if self._automaton is not None else 'substring'
+
+    def find(self, text: str) -> List[int]:
+        """
+        หาคำสำคัญทั้งหมดที่อยู่ในข้อความ (รวมคำที่ทับซ้อนกัน)
+
+        Returns:
+            List[int]: ลำดับของคำที่พบในทะเบียน เรียงจากน้อยไปมาก
+        """
+        text = text.lower()
+        if self._automaton is None:
+            return [index for index, pattern in enumerate(self._patterns)
+                    if pattern in text and self._occurs(text, index)]
+        found = set()
+        for end, index in self._automaton.iter(text):
+            if index not in found and self._bounded(text, end - len(self._patterns[index]) + 1, index):
+                found.add(index)
+        return sorted(found)
+
+    def _occurs(self, text: str, index: int) -> bool:
+        """มีตำแหน่งของคำที่ผ่านเงื่อนไขขอบเขตคำอย่างน้อยหนึ่งตำแหน่ง (ใช้เมื่อไม่มี automaton)"""
+        if not self.keywords[index].word_boundary:
+            return True
+        start = text.find(self._patterns[index])
+        while start != -1:
+            if self._bounded(text, start, index):
+                return True
+            start = text.find(self._patterns[index], start + 1)
+        return False
+
+    def _bounded(self, text: str, start: int, index: int) -> bool:
+        """ตรวจขอบเขตคำ (อักขระก่อนและหลังต้องไม่ใช่ตัวอักษรหรือตัวเลขภาษาอังกฤษ)"""
+        if not self.keywords[index].word_boundary:
+            return True
+        end = start + len(self._patterns[index])
+        if start > 0 and text[start - 1] in _WORD_CHARS:
+            return False
+        return end >= len(text) or text[end] not in _WORD_CHARS
+
+    def scan(self, text: str) -> KeywordScan:
+        """
+        ค้นหาคำสำคัญแล้วสรุประดับความเสี่ยง คะแนนความสำคัญ และความเป็นประวัติสำคัญในครั้งเดียว
+
+        Args:
+            text (str): ข้อความที่ต้องการตรวจ
+
+        Returns:
+            KeywordScan: ผลการค้นหา
+        """
+        if not text:
+            return KeywordScan()
+        matches = []
+        risk = {'high': [], 'medium': []}
+        priority = BASE_PRIORITY
+        important = False
+        for index in self.find(text):
+            keyword = self.keywords[index]
+            matches.append(keyword.text)
+            if keyword.risk:
+                risk[keyword.risk].append(keyword.text)
+            priority += keyword.priority
+            important = important or keyword.important
+        risk_level = 'high' if risk['high'] else 'medium' if risk['medium'] else 'low'
+        return KeywordScan(
+            matches=matches,
+            risk_level=risk_level,
+            risk_keywords=risk.get(risk_level, []),
+            priority=min(priority, MAX_PRIORITY),
+            important=important
+        )
+
+# ตัวค้นหาที่ใช้ร่วมกันทั้งแอป (สร้างครั้งเดียวตอนนำเข้าโมดูล)
+keyword_matcher = KeywordMatcher(KEYWORDS)
@@ -0,0 +1,259 @@
+"""
+โมดูลไคลเอนต์ LINE Messaging API สำหรับแชทบอท 'ใจดี'
+ใช้การเชื่อมต่อแบบ keep-alive ร่วมกัน (ไม่ต้องเปิด TLS ใหม่ทุกข้อความ) กำหนดเวลารอที่เข้มงวด
+และคืนข้อมูลเวลาที่ใช้ของทุกคำขอ รองรับทั้งโค้ดซิงโครนัส (WSGI) และอะซิงโครนัส (ASGI)
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Union
+
+import httpx
+
+from .metrics import metrics
+from .streaming import LINE_MAX_MESSAGES_PER_REQUEST
+
+LINE_API_BASE_URL = "https://api.line.me"
+
+class LineResult:
+    """
+    ผลลัพธ์ของคำขอ LINE API หนึ่งครั้ง (ใช้เป็น bool ได้: True เมื่อสำเร็จ)
+    """
+    __slots__ = ("endpoint", "ok", "status_code", "elapsed", "error", "data")
+
+    def __init__(self, endpoint: str, ok: bool, status_code: Optional[int], elapsed: float,
+                 error: Optional[str] = None, data: Optional[Dict[str, Any]] = None):
+        self.endpoint = endpoint
+        self.ok = ok
+        self.status_code = status_code
+        self.elapsed = elapsed
+        self.error = error
+        self.data = data
+
+    def __bool__(self) -> bool:
+        return self.ok
+
+    def __repr__(self) -> str:
+        return (f"LineResult(endpoint={self.endpoint!r}, ok={self.ok}, status_code={self.status_code}, "
+                f"elapsed={self.elapsed:.3f}, error={self.error!r})")
+
+    def as_dict(self) -> Dict[str, Any]:
+        """แปลงผลลัพธ์เป็น dict สำหรับบันทึกหรือแสดงผล"""
+        return {
+            "endpoint": self.endpoint,
+            "ok": self.ok,
+            "status_code": self.status_code,
+            "elapsed_ms": round(self.elapsed * 1000, 1),
+            "error": self.error
+        }
+
+def _text_messages(texts: Union[str, List[str]]) -> List[Dict[str, str]]:
+    """แปลงข้อความเป็นรูปแบบข้อความของ LINE (สูงสุด 5 ข้อความต่อคำขอ)"""
+    if isinstance(texts, str):
+        texts = [texts]
+    if len(texts) > LINE_MAX_MESSAGES_PER_REQUEST:
+        raise ValueError(f"LINE accepts at most {LINE_MAX_MESSAGES_PER_REQUEST} messages per request")
+    return [{"type": "text", "text": text} for text in texts]
+
+def _timeout(timeout: float, connect_timeout: float) -> httpx.Timeout:
+    """สร้างการตั้งค่าเวลารอ (การเชื่อมต่อสั้นกว่าการอ่าน)"""
+    return httpx.Timeout(timeout, connect=connect_timeout)
+
+def _limits(pool_size: int) -> httpx.Limits:
+    """สร้างขีดจำกัดของ connection pool"""
+    return httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=300.0
+    )
+
+def _finish(endpoint: str, start_time: float, response: Optional[httpx.Response] = None,
+            error: Optional[Exception] = None) -> LineResult:
+    """สร้างผลลัพธ์ของคำขอ บันทึกตัวชี้วัด และบันทึก log เมื่อล้มเหลว"""
+    elapsed = time.monotonic() - start_time
+    labels = {'endpoint': endpoint}
+    metrics.observe('line_api_seconds', elapsed, labels=labels)
+
+    if error is not None:
+        metrics.inc('line_api_errors_total', labels=labels)
+        logging.error(f"LINE API {endpoint} ล้มเหลว: {str(error)}")
+        return LineResult(endpoint, False, None, elapsed, error=str(error))
+
+    ok = response.status_code in (200, 202)
+    data = None
+    if ok:
+        try:
+            data = response.json() if response.content else {}
+        except ValueError:
+            data = {}
+    else:
+        metrics.inc('line_api_errors_total', labels=labels)
+        logging.error(f"LINE API {endpoint} ตอบกลับ {response.status_code}: {response.text}")
+    return LineResult(endpoint, ok, response.status_code, elapsed,
+                      error=None if ok else response.text, data=data)
+
+class LineClient:
+    """
+    ไคลเอนต์ LINE Messaging API แบบซิงโครนัส ใช้ connection pool ร่วมกันระหว่างเธรด
+    """
+    def __init__(self,
+                 access_token: str,
+                 timeout: float = 10.0,
+                 connect_timeout: float = 3.0,
+                 pool_size: int = 20,
+                 background_workers: int = 4):
+        """
+        สร้างไคลเอนต์ LINE
+
+        Args:
+            access_token (str): Channel access token
+            timeout (float): เวลารอสูงสุดต่อคำขอ (วินาที)
+            connect_timeout (float): เวลารอสูงสุดในการเชื่อมต่อ (วินาที)
+            pool_size (int): จำนวนการเชื่อมต่อ keep-alive สูงสุด
+            background_workers (int): จำนวนเธรดสำหรับคำขอแบบไม่รอผล (fire-and-forget)
+        """
+        self.client = httpx.Client(
+            base_url=LINE_API_BASE_URL,
+            timeout=_timeout(timeout, connect_timeout),
+            limits=_limits(pool_size),
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
+        self._background = ThreadPoolExecutor(max_workers=background_workers, thread_name_prefix='line')
+
+    def _request(self, endpoint: str, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> LineResult:
+        """ส่งคำขอหนึ่งครั้งและคืนผลลัพธ์พร้อมเวลาที่ใช้ (ไม่โยนข้อผิดพลาด)"""
+        start_time = time.monotonic()
+        try:
+            response = self.client.request(method, path, json=payload)
+        except httpx.HTTPError as e:
+            return _finish(endpoint, start_time, error=e)
+        return _finish(endpoint, start_time, response)
+
+    def push_message(self, to: str, texts: Union[str, List[str]]) -> LineResult:
+        """
+        ส่งข้อความแบบ push (นับโควตารายเดือน)
+
+        Args:
+            to (str): LINE user ID
+            texts (str | List[str]): ข้อความหนึ่งข้อความหรือลิสต์ (สูงสุด 5)
+
+        Returns:
+            LineResult: ผลลัพธ์พร้อมเวลาที่ใช้
+        """
+        return self._request('push', 'POST', '/v2/bot/message/push',
+                             {"to": to, "messages": _text_messages(texts)})
+
+    def reply_message(self, reply_token: str, texts: Union[str, List[str]]) -> LineResult:
+        """
+        ตอบกลับด้วย reply token (ไม่นับโควตา ใช้ได้ครั้งเดียวภายในเวลาจำกัด)
+
+        Args:
+            reply_token (str): reply token จากเหตุการณ์
+            texts (str | List[str]): ข้อความหนึ่งข้อความหรือลิสต์ (สูงสุด 5)
+
+        Returns:
+            LineResult: ผลลัพธ์พร้อมเวลาที่ใช้
+        """
+        return self._request('reply', 'POST', '/v2/bot/message/reply',
+                             {"replyToken": reply_token, "messages": _text_messages(texts)})
+
+    def start_loading(self, chat_id: str, seconds: int = 60) -> LineResult:
+        """
+        แสดงภาพเคลื่อนไหวการโหลดในแชท
+
+        Args:
+            chat_id (str): LINE user ID
+            seconds (int): ระยะเวลา (5-60 วินาที เป็นจำนวนเท่าของ 5)
+
+        Returns:
+            LineResult: ผลลัพธ์พร้อมเวลาที่ใช้
+        """
+        return self._request('loading', 'POST', '/v2/bot/chat/loading/start',
+                             {"chatId": chat_id, "loadingSeconds": seconds})
+
+    def start_loading_background(self, chat_id: str, seconds: int = 60) -> Future:
+        """
+        แสดงภาพเคลื่อนไหวการโหลดโดยไม่รอผล (ไม่อยู่บนเส้นทางหลักของการตอบกลับ)
+
+        Returns:
+            Future: ผลลัพธ์ (LineResult) เมื่อคำขอเสร็จ
+        """
+        return self._background.submit(self.start_loading, chat_id, seconds)
+
+    def get_bot_info(self) -> LineResult:
+        """ดึงข้อมูลบอท (ใช้ตรวจสอบสุขภาพ) ข้อมูลอยู่ใน LineResult.data"""
+        return self._request('bot_info', 'GET', '/v2/bot/info')
+
+    def close(self):
+        """ปิดการเชื่อมต่อทั้งหมด"""
+        self._background.shutdown(wait=False)
+        self.client.close()
+
+class AsyncLineClient:
+    """
+    ไคลเอนต์ LINE Messaging API แบบอะซิงโครนัส (ผูกกับ event loop ที่สร้าง)
+    """
+    def __init__(self,
+                 access_token: str,
+                 timeout: float = 10.0,
+                 connect_timeout: float = 3.0,
+                 pool_size: int = 100):
+        """
+        สร้างไคลเอนต์ LINE แบบอะซิงโครนัส
+
+        Args:
+            access_token (str): Channel access token
+            timeout (float): เวลารอสูงสุดต่อคำขอ (วินาที)
+            connect_timeout (float): เวลารอสูงสุดในการเชื่อมต่อ (วินาที)
+            pool_size (int): จำนวนการเชื่อมต่อ keep-alive สูงสุด
+        """
+        self.client = httpx.AsyncClient(
+            base_url=LINE_API_BASE_URL,
+            timeout=_timeout(timeout, connect_timeout),
+            limits=_limits(pool_size),
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
+        self._background = set()
+
+    async def _request(self, endpoint: str, method: str, path: str,
+                       payload: Optional[Dict[str, Any]] = None) -> LineResult:
+        """ส่งคำขอหนึ่งครั้งและคืนผลลัพธ์พร้อมเวลาที่ใช้ (ไม่โยนข้อผิดพลาด)"""
+        start_time = time.monotonic()
+        try:
+            response = await self.client.request(method, path, json=payload)
+        except httpx.HTTPError as e:
+            return _finish(endpoint, start_time, error=e)
+        return _finish(endpoint, start_time, response)
+
+    async def push_message(self, to: str, texts: Union[str, List[str]]) -> LineResult:
+        """ส่งข้อความแบบ push (ดู LineClient.push_message)"""
+        return await self._request('push', 'POST', '/v2/bot/message/push',
+                                   {"to": to, "messages": _text_messages(texts)})
+
+    async def reply_message(self, reply_token: str, texts: Union[str, List[str]]) -> LineResult:
+        """ตอบกลับด้วย reply token (ดู LineClient.reply_message)"""
+        return await self._request('reply', 'POST', '/v2/bot/message/reply',
+                                   {"replyToken": reply_token, "messages": _text_messages(texts)})
+
+    async def start_loading(self, chat_id: str, seconds: int = 60) -> LineResult:
+        """แสดงภาพเคลื่อนไหวการโหลดในแชท (ดู LineClient.start_loading)"""
+        return await self._request('loading', 'POST', '/v2/bot/chat/loading/start',
+                                   {"chatId": chat_id, "loadingSeconds": seconds})
+
+    def start_loading_background(self, chat_id: str, seconds: int = 60) -> asyncio.Task:
+        """แสดงภาพเคลื่อนไหวการโหลดโดยไม่รอผล (ต้องเรียกจากภายใน event loop)"""
+        task = asyncio.get_running_loop().create_task(self.start_loading(chat_id, seconds))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def get_bot_info(self) -> LineResult:
+        """ดึงข้อมูลบอท (ใช้ตรวจสอบสุขภาพ)"""
+        return await self._request('bot_info', 'GET', '/v2/bot/info')
+
+    async def close(self):
+        """รอคำขอเบื้องหลังที่ค้างอยู่ แล้วปิดการเชื่อมต่อทั้งหมด"""
+        if self._background:
+            await asyncio.wait(self._background, timeout=5)
+        await self.client.aclose()
@@ -0,0 +1,146 @@
+"""
+โมดูลเก็บตัวชี้วัด (metrics) ภายในโปรเซสสำหรับแชทบอท 'ใจดี'
+รวบรวมตัวนับ เกจ และค่าสถิติของเวลา เพื่อแสดงผลผ่าน endpoint /metrics
+"""
+import threading
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+# จำนวนตัวอย่างสูงสุดที่เก็บไว้สำหรับคำนวณเปอร์เซ็นไทล์
+RESERVOIR_SIZE = 1024
+
+def _metric_key(name: str, labels: Optional[Dict[str, Any]]) -> Tuple[str, Tuple]:
+    """สร้างคีย์ของตัวชี้วัดจากชื่อและป้ายกำกับ"""
+    if not labels:
+        return name, ()
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _format_key(key: Tuple[str, Tuple]) -> str:
+    """แปลงคีย์ของตัวชี้วัดเป็นสตริงในรูปแบบ name{k=v}"""
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+def _percentile(sorted_values, fraction: float) -> float:
+    """คำนวณเปอร์เซ็นไทล์จากลิสต์ที่เรียงแล้ว"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+class MetricsRegistry:
+    """
+    ที่เก็บตัวชี้วัดแบบปลอดภัยต่อเธรด
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._observations = {}
+
+    def inc(self, name: str, value: float = 1, labels: Optional[Dict[str, Any]] = None):
+        """
+        เพิ่มค่าตัวนับ
+
+        Args:
+            name (str): ชื่อตัวชี้วัด
+            value (float): ค่าที่ต้องการเพิ่ม
+            labels (Dict[str, Any], optional): ป้ายกำกับของตัวชี้วัด
+        """
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, labels: Optional[Dict[str, Any]] = None):
+        """
+        ตั้งค่าเกจเป็นค่าปัจจุบัน
+
+        Args:
+            name (str): ชื่อตัวชี้วัด
+            value (float): ค่าปัจจุบัน
+            labels (Dict[str, Any], optional): ป้ายกำกับของตัวชี้วัด
+        """
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, Any]] = None):
+        """
+        บันทึกค่าที่สังเกตได้ (เช่น เวลาแฝง) เพื่อคำนวณสถิติ
+
+        Args:
+            name (str): ชื่อตัวชี้วัด
+            value (float): ค่าที่สังเกตได้
+            labels (Dict[str, Any], optional): ป้ายกำกับของตัวชี้วัด
+        """
+        key = _metric_key(name, labels)
+        with self._lock:
+            entry = self._observations.get(key)
+            if entry is None:
+                entry = {"count": 0, "sum": 0.0, "max": value, "samples": deque(maxlen=RESERVOIR_SIZE)}
+                self._observations[key] = entry
+            entry["count"] += 1
+            entry["sum"] += value
+            entry["max"] = max(entry["max"], value)
+            entry["samples"].append(value)
+
+    def get_counter(self, name: str, labels: Optional[Dict[str, Any]] = None) -> float:
+        """ดึงค่าตัวนับปัจจุบัน"""
+        with self._lock:
+            return self._counters.get(_metric_key(name, labels), 0)
+
+    def get_gauge(self, name: str, labels: Optional[Dict[str, Any]] = None) -> Optional[float]:
+        """ดึงค่าเกจปัจจุบัน"""
+        with self._lock:
+            return self._gauges.get(_metric_key(name, labels))
+
+    def get_percentile(self, name: str, fraction: float, labels: Optional[Dict[str, Any]] = None) -> Optional[float]:
+        """
+        ดึงเปอร์เซ็นไทล์ของค่าที่สังเกตได้
+
+        Args:
+            name (str): ชื่อตัวชี้วัด
+            fraction (float): เปอร์เซ็นไทล์ในช่วง 0-1 เช่น 0.95
+            labels (Dict[str, Any], optional): ป้ายกำกับของตัวชี้วัด
+
+        Returns:
+            Optional[float]: ค่าเปอร์เซ็นไทล์ หรือ None ถ้ายังไม่มีข้อมูล
+        """
+        with self._lock:
+            entry = self._observations.get(_metric_key(name, labels))
+            if not entry or not entry["samples"]:
+                return None
+            samples = sorted(entry["samples"])
+        return _percentile(samples, fraction)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        สร้างสแนปช็อตของตัวชี้วัดทั้งหมด
+
+        Returns:
+            Dict[str, Any]: ตัวนับ เกจ และสถิติของค่าที่สังเกตได้
+        """
+        with self._lock:
+            counters = {_format_key(k): v for k, v in self._counters.items()}
+            gauges = {_format_key(k): v for k, v in self._gauges.items()}
+            observations = {
+                _format_key(k): (v["count"], v["sum"], v["max"], sorted(v["samples"]))
+                for k, v in self._observations.items()
+            }
+
+        summaries = {}
+        for name, (count, total, maximum, samples) in observations.items():
+            summaries[name] = {
+                "count": count,
+                "avg": round(total / count, 4) if count else 0.0,
+                "p50": round(_percentile(samples, 0.50), 4),
+                "p95": round(_percentile(samples, 0.95), 4),
+                "p99": round(_percentile(samples, 0.99), 4),
+                "max": round(maximum, 4)
+            }
+
+        return {"counters": counters, "gauges": gauges, "summaries": summaries}
+
+# ตัวชี้วัดที่ใช้ร่วมกันทั้งโปรเซส
+metrics = MetricsRegistry()
@@ -0,0 +1,394 @@
+"""
+ส่วนประกอบที่ใช้ร่วมกันระหว่างโหมด WSGI (app_deepseek.py) และ ASGI (asgi_app.py)
+รวมค่าคงที่ของแอป ข้อความที่ส่งถึงผู้ใช้ ฟังก์ชันที่ไม่ขึ้นกับการเชื่อมต่อ และฟังก์ชันสร้างส่วนประกอบจากคอนฟิก
+
+การนำเข้าโมดูลนี้ไม่สร้างการเชื่อมต่อหรือเธรด แต่ละโหมดสร้างส่วนประกอบของตัวเองตอนเริ่มต้น
+"""
+import logging
+import math
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from .call_policy import CallPolicy, CircuitBreaker
+from .chat_history_db import ChatHistoryDB
+from .concurrency import AdaptiveLimiter
+from .config import (
+    SYSTEM_MESSAGES, SUMMARY_GENERATION_CONFIG, DISPATCHER_CONFIG, SUMMARY_CONFIG, PROMPT_CONTEXT_CONFIG,
+    DEEPSEEK_POLICY_CONFIG, CONCURRENCY_CONFIG, LINE_CLIENT_CONFIG, USER_STATE_CONFIG, TOKEN_COUNTER_CONFIG
+)
+from .context_builder import PromptContextBuilder
+from .conversation_summary import RollingSummarizer
+from .database_init import initialize_database
+from .keywords import keyword_matcher
+from .token_counter import TokenCounter
+from .user_state import create_user_state_store
+
+# ค่าคงที่ส่วนของการแอพลิเคชัน
+FOLLOW_UP_INTERVALS = [1, 3, 7, 14, 30]  # จำนวนวันในการติดตาม
+FOLLOW_UP_CHECK_MINUTES = 30  # รอบการตรวจสอบการติดตามที่ถึงกำหนด (นาที)
+SESSION_TIMEOUT = 604800  # 7 วัน (7 * 24 * 60 * 60 วินาที)
+SESSION_TTL = 3600 * 24  # เซสชันการแชทหมดอายุหลังจาก 24 ชั่วโมง
+TIMEOUT_WARNING_TTL = 86400  # แจ้งเตือน 1 วันก่อนเซสชันหมดอายุ และไม่แจ้งซ้ำภายใน 1 วัน
+# จำนวนการเรียก LINE แบบรอผลสูงสุดในหนึ่งรอบการประมวลผล (แจ้งเตือนเซสชัน, แจ้งเตือนฉุกเฉิน, คำตอบ)
+LINE_CALLS_PER_MESSAGE = 3
+# ระยะเวลาล็อค (วินาที): ครอบคลุมการเตรียมข้อมูล งบประมาณเวลาของ DeepSeek และการเรียก LINE ในรอบเดียว
+MESSAGE_LOCK_TIMEOUT = math.ceil(
+    DISPATCHER_CONFIG['prepare_timeout']
+    + DEEPSEEK_POLICY_CONFIG['deadline']
+    + LINE_CALLS_PER_MESSAGE * (LINE_CLIENT_CONFIG['connect_timeout'] + LINE_CLIENT_CONFIG['timeout'])
+) + 10
+PENDING_MESSAGE_TTL = 300  # ระยะเวลาเก็บข้อความที่เข้ามาระหว่างล็อค (วินาที)
+MAX_PENDING_MESSAGES = 20  # จำนวนข้อความสูงสุดที่พักไว้ต่อผู้ใช้
+
+# ข้อความแจ้งเตือนที่ใช้ร่วมกันระหว่างโหมด WSGI และ ASGI
+TIMEOUT_WARNING_MESSAGE = (
+    "⚠️ เซสชันของคุณจะหมดอายุในอีก 1 วัน\n"
+    "หากต้องการคุยต่อ กรุณาพิมพ์ข้อความใดๆ เพื่อต่ออายุเซสชัน"
+)
+SESSION_TIMEOUT_MESSAGE = (
+    "สวัสดีค่ะ ยินดีต้อนรับกลับมา 👋\n\n"
+    "เซสชันก่อนหน้าของเราหมดอายุแล้ว เราสามารถเริ่มการสนทนาใหม่ได้ทันที\n\n"
+    "💡 ต้องการดูประวัติการสนทนาก่อนหน้า พิมพ์: /status\n"
+    "💡 ต้องการดูรายงานความก้าวหน้า พิมพ์: /progress\n"
+    "💡 ต้องการคำแนะนำเพิ่มเติม พิมพ์: /help\n\n"
+    "คุณต้องการพูดคุยเกี่ยวกับเรื่องอะไรดีคะวันนี้?"
+)
+EMERGENCY_MESSAGE = (
+    "⚠️ น้องใจดีกังวลว่าคุณอาจกำลังเผชิญกับภาวะเสี่ยง\n\n"
+    "ขอแนะนำให้ติดต่อผู้เชี่ยวชาญเพื่อรับความช่วยเหลือโดยเร็วที่สุด:\n"
+    "📞 สายด่วนสุขภาพจิต: 1323\n"
+    "📞 สายด่วนยาเสพติด: 1165\n"
+    "📞 หน่วยกู้ชีพฉุกเฉิน: 1669\n\n"
+    "คุณไม่จำเป็นต้องเผชิญกับสิ่งนี้เพียงลำพัง การขอความช่วยเหลือคือความกล้าหาญ"
+)
+WAIT_NOTICE_MESSAGE = "ได้รับข้อความแล้วค่ะ น้องใจดีจะตอบรวมกันหลังตอบข้อความก่อนหน้าเสร็จนะคะ"
+ERROR_MESSAGE = "ขออภัยค่ะ เกิดข้อผิดพลาดในการประมวลผล"
+HOLDING_MESSAGE = (
+    "ขออภัยค่ะ ตอนนี้น้องใจดีมีผู้ใช้งานจำนวนมากและตอบช้ากว่าปกติ "
+    "รบกวนส่งข้อความมาอีกครั้งในอีกสักครู่นะคะ 🙏"
+)
+FOLLOW_UP_MESSAGE = (
+    "สวัสดีค่ะ ใจดีมาติดตามผลการเลิกใช้สารเสพติดของคุณ\n"
+    "คุณสามารถเล่าให้ฟังได้ว่าช่วงที่ผ่านมาเป็นอย่างไรบ้าง?"
+)
+
+# ข้อความตอบกลับของคำสั่ง
+RESET_MESSAGE = (
+    "🔄 ล้างประวัติการสนทนาเรียบร้อยแล้วค่ะ\n\n"
+    "เราสามารถเริ่มต้นการสนทนาใหม่ได้ทันที\n"
+    "คุณต้องการพูดคุยเกี่ยวกับเรื่องอะไรดีคะ?"
+)
+HELP_MESSAGE = (
+    "สวัสดีค่ะ 👋 ฉันคือน้องใจดี ผู้ช่วยดูแลและให้คำปรึกษาสำหรับผู้ที่ต้องการเลิกใช้สารเสพติด\n\n"
+    "💬 ฉันสามารถช่วยคุณได้ดังนี้:\n"
+    "- พูดคุยและให้กำลังใจในการเลิกใช้สารเสพติด\n"
+    "- ให้ข้อมูลเกี่ยวกับผลกระทบของสารเสพติดต่อร่างกายและจิตใจ\n"
+    "- แนะนำเทคนิคจัดการความอยากและความเครียด\n"
+    "- เชื่อมต่อกับบริการช่วยเหลือในกรณีฉุกเฉิน\n\n"
+    "📋 คำสั่งที่ใช้ได้:\n"
+    "📊 /status - ดูสถิติการใช้งานและข้อมูลเซสชัน\n"
+    "📈 /progress - ดูรายงานความก้าวหน้าของคุณ\n"
+    "🚨 /emergency - ดูข้อมูลติดต่อฉุกเฉินและสายด่วน\n"
+    "📩 /feedback - ส่งความคิดเห็นเพื่อพัฒนาระบบ\n"
+    "❓ /help - แสดงเมนูช่วยเหลือนี้\n\n"
+    "💡 ตัวอย่างคำถามที่สามารถถามฉันได้:\n"
+    "- \"ช่วยประเมินการใช้สารเสพติดของฉันหน่อย\"\n"
+    "- \"ผลกระทบของยาบ้าต่อร่างกายมีอะไรบ้าง\"\n"
+    "- \"มีเทคนิคจัดการความอยากยาอย่างไร\"\n"
+    "- \"ฉันควรทำอย่างไรเมื่อรู้สึกอยากกลับไปใช้สารอีก\"\n\n"
+    "เริ่มพูดคุยกับฉันได้เลยนะคะ ฉันพร้อมรับฟังและช่วยเหลือคุณ 💚"
+)
+EMERGENCY_CONTACTS_MESSAGE = (
+    "🚨 บริการช่วยเหลือฉุกเฉิน 🚨\n\n"
+    "หากคุณหรือคนใกล้ตัวกำลังประสบปัญหาต่อไปนี้:\n"
+    "- ใช้สารเสพติดเกินขนาด (Overdose)\n"
+    "- มีอาการชัก เลือดออก หมดสติ\n"
+    "- มีความคิดทำร้ายตัวเอง\n"
+    "- มีอาการถอนยารุนแรง\n\n"
+    "📞 ติดต่อขอความช่วยเหลือด่วนได้ที่:\n"
+    "🔸 สายด่วนกรมควบคุมโรค: 1422\n"
+    "🔸 ศูนย์ปรึกษาปัญหายาเสพติด: 1165\n"
+    "🔸 หน่วยกู้ชีพฉุกเฉิน: 1669\n"
+    "🔸 สายด่วนสุขภาพจิต: 1323\n\n"
+    "🌐 เว็บไซต์ช่วยเหลือ:\n"
+    "https://www.pmnidat.go.th\n\n"
+    "💚 การขอความช่วยเหลือคือก้าวแรกของการดูแลตัวเอง"
+)
+FEEDBACK_MESSAGE = (
+    "🌟 ความคิดเห็นของคุณมีคุณค่าต่อการพัฒนา\n\n"
+    "น้องใจดีต้องการพัฒนาให้ดียิ่งขึ้นสำหรับทุกคน\n"
+    "โปรดแสดงความคิดเห็นผ่านแบบฟอร์มนี้:\n"
+    "https://forms.gle/7K2y21gomWHGcWpq9\n\n"
+    "🙏 ขอบคุณที่ช่วยพัฒนาน้องใจดีให้ดีขึ้น"
+)
+NO_PROGRESS_MESSAGE = (
+    "📊 รายงานความก้าวหน้า\n\n"
+    "ยังไม่มีข้อมูลความก้าวหน้าเพียงพอสำหรับการวิเคราะห์\n\n"
+    "เมื่อเราพูดคุยกันมากขึ้น น้องใจดีจะสามารถติดตามและวิเคราะห์ความก้าวหน้าของคุณได้"
+)
+UNKNOWN_COMMAND_MESSAGE = "คำสั่งไม่ถูกต้อง ลองพิมพ์ /help เพื่อดูคำสั่งทั้งหมด"
+
+# คำสั่งที่ตอบด้วยข้อความคงที่ (ไม่ต้องอ่านข้อมูลของผู้ใช้)
+STATIC_COMMAND_RESPONSES = {
+    '/help': HELP_MESSAGE,
+    '/emergency': EMERGENCY_CONTACTS_MESSAGE,
+    '/feedback': FEEDBACK_MESSAGE
+}
+
+# ฟังก์ชันที่ไม่ขึ้นกับการเชื่อมต่อ
+def assess_risk(message):
+    """ประเมินความเสี่ยงจากข้อความ (คำสำคัญจากทะเบียนใน keywords.py)"""
+    result = keyword_matcher.scan(message)
+    return result.risk_level, result.risk_keywords
+
+def progress_entry(risk_level, keywords):
+    """สร้างข้อมูลความก้าวหน้าของข้อความหนึ่งข้อความ (บันทึกพร้อมผลอื่นผ่าน user_state.save)"""
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'risk_level': risk_level,
+        'keywords': keywords
+    }
+
+def merge_pending_messages(pending):
+    """รวมข้อความต่อเนื่องเป็นรอบเดียว โดยแยกคำสั่งออกมาประมวลผลทีละคำสั่ง"""
+    turns = []
+    for message in pending:
+        if message.startswith('/') or not turns or turns[-1].startswith('/'):
+            turns.append(message)
+        else:
+            turns[-1] += "\n" + message
+    return turns
+
+def next_follow_up_time(interaction_date):
+    """คำนวณเวลาติดตามผลครั้งถัดไป (epoch วินาที) หรือ None ถ้าไม่มีกำหนดถัดไป"""
+    current_date = datetime.now()
+    for days in FOLLOW_UP_INTERVALS:
+        follow_up_date = interaction_date + timedelta(days=days)
+        if follow_up_date > current_date:
+            return follow_up_date.timestamp()
+    return None
+
+def needs_timeout_warning(state: Dict[str, Any], now: float) -> bool:
+    """
+    ตรวจสอบว่าต้องแจ้งเตือนเซสชันใกล้หมดอายุหรือไม่
+    (ผ่านไป 6 วันนับจากการใช้งานล่าสุด และยังไม่เคยส่งการแจ้งเตือน)
+
+    Args:
+        state (Dict[str, Any]): ผลลัพธ์ของ UserStateStore.prepare
+        now (float): เวลาปัจจุบัน (epoch วินาที)
+    """
+    last_activity = state['last_activity']
+    return bool(not state['timed_out'] and last_activity and not state['warning_sent']
+                and now - last_activity > (SESSION_TIMEOUT - TIMEOUT_WARNING_TTL))
+
+def format_progress_report(data: List[Dict[str, Any]]) -> str:
+    """
+    สร้างรายงานความก้าวหน้าจากข้อมูลความก้าวหน้า (ล่าสุดก่อน)
+
+    Args:
+        data (List[Dict[str, Any]]): ผลลัพธ์ของ UserStateStore.get_progress
+
+    Returns:
+        str: รายงานความก้าวหน้า
+    """
+    if not data:
+        return "ยังไม่มีข้อมูลความก้าวหน้า"
+
+    # วิเคราะห์แนวโน้มความเสี่ยง
+    risk_trends = {
+        'high': sum(1 for d in data if d['risk_level'] == 'high'),
+        'medium': sum(1 for d in data if d['risk_level'] == 'medium'),
+        'low': sum(1 for d in data if d['risk_level'] == 'low')
+    }
+
+    return (
+        "📊 รายงานความก้าวหน้า\n\n"
+        f"📅 ช่วงเวลา: {data[-1]['timestamp'][:10]} ถึง {data[0]['timestamp'][:10]}\n"
+        f"📈 การประเมินความเสี่ยง:\n"
+        f"▫️ ความเสี่ยงสูง: {risk_trends['high']} ครั้ง\n"
+        f"▫️ ความเสี่ยงปานกลาง: {risk_trends['medium']} ครั้ง\n"
+        f"▫️ ความเสี่ยงต่ำ: {risk_trends['low']} ครั้ง\n"
+    )
+
+def collect_status(db: ChatHistoryDB, token_counter: TokenCounter, user_id: str,
+                   session: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    รวบรวมสถิติของคำสั่ง /status จากฐานข้อมูลและเซสชันปัจจุบัน (เรียก MySQL แบบซิงโครนัส)
+
+    Args:
+        db (ChatHistoryDB): ฐานข้อมูลประวัติการแชท
+        token_counter (TokenCounter): ตัวนับโทเค็นสำหรับข้อความจากเซสชันรูปแบบเดิมที่ยังไม่มีจำนวน
+        user_id (str): LINE User ID
+        session (List[Dict[str, Any]]): เซสชันการแชทปัจจุบัน
+
+    Returns:
+        Dict[str, Any]: สถิติสำหรับ format_status
+    """
+    return {
+        'history_count': db.get_user_history_count(user_id),
+        'important_count': db.get_important_message_count(user_id),
+        'last_interaction': db.get_last_interaction(user_id),
+        'current_session': bool(session),
+        'total_tokens': db.get_total_tokens(user_id) or 0,
+        # คำนวณโทเค็นในเซสชันจากจำนวนที่เก็บไว้
+        'session_tokens': sum(
+            msg['tokens'] if msg.get('tokens') is not None else token_counter.count_tokens(msg['content'])
+            for msg in session
+            if msg['role'] in ['user', 'assistant']
+        )
+    }
+
+def format_status(status_data: Dict[str, Any]) -> str:
+    """สร้างข้อความตอบกลับของคำสั่ง /status จากผลลัพธ์ของ collect_status"""
+    return (
+        "📊 สถิติการสนทนาของคุณ\n"
+        f"▫️ จำนวนการสนทนาที่บันทึก: {status_data['history_count']} ครั้ง\n"
+        f"▫️ ประเด็นสำคัญที่พูดคุย: {status_data['important_count']} รายการ\n"
+        f"▫️ สนทนาล่าสุดเมื่อ: {status_data['last_interaction']}\n"
+        f"▫️ สถานะเซสชันปัจจุบัน: {'🟢 กำลังสนทนาอยู่' if status_data['current_session'] else '🔴 ยังไม่เริ่มสนทนา'}\n\n"
+        "💚 น้องใจดีพร้อมให้คำปรึกษาและสนับสนุนคุณตลอดเส้นทางการเลิกสารเสพติด\n"
+        "💬 มีคำถามหรือต้องการความช่วยเหลือ เพียงพิมพ์บอกฉันได้เลยค่ะ"
+    )
+
+def get_important_turns(db: ChatHistoryDB, context_builder: PromptContextBuilder, user_id: str,
+                        session: List[Dict[str, Any]]) -> List[tuple]:
+    """ดึงการสนทนาสำคัญที่เก่ากว่าเซสชันสำหรับเติมพรอมต์เมื่อเหลืองบประมาณ (เรียก MySQL แบบซิงโครนัส)"""
+    if PROMPT_CONTEXT_CONFIG['important_turns'] <= 0:
+        return []
+    return db.get_important_turns(
+        user_id,
+        session_turns=len(context_builder.split_turns(session)),
+        limit=PROMPT_CONTEXT_CONFIG['important_turns']
+    ) or []
+
+# ฟังก์ชันสร้างส่วนประกอบจากคอนฟิก
+def create_deepseek_limiter(redis_conn) -> Optional[AdaptiveLimiter]:
+    """
+    สร้างตัวจำกัดคำขอพร้อมกันแบบปรับตัวสำหรับไคลเอนต์ DeepSeek หนึ่งตัว (หนึ่ง event loop)
+
+    Args:
+        redis_conn: การเชื่อมต่อ Redis แบบซิงโครนัสสำหรับประสานระหว่างโปรเซส
+
+    Returns:
+        AdaptiveLimiter: ตัวจำกัด หรือ None ถ้าปิดการใช้งาน
+    """
+    if not CONCURRENCY_CONFIG['enabled']:
+        return None
+    return AdaptiveLimiter(
+        'deepseek',
+        initial_limit=CONCURRENCY_CONFIG['initial_limit'],
+        min_limit=CONCURRENCY_CONFIG['min_limit'],
+        max_limit=CONCURRENCY_CONFIG['max_limit'],
+        latency_target=CONCURRENCY_CONFIG['latency_target'],
+        queue_timeout=CONCURRENCY_CONFIG['queue_timeout'],
+        redis_client=redis_conn,
+        sync_interval=CONCURRENCY_CONFIG['sync_interval']
+    )
+
+def create_deepseek_policy() -> CallPolicy:
+    """สร้างนโยบายการเรียก DeepSeek (งบประมาณเวลา การลองใหม่ hedging และ circuit breaker ต่อโปรเซส)"""
+    return CallPolicy(
+        'deepseek',
+        breaker=CircuitBreaker(
+            'deepseek',
+            failure_threshold=DEEPSEEK_POLICY_CONFIG['breaker_failure_threshold'],
+            recovery_timeout=DEEPSEEK_POLICY_CONFIG['breaker_recovery_timeout']
+        ),
+        deadline=DEEPSEEK_POLICY_CONFIG['deadline'],
+        max_attempts=DEEPSEEK_POLICY_CONFIG['max_attempts'],
+        base_delay=DEEPSEEK_POLICY_CONFIG['base_delay'],
+        max_delay=DEEPSEEK_POLICY_CONFIG['max_delay'],
+        hedge=DEEPSEEK_POLICY_CONFIG['hedge'],
+        hedge_min_delay=DEEPSEEK_POLICY_CONFIG['hedge_min_delay'],
+        hedge_max_ratio=DEEPSEEK_POLICY_CONFIG['hedge_max_ratio']
+    )
+
+def create_token_counter() -> TokenCounter:
+    """สร้างตัวนับโทเค็นตาม TOKEN_COUNTER_CONFIG (ใช้ร่วมกับ ChatHistoryDB เพื่อใช้แคชเดียวกัน)"""
+    return TokenCounter(
+        cache_bytes=TOKEN_COUNTER_CONFIG['cache_bytes'],
+        batch_threads=TOKEN_COUNTER_CONFIG['batch_threads'],
+        encoding_cache_dir=TOKEN_COUNTER_CONFIG['cache_dir'],
+        offline=TOKEN_COUNTER_CONFIG['offline'],
+        mode=TOKEN_COUNTER_CONFIG['mode'],
+        estimator_file=TOKEN_COUNTER_CONFIG['estimator_file']
+    )
+
+def create_chat_history_db(config, token_counter: TokenCounter, pool_size: int = 10) -> ChatHistoryDB:
+    """
+    สร้าง MySQL pool ตรวจสอบและเริ่มต้นตาราง แล้วสร้างฐานข้อมูลประวัติการแชท
+
+    Args:
+        config (Config): การตั้งค่าแอปพลิเคชันจาก load_config
+        token_counter (TokenCounter): ตัวนับโทเค็นที่ใช้ร่วมกัน
+        pool_size (int): จำนวนการเชื่อมต่อใน pool
+
+    Returns:
+        ChatHistoryDB: ฐานข้อมูลประวัติการแชท
+    """
+    from mysql.connector import pooling
+    mysql_pool = pooling.MySQLConnectionPool(
+        pool_name="chat_pool",
+        pool_size=pool_size,
+        host=config.MYSQL_HOST,
+        user=config.MYSQL_USER,
+        password=config.MYSQL_PASSWORD,
+        database=config.MYSQL_DB,
+        port=config.MYSQL_PORT,
+        connect_timeout=10
+    )
+
+    # เริ่มต้นฐานข้อมูล (สร้างตารางถ้ายังไม่มี)
+    initialize_database(mysql_pool)
+    logging.info("เสร็จสิ้นการตรวจสอบและเริ่มต้นฐานข้อมูล")
+    return ChatHistoryDB(mysql_pool, token_counter=token_counter)
+
+def create_summarizer(db: ChatHistoryDB, redis_client, deepseek_client) -> RollingSummarizer:
+    """
+    สร้างตัวจัดการสรุปการสนทนาแบบสะสม
+
+    Args:
+        db (ChatHistoryDB): ฐานข้อมูลประวัติการแชท
+        redis_client: การเชื่อมต่อ Redis แบบซิงโครนัสสำหรับล็อคการปรับปรุง
+        deepseek_client (AsyncDeepseekClient): ไคลเอนต์ DeepSeek แบบอะซิงโครนัส
+    """
+    return RollingSummarizer(
+        db,
+        redis_client,
+        deepseek_client,
+        SYSTEM_MESSAGES,
+        recent_window=SUMMARY_CONFIG['recent_window'],
+        min_new_turns=SUMMARY_CONFIG['min_new_turns'],
+        max_tokens=SUMMARY_GENERATION_CONFIG['max_tokens']
+    )
+
+def create_context_builder(token_counter: TokenCounter) -> PromptContextBuilder:
+    """สร้างตัวประกอบพรอมต์แบบคงส่วนต้นตาม PROMPT_CONTEXT_CONFIG"""
+    return PromptContextBuilder(
+        SYSTEM_MESSAGES,
+        session_max_messages=PROMPT_CONTEXT_CONFIG['session_max_messages'],
+        session_keep_messages=PROMPT_CONTEXT_CONFIG['session_keep_messages'],
+        token_counter=token_counter,
+        max_prompt_tokens=PROMPT_CONTEXT_CONFIG['max_prompt_tokens']
+    )
+
+def create_user_state(redis_client, asynchronous: bool = False):
+    """
+    สร้างตัวจัดการสถานะผู้ใช้ตาม USER_STATE_CONFIG
+
+    Args:
+        redis_client (redis.Redis | redis.asyncio.Redis): การเชื่อมต่อ Redis (decode_responses=True)
+        asynchronous (bool): สร้างตัวจัดการแบบอะซิงโครนัสสำหรับโหมด ASGI
+
+    Returns:
+        UserStateStore: ตัวจัดการสถานะผู้ใช้
+    """
+    return create_user_state_store(
+        redis_client,
+        layout=USER_STATE_CONFIG['layout'],
+        asynchronous=asynchronous,
+        session_timeout=SESSION_TIMEOUT,
+        session_ttl=SESSION_TTL,
+        lock_timeout=MESSAGE_LOCK_TIMEOUT,
+        compact=USER_STATE_CONFIG['compact']
+    )
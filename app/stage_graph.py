@@ -0,0 +1,179 @@
+"""
+โมดูลกราฟขั้นตอนสำหรับแชทบอท 'ใจดี'
+รันขั้นตอนเตรียมข้อมูลที่ไม่ขึ้นต่อกัน (Redis, MySQL) พร้อมกันบนกลุ่มเธรด
+ขั้นตอนที่มีขั้นตอนก่อนหน้าจะเริ่มทันทีที่ขั้นตอนก่อนหน้าเสร็จครบ
+และรายงานเวลาของแต่ละขั้นตอนพร้อมเส้นทางวิกฤต (critical path) ของทั้งกราฟ
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Sequence
+
+from .metrics import metrics
+
+class _Stage:
+    __slots__ = ("name", "fn", "args", "deps", "result", "error", "scheduled", "started", "finished")
+
+    def __init__(self, name: str, fn: Callable[..., Any], args: tuple, deps: Sequence[str]):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.deps = tuple(deps)
+        self.result = None
+        self.error = None
+        self.scheduled = False
+        self.started = None
+        self.finished = None
+
+class StageGraph:
+    """
+    กราฟขั้นตอนแบบใช้ครั้งเดียว: เพิ่มขั้นตอนด้วย add() แล้วเรียก run()
+    """
+    def __init__(self, name: str, executor: Executor):
+        """
+        Args:
+            name (str): ชื่อกราฟ ใช้เป็นคำนำหน้าตัวชี้วัด
+            executor (Executor): กลุ่มเธรดที่ใช้รันขั้นตอน (ต้องไม่ใช่กลุ่มเธรดที่เรียก run())
+        """
+        self.name = name
+        self.executor = executor
+        self._stages: Dict[str, _Stage] = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._remaining = 0
+        self._start = None
+
+    def add(self, name: str, fn: Callable[..., Any], *args: Any, deps: Sequence[str] = ()) -> 'StageGraph':
+        """
+        เพิ่มขั้นตอน
+
+        Args:
+            name (str): ชื่อขั้นตอน (ไม่ซ้ำกัน)
+            fn (Callable): ฟังก์ชันของขั้นตอน เรียกด้วย *args ตามด้วยผลลัพธ์ของ deps ตามลำดับ
+            *args: อาร์กิวเมนต์ของฟังก์ชัน
+            deps (Sequence[str]): ชื่อขั้นตอนที่ต้องเสร็จก่อน (ต้องเพิ่มไว้ก่อนแล้ว)
+
+        Returns:
+            StageGraph: กราฟนี้ (เรียกต่อกันได้)
+        """
+        if name in self._stages:
+            raise ValueError(f"duplicate stage: {name}")
+        missing = [dep for dep in deps if dep not in self._stages]
+        if missing:
+            raise ValueError(f"unknown dependencies for {name}: {missing}")
+        self._stages[name] = _Stage(name, fn, args, deps)
+        return self
+
+    def run(self, timeout: float = None) -> Dict[str, Any]:
+        """
+        รันทุกขั้นตอนและรอจนเสร็จ
+
+        Args:
+            timeout (float): เวลารอสูงสุด (วินาที) หรือ None เพื่อรอจนเสร็จ
+
+        Returns:
+            Dict[str, Any]: ผลลัพธ์ของแต่ละขั้นตอนตามชื่อ
+
+        Raises:
+            Exception: ข้อผิดพลาดของขั้นตอนแรกที่ล้มเหลว (ขั้นตอนที่ขึ้นต่อขั้นตอนนั้นจะไม่ถูกรัน)
+            TimeoutError: ถ้าเกินเวลารอ
+        """
+        self._start = time.monotonic()
+        self._remaining = len(self._stages)
+        if not self._stages:
+            return {}
+        for stage in self._stages.values():
+            if not stage.deps:
+                stage.scheduled = True
+                self._submit(stage)
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.name} did not finish within {timeout} seconds")
+
+        self._report()
+        for stage in self._stages.values():
+            if stage.error is not None:
+                raise stage.error
+        return {name: stage.result for name, stage in self._stages.items()}
+
+    def _submit(self, stage: _Stage):
+        try:
+            self.executor.submit(self._execute, stage)
+        except RuntimeError as e:
+            # กลุ่มเธรดปิดแล้ว (เช่น ระหว่างปิดแอป)
+            stage.error = e
+            self._complete(stage)
+
+    def _execute(self, stage: _Stage):
+        """รันขั้นตอนหนึ่ง แล้วปล่อยขั้นตอนที่รอขั้นตอนนี้"""
+        stage.started = time.monotonic()
+        failed = [self._stages[dep] for dep in stage.deps if self._stages[dep].error is not None]
+        if failed:
+            stage.error = failed[0].error
+        else:
+            try:
+                stage.result = stage.fn(*stage.args, *(self._stages[dep].result for dep in stage.deps))
+            except Exception as e:
+                stage.error = e
+        self._complete(stage)
+
+    def _complete(self, stage: _Stage):
+        stage.finished = time.monotonic()
+        if stage.started is None:
+            stage.started = stage.finished
+        ready = []
+        with self._lock:
+            self._remaining -= 1
+            for other in self._stages.values():
+                if (not other.scheduled and stage.name in other.deps
+                        and all(self._stages[dep].finished is not None for dep in other.deps)):
+                    other.scheduled = True
+                    ready.append(other)
+            finished = self._remaining == 0
+        for other in ready:
+            self._submit(other)
+        if finished:
+            self._done.set()
+
+    def critical_path(self) -> List[str]:
+        """
+        หาเส้นทางวิกฤต: เริ่มจากขั้นตอนที่เสร็จช้าที่สุด ย้อนกลับผ่านขั้นตอนก่อนหน้าที่เสร็จช้าที่สุด
+
+        Returns:
+            List[str]: ชื่อขั้นตอนบนเส้นทางวิกฤต เรียงจากต้นไปปลาย
+        """
+        finished = [stage for stage in self._stages.values() if stage.finished is not None]
+        if not finished:
+            return []
+        stage = max(finished, key=lambda s: s.finished)
+        path = [stage.name]
+        while stage.deps:
+            stage = max((self._stages[dep] for dep in stage.deps), key=lambda s: s.finished)
+            path.append(stage.name)
+        return list(reversed(path))
+
+    def timings(self) -> Dict[str, Dict[str, float]]:
+        """เวลาเริ่ม (นับจากเริ่มกราฟ) และระยะเวลาของแต่ละขั้นตอนเป็นมิลลิวินาที"""
+        return {
+            name: {
+                "start_ms": round((stage.started - self._start) * 1000, 1),
+                "duration_ms": round((stage.finished - stage.started) * 1000, 1)
+            }
+            for name, stage in self._stages.items()
+            if stage.finished is not None
+        }
+
+    def _report(self):
+        """บันทึกตัวชี้วัดของแต่ละขั้นตอนและเส้นทางวิกฤต"""
+        for name, stage in self._stages.items():
+            labels = {'stage': name}
+            metrics.observe(f'{self.name}_stage_seconds', stage.finished - stage.started, labels=labels)
+            # เวลาจากเริ่มกราฟจนขั้นตอนนี้เสร็จ = ความยาวเส้นทางวิกฤตที่สิ้นสุดที่ขั้นตอนนี้
+            metrics.observe(f'{self.name}_stage_finish_seconds', stage.finished - self._start, labels=labels)
+        path = self.critical_path()
+        total = max(stage.finished for stage in self._stages.values()) - self._start
+        metrics.observe(f'{self.name}_critical_path_seconds', total)
+        for name in path:
+            metrics.inc(f'{self.name}_critical_stage_total', labels={'stage': name})
+        logging.debug(f"{self.name}: เส้นทางวิกฤต {' -> '.join(path)} ({total * 1000:.0f} มิลลิวินาที), "
+                      f"ขั้นตอน {self.timings()}")
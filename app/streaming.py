@@ -0,0 +1,120 @@
+"""
+โมดูลแบ่งข้อความสตรีมสำหรับแชทบอท 'ใจดี'
+ตัดข้อความที่ได้รับทีละส่วนจาก DeepSeek เป็นชิ้นตามขอบเขตย่อหน้าหรือประโยค
+(รองรับภาษาไทยที่ใช้ช่องว่างและคำลงท้ายแทนเครื่องหมายจบประโยค)
+เพื่อส่งชิ้นแรกให้ผู้ใช้ได้ทันที
+"""
+import re
+from typing import List, Optional
+
+# ขอบเขตที่ชัดเจน เรียงจากแข็งแรงที่สุด: ย่อหน้า, ขึ้นบรรทัดใหม่, จบประโยค
+PARAGRAPH_BOUNDARY = re.compile(r'\n\s*\n')
+LINE_BOUNDARY = re.compile(r'\n')
+SENTENCE_BOUNDARY = re.compile(
+    r'(?:[.!?…]+["\')\]]?'                                 # เครื่องหมายจบประโยค
+    r'|(?:ค่ะ|คะ|ครับ|นะคะ|นะ|จ้ะ|จ้า|ค่า)[!?.]*'            # คำลงท้ายภาษาไทย
+    r'|[\U0001F300-\U0001FAFF☀-➿])'              # อีโมจิท้ายประโยค
+    r'\s+'
+)
+# ขอบเขตอ่อน: ช่องว่างทั่วไป (ในภาษาไทยมักคั่นวลีหรือประโยค)
+SPACE_BOUNDARY = re.compile(r'\s+')
+
+# ข้อจำกัดของ LINE Messaging API
+LINE_MAX_TEXT_LENGTH = 5000
+LINE_MAX_MESSAGES_PER_REQUEST = 5
+
+class ThaiChunker:
+    """
+    ตัวแบ่งข้อความสตรีมเป็นชิ้นที่อ่านได้ต่อเนื่อง
+    """
+    def __init__(self, first_min_chars: int = 40, min_chars: int = 200, max_chars: int = 1000):
+        """
+        สร้างตัวแบ่งข้อความ
+
+        Args:
+            first_min_chars (int): ความยาวขั้นต่ำของชิ้นแรก (ส่งเร็วที่สุด)
+            min_chars (int): ความยาวขั้นต่ำของชิ้นถัดไป
+            max_chars (int): ความยาวสูงสุดของชิ้น (ตัดที่ช่องว่างหรือตัดตรงถ้าไม่มีขอบเขต)
+        """
+        self.first_min_chars = first_min_chars
+        self.min_chars = min_chars
+        self.max_chars = min(max_chars, LINE_MAX_TEXT_LENGTH)
+        self.buffer = ""
+        self.chunks_emitted = 0
+
+    def feed(self, text: str) -> List[str]:
+        """
+        เพิ่มข้อความที่ได้รับจากสตรีม
+
+        Args:
+            text (str): ข้อความส่วนใหม่
+
+        Returns:
+            List[str]: ชิ้นข้อความที่พร้อมส่ง (อาจว่าง)
+        """
+        self.buffer += text
+        chunks = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                break
+            chunk = self.buffer[:cut].strip()
+            self.buffer = self.buffer[cut:]
+            if chunk:
+                chunks.append(chunk)
+                self.chunks_emitted += 1
+        return chunks
+
+    def flush(self) -> List[str]:
+        """
+        ดึงข้อความที่เหลือทั้งหมดเมื่อสตรีมจบ
+
+        Returns:
+            List[str]: ชิ้นข้อความที่เหลือ
+        """
+        chunks = []
+        remaining = self.buffer.strip()
+        self.buffer = ""
+        while remaining:
+            chunks.append(remaining[:self.max_chars])
+            remaining = remaining[self.max_chars:].strip()
+        self.chunks_emitted += len(chunks)
+        return chunks
+
+    def _find_cut(self) -> Optional[int]:
+        """หาตำแหน่งตัดที่เหมาะสมในบัฟเฟอร์ หรือ None ถ้ายังควรรอข้อความเพิ่ม"""
+        min_len = self.first_min_chars if self.chunks_emitted == 0 else self.min_chars
+        if len(self.buffer) < min_len:
+            return None
+
+        window = self.buffer[:self.max_chars]
+        for pattern in (PARAGRAPH_BOUNDARY, LINE_BOUNDARY, SENTENCE_BOUNDARY):
+            cut = _first_boundary_after(pattern, window, min_len)
+            if cut is not None:
+                return cut
+
+        if len(self.buffer) < self.max_chars:
+            return None
+
+        # ยาวเกินกำหนดโดยไม่มีขอบเขตชัดเจน: ตัดที่ช่องว่างสุดท้าย หรือตัดตรงความยาวสูงสุด
+        spaces = [m.end() for m in SPACE_BOUNDARY.finditer(window) if m.end() >= min_len]
+        return spaces[-1] if spaces else self.max_chars
+
+def _first_boundary_after(pattern, text: str, min_len: int) -> Optional[int]:
+    """หาตำแหน่งสิ้นสุดของขอบเขตแรกที่อยู่หลังความยาวขั้นต่ำ"""
+    for match in pattern.finditer(text, min_len - 1 if min_len > 0 else 0):
+        return match.end()
+    return None
+
+def batch_messages(chunks: List[str], size: int = LINE_MAX_MESSAGES_PER_REQUEST) -> List[List[str]]:
+    """
+    แบ่งชิ้นข้อความเป็นกลุ่มตามจำนวนข้อความสูงสุดต่อคำขอของ LINE
+
+    Args:
+        chunks (List[str]): ชิ้นข้อความ
+        size (int): จำนวนข้อความสูงสุดต่อกลุ่ม
+
+    Returns:
+        List[List[str]]: กลุ่มของชิ้นข้อความ
+    """
+    return [chunks[i:i + size] for i in range(0, len(chunks), size)]
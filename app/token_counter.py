@@ -1,27 +1,296 @@
-import re
+import os
+import sys
 import json
-from typing import Union, List, Dict
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Union, List, Dict, Optional
 
-class TokenCounter:
-    def __init__(self, model_name="deepseek-chat"):
-        self.model_name = model_name
-        self.history = {}
-        
-        # Try to load tiktoken for accurate counting
+from .metrics import metrics
+
+# Approximate per-entry overhead of an OrderedDict slot (hash table entry + linked-list node)
+_ENTRY_OVERHEAD_BYTES = 100
+
+# Below this many uncached texts a batch is encoded in a plain loop (thread pool start-up costs more)
+BATCH_MIN_TEXTS = 8
+
+ENCODING_NAME = "cl100k_base"
+ENCODING_URL = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+
+# One encoding per process, shared by every TokenCounter (and by forked workers when loaded pre-fork)
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+def encoding_cache_file(cache_dir: str) -> str:
+    """Path tiktoken reads the BPE ranks from inside TIKTOKEN_CACHE_DIR (sha1 of the source URL)"""
+    return os.path.join(cache_dir, hashlib.sha1(ENCODING_URL.encode()).hexdigest())
+
+def load_encoding(cache_dir: Optional[str] = None, offline: bool = False):
+    """
+    Load the cl100k_base encoding once per process and return it, or None for the estimator.
+    With offline=True the encoding is only read from cache_dir and never downloaded;
+    a missing file or any load error falls back to approximate counting instead of failing start-up.
+    """
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return _encoding
+    with _encoding_lock:
+        if _encoding_loaded:
+            return _encoding
+        start_time = time.perf_counter()
         try:
             import tiktoken
-            self.tokenizer = tiktoken.get_encoding("cl100k_base")
-            self.use_tiktoken = True
-            print("Using tiktoken for accurate token counting")
+            if cache_dir:
+                os.environ.setdefault("TIKTOKEN_CACHE_DIR", cache_dir)
+            cache_dir = os.environ.get("TIKTOKEN_CACHE_DIR")
+            if offline and not (cache_dir and os.path.exists(encoding_cache_file(cache_dir))):
+                logging.warning(f"Tokenizer file not found in {cache_dir} (offline), using approximate token counting")
+            else:
+                _encoding = tiktoken.get_encoding(ENCODING_NAME)
         except (ImportError, ModuleNotFoundError):
-            self.use_tiktoken = False
-            print("Tiktoken not found, using approximate token counting")
+            logging.info("Tiktoken not found, using approximate token counting")
+        except Exception as e:
+            logging.warning(f"Could not load {ENCODING_NAME} ({e}), using approximate token counting")
+        _encoding_loaded = True
+        elapsed = time.perf_counter() - start_time
+        metrics.set_gauge('tokenizer_load_seconds', elapsed)
+        if _encoding is not None:
+            logging.info(f"Loaded {ENCODING_NAME} for token counting in {elapsed:.3f}s")
+        return _encoding
+
+TOKEN_COUNTER_MODES = ("tiktoken", "estimate")
+
+# Features of the fast estimator: codepoint-class counts ("other" is everything outside ASCII and Thai)
+ESTIMATOR_FEATURES = ("thai", "thai_mark", "latin", "digit", "symbol", "space", "other")
+
+# Per-class weights before calibration, close to the previous hand-picked estimator
+# (fit real ones with scripts/calibrate_token_estimator.py)
+DEFAULT_ESTIMATOR_COEFFICIENTS = {
+    "thai": 1.0,
+    "thai_mark": 1.0,
+    "latin": 0.25,
+    "digit": 0.34,
+    "symbol": 1.0,
+    "space": 0.0,
+    "other": 1.0,
+    "intercept": 0.0
+}
+
+def _build_class_table() -> Dict[int, str]:
+    """Map ASCII and Thai codepoints to a one-letter class code for str.translate"""
+    table = {}
+    for cp in range(128):
+        ch = chr(cp)
+        if ch.isalpha():
+            table[cp] = "l"
+        elif ch.isdigit():
+            table[cp] = "d"
+        elif ch.isspace():
+            table[cp] = "w"
+        else:
+            table[cp] = "s"
+    for cp in range(0x0E00, 0x0E80):
+        category = unicodedata.category(chr(cp))
+        if category == "Cn":
+            continue
+        if category == "Nd":
+            table[cp] = "d"
+        elif category == "Mn":
+            table[cp] = "m"
+        elif category.startswith("L"):
+            table[cp] = "t"
+        else:
+            table[cp] = "s"
+    return table
+
+_CLASS_TABLE = _build_class_table()
+# Class code of each feature except "other" (unmapped codepoints are never ASCII letters)
+_CLASS_CODES = "tmldsw"
+
+class TokenEstimator:
+    """
+    Tokenizer-free token estimate: one str.translate pass maps every codepoint to its class,
+    then the per-class counts are weighted by linear coefficients fitted on real API usage.
+    """
+
+    def __init__(self, coefficients: Optional[Dict[str, float]] = None):
+        self.coefficients = {**DEFAULT_ESTIMATOR_COEFFICIENTS, **(coefficients or {})}
+        self._weights = [self.coefficients[name] for name in ESTIMATOR_FEATURES]
+        self._intercept = self.coefficients["intercept"]
+
+    @classmethod
+    def from_file(cls, path: str) -> "TokenEstimator":
+        """Load coefficients written by scripts/calibrate_token_estimator.py"""
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f)["coefficients"])
+
+    @staticmethod
+    def features(text: str) -> List[int]:
+        """Codepoint-class counts of text, in ESTIMATOR_FEATURES order"""
+        classes = text.translate(_CLASS_TABLE)
+        counts = [classes.count(code) for code in _CLASS_CODES]
+        counts.append(len(classes) - sum(counts))
+        return counts
+
+    def estimate(self, text: str) -> int:
+        """Estimated token count of a non-empty text (at least 1)"""
+        total = self._intercept
+        for weight, count in zip(self._weights, self.features(text)):
+            total += weight * count
+        return max(1, round(total))
+
+class TokenCountCache:
+    """Thread-safe LRU cache of token counts keyed on a digest of the full text, bounded by bytes"""
+
+    def __init__(self, max_bytes: int = 8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        """128-bit digest of the whole text (prefix collisions cannot share a count)"""
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    @staticmethod
+    def _cost(key: bytes, value: int) -> int:
+        return sys.getsizeof(key) + sys.getsizeof(value) + _ENTRY_OVERHEAD_BYTES
+
+    def get(self, key: bytes) -> Optional[int]:
+        """Return the cached count and mark it most recently used, or None on a miss"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        metrics.inc('token_cache_hits_total' if value is not None else 'token_cache_misses_total')
+        return value
+
+    def put(self, key: bytes, value: int):
+        """Store a count, evicting least recently used entries until the byte budget fits"""
+        cost = self._cost(key, value)
+        if cost > self.max_bytes:
+            return
+        evicted = 0
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size_bytes -= self._cost(key, previous)
+            self._entries[key] = value
+            self.size_bytes += cost
+            while self.size_bytes > self.max_bytes:
+                old_key, old_value = self._entries.popitem(last=False)
+                self.size_bytes -= self._cost(old_key, old_value)
+                evicted += 1
+            self.evictions += evicted
+            size_bytes = self.size_bytes
+        if evicted:
+            metrics.inc('token_cache_evictions_total', evicted)
+        metrics.set_gauge('token_cache_bytes', size_bytes)
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """Cache counters for health checks and logging"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+class TokenCounter:
+    def __init__(self, model_name="deepseek-chat", cache_bytes: int = 8 * 1024 * 1024, batch_threads: int = 4,
+                 encoding_cache_dir: Optional[str] = None, offline: bool = False, mode: str = "tiktoken",
+                 estimator_file: Optional[str] = None):
+        if mode not in TOKEN_COUNTER_MODES:
+            raise ValueError(f"unknown token counter mode: {mode}")
+        self.model_name = model_name
+        self.cache = TokenCountCache(cache_bytes)
+        self.batch_threads = batch_threads
+        
+        # tiktoken is loaded on first use (or pre-fork via load_encoding), not at construction;
+        # "estimate" mode never loads it and counts with the calibrated estimator only
+        self.encoding_cache_dir = encoding_cache_dir
+        self.offline = offline
+        self.mode = mode
+        
+        # Estimator used in "estimate" mode and whenever tiktoken is unavailable
+        self.estimator = TokenEstimator()
+        if estimator_file:
+            try:
+                self.estimator = TokenEstimator.from_file(estimator_file)
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"Could not load estimator coefficients from {estimator_file} ({e}), using defaults")
+
+    @property
+    def tokenizer(self):
+        """The shared tiktoken encoding, or None when counting falls back to the estimator"""
+        if self.mode == "estimate":
+            return None
+        return load_encoding(self.encoding_cache_dir, self.offline)
+
+    @property
+    def use_tiktoken(self) -> bool:
+        return self.tokenizer is not None
     
     def count_tokens(self, text: Union[str, List[str]]) -> Union[int, List[int]]:
         """Count tokens in text or list of texts"""
         if isinstance(text, list):
-            return [self._count_single_text(t) for t in text]
+            return self.count_tokens_batch(text)
         return self._count_single_text(text)
+
+    def count_tokens_batch(self, texts: List[str], num_threads: Optional[int] = None) -> List[int]:
+        """
+        Count tokens in many texts at once.
+        Cached texts are answered from the cache; the distinct remaining texts are encoded
+        with tiktoken's batch API on a thread pool (the Rust encoder releases the GIL).
+        """
+        counts = [0] * len(texts)
+        missing = {}
+        for i, text in enumerate(texts):
+            if not text:
+                continue
+            key = self.cache.key(text)
+            cached = self.cache.get(key)
+            if cached is not None:
+                counts[i] = cached
+            else:
+                missing.setdefault(key, (text, []))[1].append(i)
+        if not missing:
+            return counts
+
+        keys = list(missing)
+        unique = [missing[key][0] for key in keys]
+        tokenizer = self.tokenizer
+        if tokenizer is not None and len(unique) >= BATCH_MIN_TEXTS:
+            encoded = tokenizer.encode_ordinary_batch(unique, num_threads=num_threads or self.batch_threads)
+            results = [len(tokens) for tokens in encoded]
+        else:
+            results = [self._encode_count(text) for text in unique]
+
+        for key, token_count in zip(keys, results):
+            self.cache.put(key, token_count)
+            for i in missing[key][1]:
+                counts[i] = token_count
+        return counts
     
     def _count_single_text(self, text: str) -> int:
         """Count tokens in a single text string"""
@@ -29,34 +298,23 @@ class TokenCounter:
             return 0
             
         # Use cached value if available
-        text_hash = hash(text[:100])
-        if text_hash in self.history:
-            return self.history[text_hash]
+        key = self.cache.key(text)
+        token_count = self.cache.get(key)
+        if token_count is not None:
+            return token_count
             
-        # Use tiktoken if available
-        if self.use_tiktoken:
-            token_count = len(self.tokenizer.encode(text))
+        token_count = self._encode_count(text)
+        self.cache.put(key, token_count)
+        return token_count
+
+    def _encode_count(self, text: str) -> int:
+        """Count tokens in a single non-empty text without the cache"""
+        # Use tiktoken if available (special-token text in user messages is counted as plain text)
+        tokenizer = self.tokenizer
+        if tokenizer is not None:
+            token_count = len(tokenizer.encode_ordinary(text))
         else:
-            # Advanced multi-language token estimator
-            # Remove excess whitespace
-            text = re.sub(r'\s+', ' ', text.strip())
-            
-            # Handle Thai, English, and other characters
-            thai_chars = len(re.findall(r'[\u0E00-\u0E7F]', text))
-            english_words = len(re.findall(r'[a-zA-Z]+', text))
-            numbers = len(re.findall(r'[0-9]+', text))
-            symbols = len(re.findall(r'[^\w\s\u0E00-\u0E7F]', text))
-            
-            # Thai is approximately 1 token per character
-            # English is approximately 0.75 tokens per word
-            # Numbers and symbols count as approximately 1 token per group
-            token_count = int(thai_chars + (english_words * 0.75) + numbers + symbols)
-            token_count = max(1, token_count)  # Ensure at least 1 token
-        
-        # Cache result (limited to 1000 items)
-        if len(self.history) > 1000:
-            self.history.clear()
-        self.history[text_hash] = token_count
+            token_count = self.estimator.estimate(text)
         
         return token_count
     
@@ -0,0 +1,876 @@
+"""
+โมดูลสถานะผู้ใช้บน Redis สำหรับแชทบอท 'ใจดี'
+รวมคำสั่ง Redis ของเส้นทางประมวลผลข้อความให้เหลือไม่กี่ round trip:
+ล็อค, เตรียมข้อมูล (สคริปต์ Lua เดียว), บันทึกผล (pipeline เดียว) และปลดล็อคพร้อมตรวจข้อความที่พักไว้
+
+รองรับสองรูปแบบการจัดเก็บ:
+- keys: หนึ่งคีย์ต่อข้อมูล (chat_messages:, last_activity:, timeout_warning:, wait_notice:, message_lock:)
+- hash: แฮชเดียวต่อผู้ใช้ (user:{user_id}) โดยเก็บเวลาหมดอายุของแต่ละฟิลด์ไว้ในฟิลด์คู่กัน
+  ลดจำนวนคีย์และค่าใช้จ่ายต่อคีย์ของ Redis เมื่อมีผู้ใช้จำนวนมาก
+
+เซสชันการแชทเก็บเป็นรายการต่อท้าย (หนึ่งรายการต่อข้อความ พร้อมจำนวนโทเค็น) แต่ละรอบส่งเฉพาะข้อความใหม่
+แล้วตัดด้วย LTRIM (หรือสคริปต์ Lua ในรูปแบบแฮช) เซสชัน JSON เดิม (chat_session:) ถูกอ่านได้และเขียนใหม่ครั้งเดียว
+"""
+import base64
+import json
+import logging
+import time
+import uuid
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from .context_builder import record_cache_usage
+from .delivery import REPLY_TOKEN_KEY
+from .metrics import metrics
+
+SESSION_KEY = "chat_messages:{}"
+LEGACY_SESSION_KEY = "chat_session:{}"
+
+# KEYS: wait_notice, last_activity, timeout_warning, chat_messages, reply_token, chat_session (เดิม)
+# ARGV: now, session_timeout, reply_token_value, reply_token_ttl
+PREPARE_SCRIPT = """
+redis.call('DEL', KEYS[1])
+if ARGV[3] ~= '' then
+    redis.call('SET', KEYS[5], ARGV[3], 'EX', ARGV[4])
+end
+local last = redis.call('GET', KEYS[2])
+local warning = redis.call('GET', KEYS[3])
+if last and (tonumber(ARGV[1]) - tonumber(last)) > tonumber(ARGV[2]) then
+    redis.call('DEL', KEYS[4], KEYS[6])
+    return {1, last, warning, {}, false}
+end
+redis.call('SET', KEYS[2], ARGV[1], 'EX', ARGV[2])
+local entries = redis.call('LRANGE', KEYS[4], 0, -1)
+if #entries > 0 then
+    return {0, last, warning, entries, false}
+end
+return {0, last, warning, entries, redis.call('GET', KEYS[6])}
+"""
+
+# KEYS: message_lock, pending_messages
+# ARGV: owner_token
+# ลบล็อคเฉพาะเมื่อยังเป็นของผู้ถือเดิม (ล็อคที่หมดอายุแล้วอาจเป็นของการประมวลผลอื่น)
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+return redis.call('EXISTS', KEYS[2])
+"""
+
+# KEYS: message_lock
+# ARGV: owner_token, lock_timeout
+EXTEND_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS: user_hash, reply_token
+# ARGV: now, session_timeout, reply_token_value, reply_token_ttl
+HASH_PREPARE_SCRIPT = """
+local now = tonumber(ARGV[1])
+redis.call('HDEL', KEYS[1], 'wn')
+if ARGV[3] ~= '' then
+    redis.call('SET', KEYS[2], ARGV[3], 'EX', ARGV[4])
+end
+local fields = redis.call('HMGET', KEYS[1], 'la', 'tw', 'm', 'se', 's')
+local last, warning = fields[1], fields[2]
+if warning and tonumber(warning) <= now then
+    warning = false
+end
+if last and (now - tonumber(last)) > tonumber(ARGV[2]) then
+    redis.call('HDEL', KEYS[1], 'm', 'se', 's')
+    return {1, last, warning, false, false}
+end
+redis.call('HSET', KEYS[1], 'la', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if not fields[4] or tonumber(fields[4]) <= now then
+    return {0, last, warning, false, false}
+end
+return {0, last, warning, fields[3], fields[5]}
+"""
+
+# KEYS: user_hash
+# ARGV: now, session_ttl, keep, entries...
+# ต่อท้ายรายการในฟิลด์ m (คั่นด้วยขึ้นบรรทัดใหม่) แล้วเก็บไว้เพียง keep รายการล่าสุด
+# เมื่อ keep ไม่เกินจำนวนรายการใหม่ (เช่น การเขียนใหม่ทั้งเซสชัน) จะไม่อ่านรายการเดิม
+HASH_APPEND_SCRIPT = """
+local now = tonumber(ARGV[1])
+local keep = tonumber(ARGV[3])
+if keep == 0 then
+    redis.call('HDEL', KEYS[1], 'm', 'se', 's')
+    return 0
+end
+local entries = {}
+local deadline = redis.call('HGET', KEYS[1], 'se')
+if keep > #ARGV - 3 and deadline and tonumber(deadline) > now then
+    local current = redis.call('HGET', KEYS[1], 'm')
+    if current then
+        for entry in string.gmatch(current, '[^\\n]+') do
+            entries[#entries + 1] = entry
+        end
+    end
+end
+for i = 4, #ARGV do
+    entries[#entries + 1] = ARGV[i]
+end
+local first = math.max(#entries - keep + 1, 1)
+redis.call('HSET', KEYS[1], 'm', table.concat(entries, '\\n', first), 'se', now + tonumber(ARGV[2]))
+redis.call('HDEL', KEYS[1], 's')
+return #entries - first + 1
+"""
+
+# KEYS: user_hash
+# ARGV: field, now, field_ttl, key_ttl
+# ตั้งฟิลด์กำหนดเวลาเมื่อยังไม่มีหรือหมดอายุแล้ว (เทียบเท่า SET NX EX ของฟิลด์เดียว)
+HASH_SET_DEADLINE_SCRIPT = """
+local deadline = redis.call('HGET', KEYS[1], ARGV[1])
+if deadline and tonumber(deadline) > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], tonumber(ARGV[2]) + tonumber(ARGV[3]))
+if redis.call('TTL', KEYS[1]) < 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+end
+return 1
+"""
+
+# KEYS: user_hash
+# ARGV: owner_token, now, lock_timeout, key_ttl
+# ล็อคด้วยฟิลด์กำหนดเวลา lk และเก็บผู้ถือไว้ใน lo
+HASH_LOCK_SCRIPT = """
+local deadline = redis.call('HGET', KEYS[1], 'lk')
+if deadline and tonumber(deadline) > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'lk', tonumber(ARGV[2]) + tonumber(ARGV[3]), 'lo', ARGV[1])
+if redis.call('TTL', KEYS[1]) < 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+end
+return 1
+"""
+
+# KEYS: user_hash, pending_messages
+# ARGV: owner_token
+HASH_RELEASE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'lo') == ARGV[1] then
+    redis.call('HDEL', KEYS[1], 'lk', 'lo')
+end
+return redis.call('EXISTS', KEYS[2])
+"""
+
+# KEYS: user_hash
+# ARGV: owner_token, now, lock_timeout
+HASH_EXTEND_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'lo') == ARGV[1] then
+    redis.call('HSET', KEYS[1], 'lk', tonumber(ARGV[2]) + tonumber(ARGV[3]))
+    return 1
+end
+return 0
+"""
+
+# คำนำหน้าของข้อมูลที่บีบอัด (zlib + base64 เพราะไคลเอนต์ใช้ decode_responses=True)
+COMPACT_PREFIX = "z:"
+
+# รหัสบทบาทแบบสั้นในรายการของเซสชัน
+ROLE_CODES = {"user": "u", "assistant": "a", "system": "s"}
+ROLE_NAMES = {code: role for role, code in ROLE_CODES.items()}
+
+def encode_entry(message: Dict[str, Any], compact: bool = False) -> str:
+    """
+    เข้ารหัสข้อความหนึ่งข้อความของเซสชันเป็นรายการ [บทบาท, จำนวนโทเค็น, เนื้อหา]
+
+    Args:
+        message (dict): ข้อความ (role, content และ tokens ถ้านับแล้ว)
+        compact (bool): บีบอัดด้วย zlib เมื่อได้ขนาดเล็กกว่า
+
+    Returns:
+        str: JSON หรือ COMPACT_PREFIX ตามด้วยข้อมูลที่บีบอัด (ไม่มีอักขระขึ้นบรรทัดใหม่)
+    """
+    data = json.dumps([ROLE_CODES.get(message["role"], message["role"]), message.get("tokens"), message["content"]],
+                      ensure_ascii=False, separators=(',', ':'))
+    if compact:
+        packed = COMPACT_PREFIX + base64.b64encode(zlib.compress(data.encode('utf-8'), 6)).decode('ascii')
+        if len(packed) < len(data.encode('utf-8')):
+            return packed
+    return data
+
+def decode_entries(raws: List[str]) -> List[Dict[str, Any]]:
+    """
+    ถอดรหัสรายการของเซสชัน (ข้ามรายการที่เสียหาย)
+
+    Returns:
+        List[dict]: ข้อความ (role, content และ tokens ถ้ามี)
+    """
+    messages = []
+    for raw in raws:
+        try:
+            if raw.startswith(COMPACT_PREFIX):
+                raw = zlib.decompress(base64.b64decode(raw[len(COMPACT_PREFIX):])).decode('utf-8')
+            role, tokens, content = json.loads(raw)
+        except (ValueError, TypeError, zlib.error) as e:
+            logging.error(f"รายการเซสชันการแชทเสียหาย: {str(e)}")
+            continue
+        message = {"role": ROLE_NAMES.get(role, role), "content": content}
+        if tokens is not None:
+            message["tokens"] = tokens
+        messages.append(message)
+    return messages
+
+def queue_session_write(pipe, user_id: str, session: List[Dict[str, Any]], new_messages: int,
+                        ttl: int, compact: bool = False, rewrite: bool = False):
+    """
+    เพิ่มคำสั่งบันทึกเซสชันแบบต่อท้ายลงใน pipeline (ใช้ได้ทั้ง redis และ redis.asyncio)
+
+    Args:
+        pipe: pipeline ของ Redis
+        user_id (str): LINE User ID
+        session (List[dict]): เซสชันหลังตัดความยาวแล้ว (ต้องเป็นส่วนท้ายของเซสชันเดิมต่อด้วยข้อความใหม่)
+        new_messages (int): จำนวนข้อความใหม่ที่ท้ายเซสชัน (ส่งเฉพาะข้อความเหล่านี้)
+        ttl (int): อายุของเซสชัน (วินาที)
+        compact (bool): บีบอัดรายการ
+        rewrite (bool): เขียนใหม่ทั้งเซสชันและลบเซสชัน JSON เดิม
+    """
+    key = SESSION_KEY.format(user_id)
+    if rewrite:
+        pipe.delete(key, LEGACY_SESSION_KEY.format(user_id))
+        new_messages = len(session)
+    appended = session[len(session) - min(new_messages, len(session)):]
+    if appended:
+        pipe.rpush(key, *(encode_entry(m, compact) for m in appended))
+    if session:
+        pipe.ltrim(key, -len(session), -1)
+        pipe.expire(key, ttl)
+    elif not rewrite:
+        pipe.delete(key)
+
+def decode_session(raw: Optional[str]) -> List[Dict[str, str]]:
+    """
+    ถอดรหัสเซสชัน JSON รูปแบบเดิม (ทั้งข้อมูลเป็นค่าเดียว อ่านได้ทั้งแบบ JSON และแบบบีบอัด)
+
+    Returns:
+        List[dict]: ข้อความในเซสชัน หรือลิสต์ว่างถ้าไม่มีหรือเสียหาย
+    """
+    if not raw:
+        return []
+    try:
+        if raw.startswith(COMPACT_PREFIX):
+            raw = zlib.decompress(base64.b64decode(raw[len(COMPACT_PREFIX):])).decode('utf-8')
+        return [{"role": m["role"], "content": m["content"]} for m in json.loads(raw)]
+    except (ValueError, KeyError, TypeError, zlib.error) as e:
+        logging.error(f"เซสชันการแชทเสียหาย: {str(e)}")
+        return []
+
+class RoundTrips:
+    """
+    ตัวนับ round trip ของ Redis สำหรับการประมวลผลข้อความหนึ่งรอบ
+    """
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+    def add(self, n: int = 1):
+        self.count += n
+
+    def observe(self):
+        """บันทึกจำนวน round trip ของรอบนี้ลงตัวชี้วัด"""
+        metrics.observe('redis_round_trips_per_message', self.count)
+
+def _add(trips: Optional[RoundTrips], n: int = 1):
+    if trips is not None:
+        trips.add(n)
+
+class UserStateStore:
+    """
+    ตัวจัดการสถานะผู้ใช้บน Redis (ล็อค, เวลาใช้งานล่าสุด, เซสชัน, ความก้าวหน้า, การติดตาม)
+    """
+    def __init__(self,
+                 redis_client,
+                 session_timeout: int = 604800,
+                 session_ttl: int = 86400,
+                 lock_timeout: int = 30,
+                 progress_limit: int = 100,
+                 compact: bool = False):
+        """
+        Args:
+            redis_client (redis.Redis): การเชื่อมต่อ Redis (decode_responses=True)
+            session_timeout (int): เวลาที่ไม่มีการใช้งานก่อนเซสชันหมดอายุ (วินาที)
+            session_ttl (int): อายุของเซสชันการแชทใน Redis (วินาที)
+            lock_timeout (int): อายุของล็อคการประมวลผล (วินาที)
+            progress_limit (int): จำนวนรายการความก้าวหน้าล่าสุดที่เก็บไว้
+            compact (bool): บีบอัดเซสชันการแชทก่อนเก็บ
+        """
+        self.redis = redis_client
+        self.session_timeout = session_timeout
+        self.session_ttl = session_ttl
+        self.lock_timeout = lock_timeout
+        self.progress_limit = progress_limit
+        self.compact = compact
+        self._prepare = redis_client.register_script(PREPARE_SCRIPT)
+        self._release = redis_client.register_script(RELEASE_SCRIPT)
+        self._extend = redis_client.register_script(EXTEND_SCRIPT)
+
+    def lock(self, user_id: str, trips: Optional[RoundTrips] = None) -> Optional[str]:
+        """
+        ล็อคผู้ใช้ (หนึ่ง round trip)
+
+        Returns:
+            Optional[str]: โทเค็นผู้ถือล็อค (ใช้กับ release/extend) หรือ None ถ้ามีการประมวลผลอื่นถือล็อคอยู่
+        """
+        token = uuid.uuid4().hex
+        _add(trips)
+        if self.redis.set(f"message_lock:{user_id}", token, nx=True, ex=self.lock_timeout):
+            return token
+        return None
+
+    def extend(self, user_id: str, token: str, trips: Optional[RoundTrips] = None) -> bool:
+        """
+        ต่ออายุล็อคเป็น lock_timeout นับจากตอนนี้ (หนึ่ง round trip)
+
+        Returns:
+            bool: True ถ้ายังถือล็อคอยู่
+        """
+        _add(trips)
+        return bool(self._extend(keys=[f"message_lock:{user_id}"], args=[token, self.lock_timeout]))
+
+    def release(self, user_id: str, token: str, trips: Optional[RoundTrips] = None) -> bool:
+        """
+        ปลดล็อคผู้ใช้ (เฉพาะเมื่อยังเป็นผู้ถือ) และตรวจสอบข้อความที่พักไว้ในขั้นตอนเดียว (หนึ่ง round trip)
+
+        Returns:
+            bool: True ถ้ามีข้อความที่พักไว้รอประมวลผล
+        """
+        _add(trips)
+        return bool(self._release(keys=[f"message_lock:{user_id}", f"pending_messages:{user_id}"], args=[token]))
+
+    def prepare(self, user_id: str, now: float, reply_token: Optional[Tuple[str, int]] = None,
+                trips: Optional[RoundTrips] = None) -> Dict[str, Any]:
+        """
+        เตรียมสถานะก่อนประมวลผลข้อความด้วยสคริปต์เดียว (หนึ่ง round trip):
+        ล้างการแจ้งเตือนรอ, เก็บ reply token, ตรวจสอบการหมดเวลาเซสชัน,
+        อัพเดทเวลาใช้งานล่าสุด และดึงเซสชันการแชท
+
+        Args:
+            user_id (str): LINE User ID
+            now (float): เวลาปัจจุบัน (epoch วินาที)
+            reply_token (tuple | None): (ค่าที่เข้ารหัสแล้ว, อายุที่เหลือเป็นวินาที) จาก ReplyTokenStore.entry
+            trips (RoundTrips | None): ตัวนับ round trip
+
+        Returns:
+            Dict[str, Any]: timed_out, last_activity (float | None), warning_sent และ session (List[dict])
+        """
+        token_value, token_ttl = reply_token or ("", 0)
+        _add(trips)
+        timed_out, last_activity, warning_sent, entries, legacy = self._prepare(
+            keys=[
+                f"wait_notice:{user_id}",
+                f"last_activity:{user_id}",
+                f"timeout_warning:{user_id}",
+                SESSION_KEY.format(user_id),
+                REPLY_TOKEN_KEY.format(user_id),
+                LEGACY_SESSION_KEY.format(user_id)
+            ],
+            args=[now, self.session_timeout, token_value, token_ttl]
+        )
+        return {
+            "timed_out": bool(timed_out),
+            "last_activity": float(last_activity) if last_activity else None,
+            "warning_sent": bool(warning_sent),
+            "session": self._load_session(user_id, entries, legacy, trips)
+        }
+
+    def _load_session(self, user_id: str, entries: Optional[List[str]], legacy: Optional[str],
+                      trips: Optional[RoundTrips] = None) -> List[Dict[str, Any]]:
+        """ถอดรหัสเซสชัน และเขียนเซสชัน JSON เดิมใหม่เป็นรายการต่อท้าย (ครั้งเดียวต่อผู้ใช้)"""
+        if entries:
+            return decode_entries(entries)
+        session = decode_session(legacy)
+        if session:
+            try:
+                _add(trips)
+                self._rewrite_session(user_id, session)
+                metrics.inc('chat_session_migrations_total')
+            except Exception as e:
+                logging.warning(f"เขียนเซสชันเดิมของ {user_id} ใหม่ไม่สำเร็จ: {str(e)}")
+        return session
+
+    def _rewrite_session(self, user_id: str, session: List[Dict[str, Any]]):
+        pipe = self.redis.pipeline(transaction=True)
+        queue_session_write(pipe, user_id, session, len(session), self.session_ttl, self.compact, rewrite=True)
+        pipe.execute()
+
+    def get_session(self, user_id: str) -> List[Dict[str, Any]]:
+        """ดึงเซสชันการแชทของผู้ใช้พร้อมจำนวนโทเค็นของแต่ละข้อความ (ลิสต์ว่างถ้าไม่มี)"""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.lrange(SESSION_KEY.format(user_id), 0, -1)
+        pipe.get(LEGACY_SESSION_KEY.format(user_id))
+        entries, legacy = pipe.execute()
+        return self._load_session(user_id, entries, legacy)
+
+    def clear_session(self, user_id: str):
+        """ลบเซสชันการแชทของผู้ใช้"""
+        self.redis.delete(SESSION_KEY.format(user_id), LEGACY_SESSION_KEY.format(user_id))
+
+    def get_progress(self, user_id: str) -> List[Dict[str, Any]]:
+        """ดึงข้อมูลความก้าวหน้าทั้งหมดของผู้ใช้ (ล่าสุดก่อน)"""
+        return [json.loads(item) for item in self.redis.lrange(f"progress:{user_id}", 0, -1)]
+
+    def mark_warning_sent(self, user_id: str, ttl: int = 86400, trips: Optional[RoundTrips] = None):
+        """บันทึกว่าได้ส่งการแจ้งเตือนเซสชันใกล้หมดอายุแล้ว"""
+        _add(trips)
+        self.redis.setex(f"timeout_warning:{user_id}", ttl, "1")
+
+    def save(self,
+             user_id: str,
+             session: Optional[List[Dict[str, Any]]] = None,
+             new_messages: int = 0,
+             progress: Optional[Dict[str, Any]] = None,
+             follow_up_at: Optional[float] = None,
+             cache_usage: Optional[Dict[str, Any]] = None,
+             trips: Optional[RoundTrips] = None):
+        """
+        บันทึกผลหลังประมวลผลข้อความด้วย pipeline เดียว (หนึ่ง round trip):
+        ข้อความใหม่ของเซสชัน, ข้อมูลความก้าวหน้า, เวลาติดตามผล และสถิติ context cache
+
+        Args:
+            user_id (str): LINE User ID
+            session (List[dict] | None): ข้อความในเซสชันที่ตัดความยาวแล้ว (ข้อความควรมี tokens)
+            new_messages (int): จำนวนข้อความใหม่ที่ท้ายเซสชัน (ส่งไป Redis เฉพาะข้อความเหล่านี้)
+            progress (dict | None): ข้อมูลความก้าวหน้าของข้อความนี้
+            follow_up_at (float | None): เวลาติดตามผลครั้งถัดไป (epoch วินาที)
+            cache_usage (dict | None): ฟิลด์ usage จาก DeepSeek สำหรับสถิติ context cache
+            trips (RoundTrips | None): ตัวนับ round trip
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        if session is not None:
+            queue_session_write(pipe, user_id, session, new_messages, self.session_ttl, self.compact)
+        self._queue_common(pipe, user_id, progress, follow_up_at, cache_usage)
+        if not len(pipe):
+            return
+        _add(trips)
+        pipe.execute()
+
+    def _queue_common(self, pipe, user_id: str, progress: Optional[Dict[str, Any]],
+                      follow_up_at: Optional[float], cache_usage: Optional[Dict[str, Any]]):
+        """เพิ่มคำสั่งที่เหมือนกันทุกรูปแบบการจัดเก็บลงใน pipeline (ความก้าวหน้า, การติดตาม, สถิติ cache)"""
+        if progress is not None:
+            pipe.lpush(f"progress:{user_id}", json.dumps(progress))
+            pipe.ltrim(f"progress:{user_id}", 0, self.progress_limit - 1)
+        if follow_up_at is not None:
+            pipe.zadd('follow_up_queue', {user_id: follow_up_at})
+        record_cache_usage(self.redis, user_id, cache_usage, pipeline=pipe)
+
+    def buffer_pending(self, user_id: str, message: str, max_messages: int, ttl: int,
+                       notice_ttl: int, trips: Optional[RoundTrips] = None) -> bool:
+        """
+        พักข้อความที่เข้ามาระหว่างล็อค และจองการแจ้งเตือนรอในขั้นตอนเดียว (หนึ่ง round trip)
+
+        Returns:
+            bool: True ถ้าต้องส่งการแจ้งเตือนรอ (ครั้งแรกของรอบการประมวลผล)
+        """
+        key = f"pending_messages:{user_id}"
+        pipe = self.redis.pipeline()
+        pipe.rpush(key, message)
+        pipe.ltrim(key, -max_messages, -1)
+        pipe.expire(key, ttl)
+        pipe.set(f"wait_notice:{user_id}", "1", nx=True, ex=notice_ttl)
+        _add(trips)
+        *_, notice_set = pipe.execute()
+        return bool(notice_set)
+
+    def drain_pending(self, user_id: str, trips: Optional[RoundTrips] = None) -> List[str]:
+        """ดึงและลบข้อความที่พักไว้ทั้งหมดในขั้นตอนเดียว (หนึ่ง round trip)"""
+        key = f"pending_messages:{user_id}"
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        _add(trips)
+        pending, _ = pipe.execute()
+        return pending
+
+class HashUserStateStore(UserStateStore):
+    """
+    ตัวจัดการสถานะผู้ใช้แบบแฮชเดียวต่อผู้ใช้ (user:{user_id})
+
+    ฟิลด์: m (รายการของเซสชันคั่นด้วยขึ้นบรรทัดใหม่), se (กำหนดหมดอายุของเซสชัน),
+    s (เซสชัน JSON รูปแบบเดิม), la (เวลาใช้งานล่าสุด),
+    tw (กำหนดหมดอายุของการแจ้งเตือนเซสชัน), wn (กำหนดหมดอายุของการแจ้งเตือนรอ), lk (กำหนดหมดอายุของล็อค),
+    lo (โทเค็นผู้ถือล็อค)
+    ทั้งแฮชหมดอายุเมื่อไม่มีการใช้งานครบ session_timeout
+
+    ข้อมูลความก้าวหน้า (ประวัติระยะยาวที่ไม่หมดอายุ), ข้อความที่พักไว้ (ลิสต์ชั่วคราว)
+    และคิวติดตามผล (sorted set รวมของทุกผู้ใช้) ยังคงอยู่ในคีย์เดิม
+    """
+    HASH_KEY = "user:{}"
+
+    def __init__(self, redis_client, **kwargs):
+        super().__init__(redis_client, **kwargs)
+        self._prepare = redis_client.register_script(HASH_PREPARE_SCRIPT)
+        self._release = redis_client.register_script(HASH_RELEASE_SCRIPT)
+        self._acquire = redis_client.register_script(HASH_LOCK_SCRIPT)
+        self._extend = redis_client.register_script(HASH_EXTEND_SCRIPT)
+        self._set_deadline = redis_client.register_script(HASH_SET_DEADLINE_SCRIPT)
+        self._append = redis_client.register_script(HASH_APPEND_SCRIPT)
+
+    def lock(self, user_id: str, trips: Optional[RoundTrips] = None) -> Optional[str]:
+        """ล็อคผู้ใช้ด้วยฟิลด์กำหนดเวลา lk และโทเค็นผู้ถือ lo (หนึ่ง round trip)"""
+        token = uuid.uuid4().hex
+        _add(trips)
+        if self._acquire(keys=[self.HASH_KEY.format(user_id)],
+                         args=[token, time.time(), self.lock_timeout, self.session_timeout]):
+            return token
+        return None
+
+    def extend(self, user_id: str, token: str, trips: Optional[RoundTrips] = None) -> bool:
+        """ต่ออายุล็อคถ้ายังเป็นผู้ถือ (หนึ่ง round trip)"""
+        _add(trips)
+        return bool(self._extend(keys=[self.HASH_KEY.format(user_id)],
+                                 args=[token, time.time(), self.lock_timeout]))
+
+    def release(self, user_id: str, token: str, trips: Optional[RoundTrips] = None) -> bool:
+        """ปลดล็อคผู้ใช้ (เฉพาะเมื่อยังเป็นผู้ถือ) และตรวจสอบข้อความที่พักไว้ในขั้นตอนเดียว (หนึ่ง round trip)"""
+        _add(trips)
+        return bool(self._release(keys=[self.HASH_KEY.format(user_id), f"pending_messages:{user_id}"],
+                                  args=[token]))
+
+    def prepare(self, user_id: str, now: float, reply_token: Optional[Tuple[str, int]] = None,
+                trips: Optional[RoundTrips] = None) -> Dict[str, Any]:
+        """เตรียมสถานะก่อนประมวลผลข้อความด้วยสคริปต์เดียว (ดู UserStateStore.prepare)"""
+        token_value, token_ttl = reply_token or ("", 0)
+        _add(trips)
+        timed_out, last_activity, warning_sent, entries, legacy = self._prepare(
+            keys=[self.HASH_KEY.format(user_id), REPLY_TOKEN_KEY.format(user_id)],
+            args=[now, self.session_timeout, token_value, token_ttl]
+        )
+        return {
+            "timed_out": bool(timed_out),
+            "last_activity": float(last_activity) if last_activity else None,
+            "warning_sent": bool(warning_sent),
+            "session": self._load_session(user_id, entries.split('\n') if entries else None, legacy, trips)
+        }
+
+    def _rewrite_session(self, user_id: str, session: List[Dict[str, Any]]):
+        self._append(
+            keys=[self.HASH_KEY.format(user_id)],
+            args=[time.time(), self.session_ttl, len(session), *(encode_entry(m, self.compact) for m in session)]
+        )
+
+    def get_session(self, user_id: str) -> List[Dict[str, Any]]:
+        """ดึงเซสชันการแชทของผู้ใช้พร้อมจำนวนโทเค็น (ลิสต์ว่างถ้าไม่มีหรือหมดอายุแล้ว)"""
+        entries, legacy, deadline = self.redis.hmget(self.HASH_KEY.format(user_id), 'm', 's', 'se')
+        if not deadline or float(deadline) <= time.time():
+            return []
+        return self._load_session(user_id, entries.split('\n') if entries else None, legacy)
+
+    def clear_session(self, user_id: str):
+        """ลบเซสชันการแชทของผู้ใช้"""
+        self.redis.hdel(self.HASH_KEY.format(user_id), 'm', 'se', 's')
+
+    def mark_warning_sent(self, user_id: str, ttl: int = 86400, trips: Optional[RoundTrips] = None):
+        """บันทึกว่าได้ส่งการแจ้งเตือนเซสชันใกล้หมดอายุแล้ว"""
+        _add(trips)
+        self.redis.hset(self.HASH_KEY.format(user_id), 'tw', time.time() + ttl)
+
+    def save(self,
+             user_id: str,
+             session: Optional[List[Dict[str, Any]]] = None,
+             new_messages: int = 0,
+             progress: Optional[Dict[str, Any]] = None,
+             follow_up_at: Optional[float] = None,
+             cache_usage: Optional[Dict[str, Any]] = None,
+             trips: Optional[RoundTrips] = None):
+        """บันทึกผลหลังประมวลผลข้อความด้วย pipeline เดียว (ดู UserStateStore.save)"""
+        pipe = self.redis.pipeline(transaction=False)
+        if session is not None:
+            appended = session[len(session) - min(new_messages, len(session)):]
+            self._append(
+                keys=[self.HASH_KEY.format(user_id)],
+                args=[time.time(), self.session_ttl, len(session), *(encode_entry(m, self.compact) for m in appended)],
+                client=pipe
+            )
+        self._queue_common(pipe, user_id, progress, follow_up_at, cache_usage)
+        if not len(pipe):
+            return
+        _add(trips)
+        pipe.execute()
+
+    def buffer_pending(self, user_id: str, message: str, max_messages: int, ttl: int,
+                       notice_ttl: int, trips: Optional[RoundTrips] = None) -> bool:
+        """พักข้อความที่เข้ามาระหว่างล็อค และจองการแจ้งเตือนรอในขั้นตอนเดียว (ดู UserStateStore.buffer_pending)"""
+        key = f"pending_messages:{user_id}"
+        pipe = self.redis.pipeline()
+        pipe.rpush(key, message)
+        pipe.ltrim(key, -max_messages, -1)
+        pipe.expire(key, ttl)
+        self._set_deadline(
+            keys=[self.HASH_KEY.format(user_id)],
+            args=['wn', time.time(), notice_ttl, self.session_timeout],
+            client=pipe
+        )
+        _add(trips)
+        *_, notice_set = pipe.execute()
+        return bool(notice_set)
+
+class AsyncUserStateStore(UserStateStore):
+    """
+    ตัวจัดการสถานะผู้ใช้แบบอะซิงโครนัส (ใช้ redis.asyncio) ด้วยคีย์และสคริปต์เดียวกับ UserStateStore
+    """
+    async def lock(self, user_id: str, trips: Optional[RoundTrips] = None) -> Optional[str]:
+        """ล็อคผู้ใช้ (ดู UserStateStore.lock)"""
+        token = uuid.uuid4().hex
+        _add(trips)
+        if await self.redis.set(f"message_lock:{user_id}", token, nx=True, ex=self.lock_timeout):
+            return token
+        return None
+
+    async def extend(self, user_id: str, token: str, trips: Optional[RoundTrips] = None) -> bool:
+        """ต่ออายุล็อคถ้ายังเป็นผู้ถือ (ดู UserStateStore.extend)"""
+        _add(trips)
+        return bool(await self._extend(keys=[f"message_lock:{user_id}"], args=[token, self.lock_timeout]))
+
+    async def release(self, user_id: str, token: str, trips: Optional[RoundTrips] = None) -> bool:
+        """ปลดล็อคผู้ใช้และตรวจสอบข้อความที่พักไว้ (ดู UserStateStore.release)"""
+        _add(trips)
+        return bool(await self._release(keys=[f"message_lock:{user_id}", f"pending_messages:{user_id}"],
+                                        args=[token]))
+
+    async def prepare(self, user_id: str, now: float, reply_token: Optional[Tuple[str, int]] = None,
+                      trips: Optional[RoundTrips] = None) -> Dict[str, Any]:
+        """เตรียมสถานะก่อนประมวลผลข้อความด้วยสคริปต์เดียว (ดู UserStateStore.prepare)"""
+        token_value, token_ttl = reply_token or ("", 0)
+        _add(trips)
+        timed_out, last_activity, warning_sent, entries, legacy = await self._prepare(
+            keys=[
+                f"wait_notice:{user_id}",
+                f"last_activity:{user_id}",
+                f"timeout_warning:{user_id}",
+                SESSION_KEY.format(user_id),
+                REPLY_TOKEN_KEY.format(user_id),
+                LEGACY_SESSION_KEY.format(user_id)
+            ],
+            args=[now, self.session_timeout, token_value, token_ttl]
+        )
+        return {
+            "timed_out": bool(timed_out),
+            "last_activity": float(last_activity) if last_activity else None,
+            "warning_sent": bool(warning_sent),
+            "session": await self._load_session(user_id, entries, legacy, trips)
+        }
+
+    async def _load_session(self, user_id: str, entries: Optional[List[str]], legacy: Optional[str],
+                            trips: Optional[RoundTrips] = None) -> List[Dict[str, Any]]:
+        """ถอดรหัสเซสชัน และเขียนเซสชัน JSON เดิมใหม่ (ดู UserStateStore._load_session)"""
+        if entries:
+            return decode_entries(entries)
+        session = decode_session(legacy)
+        if session:
+            try:
+                _add(trips)
+                await self._rewrite_session(user_id, session)
+                metrics.inc('chat_session_migrations_total')
+            except Exception as e:
+                logging.warning(f"เขียนเซสชันเดิมของ {user_id} ใหม่ไม่สำเร็จ: {str(e)}")
+        return session
+
+    async def _rewrite_session(self, user_id: str, session: List[Dict[str, Any]]):
+        pipe = self.redis.pipeline(transaction=True)
+        queue_session_write(pipe, user_id, session, len(session), self.session_ttl, self.compact, rewrite=True)
+        await pipe.execute()
+
+    async def get_session(self, user_id: str) -> List[Dict[str, Any]]:
+        """ดึงเซสชันการแชทของผู้ใช้ (ดู UserStateStore.get_session)"""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.lrange(SESSION_KEY.format(user_id), 0, -1)
+        pipe.get(LEGACY_SESSION_KEY.format(user_id))
+        entries, legacy = await pipe.execute()
+        return await self._load_session(user_id, entries, legacy)
+
+    async def clear_session(self, user_id: str):
+        """ลบเซสชันการแชทของผู้ใช้"""
+        await self.redis.delete(SESSION_KEY.format(user_id), LEGACY_SESSION_KEY.format(user_id))
+
+    async def get_progress(self, user_id: str) -> List[Dict[str, Any]]:
+        """ดึงข้อมูลความก้าวหน้าทั้งหมดของผู้ใช้ (ล่าสุดก่อน)"""
+        return [json.loads(item) for item in await self.redis.lrange(f"progress:{user_id}", 0, -1)]
+
+    async def mark_warning_sent(self, user_id: str, ttl: int = 86400, trips: Optional[RoundTrips] = None):
+        """บันทึกว่าได้ส่งการแจ้งเตือนเซสชันใกล้หมดอายุแล้ว"""
+        _add(trips)
+        await self.redis.setex(f"timeout_warning:{user_id}", ttl, "1")
+
+    async def save(self,
+                   user_id: str,
+                   session: Optional[List[Dict[str, Any]]] = None,
+                   new_messages: int = 0,
+                   progress: Optional[Dict[str, Any]] = None,
+                   follow_up_at: Optional[float] = None,
+                   cache_usage: Optional[Dict[str, Any]] = None,
+                   trips: Optional[RoundTrips] = None):
+        """บันทึกผลหลังประมวลผลข้อความด้วย pipeline เดียว (ดู UserStateStore.save)"""
+        pipe = self.redis.pipeline(transaction=False)
+        if session is not None:
+            queue_session_write(pipe, user_id, session, new_messages, self.session_ttl, self.compact)
+        self._queue_common(pipe, user_id, progress, follow_up_at, cache_usage)
+        if not len(pipe):
+            return
+        _add(trips)
+        await pipe.execute()
+
+    async def buffer_pending(self, user_id: str, message: str, max_messages: int, ttl: int,
+                             notice_ttl: int, trips: Optional[RoundTrips] = None) -> bool:
+        """พักข้อความที่เข้ามาระหว่างล็อค และจองการแจ้งเตือนรอ (ดู UserStateStore.buffer_pending)"""
+        key = f"pending_messages:{user_id}"
+        pipe = self.redis.pipeline()
+        pipe.rpush(key, message)
+        pipe.ltrim(key, -max_messages, -1)
+        pipe.expire(key, ttl)
+        pipe.set(f"wait_notice:{user_id}", "1", nx=True, ex=notice_ttl)
+        _add(trips)
+        *_, notice_set = await pipe.execute()
+        return bool(notice_set)
+
+    async def drain_pending(self, user_id: str, trips: Optional[RoundTrips] = None) -> List[str]:
+        """ดึงและลบข้อความที่พักไว้ทั้งหมดในขั้นตอนเดียว (ดู UserStateStore.drain_pending)"""
+        key = f"pending_messages:{user_id}"
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        _add(trips)
+        pending, _ = await pipe.execute()
+        return pending
+
+class AsyncHashUserStateStore(AsyncUserStateStore, HashUserStateStore):
+    """
+    ตัวจัดการสถานะผู้ใช้แบบแฮชเดียวต่อผู้ใช้แบบอะซิงโครนัส (ดู HashUserStateStore)
+    ใช้สคริปต์ของ HashUserStateStore และเมธอดที่ไม่ขึ้นกับรูปแบบการจัดเก็บจาก AsyncUserStateStore
+    (_load_session, get_progress, drain_pending)
+    """
+    async def lock(self, user_id: str, trips: Optional[RoundTrips] = None) -> Optional[str]:
+        """ล็อคผู้ใช้ด้วยฟิลด์กำหนดเวลา lk และโทเค็นผู้ถือ lo (ดู HashUserStateStore.lock)"""
+        token = uuid.uuid4().hex
+        _add(trips)
+        if await self._acquire(keys=[self.HASH_KEY.format(user_id)],
+                               args=[token, time.time(), self.lock_timeout, self.session_timeout]):
+            return token
+        return None
+
+    async def extend(self, user_id: str, token: str, trips: Optional[RoundTrips] = None) -> bool:
+        """ต่ออายุล็อคถ้ายังเป็นผู้ถือ (ดู HashUserStateStore.extend)"""
+        _add(trips)
+        return bool(await self._extend(keys=[self.HASH_KEY.format(user_id)],
+                                       args=[token, time.time(), self.lock_timeout]))
+
+    async def release(self, user_id: str, token: str, trips: Optional[RoundTrips] = None) -> bool:
+        """ปลดล็อคผู้ใช้และตรวจสอบข้อความที่พักไว้ (ดู HashUserStateStore.release)"""
+        _add(trips)
+        return bool(await self._release(keys=[self.HASH_KEY.format(user_id), f"pending_messages:{user_id}"],
+                                        args=[token]))
+
+    async def prepare(self, user_id: str, now: float, reply_token: Optional[Tuple[str, int]] = None,
+                      trips: Optional[RoundTrips] = None) -> Dict[str, Any]:
+        """เตรียมสถานะก่อนประมวลผลข้อความด้วยสคริปต์เดียว (ดู UserStateStore.prepare)"""
+        token_value, token_ttl = reply_token or ("", 0)
+        _add(trips)
+        timed_out, last_activity, warning_sent, entries, legacy = await self._prepare(
+            keys=[self.HASH_KEY.format(user_id), REPLY_TOKEN_KEY.format(user_id)],
+            args=[now, self.session_timeout, token_value, token_ttl]
+        )
+        return {
+            "timed_out": bool(timed_out),
+            "last_activity": float(last_activity) if last_activity else None,
+            "warning_sent": bool(warning_sent),
+            "session": await self._load_session(user_id, entries.split('\n') if entries else None, legacy, trips)
+        }
+
+    async def _rewrite_session(self, user_id: str, session: List[Dict[str, Any]]):
+        await self._append(
+            keys=[self.HASH_KEY.format(user_id)],
+            args=[time.time(), self.session_ttl, len(session), *(encode_entry(m, self.compact) for m in session)]
+        )
+
+    async def get_session(self, user_id: str) -> List[Dict[str, Any]]:
+        """ดึงเซสชันการแชทของผู้ใช้ (ดู HashUserStateStore.get_session)"""
+        entries, legacy, deadline = await self.redis.hmget(self.HASH_KEY.format(user_id), 'm', 's', 'se')
+        if not deadline or float(deadline) <= time.time():
+            return []
+        return await self._load_session(user_id, entries.split('\n') if entries else None, legacy)
+
+    async def clear_session(self, user_id: str):
+        """ลบเซสชันการแชทของผู้ใช้"""
+        await self.redis.hdel(self.HASH_KEY.format(user_id), 'm', 'se', 's')
+
+    async def mark_warning_sent(self, user_id: str, ttl: int = 86400, trips: Optional[RoundTrips] = None):
+        """บันทึกว่าได้ส่งการแจ้งเตือนเซสชันใกล้หมดอายุแล้ว"""
+        _add(trips)
+        await self.redis.hset(self.HASH_KEY.format(user_id), 'tw', time.time() + ttl)
+
+    async def save(self,
+                   user_id: str,
+                   session: Optional[List[Dict[str, Any]]] = None,
+                   new_messages: int = 0,
+                   progress: Optional[Dict[str, Any]] = None,
+                   follow_up_at: Optional[float] = None,
+                   cache_usage: Optional[Dict[str, Any]] = None,
+                   trips: Optional[RoundTrips] = None):
+        """บันทึกผลหลังประมวลผลข้อความด้วย pipeline เดียว (ดู HashUserStateStore.save)"""
+        pipe = self.redis.pipeline(transaction=False)
+        if session is not None:
+            appended = session[len(session) - min(new_messages, len(session)):]
+            await self._append(
+                keys=[self.HASH_KEY.format(user_id)],
+                args=[time.time(), self.session_ttl, len(session), *(encode_entry(m, self.compact) for m in appended)],
+                client=pipe
+            )
+        self._queue_common(pipe, user_id, progress, follow_up_at, cache_usage)
+        if not len(pipe):
+            return
+        _add(trips)
+        await pipe.execute()
+
+    async def buffer_pending(self, user_id: str, message: str, max_messages: int, ttl: int,
+                             notice_ttl: int, trips: Optional[RoundTrips] = None) -> bool:
+        """พักข้อความที่เข้ามาระหว่างล็อค และจองการแจ้งเตือนรอ (ดู HashUserStateStore.buffer_pending)"""
+        key = f"pending_messages:{user_id}"
+        pipe = self.redis.pipeline()
+        pipe.rpush(key, message)
+        pipe.ltrim(key, -max_messages, -1)
+        pipe.expire(key, ttl)
+        await self._set_deadline(
+            keys=[self.HASH_KEY.format(user_id)],
+            args=['wn', time.time(), notice_ttl, self.session_timeout],
+            client=pipe
+        )
+        _add(trips)
+        *_, notice_set = await pipe.execute()
+        return bool(notice_set)
+
+USER_STATE_LAYOUTS = {
+    'keys': UserStateStore,
+    'hash': HashUserStateStore
+}
+
+ASYNC_USER_STATE_LAYOUTS = {
+    'keys': AsyncUserStateStore,
+    'hash': AsyncHashUserStateStore
+}
+
+def create_user_state_store(redis_client, layout: str = 'keys', asynchronous: bool = False,
+                            **kwargs) -> UserStateStore:
+    """
+    สร้างตัวจัดการสถานะผู้ใช้ตามรูปแบบการจัดเก็บ
+
+    Args:
+        redis_client (redis.Redis | redis.asyncio.Redis): การเชื่อมต่อ Redis (decode_responses=True)
+        layout (str): 'keys' (หนึ่งคีย์ต่อข้อมูล) หรือ 'hash' (แฮชเดียวต่อผู้ใช้)
+        asynchronous (bool): สร้างตัวจัดการแบบอะซิงโครนัส (redis_client ต้องเป็น redis.asyncio.Redis)
+        **kwargs: อาร์กิวเมนต์ของ UserStateStore
+
+    Returns:
+        UserStateStore: ตัวจัดการสถานะผู้ใช้
+    """
+    layouts = ASYNC_USER_STATE_LAYOUTS if asynchronous else USER_STATE_LAYOUTS
+    if layout not in layouts:
+        raise ValueError(f"unknown user state layout: {layout}")
+    return layouts[layout](redis_client, **kwargs)
@@ -8,6 +8,8 @@ import traceback
 import time
 from typing import Callable, Any, TypeVar, cast, Dict
 
+from .keywords import keyword_matcher
+
 # ตัวแปรประเภทสำหรับฟังก์ชัน
 F = TypeVar('F', bound=Callable[..., Any])
 
@@ -158,31 +160,5 @@ def calculate_message_priority(message: str) -> int:
     Returns:
         int: คะแนนความสำคัญ (1-10)
     """
-    priority = 5  # ค่าความสำคัญเริ่มต้นปานกลาง
-    
-    # คำที่บ่งชี้ความสำคัญสูง
-    high_priority_words = [
-        'ฆ่าตัวตาย', 'ทำร้ายตัวเอง', 'อยากตาย', 'overdose', 'od', 'ฉุกเฉิน', 
-        'ช่วยด่วน', 'เลือดออก', 'หายใจไม่ออก', 'โคม่า', 'ชัก'
-    ]
-    
-    # คำที่บ่งชี้ความสำคัญปานกลาง
-    medium_priority_words = [
-        'เครียด', 'ซึมเศร้า', 'กังวล', 'ไม่อยากมีชีวิตอยู่', 'ทรมาน',
-        'เสพติด', 'กลับไปเสพ', 'อยากเสพ', 'cravings'
-    ]
-    
-    # ตรวจสอบคำสำคัญ
-    message_lower = message.lower()
-    
-    # เพิ่มความสำคัญตามคำที่พบ
-    for word in high_priority_words:
-        if word in message_lower:
-            priority += 3
-    
-    for word in medium_priority_words:
-        if word in message_lower:
-            priority += 1
-    
-    # จำกัดค่าสูงสุดที่ 10
-    return min(priority, 10)
\ No newline at end of file
+    # คะแนนเริ่มต้น 5 บวกน้ำหนักของคำสำคัญที่พบ (ทะเบียนใน keywords.py) จำกัดไม่เกิน 10
+    return keyword_matcher.scan(message).priority
\ No newline at end of file
@@ -0,0 +1,46 @@
+"""
+จุดเริ่มต้น ASGI สำหรับแชทบอท 'ใจดี'
+ไฟล์นี้ใช้สำหรับรันไปป์ไลน์ข้อความแบบอะซิงโครนัสทั้งหมด
+ด้วยเซิร์ฟเวอร์ ASGI เช่น Uvicorn (โหมด WSGI ยังคงใช้งานได้ผ่าน wsgi.py)
+"""
+import os
+import sys
+import logging
+from dotenv import load_dotenv
+
+# เพิ่มไดเรกทอรีปัจจุบันลงในเส้นทางระบบ
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# โหลดตัวแปรสภาพแวดล้อมจากไฟล์ .env
+load_dotenv()
+
+# ตั้งค่า logging
+logging.basicConfig(
+    level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO')),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('asgi.log'),
+        logging.StreamHandler()
+    ]
+)
+
+try:
+    # นำเข้าแอป ASGI (การติดตามผลตรวจสอบเป็นรอบบน event loop ของแอปเอง)
+    from app.asgi_app import app
+    
+except Exception as e:
+    logging.critical(f"เกิดข้อผิดพลาดร้ายแรงในการเริ่มต้นแอปพลิเคชัน: {str(e)}")
+    raise
+
+# สำหรับ Uvicorn: uvicorn asgi:application
+application = app
+
+# สำหรับการรันโดยตรง
+if __name__ == "__main__":
+    import uvicorn
+    
+    # กำหนดพอร์ตจากตัวแปรสภาพแวดล้อมหรือใช้ค่าเริ่มต้น
+    port = int(os.getenv('PORT', 5000))
+    
+    logging.info(f"เริ่มต้นเซิร์ฟเวอร์ Uvicorn บนพอร์ต {port}")
+    uvicorn.run(app, host='0.0.0.0', port=port)
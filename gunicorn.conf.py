@@ -0,0 +1,47 @@
+"""
+การตั้งค่า Gunicorn สำหรับแชทบอท 'ใจดี'
+โหลดตัวตัดคำ cl100k_base ครั้งเดียวในโปรเซสหลักก่อน fork เพื่อให้ worker ทุกตัวใช้หน่วยความจำร่วมกัน
+(copy-on-write) และไม่ต้องโหลดหรือดาวน์โหลดซ้ำตอนเริ่มต้น
+
+ตัวอย่าง:
+    gunicorn -c gunicorn.conf.py wsgi:application
+"""
+import os
+import time
+import hashlib
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = 'gthread'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+
+# ต้องตรงกับ ENCODING_URL ใน app/token_counter.py (ไม่ import แพ็กเกจ app ในโปรเซสหลัก
+# เพราะ app/__init__.py ตั้งค่า logging และเปิด app.log ก่อน fork)
+ENCODING_URL = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.tiktoken_cache')
+
+def on_starting(server):
+    """โหลดตัวตัดคำเข้ารีจิสทรีของ tiktoken ก่อน fork (worker ได้รับสำเนาผ่าน copy-on-write)"""
+    cache_dir = os.environ.setdefault('TIKTOKEN_CACHE_DIR', DEFAULT_CACHE_DIR)
+    offline = os.getenv('TOKENIZER_OFFLINE', 'false').lower() == 'true'
+    cache_file = os.path.join(cache_dir, hashlib.sha1(ENCODING_URL.encode()).hexdigest())
+    if offline and not os.path.exists(cache_file):
+        server.log.warning(f"ไม่พบไฟล์ตัวตัดคำใน {cache_dir} (offline) worker จะใช้การนับโทเค็นแบบประมาณ")
+        return
+    start_time = time.perf_counter()
+    try:
+        import tiktoken
+        tiktoken.get_encoding("cl100k_base")
+        server.log.info(f"โหลดตัวตัดคำ cl100k_base ก่อน fork ใน {time.perf_counter() - start_time:.2f} วินาที")
+    except Exception as e:
+        # worker จะลองโหลดเองเมื่อใช้งานครั้งแรก (และใช้ตัวประมาณถ้าไม่สำเร็จ)
+        server.log.warning(f"โหลดตัวตัดคำก่อน fork ไม่สำเร็จ: {str(e)}")
+
+def post_fork(server, worker):
+    """บันทึกเวลาที่ fork เพื่อให้ wsgi.py รายงานเวลาเริ่มต้นของ worker"""
+    os.environ['WORKER_FORKED_AT'] = str(time.time())
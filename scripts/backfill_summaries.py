@@ -0,0 +1,107 @@
+"""
+งาน backfill สรุปการสนทนาแบบสะสมสำหรับแชทบอท 'ใจดี'
+สร้างหรือปรับปรุงสรุปของผู้ใช้ที่มีการสนทนานอกหน้าต่างล่าสุดซึ่งยังไม่ถูกรวมในสรุป
+โดยเรียก DeepSeek พร้อมกันแบบจำกัดจำนวน และบันทึกผลทันทีที่แต่ละรายการเสร็จ
+
+ตัวอย่าง:
+    python scripts/backfill_summaries.py --limit 500 --concurrency 8 --http2
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+# เพิ่มไดเรกทอรีหลักของโปรเจกต์ลงในเส้นทางระบบ
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(
+    level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO')),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+def parse_args():
+    """อ่านอาร์กิวเมนต์จากบรรทัดคำสั่ง"""
+    parser = argparse.ArgumentParser(description="Backfill rolling conversation summaries")
+    parser.add_argument('--limit', type=int, default=1000, help="จำนวนผู้ใช้สูงสุดที่ประมวลผล")
+    parser.add_argument('--concurrency', type=int, default=8, help="จำนวนคำขอ DeepSeek พร้อมกัน")
+    parser.add_argument('--timeout', type=float, default=90.0, help="เวลาสูงสุดต่อผู้ใช้ (วินาที)")
+    parser.add_argument('--http2', action='store_true', help="ใช้ HTTP/2 กับ DeepSeek (ต้องติดตั้ง h2)")
+    parser.add_argument('--dry-run', action='store_true', help="แสดงจำนวนผู้ใช้ที่ต้องสรุปโดยไม่เรียก API")
+    return parser.parse_args()
+
+def iter_items(core, user_ids):
+    """
+    สร้างรายการสำหรับ stream_message_batch ทีละผู้ใช้ (ดึงจากฐานข้อมูลเมื่อมีช่องว่างเท่านั้น)
+
+    Yields:
+        dict: รายการที่มี id (user_id, ID การสนทนาล่าสุดที่รวมในสรุป), messages และ config
+    """
+    summarizer = core.summarizer
+    for user_id in user_ids:
+        summary, version = summarizer.get(user_id)
+        turns = core.db.get_turns_outside_window(
+            user_id, version, summarizer.recent_window, summarizer.max_turns_per_refresh
+        )
+        if not turns or len(turns) < summarizer.min_new_turns:
+            continue
+        yield {
+            "id": (user_id, turns[-1][0]),
+            "messages": summarizer.build_prompt(summary, turns),
+            "config": summarizer.generation_config
+        }
+
+async def backfill(core, user_ids, args):
+    """เรียก DeepSeek แบบจำกัดจำนวนพร้อมกัน และบันทึกสรุปทันทีที่แต่ละรายการเสร็จ"""
+    from app.async_api import AsyncDeepseekClient
+
+    client = await AsyncDeepseekClient(
+        core.config.DEEPSEEK_API_KEY,
+        max_connections=args.concurrency,
+        max_keepalive_connections=args.concurrency,
+        http2=args.http2
+    ).setup()
+    saved = failed = 0
+    start_time = time.monotonic()
+    try:
+        async for result in client.stream_message_batch(
+            iter_items(core, user_ids),
+            core.summarizer.system_message,
+            max_concurrency=args.concurrency,
+            item_timeout=args.timeout
+        ):
+            user_id, last_conversation_id = result["id"]
+            if not result["success"]:
+                failed += 1
+                logging.warning(f"สรุปของ {user_id} ล้มเหลว: {result['error']}")
+                continue
+            summary = result["response"]["choices"][0]["message"]["content"]
+            await asyncio.to_thread(core.db.save_conversation_summary, user_id, summary, last_conversation_id)
+            saved += 1
+            logging.info(f"บันทึกสรุปของ {user_id} (เวอร์ชัน {last_conversation_id}, {result['latency']:.1f} วินาที)")
+    finally:
+        await client.close()
+    logging.info(f"backfill เสร็จสิ้น: สำเร็จ {saved}, ล้มเหลว {failed}, "
+                 f"ใช้เวลา {time.monotonic() - start_time:.1f} วินาที")
+
+def main():
+    args = parse_args()
+    from app import app_deepseek as core
+
+    user_ids = core.db.get_users_needing_summary(
+        recent_window=core.summarizer.recent_window,
+        min_new_turns=core.summarizer.min_new_turns,
+        limit=args.limit
+    ) or []
+    logging.info(f"พบผู้ใช้ที่ต้องปรับปรุงสรุป {len(user_ids)} คน")
+    if args.dry_run or not user_ids:
+        return
+    asyncio.run(backfill(core, user_ids, args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+เปรียบเทียบความเร็วของการค้นหาคำสำคัญแบบเดิม (วน `keyword in text` สามรายการแยกกัน)
+กับ KeywordMatcher ที่ให้ผลทั้งสามอย่างในการค้นหาครั้งเดียว
+(automaton ของ pyahocorasick และแบบค้นหาทีละคำในทะเบียนเมื่อไม่ได้ติดตั้ง)
+และนับข้อความที่ผลต่างจากแบบเดิม (เช่น 'od' ที่เคยตรงกับคำอังกฤษทั่วไป และรายการคำที่ไม่ตรงกัน)
+
+ตัวอย่าง:
+    python scripts/benchmark_keywords.py --count 20000
+    python scripts/benchmark_keywords.py --input exported_messages.txt
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+# เพิ่มไดเรกทอรีหลักของโปรเจกต์ลงในเส้นทางระบบ
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.keywords import KEYWORDS, KeywordMatcher, keyword_matcher
+from benchmark_token_counter import ENGLISH_SENTENCES, THAI_SENTENCES
+
+# ประโยคที่มีคำสำคัญ (รวมคำอังกฤษที่มี 'od' อยู่ข้างใน)
+KEYWORD_SENTENCES = [
+    "เมื่อคืนกินยาเกินขนาดไปนิดหน่อย ตอนนี้ยังมึนอยู่",
+    "เครียดมากจนนอนไม่หลับหลายวันแล้ว",
+    "บางทีก็รู้สึกว่าไม่อยากมีชีวิตอยู่",
+    "I think I might OD if this keeps going.",
+    "Good food and a good mood helped today.",
+    "อยากเสพมากตอนเย็น cravings มาแรงมาก",
+    "ฉุกเฉิน เพื่อนหายใจไม่ออก ต้องทำยังไง",
+]
+
+# รายการคำเดิมก่อนรวมเป็นทะเบียนเดียว
+OLD_RISK_KEYWORDS = {
+    'high_risk': ['ฆ่าตัวตาย', 'ทำร้ายตัวเอง', 'อยากตาย', 'เกินขนาด', 'overdose', 'od',
+                  'เลือดออก', 'ชัก', 'หมดสติ'],
+    'medium_risk': ['นอนไม่หลับ', 'เครียด', 'กังวล', 'ซึมเศร้า', 'เหงา', 'ท้อแท้']
+}
+OLD_HIGH_PRIORITY = ['ฆ่าตัวตาย', 'ทำร้ายตัวเอง', 'อยากตาย', 'overdose', 'od', 'ฉุกเฉิน',
+                     'ช่วยด่วน', 'เลือดออก', 'หายใจไม่ออก', 'โคม่า', 'ชัก']
+OLD_MEDIUM_PRIORITY = ['เครียด', 'ซึมเศร้า', 'กังวล', 'ไม่อยากมีชีวิตอยู่', 'ทรมาน',
+                       'เสพติด', 'กลับไปเสพ', 'อยากเสพ', 'cravings']
+OLD_IMPORTANT = ['ฆ่าตัวตาย', 'ทำร้ายตัวเอง', 'อยากตาย', 'overdose', 'เกินขนาด', 'ก้าวร้าว',
+                 'ซึมเศร้า', 'วิตกกังวล', 'ความทรงจำ', 'ไม่มีความสุข', 'ทรมาน', 'เครียด',
+                 'เลิก', 'หยุด', 'อดทน']
+
+def old_assess_risk(message):
+    message = message.lower()
+    matched = [k for k in OLD_RISK_KEYWORDS['high_risk'] if k in message]
+    if matched:
+        return 'high', matched
+    matched = [k for k in OLD_RISK_KEYWORDS['medium_risk'] if k in message]
+    return ('medium' if matched else 'low'), matched
+
+def old_priority(message):
+    message = message.lower()
+    priority = 5
+    priority += 3 * sum(1 for word in OLD_HIGH_PRIORITY if word in message)
+    priority += sum(1 for word in OLD_MEDIUM_PRIORITY if word in message)
+    return min(priority, 10)
+
+def old_important(text):
+    text = text.lower()
+    return any(keyword.lower() in text for keyword in OLD_IMPORTANT)
+
+def parse_args():
+    """อ่านอาร์กิวเมนต์จากบรรทัดคำสั่ง"""
+    parser = argparse.ArgumentParser(description="Benchmark keyword loops vs the Aho-Corasick matcher")
+    parser.add_argument('--input', help="ไฟล์ข้อความ (หนึ่งข้อความต่อบรรทัด) แทนข้อมูลจำลอง")
+    parser.add_argument('--count', type=int, default=10000, help="จำนวนข้อความจำลอง")
+    parser.add_argument('--keyword-ratio', type=float, default=0.2, help="สัดส่วนประโยคที่มีคำสำคัญ")
+    parser.add_argument('--repeat', type=int, default=5, help="จำนวนรอบต่อวิธี (รายงานค่ามัธยฐาน)")
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args()
+
+def synthetic_messages(count, keyword_ratio, seed):
+    """สร้างข้อความจำลอง 1-6 ประโยค ผสมภาษาไทย อังกฤษ และประโยคที่มีคำสำคัญ"""
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        sentences = []
+        for _ in range(rng.randint(1, 6)):
+            if rng.random() < keyword_ratio:
+                sentences.append(rng.choice(KEYWORD_SENTENCES))
+            else:
+                sentences.append(rng.choice(THAI_SENTENCES if rng.random() < 0.8 else ENGLISH_SENTENCES))
+        messages.append(" ".join(sentences))
+    return messages
+
+def measure(fn, texts, repeat):
+    """มัธยฐานของเวลาต่อข้อความ (ไมโครวินาที)"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            fn(text)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) / len(texts) * 1e6
+
+def main():
+    args = parse_args()
+    if args.input:
+        with open(args.input, encoding='utf-8') as f:
+            texts = [line.rstrip('\n') for line in f if line.strip()]
+    else:
+        texts = synthetic_messages(args.count, args.keyword_ratio, args.seed)
+
+    chars = sum(len(t) for t in texts)
+    print(f"ข้อความ {len(texts)} ข้อความ, เฉลี่ย {chars / len(texts):.0f} ตัวอักษร, รอบละ {args.repeat} ครั้ง (มัธยฐาน)")
+    print(f"{'วิธี':<34}{'ไมโครวินาที/ข้อความ':>22}")
+    rows = [
+        ("loops: assess_risk", old_assess_risk),
+        ("loops: priority", old_priority),
+        ("loops: importance", old_important),
+        ("loops: all three", lambda t: (old_assess_risk(t), old_priority(t), old_important(t))),
+        ("matcher: substring (all three)", KeywordMatcher(KEYWORDS, use_automaton=False).scan),
+    ]
+    if keyword_matcher.backend == 'aho-corasick':
+        rows.append(("matcher: aho-corasick (all three)", keyword_matcher.scan))
+    else:
+        print("ไม่พบ pyahocorasick: วัดเฉพาะแบบค้นหาทีละคำ")
+    results = {}
+    for name, fn in rows:
+        results[name] = measure(fn, texts, args.repeat)
+        print(f"{name:<34}{results[name]:>22.2f}")
+    for name, _ in rows[4:]:
+        print(f"{name}: เร็วขึ้น {results['loops: all three'] / results[name]:.2f}x เมื่อต้องการผลทั้งสามอย่าง")
+
+    changed = {'risk_level': 0, 'priority': 0, 'important': 0}
+    for text in texts:
+        scan = keyword_matcher.scan(text)
+        changed['risk_level'] += scan.risk_level != old_assess_risk(text)[0]
+        changed['priority'] += scan.priority != old_priority(text)
+        changed['important'] += scan.important != old_important(text)
+    print("ข้อความที่ผลต่างจากแบบเดิม: " + ", ".join(f"{k} {v}" for k, v in changed.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+เปรียบเทียบความเร็วการนับโทเค็นแบบทีละข้อความกับแบบ batch (tiktoken encode_ordinary_batch บนกลุ่มเธรด)
+ใช้ข้อมูลบทสนทนาภาษาไทยและอังกฤษ: จากไฟล์ (หนึ่งข้อความต่อบรรทัด) หรือข้อมูลจำลองตามสัดส่วนที่กำหนด
+ทุกการวัดปิดแคช (cache_bytes=0) ยกเว้นแถว warm cache และตรวจว่าจำนวนโทเค็นตรงกันทุกวิธี
+
+ตัวอย่าง:
+    python scripts/benchmark_token_counter.py --count 5000 --threads 1 2 4 8
+    python scripts/benchmark_token_counter.py --input exported_messages.txt
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+# เพิ่มไดเรกทอรีหลักของโปรเจกต์ลงในเส้นทางระบบ
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.token_counter import TokenCounter
+
+THAI_SENTENCES = [
+    "ช่วงนี้นอนไม่ค่อยหลับเลยค่ะ คิดเรื่องเดิมวนไปวนมา",
+    "อยากเลิกให้ได้จริงๆ แต่พอเครียดก็กลับไปใช้อีก",
+    "เข้าใจค่ะ ความอยากมักเกิดขึ้นเป็นช่วงๆ และจะค่อยๆ ลดลงถ้าเราไม่ตอบสนองมัน",
+    "ลองสังเกตดูว่าสถานการณ์แบบไหนที่ทำให้รู้สึกอยากมากที่สุด",
+    "การออกกำลังกายเบาๆ และการหายใจช้าๆ ช่วยให้ร่างกายผ่อนคลายได้",
+    "ถ้ารู้สึกไม่ปลอดภัย สามารถโทรสายด่วน 1165 ได้ตลอด 24 ชั่วโมงนะคะ",
+    "เมื่อวานทะเลาะกับที่บ้าน รู้สึกเหงาและท้อแท้มาก",
+    "คุณทำได้ดีมากแล้วที่กล้าเล่าเรื่องนี้ให้ฟัง",
+    "ผลกระทบของยาบ้าต่อร่างกายมีทั้งระยะสั้นและระยะยาว เช่น หัวใจเต้นเร็วและนอนไม่หลับ",
+    "วันนี้ผ่านมาได้ 14 วันแล้วที่ไม่ได้ใช้ รู้สึกภูมิใจกับตัวเอง",
+]
+
+ENGLISH_SENTENCES = [
+    "I have been trying to quit for three weeks now.",
+    "Cravings usually peak and then fade within twenty minutes.",
+    "Could you suggest some ways to handle stress at work?",
+    "It's okay to have setbacks; what matters is getting back on track.",
+    "Try writing down your triggers and what you did instead.",
+    "Call the hotline if you ever feel unsafe, day or night.",
+]
+
+def parse_args():
+    """อ่านอาร์กิวเมนต์จากบรรทัดคำสั่ง"""
+    parser = argparse.ArgumentParser(description="Benchmark per-item vs batched token counting")
+    parser.add_argument('--input', help="ไฟล์ข้อความ (หนึ่งข้อความต่อบรรทัด) แทนข้อมูลจำลอง")
+    parser.add_argument('--count', type=int, default=2000, help="จำนวนข้อความจำลอง")
+    parser.add_argument('--thai-ratio', type=float, default=0.8, help="สัดส่วนข้อความภาษาไทยในข้อมูลจำลอง")
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8], help="จำนวนเธรดที่ทดสอบ")
+    parser.add_argument('--repeat', type=int, default=5, help="จำนวนรอบต่อวิธี (รายงานค่ามัธยฐาน)")
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args()
+
+def synthetic_messages(count, thai_ratio, seed):
+    """
+    สร้างข้อความจำลองสลับผู้ใช้ (สั้น 1-3 ประโยค) และบอท (ยาว 4-15 ประโยค)
+
+    Returns:
+        List[str]: ข้อความจำลอง
+    """
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        pool = THAI_SENTENCES if rng.random() < thai_ratio else ENGLISH_SENTENCES
+        sentences = rng.randint(1, 3) if i % 2 == 0 else rng.randint(4, 15)
+        # เลขลำดับทำให้แต่ละข้อความไม่ซ้ำกัน (ไม่วัดผลของการรวมข้อความซ้ำ)
+        messages.append(f"{i} " + " ".join(rng.choice(pool) for _ in range(sentences)))
+    return messages
+
+def measure(fn, repeat):
+    """รันฟังก์ชันตามจำนวนรอบ แล้วคืนเวลามัธยฐาน (วินาที) และผลลัพธ์รอบสุดท้าย"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+def main():
+    args = parse_args()
+    if args.input:
+        with open(args.input, encoding='utf-8') as f:
+            texts = [line.rstrip('\n') for line in f if line.strip()]
+    else:
+        texts = synthetic_messages(args.count, args.thai_ratio, args.seed)
+
+    cold = TokenCounter(cache_bytes=0)
+    if not cold.use_tiktoken:
+        print("ไม่พบ tiktoken: ทั้งสองวิธีใช้ตัวประมาณแบบทีละข้อความ ผลการเปรียบเทียบไม่มีความหมาย")
+
+    chars = sum(len(t) for t in texts)
+    print(f"ข้อความ {len(texts)} ข้อความ, {chars} ตัวอักษร, รอบละ {args.repeat} ครั้ง (มัธยฐาน)")
+    print(f"{'วิธี':<22}{'มิลลิวินาที':>14}{'ข้อความ/วินาที':>18}{'เร็วขึ้น':>10}")
+
+    baseline, expected = measure(lambda: [cold._count_single_text(t) for t in texts], args.repeat)
+    print(f"{'loop':<22}{baseline * 1000:>14.1f}{len(texts) / baseline:>18.0f}{1.0:>9.2f}x")
+
+    for threads in args.threads:
+        elapsed, counts = measure(lambda: cold.count_tokens_batch(texts, num_threads=threads), args.repeat)
+        if counts != expected:
+            print(f"batch x{threads}: จำนวนโทเค็นไม่ตรงกับแบบทีละข้อความ")
+        print(f"{f'batch x{threads}':<22}{elapsed * 1000:>14.1f}{len(texts) / elapsed:>18.0f}"
+              f"{baseline / elapsed:>9.2f}x")
+
+    warm = TokenCounter()
+    warm.count_tokens_batch(texts)
+    elapsed, _ = measure(lambda: warm.count_tokens_batch(texts), args.repeat)
+    print(f"{'batch (warm cache)':<22}{elapsed * 1000:>14.1f}{len(texts) / elapsed:>18.0f}{baseline / elapsed:>9.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+วัดความแม่นยำและความเร็วของตัวประมาณจำนวนโทเค็น (ใช้เมื่อไม่มี tiktoken หรือ TOKEN_COUNTER_MODE=estimate)
+เทียบตัวประมาณแบบ regex เดิม, TokenEstimator (ค่าเริ่มต้นและไฟล์สัมประสิทธิ์ที่ปรับเทียบแล้ว) และ tiktoken
+
+ค่าอ้างอิง: จำนวนโทเค็นจริงของ DeepSeek จากคลังตัวอย่าง (--corpus จาก calibrate_token_estimator.py collect)
+หรือจำนวนโทเค็นของ tiktoken เมื่อใช้ข้อความจากไฟล์ (--input) หรือข้อมูลจำลอง
+รายงานความคลาดเคลื่อนสัมพัทธ์ต่อข้อความ (ค่ามัธยฐาน, p90, p99), ความเอนเอียงของผลรวม และข้อความต่อวินาที
+
+ตัวอย่าง:
+    python scripts/benchmark_token_estimator.py --corpus token_corpus.jsonl --coefficients token_estimator.json
+    python scripts/benchmark_token_estimator.py --count 5000
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+# เพิ่มไดเรกทอรีหลักของโปรเจกต์ลงในเส้นทางระบบ
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.token_counter import TokenCounter, TokenEstimator
+from benchmark_token_counter import synthetic_messages
+
+def parse_args():
+    """อ่านอาร์กิวเมนต์จากบรรทัดคำสั่ง"""
+    parser = argparse.ArgumentParser(description="Benchmark token estimator accuracy and throughput")
+    parser.add_argument('--corpus', help="คลังตัวอย่าง JSONL ที่มีจำนวนโทเค็นจริงของ DeepSeek")
+    parser.add_argument('--input', help="ไฟล์ข้อความ (หนึ่งข้อความต่อบรรทัด) เทียบกับ tiktoken")
+    parser.add_argument('--coefficients', help="ไฟล์สัมประสิทธิ์จาก calibrate_token_estimator.py fit")
+    parser.add_argument('--count', type=int, default=2000, help="จำนวนข้อความจำลอง")
+    parser.add_argument('--thai-ratio', type=float, default=0.8, help="สัดส่วนข้อความภาษาไทยในข้อมูลจำลอง")
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args()
+
+def regex_estimate(text):
+    """ตัวประมาณแบบเดิม (regex สี่รอบ + น้ำหนักที่เลือกเอง) เพื่อใช้เป็นเส้นฐาน"""
+    text = re.sub(r'\s+', ' ', text.strip())
+    thai_chars = len(re.findall(r'[\u0E00-\u0E7F]', text))
+    english_words = len(re.findall(r'[a-zA-Z]+', text))
+    numbers = len(re.findall(r'[0-9]+', text))
+    symbols = len(re.findall(r'[^\w\s\u0E00-\u0E7F]', text))
+    return max(1, int(thai_chars + (english_words * 0.75) + numbers + symbols))
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def evaluate(fn, texts, reference):
+    """
+    รันวิธีนับหนึ่งรอบแล้วสรุปความเร็วและความคลาดเคลื่อนเทียบกับค่าอ้างอิง
+
+    Returns:
+        dict: texts_per_sec, median, p90, p99 (ความคลาดเคลื่อนสัมพัทธ์สัมบูรณ์ %) และ bias (% ของผลรวม)
+    """
+    start = time.perf_counter()
+    counts = [fn(text) for text in texts]
+    elapsed = time.perf_counter() - start
+    errors = [100 * abs(count - ref) / ref for count, ref in zip(counts, reference)]
+    return {
+        "texts_per_sec": len(texts) / elapsed,
+        "median": percentile(errors, 0.5),
+        "p90": percentile(errors, 0.9),
+        "p99": percentile(errors, 0.99),
+        "bias": 100 * (sum(counts) / sum(reference) - 1)
+    }
+
+def main():
+    args = parse_args()
+    counter = TokenCounter(cache_bytes=0)
+    tokenizer = counter.tokenizer
+
+    if args.corpus:
+        with open(args.corpus, encoding='utf-8') as f:
+            samples = [json.loads(line) for line in f if line.strip()]
+        samples = [s for s in samples if s.get("text") and s.get("tokens", 0) > 0]
+        texts = [s["text"] for s in samples]
+        reference = [s["tokens"] for s in samples]
+        source = "usage.prompt_tokens ของ DeepSeek"
+    else:
+        if tokenizer is None:
+            print("ไม่พบ tiktoken: ต้องใช้ --corpus เป็นค่าอ้างอิง")
+            sys.exit(1)
+        if args.input:
+            with open(args.input, encoding='utf-8') as f:
+                texts = [line.rstrip('\n') for line in f if line.strip()]
+        else:
+            texts = synthetic_messages(args.count, args.thai_ratio, args.seed)
+        reference = [max(1, len(tokenizer.encode_ordinary(text))) for text in texts]
+        source = "tiktoken cl100k_base"
+
+    methods = [("regex (previous)", regex_estimate), ("estimator (default)", TokenEstimator().estimate)]
+    if args.coefficients:
+        methods.append(("estimator (calibrated)", TokenEstimator.from_file(args.coefficients).estimate))
+    if tokenizer is not None:
+        methods.append(("tiktoken", lambda text: len(tokenizer.encode_ordinary(text))))
+
+    print(f"ข้อความ {len(texts)} ข้อความ, {sum(len(t) for t in texts)} ตัวอักษร, ค่าอ้างอิง: {source}")
+    print(f"{'วิธี':<24}{'ข้อความ/วินาที':>16}{'มัธยฐาน %':>12}{'p90 %':>9}{'p99 %':>9}{'bias %':>9}")
+    for name, fn in methods:
+        result = evaluate(fn, texts, reference)
+        print(f"{name:<24}{result['texts_per_sec']:>16.0f}{result['median']:>12.1f}{result['p90']:>9.1f}"
+              f"{result['p99']:>9.1f}{result['bias']:>+9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+ปรับเทียบสัมประสิทธิ์ของตัวประมาณจำนวนโทเค็น (TokenEstimator) กับ usage.prompt_tokens จริงของ DeepSeek
+
+- collect: ดึงข้อความล่าสุดจากตาราง conversations แล้วส่งแต่ละข้อความให้ DeepSeek (max_tokens=1)
+  จำนวนโทเค็นของข้อความ = prompt_tokens - ค่าโสหุ้ยคงที่ของพรอมต์ (วัดจากข้อความ "a" ซึ่งนับเป็น 1 โทเค็น)
+  บันทึกเป็นคลังตัวอย่าง JSONL ({"text": ..., "tokens": ...}) ต่อท้ายไฟล์เดิม
+- fit: หาสัมประสิทธิ์ต่อกลุ่มอักขระด้วย least squares (ไม่ติดลบ) รายงานความคลาดเคลื่อนบนชุดทดสอบ
+  (ทุกตัวอย่างที่ 5) เทียบกับค่าเริ่มต้น แล้วเขียนไฟล์สำหรับ TOKEN_ESTIMATOR_FILE
+
+ตัวอย่าง:
+    python scripts/calibrate_token_estimator.py collect --limit 2000 --output token_corpus.jsonl
+    python scripts/calibrate_token_estimator.py fit --corpus token_corpus.jsonl --output token_estimator.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+# เพิ่มไดเรกทอรีหลักของโปรเจกต์ลงในเส้นทางระบบ
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(
+    level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO')),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+from app.token_counter import DEFAULT_ESTIMATOR_COEFFICIENTS, ESTIMATOR_FEATURES, TokenEstimator
+
+# คำแนะนำระบบสั้นที่สุดที่ใช้กับทุกคำขอ (ค่าโสหุ้ยคงที่ถูกหักออกด้วยข้อความอ้างอิง)
+CALIBRATION_SYSTEM_MESSAGE = {"role": "system", "content": "."}
+REFERENCE_TEXT = "a"
+HOLDOUT_EVERY = 5
+
+def parse_args():
+    """อ่านอาร์กิวเมนต์จากบรรทัดคำสั่ง"""
+    parser = argparse.ArgumentParser(description="Calibrate the token estimator against DeepSeek usage")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    collect = sub.add_parser('collect', help="สร้างคลังตัวอย่างจาก usage.prompt_tokens ของ DeepSeek")
+    collect.add_argument('--limit', type=int, default=1000, help="จำนวนการสนทนาล่าสุดที่ดึง")
+    collect.add_argument('--output', default='token_corpus.jsonl', help="ไฟล์คลังตัวอย่าง (ต่อท้าย)")
+    collect.add_argument('--concurrency', type=int, default=8, help="จำนวนคำขอ DeepSeek พร้อมกัน")
+
+    fit = sub.add_parser('fit', help="หาสัมประสิทธิ์จากคลังตัวอย่าง")
+    fit.add_argument('--corpus', default='token_corpus.jsonl', help="ไฟล์คลังตัวอย่างจาก collect")
+    fit.add_argument('--output', default='token_estimator.json', help="ไฟล์สัมประสิทธิ์ที่เขียน")
+    return parser.parse_args()
+
+async def collect(args):
+    """ส่งข้อความตัวอย่างให้ DeepSeek แล้วบันทึกจำนวนโทเค็นจริงทันทีที่แต่ละรายการเสร็จ"""
+    from app import app_deepseek as core
+    from app.async_api import AsyncDeepseekClient
+
+    texts = core.db.get_message_sample(args.limit) or []
+    logging.info(f"พบข้อความตัวอย่าง {len(texts)} ข้อความ")
+    if not texts:
+        return
+
+    items = [{"id": i, "messages": [{"role": "user", "content": text}], "config": {"max_tokens": 1}}
+             for i, text in enumerate([REFERENCE_TEXT] + texts)]
+    client = await AsyncDeepseekClient(
+        core.config.DEEPSEEK_API_KEY,
+        max_connections=args.concurrency,
+        max_keepalive_connections=args.concurrency
+    ).setup()
+    saved = 0
+    start_time = time.monotonic()
+    try:
+        # ข้อความอ้างอิงต้องเสร็จก่อนจึงจะหักค่าโสหุ้ยได้
+        reference = await client.generate_completion([CALIBRATION_SYSTEM_MESSAGE] + items[0]["messages"],
+                                                     items[0]["config"])
+        overhead = reference["usage"]["prompt_tokens"] - 1
+        logging.info(f"ค่าโสหุ้ยคงที่ของพรอมต์: {overhead} โทเค็น")
+        with open(args.output, 'a', encoding='utf-8') as f:
+            async for result in client.stream_message_batch(
+                items[1:], CALIBRATION_SYSTEM_MESSAGE, max_concurrency=args.concurrency
+            ):
+                if not result["success"] or not result["response"].get("usage"):
+                    logging.warning(f"ข้ามข้อความ {result['id']}: {result.get('error', 'ไม่มี usage')}")
+                    continue
+                tokens = result["response"]["usage"]["prompt_tokens"] - overhead
+                text = items[result["id"]]["messages"][0]["content"]
+                f.write(json.dumps({"text": text, "tokens": tokens}, ensure_ascii=False) + "\n")
+                saved += 1
+    finally:
+        await client.close()
+    logging.info(f"บันทึก {saved} ตัวอย่างลงใน {args.output} "
+                 f"(ใช้เวลา {time.monotonic() - start_time:.1f} วินาที)")
+
+def solve(rows, targets, columns):
+    """
+    least squares ของคอลัมน์ที่เลือก (สมการปกติ + ridge เล็กน้อย, แก้ด้วย Gaussian elimination)
+
+    Returns:
+        List[float]: สัมประสิทธิ์ตามลำดับ columns
+    """
+    size = len(columns)
+    matrix = [[0.0] * (size + 1) for _ in range(size)]
+    for row, target in zip(rows, targets):
+        values = [row[c] for c in columns]
+        for i in range(size):
+            for j in range(size):
+                matrix[i][j] += values[i] * values[j]
+            matrix[i][size] += values[i] * target
+    for i in range(size):
+        matrix[i][i] += 1e-6
+    for i in range(size):
+        pivot = max(range(i, size), key=lambda r: abs(matrix[r][i]))
+        matrix[i], matrix[pivot] = matrix[pivot], matrix[i]
+        for r in range(size):
+            if r != i and matrix[i][i]:
+                factor = matrix[r][i] / matrix[i][i]
+                for c in range(i, size + 1):
+                    matrix[r][c] -= factor * matrix[i][c]
+    return [matrix[i][size] / matrix[i][i] if matrix[i][i] else 0.0 for i in range(size)]
+
+def fit_coefficients(rows, targets):
+    """
+    หาสัมประสิทธิ์แบบไม่ติดลบ: ตัดกลุ่มที่ได้ค่าติดลบออกแล้วแก้ใหม่ กลุ่มที่ไม่พบในคลังคงค่าเริ่มต้น
+
+    Returns:
+        dict: สัมประสิทธิ์ตาม ESTIMATOR_FEATURES และ intercept
+    """
+    names = list(ESTIMATOR_FEATURES) + ["intercept"]
+    rows = [features + [1] for features in rows]
+    columns = [i for i in range(len(names)) if any(row[i] for row in rows)]
+    fixed = {names[i]: DEFAULT_ESTIMATOR_COEFFICIENTS[names[i]] for i in range(len(names)) if i not in columns}
+    while True:
+        solution = solve(rows, targets, columns)
+        negative = [c for c, value in zip(columns, solution) if value < 0 and names[c] != "intercept"]
+        if not negative:
+            break
+        columns = [c for c in columns if c not in negative]
+        fixed.update({names[c]: 0.0 for c in negative})
+    coefficients = dict(fixed)
+    coefficients.update({names[c]: round(value, 4) for c, value in zip(columns, solution)})
+    return {name: coefficients[name] for name in names}
+
+def mean_abs_error(estimator, texts, targets):
+    """ความคลาดเคลื่อนสัมพัทธ์เฉลี่ย (%) ของตัวประมาณ"""
+    errors = [abs(estimator.estimate(text) - target) / target for text, target in zip(texts, targets)]
+    return 100 * sum(errors) / len(errors)
+
+def fit(args):
+    """fit บนชุดฝึก รายงานผลบนชุดทดสอบ แล้ว fit ใหม่ด้วยข้อมูลทั้งหมดเพื่อเขียนไฟล์"""
+    with open(args.corpus, encoding='utf-8') as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+    samples = [s for s in samples if s.get("text") and s.get("tokens", 0) > 0]
+    if len(samples) < 2 * HOLDOUT_EVERY:
+        logging.error(f"คลังตัวอย่างมีเพียง {len(samples)} ตัวอย่าง (ต้องมีอย่างน้อย {2 * HOLDOUT_EVERY})")
+        sys.exit(1)
+    texts = [s["text"] for s in samples]
+    targets = [s["tokens"] for s in samples]
+    rows = [TokenEstimator.features(text) for text in texts]
+
+    train = [i for i in range(len(samples)) if i % HOLDOUT_EVERY]
+    test = [i for i in range(len(samples)) if not i % HOLDOUT_EVERY]
+    trained = TokenEstimator(fit_coefficients([rows[i] for i in train], [targets[i] for i in train]))
+    test_texts = [texts[i] for i in test]
+    test_targets = [targets[i] for i in test]
+    print(f"ตัวอย่าง {len(samples)} (ฝึก {len(train)}, ทดสอบ {len(test)})")
+    print(f"ความคลาดเคลื่อนเฉลี่ยบนชุดทดสอบ: ค่าเริ่มต้น {mean_abs_error(TokenEstimator(), test_texts, test_targets):.1f}%"
+          f" -> ปรับเทียบแล้ว {mean_abs_error(trained, test_texts, test_targets):.1f}%")
+
+    coefficients = fit_coefficients(rows, targets)
+    for name, value in coefficients.items():
+        print(f"  {name:<10}{value:>10.4f}")
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            "coefficients": coefficients,
+            "samples": len(samples),
+            "fitted_at": datetime.now().isoformat(timespec='seconds')
+        }, f, indent=2)
+    logging.info(f"เขียนสัมประสิทธิ์ลงใน {args.output} (ตั้ง TOKEN_ESTIMATOR_FILE เพื่อใช้งาน)")
+
+def main():
+    args = parse_args()
+    if args.command == 'collect':
+        asyncio.run(collect(args))
+    else:
+        fit(args)
+
+if __name__ == "__main__":
+    main()
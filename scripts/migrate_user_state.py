@@ -0,0 +1,231 @@
+"""
+เครื่องมือย้ายสถานะผู้ใช้บน Redis จากรูปแบบหนึ่งคีย์ต่อข้อมูลไปเป็นแฮชเดียวต่อผู้ใช้
+และรายงานเปรียบเทียบหน่วยความจำของทั้งสองรูปแบบด้วย MEMORY USAGE
+
+- migrate: อ่าน chat_messages: (หรือ chat_session: รูปแบบเดิม), last_activity: และ timeout_warning: ของผู้ใช้แต่ละคน
+  แล้วเขียนเป็นแฮช user:{user_id} โดยแปลง TTL ที่เหลือเป็นฟิลด์กำหนดเวลา
+  (ล็อคและการแจ้งเตือนรอเป็นข้อมูลชั่วคราวไม่กี่วินาที จึงไม่ย้าย)
+- report: สุ่มผู้ใช้ตามจำนวนที่กำหนด วัด MEMORY USAGE ของคีย์เดิม แล้วสร้างแฮชทดลอง
+  (ทั้งแบบ JSON และแบบบีบอัด) วัดขนาดแล้วลบทิ้ง โดยไม่แก้ไขข้อมูลจริง
+
+ตัวอย่าง:
+    python scripts/migrate_user_state.py report --sample 500
+    python scripts/migrate_user_state.py migrate --compact --dry-run
+    python scripts/migrate_user_state.py migrate --compact --delete-old
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+# เพิ่มไดเรกทอรีหลักของโปรเจกต์ลงในเส้นทางระบบ
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(
+    level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO')),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+from app.user_state import HashUserStateStore, decode_entries, decode_session, encode_entry
+
+LEGACY_KEYS = ('chat_messages', 'chat_session', 'last_activity', 'timeout_warning')
+PROBE_KEY = "user_state_probe:{}"
+DEFAULT_SESSION_TIMEOUT = 7 * 24 * 3600
+
+def parse_args():
+    """อ่านอาร์กิวเมนต์จากบรรทัดคำสั่ง"""
+    parser = argparse.ArgumentParser(description="Migrate per-user Redis state to a single hash per user")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    migrate = sub.add_parser('migrate', help="ย้ายคีย์เดิมไปเป็นแฮชต่อผู้ใช้")
+    migrate.add_argument('--compact', action='store_true', help="บีบอัดเซสชันการแชทระหว่างย้าย")
+    migrate.add_argument('--delete-old', action='store_true', help="ลบคีย์เดิมหลังเขียนแฮชแล้ว")
+    migrate.add_argument('--batch', type=int, default=200, help="จำนวนผู้ใช้ต่อ pipeline")
+    migrate.add_argument('--dry-run', action='store_true', help="นับผู้ใช้ที่จะย้ายโดยไม่เขียนข้อมูล")
+
+    report = sub.add_parser('report', help="เปรียบเทียบหน่วยความจำด้วย MEMORY USAGE")
+    report.add_argument('--sample', type=int, default=200, help="จำนวนผู้ใช้ที่สุ่มวัด")
+    return parser.parse_args()
+
+def connect():
+    """เชื่อมต่อ Redis ตามการตั้งค่าเดียวกับแอป"""
+    client = redis.Redis(
+        host=os.getenv('REDIS_HOST', 'localhost'),
+        port=int(os.getenv('REDIS_PORT', '6379')),
+        db=int(os.getenv('REDIS_DB', '0')),
+        decode_responses=True
+    )
+    client.ping()
+    return client
+
+def iter_user_ids(client, batch):
+    """
+    ไล่หาผู้ใช้จากคีย์ last_activity:, chat_messages: และ chat_session: ด้วย SCAN (ไม่บล็อก Redis)
+
+    Yields:
+        str: LINE user ID (ไม่ซ้ำ)
+    """
+    seen = set()
+    for prefix in ('last_activity', 'chat_messages', 'chat_session'):
+        for key in client.scan_iter(match=f"{prefix}:*", count=batch):
+            user_id = key.split(':', 1)[1]
+            if user_id not in seen:
+                seen.add(user_id)
+                yield user_id
+
+def read_legacy(client, user_ids):
+    """
+    อ่านค่าและ TTL ของคีย์เดิมของผู้ใช้หลายคนใน pipeline เดียว
+
+    Returns:
+        dict: user_id -> {ชื่อคีย์: (ค่า, TTL ที่เหลือเป็นวินาที)}
+    """
+    pipe = client.pipeline(transaction=False)
+    for user_id in user_ids:
+        for name in LEGACY_KEYS:
+            if name == 'chat_messages':
+                pipe.lrange(f"{name}:{user_id}", 0, -1)
+            else:
+                pipe.get(f"{name}:{user_id}")
+            pipe.ttl(f"{name}:{user_id}")
+    values = iter(pipe.execute())
+    return {
+        user_id: {name: (next(values), next(values)) for name in LEGACY_KEYS}
+        for user_id in user_ids
+    }
+
+def hash_fields(legacy, now, compact):
+    """
+    แปลงค่าของคีย์เดิมเป็นฟิลด์ของแฮช (TTL ที่เหลือกลายเป็นฟิลด์กำหนดเวลา)
+
+    Returns:
+        tuple: (dict ของฟิลด์, TTL ของทั้งแฮช หรือ None ถ้าไม่มีข้อมูล)
+    """
+    fields = {}
+    entries, session_ttl = legacy['chat_messages']
+    if entries and session_ttl > 0:
+        session = decode_entries(entries)
+    else:
+        raw, session_ttl = legacy['chat_session']
+        session = decode_session(raw) if raw and session_ttl > 0 else []
+    if session:
+        fields['m'] = '\n'.join(encode_entry(m, compact) for m in session)
+        fields['se'] = now + session_ttl
+    last_activity, last_ttl = legacy['last_activity']
+    if last_activity:
+        fields['la'] = last_activity
+    warning, warning_ttl = legacy['timeout_warning']
+    if warning and warning_ttl > 0:
+        fields['tw'] = now + warning_ttl
+    if not fields:
+        return fields, None
+    key_ttl = last_ttl if last_activity and last_ttl > 0 else DEFAULT_SESSION_TIMEOUT
+    return fields, max(key_ttl, session_ttl if session else 0)
+
+def write_hashes(client, entries, key_format):
+    """เขียนแฮชของผู้ใช้หลายคนใน pipeline เดียว"""
+    pipe = client.pipeline(transaction=False)
+    for user_id, (fields, ttl) in entries.items():
+        key = key_format.format(user_id)
+        pipe.delete(key)
+        pipe.hset(key, mapping=fields)
+        pipe.expire(key, ttl)
+    pipe.execute()
+
+def chunks(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def migrate(client, args):
+    """ย้ายผู้ใช้ทั้งหมดทีละชุด (รันซ้ำได้: แฮชถูกเขียนทับจากคีย์เดิมทุกครั้ง)"""
+    migrated = skipped = 0
+    start_time = time.monotonic()
+    for user_ids in chunks(iter_user_ids(client, args.batch), args.batch):
+        now = time.time()
+        entries = {}
+        for user_id, legacy in read_legacy(client, user_ids).items():
+            fields, ttl = hash_fields(legacy, now, args.compact)
+            if fields:
+                entries[user_id] = (fields, ttl)
+            else:
+                skipped += 1
+        migrated += len(entries)
+        if args.dry_run or not entries:
+            continue
+        write_hashes(client, entries, HashUserStateStore.HASH_KEY)
+        if args.delete_old:
+            client.delete(*(f"{name}:{user_id}" for user_id in entries for name in LEGACY_KEYS))
+    logging.info(f"{'(dry run) ' if args.dry_run else ''}ย้ายผู้ใช้ {migrated} คน, ข้าม {skipped} คน, "
+                 f"ใช้เวลา {time.monotonic() - start_time:.1f} วินาที")
+
+def memory_usage(client, key):
+    """ขนาดของคีย์เป็นไบต์ (SAMPLES 0 = นับทุกองค์ประกอบ) หรือ 0 ถ้าไม่มีคีย์"""
+    return client.memory_usage(key, samples=0) or 0
+
+def report(client, args):
+    """สุ่มวัดหน่วยความจำของรูปแบบเดิม แฮช และแฮชแบบบีบอัด แล้วประมาณการรวมของทุกผู้ใช้"""
+    sample = []
+    for user_id in iter_user_ids(client, 500):
+        sample.append(user_id)
+        if len(sample) >= args.sample:
+            break
+    if not sample:
+        logging.info("ไม่พบผู้ใช้ในรูปแบบคีย์เดิม")
+        return
+
+    now = time.time()
+    totals = {'keys': 0, 'hash': 0, 'hash_compact': 0, 'progress': 0}
+    key_count = 0
+    for user_id, legacy in read_legacy(client, sample).items():
+        for name in LEGACY_KEYS:
+            usage = memory_usage(client, f"{name}:{user_id}")
+            totals['keys'] += usage
+            key_count += 1 if usage else 0
+        totals['progress'] += memory_usage(client, f"progress:{user_id}")
+        for label, compact in (('hash', False), ('hash_compact', True)):
+            fields, ttl = hash_fields(legacy, now, compact)
+            if not fields:
+                continue
+            probe = PROBE_KEY.format(user_id)
+            write_hashes(client, {user_id: (fields, ttl)}, PROBE_KEY)
+            totals[label] += memory_usage(client, probe)
+            client.delete(probe)
+
+    users = len(sample)
+    population = sum(1 for _ in client.scan_iter(match="last_activity:*", count=1000))
+    print(f"ผู้ใช้ที่สุ่มวัด: {users} คน (ผู้ใช้ที่มี last_activity ทั้งหมด {population} คน)")
+    print(f"คีย์เดิมเฉลี่ยต่อผู้ใช้: {key_count / users:.2f} คีย์ -> แฮช 1 คีย์")
+    print(f"{'รูปแบบ':<14}{'ไบต์/ผู้ใช้':>14}{'ประมาณการรวม (MB)':>22}")
+    for label in ('keys', 'hash', 'hash_compact'):
+        per_user = totals[label] / users
+        print(f"{label:<14}{per_user:>14.0f}{per_user * population / 1024 / 1024:>22.1f}")
+    print(f"progress (เหมือนกันทั้งสองรูปแบบ): {totals['progress'] / users:.0f} ไบต์/ผู้ใช้")
+    if totals['keys']:
+        for label in ('hash', 'hash_compact'):
+            print(f"{label} ประหยัด {100 * (1 - totals[label] / totals['keys']):.1f}% เทียบกับ keys")
+
+def main():
+    args = parse_args()
+    client = connect()
+    try:
+        if args.command == 'migrate':
+            migrate(client, args)
+        else:
+            report(client, args)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+เตรียมไฟล์ตัวตัดคำ cl100k_base ไว้ใน TIKTOKEN_CACHE_DIR ล่วงหน้า
+เพื่อให้แอปโหลดจากดิสก์ได้ทันทีโดยไม่ต้องดาวน์โหลดตอนเริ่มต้น (ใช้ร่วมกับ TOKENIZER_OFFLINE=true)
+
+- ไม่ระบุ --from-file: ดาวน์โหลดผ่าน tiktoken (ต้องมีอินเทอร์เน็ต เช่น ขั้นตอน build ของ Docker)
+- --from-file: คัดลอกไฟล์ .tiktoken ที่เก็บไว้เอง (vendored) ไปยังชื่อไฟล์ที่ tiktoken ค้นหา
+
+ตัวอย่าง:
+    python scripts/preseed_tokenizer.py
+    python scripts/preseed_tokenizer.py --from-file vendor/cl100k_base.tiktoken --cache-dir /app/.tiktoken_cache
+"""
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(
+    level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO')),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+# ต้องตรงกับ ENCODING_URL ใน app/token_counter.py (ไม่ import แพ็กเกจ app เพื่อให้รันได้ขณะ build
+# โดยไม่ต้องมีฐานข้อมูลหรือ Redis)
+ENCODING_URL = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.tiktoken_cache')
+
+def parse_args():
+    """อ่านอาร์กิวเมนต์จากบรรทัดคำสั่ง"""
+    parser = argparse.ArgumentParser(description="Preseed the cl100k_base tokenizer cache")
+    parser.add_argument('--cache-dir', default=os.getenv('TIKTOKEN_CACHE_DIR', DEFAULT_CACHE_DIR),
+                        help="ไดเรกทอรีปลายทาง (ค่าเริ่มต้น TIKTOKEN_CACHE_DIR)")
+    parser.add_argument('--from-file', help="ไฟล์ cl100k_base.tiktoken ที่มีอยู่แล้ว แทนการดาวน์โหลด")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    os.makedirs(args.cache_dir, exist_ok=True)
+    # tiktoken อ่าน TIKTOKEN_CACHE_DIR ตอนโหลด จึงต้องตั้งก่อนเรียก get_encoding
+    os.environ['TIKTOKEN_CACHE_DIR'] = args.cache_dir
+    cache_file = os.path.join(args.cache_dir, hashlib.sha1(ENCODING_URL.encode()).hexdigest())
+
+    if args.from_file:
+        shutil.copyfile(args.from_file, cache_file)
+        logging.info(f"คัดลอก {args.from_file} ไปยัง {cache_file}")
+
+    try:
+        import tiktoken
+    except ImportError:
+        logging.error("ไม่พบ tiktoken: ติดตั้งด้วย pip install -r requirements.txt")
+        sys.exit(1)
+
+    # โหลดเพื่อดาวน์โหลด (ถ้ายังไม่มีไฟล์) และตรวจว่าไฟล์ใช้งานได้ (tiktoken ตรวจ hash ของไฟล์)
+    start_time = time.perf_counter()
+    encoding = tiktoken.get_encoding("cl100k_base")
+    elapsed = time.perf_counter() - start_time
+    if not os.path.exists(cache_file):
+        logging.error(f"โหลดสำเร็จแต่ไม่พบไฟล์ใน {args.cache_dir}")
+        sys.exit(1)
+    logging.info(f"ตัวตัดคำพร้อมใช้งาน: {cache_file} ({os.path.getsize(cache_file)} ไบต์, "
+                 f"{encoding.n_vocab} โทเค็น, โหลดใน {elapsed:.2f} วินาที)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+ทดสอบการนับผลของ CallPolicy ใน circuit breaker
+"""
+import asyncio
+import unittest
+
+from app.call_policy import CallPolicy, CircuitBreaker
+from app.concurrency import ConcurrencyLimitExceeded
+
+async def _rejected():
+    raise ConcurrencyLimitExceeded("queue wait exceeded")
+
+class LimiterRejectionTest(unittest.TestCase):
+    def _execute(self, policy):
+        with self.assertRaises(ConcurrencyLimitExceeded):
+            asyncio.run(policy.execute(_rejected))
+
+    def test_rejection_keeps_failure_count(self):
+        """การถูกตัวจำกัดปฏิเสธต้องไม่ล้างจำนวนความล้มเหลวต่อเนื่อง"""
+        breaker = CircuitBreaker('test', failure_threshold=3)
+        breaker.record_failure()
+        breaker.record_failure()
+        self._execute(CallPolicy('test', breaker=breaker))
+        self.assertEqual(breaker.stats()['consecutive_failures'], 2)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_rejection_releases_half_open_probe(self):
+        """การถูกปฏิเสธในสถานะ half_open ต้องไม่ปิด breaker และต้องคืนสิทธิ์ทดลอง"""
+        breaker = CircuitBreaker('test', failure_threshold=1, recovery_timeout=0)
+        breaker.record_failure()
+        self._execute(CallPolicy('test', breaker=breaker))
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow_request())
+
+class RecordOutcomeTest(unittest.TestCase):
+    def test_outcome_classification(self):
+        """record_outcome แยกผลเป็นกลาง ล้มเหลว และสำเร็จตามชนิดของข้อผิดพลาด"""
+        breaker = CircuitBreaker('test', failure_threshold=1, recovery_timeout=0)
+        policy = CallPolicy('test', breaker=breaker)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow_request())
+        policy.record_outcome(ConcurrencyLimitExceeded("queue wait exceeded"))
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow_request())
+        policy.record_outcome(ConnectionError("reset"))
+        self.assertEqual(breaker.stats()['times_opened'], 2)
+        policy.record_outcome()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+if __name__ == '__main__':
+    unittest.main()
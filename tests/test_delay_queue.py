@@ -0,0 +1,45 @@
+"""
+ทดสอบการส่งงานที่ถึงเวลาของ DelayQueue
+"""
+import threading
+import time
+import unittest
+
+from app.delay_queue import DelayQueue
+
+class DelayQueueTest(unittest.TestCase):
+    def test_blocking_job_does_not_delay_other_keys(self):
+        """งานที่บล็อกของคีย์หนึ่งต้องไม่ทำให้งานที่ถึงเวลาของคีย์อื่นล่าช้า และคีย์เดิมยังเรียงลำดับ"""
+        queue = DelayQueue(name='test_delay')
+        release = threading.Event()
+        order = []
+        try:
+            queue.schedule('a', 0, lambda: (release.wait(5), order.append('a1')))
+            queue.schedule('a', 0, order.append, 'a2')
+            queue.schedule('b', 0.05, order.append, 'b1')
+            deadline = time.monotonic() + 2
+            while queue.has_pending('b') and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertFalse(queue.has_pending('b'))
+            self.assertEqual(order, ['b1'])
+            self.assertTrue(queue.has_pending('a'))
+        finally:
+            release.set()
+            queue.stop()
+        self.assertEqual(order, ['b1', 'a1', 'a2'])
+        self.assertFalse(queue.has_pending('a'))
+
+    def test_stop_runs_remaining_jobs(self):
+        """stop ต้องส่งงานที่ยังไม่ถึงเวลาทันทีและรอให้รันเสร็จ"""
+        queue = DelayQueue(name='test_delay_stop')
+        order = []
+        queue.schedule('a', 60, order.append, 'a1')
+        start = time.monotonic()
+        queue.stop()
+        self.assertEqual(order, ['a1'])
+        self.assertLess(time.monotonic() - start, 5)
+        with self.assertRaises(RuntimeError):
+            queue.schedule('a', 0, order.append, 'a2')
+
+if __name__ == '__main__':
+    unittest.main()
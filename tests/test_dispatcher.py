@@ -0,0 +1,49 @@
+"""
+ทดสอบลำดับการรันของ UserOrderedDispatcher
+"""
+import threading
+import unittest
+
+from app.dispatcher import (
+    PRIORITY_ELEVATED, PRIORITY_NORMAL, PRIORITY_URGENT, UserOrderedDispatcher
+)
+
+class PriorityOrderTest(unittest.TestCase):
+    def test_urgent_follow_up_raises_waiting_user(self):
+        """งานด่วนที่เข้ามาขณะผู้ใช้รอคิวอยู่ต้องเลื่อนผู้ใช้นั้นขึ้นก่อนงานระดับ elevated"""
+        dispatcher = UserOrderedDispatcher(max_workers=1, aging_seconds=5.0)
+        release = threading.Event()
+        order = []
+        try:
+            dispatcher.submit('blocker', release.wait)
+            futures = [
+                dispatcher.submit_with_priority('a', PRIORITY_NORMAL, order.append, 'a1'),
+                dispatcher.submit_with_priority('b', PRIORITY_URGENT, order.append, 'b1'),
+                dispatcher.submit_with_priority('a', PRIORITY_URGENT, order.append, 'a2'),
+                dispatcher.submit_with_priority('c', PRIORITY_ELEVATED, order.append, 'c1'),
+            ]
+            self.assertTrue(dispatcher.is_saturated())
+            release.set()
+            for future in futures:
+                future.result(timeout=5)
+        finally:
+            release.set()
+            dispatcher.shutdown()
+        self.assertEqual(order, ['b1', 'a1', 'a2', 'c1'])
+        self.assertFalse(dispatcher.is_saturated())
+
+class ShutdownTest(unittest.TestCase):
+    def test_shutdown_runs_queued_jobs_of_busy_key(self):
+        """shutdown ต้องรอให้งานที่ต่อคิวหลังงานที่กำลังรันของคีย์เดียวกันรันครบ"""
+        dispatcher = UserOrderedDispatcher(max_workers=2)
+        release = threading.Event()
+        order = []
+        dispatcher.submit('a', lambda: (release.wait(5), order.append('a1')))
+        futures = [dispatcher.submit('a', order.append, f'a{i}') for i in range(2, 5)]
+        threading.Timer(0.05, release.set).start()
+        dispatcher.shutdown()
+        self.assertEqual(order, ['a1', 'a2', 'a3', 'a4'])
+        self.assertTrue(all(future.done() for future in futures))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+"""
+จุดเริ่มต้น worker สำหรับแชทบอท 'ใจดี'
+ดึงเหตุการณ์ LINE จากคิว Redis Streams และประมวลผลแยกจากเว็บเซิร์ฟเวอร์
+สามารถรันหลายโปรเซสเพื่อขยายกำลังการประมวลผลได้
+"""
+import os
+import sys
+import logging
+from dotenv import load_dotenv
+
+# เพิ่มไดเรกทอรีปัจจุบันลงในเส้นทางระบบ
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# โหลดตัวแปรสภาพแวดล้อมจากไฟล์ .env
+load_dotenv()
+
+# ตั้งค่า logging
+logging.basicConfig(
+    level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO')),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('worker.log'),
+        logging.StreamHandler()
+    ]
+)
+
+if __name__ == "__main__":
+    from app.app_deepseek import init_workers, worker_stop_event
+    
+    # กำหนดจำนวน worker จากตัวแปรสภาพแวดล้อมหรือใช้ค่าเริ่มต้น
+    num_workers = int(os.getenv('WORKER_THREADS', 4))
+    
+    threads = init_workers(num_workers)
+    if not threads:
+        logging.critical("ไม่ได้เปิดใช้งานคิวเหตุการณ์ (EVENT_QUEUE_ENABLED=false)")
+        sys.exit(1)
+    
+    logging.info(f"worker ของแชทบอท 'ใจดี' กำลังทำงาน ({num_workers} เธรด)")
+    
+    # รอจนกว่าจะได้รับสัญญาณหยุด (SIGTERM/SIGINT)
+    while not worker_stop_event.wait(1.0):
+        pass
+    for thread in threads:
+        thread.join(timeout=10)
@@ -5,9 +5,13 @@
 """
 import os
 import sys
+import time
 import logging
 from dotenv import load_dotenv
 
+# เวลาเริ่มโปรเซส (ใช้เมื่อไม่ได้ถูก fork จาก gunicorn.conf.py)
+_process_started_at = time.time()
+
 # เพิ่มไดเรกทอรีปัจจุบันลงในเส้นทางระบบ
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
@@ -26,11 +30,21 @@ logging.basicConfig(
 
 try:
     # นำเข้าแอปและขั้นตอนการเริ่มต้น
-    from app.app_deepseek import app, init_scheduler
+    from app.app_deepseek import app, init_scheduler, init_workers
     
     # เริ่มต้นตัวกำหนดการเมื่อเริ่มต้นแอปพลิเคชัน
     init_scheduler()
     
+    # เริ่มต้น worker ของคิวเหตุการณ์ในโปรเซสเว็บ (ถ้ากำหนด)
+    init_workers()
+    
+    # รายงานเวลาเริ่มต้นของ worker ตั้งแต่ fork (หรือเริ่มโปรเซส) จนพร้อมรับคำขอ
+    from app.metrics import metrics
+    started_at = float(os.getenv('WORKER_FORKED_AT', _process_started_at))
+    cold_start = time.time() - started_at
+    metrics.set_gauge('worker_cold_start_seconds', cold_start)
+    logging.info(f"worker {os.getpid()} พร้อมใช้งานใน {cold_start:.2f} วินาที")
+    
     # แสดงข้อความว่าแอปพลิเคชันกำลังทำงาน
     logging.info("แอปพลิเคชันแชทบอท 'ใจดี' กำลังทำงาน (โหมดการผลิต)")
     